@@ -13,7 +13,10 @@ local_registry = LocateRegistry.local_registry()
 local_registry.listen(background=True)
 
 # Thay đổi port nếu cần (kết nối tới Server 1 hoặc 2)
-registry = LocateRegistry.get_registry(address="10.31.176.169", port=29055)
+# multiplexed: các thread UI dùng chung session stub trên một connection
+registry = LocateRegistry.get_registry(
+    address="10.31.176.169", port=29055, multiplexed=True
+)
 auth_service = registry.lookup("auth", AuthService)
 success_callback = SuccessCallbackImpl()
 
@@ -0,0 +1,207 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Set, TypedDict
+
+from shared.models.server import ATMCommand
+from .database.main import DatabaseReader, DatabaseWriter, SQLException
+
+
+class DedupeConfig(TypedDict):
+    enabled: bool
+    window: int  # Cửa sổ chống trùng tính từ command mới nhất của mỗi origin (s)
+    prune_every: int  # Số command ghi nhận giữa 2 lần dọn applied_commands
+
+
+_id_lock = threading.Lock()
+_last_seq = 0
+
+
+def new_command_id(origin_id: int) -> str:
+    """
+    Tạo command_id duy nhất: "<origin_id>-<seq>" (origin_id = PEER_ID của server tạo command).
+
+    seq là thời điểm tạo (µs), tăng ít nhất 1 so với lần trước nên vẫn tăng dần
+    khi nhiều command được tạo cùng 1 µs hoặc đồng hồ bị chỉnh lùi. Sau khi khởi
+    động lại, observe_command_seq() đưa mốc lên trên các seq đã dùng.
+    """
+    global _last_seq
+    with _id_lock:
+        _last_seq = max(_last_seq + 1, time.time_ns() // 1000)
+        return f"{origin_id}-{_last_seq}"
+
+
+def observe_command_seq(seq: int):
+    """seq đã được dùng (đọc lại từ database/journal), command_id mới luôn lớn hơn"""
+    global _last_seq
+    with _id_lock:
+        _last_seq = max(_last_seq, seq)
+
+
+def parse_command_id(command_id: str) -> tuple[int, int]:
+    """(origin_id, seq) của command_id"""
+    origin_id, seq = command_id.split("-", 1)
+    return int(origin_id), int(seq)
+
+
+class _OriginWindow:
+    """
+    Các seq đã áp dụng của 1 origin, chỉ giữ phần trong cửa sổ gần high_water.
+    seq cũ hơn cửa sổ không được coi là đã áp dụng: is_stale()
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.high_water = 0
+        self.seqs: Set[int] = set()
+        self.order: Deque[int] = deque()
+
+    def contains(self, seq: int) -> bool:
+        return seq in self.seqs
+
+    def is_stale(self, seq: int) -> bool:
+        # Cũ hơn cửa sổ: applied_commands có thể đã bị dọn, không biết đã áp dụng chưa
+        return seq + self.window <= self.high_water and seq not in self.seqs
+
+    def add(self, seq: int):
+        self.seqs.add(seq)
+        self.order.append(seq)
+        self.high_water = max(self.high_water, seq)
+
+        while self.order and self.order[0] + self.window <= self.high_water:
+            self.seqs.discard(self.order.popleft())
+
+
+class CommandDedupe:
+    """
+    Chỉ mục chống áp dụng trùng command theo command_id.
+
+    - Bảng applied_commands là nguồn chuẩn: command thành công được ghi trong
+      cùng transaction (WriteBatch.apply_once), PRIMARY KEY chặn lần áp dụng thứ 2
+    - RAM giữ cửa sổ trượt các seq gần high-water mark của mỗi origin để bỏ qua
+      command trùng mà không cần chạm database
+    - Các dòng cũ hơn cửa sổ được xóa định kỳ khỏi applied_commands để bảng không
+      lớn dần, nên command cũ hơn cửa sổ (VD: gửi lại sau khi mất kết nối quá lâu)
+      không kiểm tra được: bị từ chối (StaleCommandError, có log + thống kê)
+      thay vì bị bỏ qua hoặc áp dụng lại. Riêng log của peer thì bỏ qua như đã
+      áp dụng: bản sao trễ của command đã áp dụng qua đường khác (forward/gửi lại),
+      replication_state vẫn tiến qua entry đó nên đoạn log không bị kẹt
+
+    Command không có command_id (tạo trước khi có tính năng này) không được kiểm tra.
+    """
+
+    def __init__(
+        self,
+        database_reader: DatabaseReader,
+        database_writer: DatabaseWriter,
+        window: int = 3600,
+        prune_every: int = 10_000,
+        origin_id: Optional[int] = None,
+    ):
+        """
+        Args:
+            window: Cửa sổ chống trùng (s), seq tính theo µs
+            prune_every: Số command ghi nhận giữa 2 lần dọn applied_commands
+            origin_id: PEER_ID của server này, command_id mới được tạo lớn hơn
+                các seq của nó trong applied_commands
+        """
+        self.origin_id = origin_id
+        self.database_reader = database_reader
+        self.database_writer = database_writer
+        self.window = window * 1_000_000
+        self.prune_every = prune_every
+
+        self._lock = threading.Lock()
+        self._origins: Dict[int, _OriginWindow] = {}
+        self._since_prune = 0
+        self._stats = {"recorded": 0, "duplicates": 0, "stale": 0, "prunes": 0}
+
+        self._load()
+
+    def _load(self):
+        """Nạp cửa sổ từ applied_commands"""
+        rows = self.database_reader.get_applied_commands(self.window)
+
+        for origin_id, seq in sorted(rows, key=lambda row: row[1]):
+            if origin_id not in self._origins:
+                self._origins[origin_id] = _OriginWindow(self.window)
+            self._origins[origin_id].add(seq)
+            if origin_id == self.origin_id:
+                observe_command_seq(seq)
+
+    @staticmethod
+    def key(cmd: ATMCommand) -> Optional[tuple[int, int]]:
+        """(origin_id, seq) của command, None nếu command không có command_id"""
+        command_id = cmd.get("command_id")
+        return parse_command_id(command_id) if command_id else None
+
+    def is_applied(self, origin_id: int, seq: int) -> bool:
+        with self._lock:
+            origin = self._origins.get(origin_id)
+            return origin is not None and origin.contains(seq)
+
+    def is_stale(self, origin_id: int, seq: int) -> bool:
+        """seq cũ hơn cửa sổ của origin: không biết đã áp dụng hay chưa"""
+        with self._lock:
+            origin = self._origins.get(origin_id)
+            return origin is not None and origin.is_stale(seq)
+
+    def committed(self, origin_id: int, seq: int):
+        """Ghi nhận command vừa được commit (dọn applied_commands khi tới hạn)"""
+        with self._lock:
+            self._origin(origin_id).add(seq)
+            self._stats["recorded"] += 1
+            self._since_prune += 1
+
+            if self._since_prune < self.prune_every:
+                return
+            self._since_prune = 0
+            floors = {
+                origin_id: origin.high_water - self.window + 1
+                for origin_id, origin in self._origins.items()
+            }
+
+        self._prune(floors)
+
+    def duplicate(self, origin_id: int, seq: int):
+        with self._lock:
+            self._stats["duplicates"] += 1
+        print(f">> [DEDUPE] Bỏ qua command đã áp dụng: {origin_id}-{seq}")
+
+    def stale(self, origin_id: int, seq: int, replicated: bool = False):
+        """replicated: command trong log của peer, được bỏ qua như đã áp dụng"""
+        with self._lock:
+            self._stats["stale"] += 1
+        if replicated:
+            print(
+                f">> [DEDUPE] Bỏ qua command {origin_id}-{seq} trong log của peer:"
+                " cũ hơn cửa sổ chống trùng, coi như đã áp dụng"
+            )
+        else:
+            print(
+                f">> [DEDUPE] Từ chối command {origin_id}-{seq}: cũ hơn cửa sổ chống trùng,"
+                " không biết đã áp dụng hay chưa"
+            )
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "window_entries": sum(len(o.seqs) for o in self._origins.values()),
+            }
+
+    def _origin(self, origin_id: int) -> _OriginWindow:
+        origin = self._origins.get(origin_id)
+        if origin is None:
+            origin = self._origins[origin_id] = _OriginWindow(self.window)
+        return origin
+
+    def _prune(self, floors: Dict[int, int]):
+        try:
+            for origin_id, below_seq in floors.items():
+                self.database_writer.prune_applied_commands(origin_id, below_seq)
+            with self._lock:
+                self._stats["prunes"] += 1
+        except SQLException as e:
+            # Lần dọn sau sẽ xóa tiếp, các dòng cũ không ảnh hưởng tính đúng
+            print(f">> [DEDUPE] Dọn applied_commands lỗi: {e}")
@@ -1,12 +1,25 @@
 from typing import Dict, TypedDict
 
+from .database.main import DatabaseBackend
+from .database.balance_cache import BalanceCacheMode
+from .database.archiver import ArchiveConfig
+from .database.pool import PoolConfig
+from .command_journal import JournalConfig
+from .replication_backlog import BacklogConfig
+from .command_dedupe import DedupeConfig
+from .idempotency import IdempotencyConfig
+from .sync_window import SyncWindowConfig
+from .token_lease import LeaseConfig
+from .shard_ownership import ForwardingConfig
+
 
 class ServerInfo(TypedDict):
     host: str
     port: int
 
 
-# Cấu hình cứng
+# Cấu hình cứng: mọi server trong cụm (thêm dòng để thêm server, mọi server
+# phải dùng cùng SERVER_CONFIG)
 # SERVER_CONFIG: Dict[int, ServerInfo] = {
 #     1: {"host": "10.31.176.42", "port": 29054},
 #     2: {"host": "10.31.176.169", "port": 29055},
@@ -20,14 +33,134 @@ SERVER_CONFIG: Dict[int, ServerInfo] = {
 PEER_ID = 1
 
 
+# Các procedure đọc được gộp (singleflight): nhiều request đồng thời cùng
+# tham số (VD: cùng số thẻ) chỉ chạy 1 query và dùng chung kết quả
+COALESCED_READS: Dict[str, bool] = {
+    "check_balance": True,
+    "get_transaction_history": True,
+}
+
+
+# Số nhóm command không xung đột (khác thẻ) chạy song song (DB_WRITER_POOL tính theo số này)
+EXECUTOR_PARALLELISM = 4
+
+# Pool connection database, reader và writer tách riêng
+DB_READER_POOL: PoolConfig = {
+    "min_size": 2,
+    "max_size": 8,
+    "checkout_timeout": 5.0,
+    "validate_idle_after": 30.0,
+    "reconnect_attempts": 3,
+    "reconnect_backoff": 0.1,
+}
+# Writer: worker (tối đa EXECUTOR_PARALLELISM nhóm song song) và ReplicationReceiver
+# (1 transaction mỗi đoạn log) cùng ghi, +1 cho archiver/dọn applied_commands.
+# Nhỏ hơn thì các bên giành connection và lệnh lỗi PoolTimeoutError sau checkout_timeout
+DB_WRITER_POOL: PoolConfig = {
+    "min_size": 1,
+    "max_size": EXECUTOR_PARALLELISM + 2,
+    "checkout_timeout": 5.0,
+    "validate_idle_after": 30.0,
+    "reconnect_attempts": 3,
+    "reconnect_backoff": 0.1,
+}
+
+# Backend thực thi: "procedure" (Stored Procedure) hoặc "inline" (prepared statement)
+DB_BACKEND: DatabaseBackend = "procedure"
+
+# Cache số dư cho check_balance: "off", "on", hoặc "verify" (đọc DB và báo lệch với cache)
+BALANCE_CACHE_MODE: BalanceCacheMode = "on"
+
+# Partition theo tháng của transactions (cần migration 002-transactions-partitioning):
+# partition cho months_ahead tháng tới luôn được thêm; enabled: partition cũ hơn
+# retention_months tháng được chuyển sang transactions_archive
+TRANSACTION_ARCHIVE: ArchiveConfig = {
+    "enabled": False,
+    "retention_months": 12,
+    "months_ahead": 3,
+    "interval": 24 * 3600,
+}
+
+# Journal trên đĩa cho các command đã nhận (khôi phục sau khi server crash).
+# Cần COMMAND_DEDUPE: checkpoint không được fsync, command replay đã thực thi
+# được bỏ qua nhờ command_id trong applied_commands
+COMMAND_JOURNAL: JournalConfig = {
+    "enabled": True,
+    "path": f"data/command_journal_s{PEER_ID}.log",
+    "group_commit_window": 0.002,
+    "max_bytes": 64 << 20,
+}
+
+# Backlog các command chờ sync cho peer: mọi command được ghi xuống segment file
+# (giữ lại khi khởi động lại), RAM giữ tối đa memory_entries command mới nhất
+REPLICATION_BACKLOG: BacklogConfig = {
+    "directory": f"data/replication_backlog_s{PEER_ID}",
+    "memory_entries": 10_000,
+    "segment_bytes": 16 << 20,
+    "state_interval": 1.0,
+}
+
+# Chống áp dụng trùng command theo command_id (cần migration 004-applied-commands)
+COMMAND_DEDUPE: DedupeConfig = {
+    "enabled": True,
+    "window": 3600,
+    "prune_every": 10_000,
+}
+
+# Kết quả theo idempotency key của ATM (gửi lại cùng key không tạo giao dịch mới)
+IDEMPOTENCY: IdempotencyConfig = {
+    "enabled": True,
+    "ttl": 600,
+    "max_entries": 100_000,
+}
+
+# Số command tối đa trong 1 lần gọi PeerService.replicate
+SYNC_BATCH_MAX = 1000
+
+# Cửa sổ gom các batch liên tiếp vào 1 lần sync cho peer: độ dài thích nghi
+# theo tốc độ command và RTT, không quá max_delay; đủ max_commands/max_bytes thì gửi ngay
+SYNC_WINDOW: SyncWindowConfig = {
+    "max_delay": 0.05,
+    "max_commands": SYNC_BATCH_MAX,
+    "max_bytes": 1 << 20,
+}
+
+# Số shard của không gian số thẻ (crc32(số thẻ) % SHARD_COUNT), mỗi shard thuộc
+# 1 server tại 1 thời điểm. Mọi server phải cùng giá trị; 1 = 1 token chung như cũ
+SHARD_COUNT = 64
+
+# Command của shard server khác đang giữ được forward cho server đó thực thi (kết quả
+# trả về cho ATM qua server này); server giữ shard trao shard cho 1 server khi trong
+# migrate_window giây nhận >= migrate_after command forward của shard đó từ server đó
+# và gấp đôi lượng dùng tại chỗ
+COMMAND_FORWARDING: ForwardingConfig = {
+    "enabled": True,
+    "max_batch": 256,
+    "migrate_after": 16,
+    "migrate_window": 1.0,
+}
+
+# Lease shard: khi peer đòi, shard không dùng trong idle_grace giây được trao ngay;
+# đang dùng thì giữ tối thiểu min_quantum, tối đa max_hold (chia theo tải của mình và server đòi)
+TOKEN_LEASE: LeaseConfig = {
+    "min_quantum": 0.01,
+    "max_hold": 0.05,
+    "idle_grace": 0.002,
+}
+
+# Chạy các command lấy ra cùng lúc trong 1 transaction (savepoint mỗi command)
+EXECUTOR_BATCH_MODE = True
+
+
 def get_current_config() -> ServerInfo:
     return SERVER_CONFIG[PEER_ID]
 
 
-def get_peer_config() -> ServerInfo:
-    # Tìm ID không phải là mình
-    for server_id, conf in SERVER_CONFIG.items():
-        if server_id != PEER_ID:
-            return conf
-
-    raise ValueError("Config error: No peer found")
+def get_peer_configs() -> Dict[int, ServerInfo]:
+    # Các server không phải là mình
+    peers = {
+        server_id: conf for server_id, conf in SERVER_CONFIG.items() if server_id != PEER_ID
+    }
+    if not peers:
+        raise ValueError("Config error: No peer found")
+    return peers
@@ -0,0 +1,196 @@
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple, TypedDict
+
+import mysql.connector
+
+from .exceptions import SQLException
+from .main import Database
+
+
+class ArchiveConfig(TypedDict):
+    enabled: bool  # Lưu trữ partition cũ (partition tương lai luôn được thêm)
+    retention_months: int  # Số tháng gần nhất giữ lại trong transactions
+    months_ahead: int  # Số tháng tới luôn có sẵn partition
+    interval: float  # Chu kỳ chạy (s)
+
+
+DEFAULT_ARCHIVE_CONFIG: ArchiveConfig = {
+    "enabled": True,
+    "retention_months": 12,
+    "months_ahead": 3,
+    "interval": 24 * 3600,
+}
+
+FUTURE_PARTITION = "p_future"
+OLD_PARTITION = "p_old"
+
+
+def month_start(year: int, month: int) -> int:
+    """Timestamp (UTC) đầu tháng, month có thể < 1 hoặc > 12"""
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def partition_name(timestamp: int) -> str:
+    """Tên partition chứa tháng của timestamp, vd p202601"""
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("p%Y%m")
+
+
+class TransactionArchiver:
+    """
+    Job định kỳ quản lý partition theo tháng của bảng transactions
+    (xem migrations/002-transactions-partitioning.sql):
+
+    - Luôn chạy: tách p_future để luôn có sẵn partition cho months_ahead tháng
+      tới (p_future còn rỗng nên REORGANIZE gần như không tốn chi phí). Bảng
+      mới (tables.sql) chỉ có p_future: lần chạy đầu tạo p_old cho phần trước
+      tháng hiện tại
+    - Khi enabled: partition cũ hơn retention_months tháng được copy sang
+      transactions_archive (nén) rồi DROP PARTITION. INSERT IGNORE theo khóa
+      (id, timestamp) nên chạy lại sau khi bị ngắt giữa chừng không tạo bản ghi trùng
+    """
+
+    def __init__(self, database: Database, config: ArchiveConfig = DEFAULT_ARCHIVE_CONFIG):
+        self.database = database
+        self.config = config
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Chạy job trong thread nền"""
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.config["enabled"]:
+                    self.run_once()
+                else:
+                    self.maintain_partitions()
+            except SQLException as e:
+                print(f">> [ARCHIVER] Lỗi: {e}")
+
+            self._stop.wait(self.config["interval"])
+
+    def run_once(self, now: Optional[datetime] = None) -> List[str]:
+        """
+        Chạy 1 lượt: thêm partition tương lai, lưu trữ partition cũ.
+
+        Returns:
+            List[str]: Tên các partition đã được lưu trữ
+
+        Raises:
+            SQLException: Nếu thao tác DDL/copy bị lỗi
+        """
+        now = now or datetime.now(timezone.utc)
+
+        try:
+            with self.database.write_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    self._add_future_partitions(cursor, now)
+                    archived = self._archive_old_partitions(conn, cursor, now)
+                    conn.commit()
+                    return archived
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            raise SQLException(str(e.msg), e.sqlstate)
+
+    def maintain_partitions(self, now: Optional[datetime] = None):
+        """
+        Chỉ thêm partition cho các tháng tới (không lưu trữ).
+
+        Raises:
+            SQLException: Nếu thao tác DDL bị lỗi
+        """
+        now = now or datetime.now(timezone.utc)
+
+        try:
+            with self.database.write_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    self._add_future_partitions(cursor, now)
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            raise SQLException(str(e.msg), e.sqlstate)
+
+    def _partitions(self, cursor) -> List[Tuple[str, Optional[int]]]:
+        """(tên, cận trên) của các partition theo thứ tự, cận trên None = MAXVALUE"""
+        cursor.execute(
+            """
+            SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+            FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'transactions'
+            ORDER BY PARTITION_ORDINAL_POSITION
+            """
+        )
+        return [
+            (name, None if description == "MAXVALUE" else int(description))
+            for name, description in cursor.fetchall()
+        ]
+
+    def _add_future_partitions(self, cursor, now: datetime):
+        bounds = [bound for _, bound in self._partitions(cursor) if bound is not None]
+        last_bound = max(bounds, default=month_start(now.year, now.month))
+        target = month_start(now.year, now.month + self.config["months_ahead"] + 1)
+
+        new_partitions = []
+        if not bounds:
+            # Chỉ có p_future: giao dịch trước tháng hiện tại vào p_old
+            new_partitions.append(
+                f"PARTITION {OLD_PARTITION} VALUES LESS THAN ({last_bound})"
+            )
+        while last_bound < target:
+            start = datetime.fromtimestamp(last_bound, tz=timezone.utc)
+            next_bound = month_start(start.year, start.month + 1)
+            new_partitions.append(
+                f"PARTITION {partition_name(last_bound)} VALUES LESS THAN ({next_bound})"
+            )
+            last_bound = next_bound
+
+        if not new_partitions:
+            return
+
+        cursor.execute(
+            f"""
+            ALTER TABLE transactions REORGANIZE PARTITION {FUTURE_PARTITION} INTO (
+                {", ".join(new_partitions)},
+                PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE
+            )
+            """
+        )
+        print(f">> [ARCHIVER] Thêm {len(new_partitions)} partition")
+
+    def _archive_old_partitions(self, conn, cursor, now: datetime) -> List[str]:
+        cutoff = month_start(now.year, now.month - self.config["retention_months"])
+        archived = []
+
+        for name, bound in self._partitions(cursor):
+            if bound is None or bound > cutoff:
+                break
+
+            cursor.execute(
+                f"""
+                INSERT IGNORE INTO transactions_archive
+                    (id, from_card_number, to_card_number, amount, transaction_type, timestamp)
+                SELECT id, from_card_number, to_card_number, amount, transaction_type, timestamp
+                FROM transactions PARTITION ({name})
+                """
+            )
+            copied = cursor.rowcount
+            # Phải commit bản copy trước khi DROP (DDL tự commit)
+            conn.commit()
+            cursor.execute(f"ALTER TABLE transactions DROP PARTITION {name}")
+
+            archived.append(name)
+            print(f">> [ARCHIVER] Lưu trữ partition {name} ({copied} giao dịch)")
+
+        return archived
@@ -1,8 +1,59 @@
 class SQLException(Exception):
-    def __init__(self, message: str, sqlstate: str | None):
+    BUSINESS_ERROR = "45000"
+    # Deadlock, hết thời gian chờ row lock: transaction chạy lại là được
+    TRANSIENT_ERRNOS = (1213, 1205)
+
+    def __init__(self, message: str, sqlstate: str | None, errno: int | None = None):
         super().__init__(message)
         self.message = message
         self.sqlstate = sqlstate
+        self.errno = errno
+
+    def is_business_error(self) -> bool:
+        return self.sqlstate == self.BUSINESS_ERROR
+
+    def is_transient(self) -> bool:
+        return self.errno in self.TRANSIENT_ERRNOS
 
     def get_notify_message(self):
-        return self.message if self.sqlstate == "45000" else "Internal server error"
+        return self.message if self.is_business_error() else "Internal server error"
+
+
+class PoolTimeoutError(SQLException):
+    """Hết thời gian chờ lấy connection từ pool"""
+
+    def __init__(self, message: str):
+        super().__init__(message, None)
+
+
+class StaleCommandError(SQLException):
+    """
+    Command (origin_id, seq) cũ hơn cửa sổ chống trùng: applied_commands có thể
+    đã bị dọn nên không biết command đã được áp dụng hay chưa, không thực thi
+    """
+
+    def __init__(self, origin_id: int, seq: int):
+        super().__init__(f"Command {origin_id}-{seq} cũ hơn cửa sổ chống trùng", None)
+        self.origin_id = origin_id
+        self.seq = seq
+
+
+class CommandFailedError(SQLException):
+    """
+    Command phải thành công (log của peer, đã thành công tại server đó) bị lỗi
+    khi áp dụng: dữ liệu 2 server đã lệch, cả batch bị rollback
+    """
+
+    def __init__(self, command_id: str | None, cause: SQLException):
+        super().__init__(f"Command {command_id} bị lỗi: {cause.message}", None)
+        self.command_id = command_id
+        self.cause = cause
+
+
+class DuplicateCommandError(SQLException):
+    """Command (origin_id, seq) đã được áp dụng trước đó"""
+
+    def __init__(self, origin_id: int, seq: int):
+        super().__init__(f"Command {origin_id}-{seq} đã được áp dụng", "23000")
+        self.origin_id = origin_id
+        self.seq = seq
@@ -0,0 +1,255 @@
+"""
+Backend "inline": thực thi các thao tác chính bằng câu SQL trực tiếp thay vì
+Stored Procedure.
+
+- Mỗi câu SQL là prepared statement phía server, chỉ prepare 1 lần trên mỗi
+  connection, các lần sau chỉ gửi tham số (binary protocol)
+- Không có round trip SET/SELECT @_proc_arg... và stored_results() của callproc
+- Logic kiểm tra giống hệt procedures.sql, lỗi nghiệp vụ trả về cùng message
+  với SQLSTATE 45000 nên CommandExecutor/client không thấy khác biệt
+- Transaction do phía Python quản lý (writer connection autocommit=False),
+  nên cùng một code dùng được cho lệnh đơn lẻ và cho batch (savepoint)
+
+Các procedure không có bản inline (register_user, get_all_users...) vẫn dùng callproc.
+"""
+
+from threading import Lock
+from typing import Any, Dict, List, cast
+from weakref import WeakKeyDictionary
+
+import mysql.connector
+from mysql.connector.connection import MySQLConnection
+from mysql.connector.cursor import MySQLCursor, MySQLCursorPrepared
+
+from shared.models.server import UserData
+from .exceptions import SQLException
+from .main import DatabaseReader, DatabaseWriter
+
+# SQLSTATE lỗi nghiệp vụ, giống SIGNAL SQLSTATE '45000' trong procedures.sql
+BUSINESS_ERROR = "45000"
+
+SQL_CHECK_BALANCE = "SELECT balance FROM cards WHERE number = ?"
+SQL_LOGIN = (
+    "SELECT u.id, u.name, u.dob, u.phone, u.citizen_id "
+    "FROM users u JOIN cards c ON u.id = c.owner_id "
+    "WHERE c.number = ? AND c.pin = ?"
+)
+SQL_LOCK_BALANCE = "SELECT balance FROM cards WHERE number = ? FOR UPDATE"
+# Khóa 2 thẻ của giao dịch chuyển khoản theo thứ tự số thẻ (tránh deadlock)
+SQL_LOCK_TRANSFER_CARDS = (
+    "SELECT number, balance FROM cards WHERE number IN (?, ?) "
+    "ORDER BY number FOR UPDATE"
+)
+SQL_LOCK_PIN = "SELECT pin FROM cards WHERE number = ? FOR UPDATE"
+SQL_DEBIT = "UPDATE cards SET balance = balance - ? WHERE number = ?"
+SQL_CREDIT = "UPDATE cards SET balance = balance + ? WHERE number = ?"
+SQL_UPDATE_PIN = "UPDATE cards SET pin = ? WHERE number = ?"
+SQL_INSERT_TRANSACTION = (
+    "INSERT INTO transactions "
+    "(from_card_number, to_card_number, amount, transaction_type, timestamp) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+
+class PreparedStatements:
+    """
+    Cache prepared cursor theo (connection, câu SQL).
+
+    MySQLCursorPrepared chỉ giữ 1 statement, execute câu khác sẽ prepare lại,
+    nên mỗi câu SQL dùng riêng 1 cursor. Connection bị pool đóng/loại bỏ thì
+    cache của nó tự mất theo (WeakKeyDictionary).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._cursors: WeakKeyDictionary[
+            MySQLConnection, Dict[str, MySQLCursorPrepared]
+        ] = WeakKeyDictionary()
+
+    def execute(
+        self, conn: MySQLConnection, sql: str, params: tuple
+    ) -> MySQLCursorPrepared:
+        """Thực thi prepared statement, trả về cursor để đọc kết quả"""
+        # Mỗi connection chỉ được 1 thread dùng tại một thời điểm (pool),
+        # lock chỉ bảo vệ WeakKeyDictionary
+        with self._lock:
+            cursors = self._cursors.setdefault(conn, {})
+
+        cursor = cursors.get(sql)
+        if cursor is None:
+            cursor = cast(MySQLCursorPrepared, conn.cursor(prepared=True))
+            cursors[sql] = cursor
+
+        cursor.execute(sql, params)
+        return cursor
+
+    def fetch_all(self, conn: MySQLConnection, sql: str, params: tuple) -> List[Any]:
+        return self.execute(conn, sql, params).fetchall()
+
+
+class InlineDatabaseReader(DatabaseReader):
+    """DatabaseReader dùng prepared statement cho check_balance và login"""
+
+    def __init__(self, database):
+        super().__init__(database)
+        self._statements = PreparedStatements()
+
+    def login(self, card_number: str, card_pin: str):
+        """Đăng nhập và lấy thông tin user"""
+
+        def query():
+            with self.database.read_connection() as conn:
+                return self._statements.fetch_all(
+                    conn, SQL_LOGIN, (card_number, card_pin)
+                )
+
+        try:
+            rows = self._with_retry(query)
+        except mysql.connector.Error as e:
+            raise SQLException(str(e.msg), e.sqlstate)
+
+        if not rows:
+            raise SQLException("Số thẻ hoặc mã PIN không hợp lệ.", BUSINESS_ERROR)
+
+        user_id, name, dob, phone, citizen_id = rows[0]
+        user_info: UserData = {
+            "id": user_id,
+            "name": name,
+            "dob": dob,
+            "phone": phone,
+            "citizen_id": citizen_id,
+            "card_number": card_number,
+        }
+        return user_info
+
+    def _call_procedure(
+        self, proc_name: str, params: list | None, dictionary: bool
+    ) -> List[Any]:
+        if proc_name != "check_balance":
+            return super()._call_procedure(proc_name, params, dictionary)
+
+        def query():
+            with self.database.read_connection() as conn:
+                return self._statements.fetch_all(
+                    conn, SQL_CHECK_BALANCE, tuple(params or [])
+                )
+
+        try:
+            rows = self._with_retry(query)
+        except mysql.connector.Error as e:
+            raise SQLException(str(e.msg), e.sqlstate)
+
+        # Cùng dạng kết quả với callproc("check_balance")
+        if dictionary:
+            return [{"balance": row[0]} for row in rows]
+        return rows
+
+
+class InlineDatabaseWriter(DatabaseWriter):
+    """DatabaseWriter chạy deposit/withdraw/transfer/change_pin bằng prepared statement"""
+
+    def __init__(self, database):
+        super().__init__(database)
+        self._statements = PreparedStatements()
+
+    def _call(
+        self,
+        conn: MySQLConnection,
+        cursor: MySQLCursor,
+        proc_name: str,
+        params: list,
+        in_batch: bool,
+    ):
+        # Transaction do caller quản lý nên in_batch không ảnh hưởng
+        match proc_name:
+            case "withdraw_money":
+                self._withdraw(conn, *params)
+            case "transfer_money":
+                self._transfer(conn, *params)
+            case "deposit_money":
+                self._deposit(conn, *params)
+            case "change_pin":
+                self._change_pin(conn, *params)
+            case _:
+                super()._call(conn, cursor, proc_name, params, in_batch)
+
+    def _withdraw(
+        self, conn: MySQLConnection, card_number: str, amount: int, transaction_time: int
+    ):
+        rows = self._statements.fetch_all(conn, SQL_LOCK_BALANCE, (card_number,))
+        if not rows:
+            raise SQLException("Số thẻ không tồn tại.", BUSINESS_ERROR)
+
+        if rows[0][0] < amount:
+            raise SQLException("Số dư hiện tại không đủ.", BUSINESS_ERROR)
+
+        self._statements.execute(conn, SQL_DEBIT, (amount, card_number))
+        self._insert_transaction(
+            conn, card_number, card_number, amount, "Withdraw", transaction_time
+        )
+
+    def _transfer(
+        self,
+        conn: MySQLConnection,
+        from_card: str,
+        to_card: str,
+        amount: int,
+        transaction_time: int,
+    ):
+        if from_card == to_card:
+            raise SQLException("Không thể chuyển khoản cho chính mình.", BUSINESS_ERROR)
+
+        rows = self._statements.fetch_all(
+            conn, SQL_LOCK_TRANSFER_CARDS, (from_card, to_card)
+        )
+        balances = {number: balance for number, balance in rows}
+
+        if to_card not in balances:
+            raise SQLException("Số tài khoản đối ứng không tồn tại.", BUSINESS_ERROR)
+        if from_card not in balances:
+            raise SQLException("Số thẻ không tồn tại.", BUSINESS_ERROR)
+
+        if balances[from_card] < amount:
+            raise SQLException("Số dư hiện tại không đủ.", BUSINESS_ERROR)
+
+        self._statements.execute(conn, SQL_DEBIT, (amount, from_card))
+        self._statements.execute(conn, SQL_CREDIT, (amount, to_card))
+        self._insert_transaction(
+            conn, from_card, to_card, amount, "Transfer", transaction_time
+        )
+
+    def _deposit(
+        self, conn: MySQLConnection, card_number: str, amount: int, transaction_time: int
+    ):
+        # Connection mặc định có CLIENT_FOUND_ROWS: rowcount = số dòng khớp WHERE
+        cursor = self._statements.execute(conn, SQL_CREDIT, (amount, card_number))
+        if cursor.rowcount == 0:
+            raise SQLException("Số thẻ không tồn tại.", BUSINESS_ERROR)
+
+        self._insert_transaction(
+            conn, card_number, card_number, amount, "Deposit", transaction_time
+        )
+
+    def _change_pin(self, conn: MySQLConnection, card_number: str, new_pin: str):
+        rows = self._statements.fetch_all(conn, SQL_LOCK_PIN, (card_number,))
+        if rows and rows[0][0] == new_pin:
+            raise SQLException(
+                "Mã PIN mới không được trùng với mã PIN cũ.", BUSINESS_ERROR
+            )
+
+        self._statements.execute(conn, SQL_UPDATE_PIN, (new_pin, card_number))
+
+    def _insert_transaction(
+        self,
+        conn: MySQLConnection,
+        from_card: str,
+        to_card: str,
+        amount: int,
+        transaction_type: str,
+        transaction_time: int,
+    ):
+        self._statements.execute(
+            conn,
+            SQL_INSERT_TRANSACTION,
+            (from_card, to_card, amount, transaction_type, transaction_time),
+        )
@@ -0,0 +1,274 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition
+from typing import Callable, Deque, Dict, Iterator, Tuple, TypedDict
+
+import mysql.connector
+from mysql.connector.connection import MySQLConnection
+
+from .exceptions import PoolTimeoutError
+
+
+class PoolConfig(TypedDict):
+    min_size: int  # Số connection mở sẵn khi khởi tạo
+    max_size: int  # Số connection tối đa
+    checkout_timeout: float  # Thời gian chờ tối đa khi pool đã hết connection (s)
+    validate_idle_after: float  # Connection idle lâu hơn ngưỡng này mới bị ping lại (s)
+    reconnect_attempts: int  # Số lần thử tạo connection mới trước khi báo lỗi
+    reconnect_backoff: float  # Thời gian chờ lần thử đầu, nhân đôi sau mỗi lần (s)
+
+
+DEFAULT_POOL_CONFIG: PoolConfig = {
+    "min_size": 1,
+    "max_size": 4,
+    "checkout_timeout": 5.0,
+    "validate_idle_after": 30.0,
+    "reconnect_attempts": 3,
+    "reconnect_backoff": 0.1,
+}
+
+# Lỗi mức connection: connection không dùng được nữa
+CONNECTION_ERRORS = (mysql.connector.OperationalError, mysql.connector.InterfaceError)
+
+
+class ConnectionPool:
+    """
+    Pool các MySQLConnection, mỗi connection chỉ được một thread dùng tại
+    một thời điểm (checkout -> dùng -> trả lại).
+
+    - Connection idle được dùng lại theo LIFO (connection "nóng" nhất trước)
+    - Không ping trước mỗi query, chỉ ping kiểm tra connection đã idle lâu
+      hơn validate_idle_after hoặc đã idle từ trước lần lỗi connection gần nhất
+      (server restart làm hỏng tất cả connection cùng lúc)
+    - Tạo connection mới có retry với backoff tăng dần
+    - Hết connection và đã đạt max_size -> chờ tối đa checkout_timeout
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], MySQLConnection],
+        config: PoolConfig = DEFAULT_POOL_CONFIG,
+    ):
+        """
+        Args:
+            name: Tên pool (để log/thống kê)
+            factory: Hàm tạo connection mới
+            config: Cấu hình kích thước/timeout
+        """
+        self.name = name
+        self.factory = factory
+        self.config = config
+
+        self._cond = Condition()
+        self._idle: Deque[Tuple[MySQLConnection, float]] = deque()
+        self._size = 0
+        self._closed = False
+
+        # Connection idle từ trước thời điểm này phải được ping trước khi dùng
+        self._suspect_before = 0.0
+
+        self._metrics = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "validations": 0,
+            "reconnect_retries": 0,
+        }
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        for _ in range(config["min_size"]):
+            conn = self._create()
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+    def _create(self) -> MySQLConnection:
+        """Tạo connection mới, thử lại với backoff nếu database chưa sẵn sàng"""
+        attempts = max(1, self.config["reconnect_attempts"])
+        backoff = self.config["reconnect_backoff"]
+
+        for attempt in range(attempts):
+            try:
+                conn = self.factory()
+                break
+            except CONNECTION_ERRORS:
+                if attempt == attempts - 1:
+                    raise
+
+                with self._cond:
+                    self._metrics["reconnect_retries"] += 1
+                time.sleep(backoff * (2**attempt))
+
+        with self._cond:
+            self._metrics["created"] += 1
+        return conn
+
+    def acquire(self) -> MySQLConnection:
+        """
+        Lấy một connection từ pool.
+
+        Raises:
+            PoolTimeoutError: Nếu chờ quá checkout_timeout mà không có connection
+            mysql.connector.Error: Nếu không tạo được connection mới
+        """
+        started = time.monotonic()
+        deadline = started + self.config["checkout_timeout"]
+        waited = False
+
+        while True:
+            conn = None
+            last_used = 0.0
+            must_create = False
+
+            with self._cond:
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+
+                    if self._size < self.config["max_size"]:
+                        self._size += 1
+                        must_create = True
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"Hết thời gian chờ connection từ pool [{self.name}]"
+                        )
+
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if must_create:
+                try:
+                    conn = self._create()
+                except BaseException:
+                    self._forget()
+                    raise
+
+            elif self._needs_validation(last_used):
+                # Chỉ ping connection đã idle lâu hoặc có thể đã hỏng (sau lỗi connection)
+                assert conn is not None
+                with self._cond:
+                    self._metrics["validations"] += 1
+                if not self._is_healthy(conn):
+                    self._discard(conn)
+                    continue
+
+            assert conn is not None
+            self._record_checkout(time.monotonic() - started, waited)
+            return conn
+
+    def release(self, conn: MySQLConnection, broken: bool = False):
+        """
+        Trả connection về pool.
+
+        Args:
+            conn: Connection đã lấy bằng acquire()
+            broken: True nếu connection bị lỗi (sẽ bị đóng và bỏ khỏi pool)
+        """
+        if broken:
+            # Lỗi connection thường do server restart/mạng -> các connection
+            # đang idle cũng có thể đã hỏng, ping chúng ở lần checkout tới
+            with self._cond:
+                self._suspect_before = time.monotonic()
+
+        if broken or self._closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[MySQLConnection]:
+        """
+        Context manager checkout/trả connection.
+
+        Lỗi mức connection (mất kết nối...) -> connection bị loại khỏi pool.
+        """
+        conn = self.acquire()
+        broken = False
+
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def stats(self) -> Dict[str, float]:
+        """Thống kê kích thước, mức sử dụng và thời gian chờ của pool"""
+        with self._cond:
+            in_use = self._size - len(self._idle)
+            checkouts = self._metrics["checkouts"]
+
+            return {
+                **self._metrics,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "max_size": self.config["max_size"],
+                "utilization": in_use / self.config["max_size"],
+                "avg_wait_ms": (self._total_wait / checkouts * 1000) if checkouts else 0,
+                "max_wait_ms": self._max_wait * 1000,
+            }
+
+    def close(self):
+        """Đóng tất cả connection idle, connection đang dùng sẽ bị đóng khi trả về"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def _record_checkout(self, wait: float, waited: bool):
+        with self._cond:
+            self._metrics["checkouts"] += 1
+            if waited:
+                self._metrics["waits"] += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+
+    def _needs_validation(self, last_used: float) -> bool:
+        with self._cond:
+            suspect_before = self._suspect_before
+
+        return (
+            last_used <= suspect_before
+            or time.monotonic() - last_used > self.config["validate_idle_after"]
+        )
+
+    @staticmethod
+    def _is_healthy(conn: MySQLConnection) -> bool:
+        try:
+            return conn.is_connected()
+        except mysql.connector.Error:
+            return False
+
+    def _discard(self, conn: MySQLConnection):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+        with self._cond:
+            self._metrics["discarded"] += 1
+        self._forget()
+
+    def _forget(self):
+        """Giảm kích thước pool và đánh thức thread đang chờ"""
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
@@ -0,0 +1,13 @@
+-- Migration cho database đã tạo bằng tables.sql cũ (chạy 1 lần trên mỗi server)
+-- - Thêm khóa chính id (surrogate key) cho transactions
+-- - Thêm index (from_card_number, timestamp) và (to_card_number, timestamp)
+--   InnoDB tự gắn id (khóa chính) vào cuối mỗi secondary index nên
+--   ORDER BY timestamp DESC, id DESC đọc thẳng theo index, không phải sort
+-- Index FK cũ trên from_card_number/to_card_number bị thay thế bởi index mới
+-- Sau khi chạy migration, chạy lại procedures.sql
+USE atm_db_s1;
+
+ALTER TABLE transactions
+    ADD COLUMN id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST,
+    ADD INDEX idx_transactions_from_time (from_card_number, timestamp),
+    ADD INDEX idx_transactions_to_time (to_card_number, timestamp);
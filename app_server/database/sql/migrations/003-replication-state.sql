@@ -0,0 +1,12 @@
+-- Migration: vị trí replication log theo từng peer gửi (chạy 1 lần trên mỗi server)
+-- - Mỗi command peer gửi sang có log index tăng dần trong 1 epoch (1 lần khởi động của peer)
+-- - applied_index được ghi trong cùng transaction với các command được áp dụng,
+--   nên sau khi crash/khởi động lại không áp dụng trùng hoặc bỏ sót command
+-- Sau khi chạy migration, chạy lại procedures.sql
+USE atm_db_s1;
+
+CREATE TABLE IF NOT EXISTS replication_state (
+    origin_id INT NOT NULL PRIMARY KEY,
+    epoch VARCHAR(32) NOT NULL,
+    applied_index BIGINT UNSIGNED NOT NULL
+);
@@ -0,0 +1,13 @@
+-- Migration: chống áp dụng trùng command (chạy 1 lần trên mỗi server)
+-- - Mỗi command có command_id = "<origin_id>-<seq>", seq tăng dần theo thời gian tạo (µs)
+-- - Command thành công được ghi (origin_id, seq) trong cùng transaction, PRIMARY KEY
+--   chặn việc áp dụng lần 2 kể cả khi 2 luồng cùng thực thi 1 command
+-- - Chỉ giữ các dòng trong cửa sổ gần high-water mark của mỗi origin (xem CommandDedupe)
+-- Sau khi chạy migration, chạy lại procedures.sql
+USE atm_db_s1;
+
+CREATE TABLE IF NOT EXISTS applied_commands (
+    origin_id INT NOT NULL,
+    seq BIGINT UNSIGNED NOT NULL,
+    PRIMARY KEY (origin_id, seq)
+);
@@ -11,6 +11,21 @@ DROP PROCEDURE IF EXISTS change_pin;
 DROP PROCEDURE IF EXISTS login;
 DROP PROCEDURE IF EXISTS check_balance;
 DROP PROCEDURE IF EXISTS get_transaction_history;
+DROP PROCEDURE IF EXISTS get_all_balances;
+DROP PROCEDURE IF EXISTS get_transaction_history_page;
+DROP PROCEDURE IF EXISTS withdraw_money_in_tx;
+DROP PROCEDURE IF EXISTS transfer_money_in_tx;
+DROP PROCEDURE IF EXISTS deposit_money_in_tx;
+DROP PROCEDURE IF EXISTS change_pin_in_tx;
+DROP PROCEDURE IF EXISTS get_replication_state;
+DROP PROCEDURE IF EXISTS set_replication_state;
+DROP PROCEDURE IF EXISTS record_applied_command;
+DROP PROCEDURE IF EXISTS get_applied_commands;
+DROP PROCEDURE IF EXISTS prune_applied_commands;
+
+-- Các procedure *_in_tx chứa logic nghiệp vụ nhưng KHÔNG tự mở/commit transaction.
+-- Dùng khi chạy nhiều lệnh trong 1 transaction (mỗi lệnh 1 SAVEPOINT, commit 1 lần cho cả batch).
+-- Các procedure thường (withdraw_money...) gọi lại chúng trong transaction riêng.
 
 -- ĐĂNG KÝ USER (ADMIN)
 DELIMITER //
@@ -89,27 +104,27 @@ BEGIN
 END //
 DELIMITER ;
 
--- RÚT TIỀN
+-- RÚT TIỀN (không tự quản lý transaction)
 DELIMITER //
-CREATE PROCEDURE withdraw_money(
+CREATE PROCEDURE withdraw_money_in_tx(
     IN card_number CHAR(6),
     IN amount INT UNSIGNED,
     IN transaction_time BIGINT  -- Thời gian giao dịch dạng timestamp từ Python
 )
 BEGIN
     DECLARE current_balance BIGINT UNSIGNED;
-    DECLARE EXIT HANDLER FOR SQLEXCEPTION -- Xử lý lỗi (Rollback nếu có lỗi)
-    BEGIN
-        ROLLBACK;
-        RESIGNAL;
-    END;
 
-    START TRANSACTION; -- Bắt đầu Transaction
-
-    -- 1. Lấy số dư hiện tại
+    -- 1. Lấy số dư hiện tại (khóa dòng tới khi transaction kết thúc)
     SELECT balance INTO current_balance
     FROM cards
-    WHERE number = card_number;
+    WHERE number = card_number
+    FOR UPDATE;
+
+    -- Bảng transactions không còn FK (partition) nên phải tự kiểm tra thẻ tồn tại
+    IF current_balance IS NULL THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'Số thẻ không tồn tại.';
+    END IF;
 
     -- 2. Kiểm tra nếu số dư không đủ
     IF current_balance < amount THEN
@@ -125,14 +140,32 @@ BEGIN
     -- 4. Ghi vào lịch sử giao dịch
     INSERT INTO transactions (from_card_number, to_card_number, amount, transaction_type, timestamp)
     VALUES (card_number, card_number, amount, 'Withdraw', transaction_time);
+END //
+DELIMITER ;
 
+-- RÚT TIỀN
+DELIMITER //
+CREATE PROCEDURE withdraw_money(
+    IN card_number CHAR(6),
+    IN amount INT UNSIGNED,
+    IN transaction_time BIGINT  -- Thời gian giao dịch dạng timestamp từ Python
+)
+BEGIN
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION -- Xử lý lỗi (Rollback nếu có lỗi)
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION; -- Bắt đầu Transaction
+    CALL withdraw_money_in_tx(card_number, amount, transaction_time);
     COMMIT; -- Kết thúc Transaction
 END //
 DELIMITER ;
 
--- CHUYỂN KHOẢN
+-- CHUYỂN KHOẢN (không tự quản lý transaction)
 DELIMITER //
-CREATE PROCEDURE transfer_money(
+CREATE PROCEDURE transfer_money_in_tx(
     IN from_card_number CHAR(6),
     IN to_card_number CHAR(6),
     IN amount INT UNSIGNED,
@@ -141,13 +174,7 @@ CREATE PROCEDURE transfer_money(
 BEGIN
     DECLARE from_balance BIGINT UNSIGNED;
     DECLARE to_card_exists TINYINT;
-    DECLARE EXIT HANDLER FOR SQLEXCEPTION
-    BEGIN
-        ROLLBACK;
-        RESIGNAL;
-    END;
-
-    START TRANSACTION; -- Bắt đầu Transaction
+    DECLARE locked_cards TINYINT;
 
     -- 1. Kiểm tra không chuyển khoản cho chính mình
     IF from_card_number = to_card_number THEN
@@ -155,6 +182,13 @@ BEGIN
         SET MESSAGE_TEXT = 'Không thể chuyển khoản cho chính mình.';
     END IF;
 
+    -- Khóa cả 2 thẻ theo thứ tự số thẻ (quét PK tăng dần), không phụ thuộc chiều chuyển
+    -- -> 2 giao dịch A->B và B->A chạy song song không bị deadlock
+    SELECT COUNT(*) INTO locked_cards
+    FROM cards
+    WHERE number IN (from_card_number, to_card_number)
+    FOR UPDATE;
+
     -- 2. Kiểm tra tài khoản đích có tồn tại không
     SELECT COUNT(*) INTO to_card_exists
     FROM cards
@@ -165,10 +199,16 @@ BEGIN
         SET MESSAGE_TEXT = 'Số tài khoản đối ứng không tồn tại.';
     END IF;
 
-    -- 3. Lấy số dư tài khoản nguồn
+    -- 3. Lấy số dư tài khoản nguồn (khóa dòng tới khi transaction kết thúc)
     SELECT balance INTO from_balance
     FROM cards
-    WHERE number = from_card_number;
+    WHERE number = from_card_number
+    FOR UPDATE;
+
+    IF from_balance IS NULL THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'Số thẻ không tồn tại.';
+    END IF;
 
     -- 4. Kiểm tra nếu số dư không đủ
     IF from_balance < amount THEN
@@ -188,17 +228,16 @@ BEGIN
     -- 6. Ghi vào lịch sử giao dịch
     INSERT INTO transactions (from_card_number, to_card_number, amount, transaction_type, timestamp)
     VALUES (from_card_number, to_card_number, amount, 'Transfer', transaction_time);
-
-    COMMIT; -- Kết thúc Transaction
 END //
 DELIMITER ;
 
--- NẠP TIỀN/GỬI TIỀN
+-- CHUYỂN KHOẢN
 DELIMITER //
-CREATE PROCEDURE deposit_money(
-    IN card_number CHAR(6),
+CREATE PROCEDURE transfer_money(
+    IN from_card_number CHAR(6),
+    IN to_card_number CHAR(6),
     IN amount INT UNSIGNED,
-    IN transaction_time BIGINT
+    IN transaction_time BIGINT -- Thời gian giao dịch dạng timestamp từ Python
 )
 BEGIN
     DECLARE EXIT HANDLER FOR SQLEXCEPTION
@@ -207,8 +246,20 @@ BEGIN
         RESIGNAL;
     END;
 
-    START TRANSACTION;
+    START TRANSACTION; -- Bắt đầu Transaction
+    CALL transfer_money_in_tx(from_card_number, to_card_number, amount, transaction_time);
+    COMMIT; -- Kết thúc Transaction
+END //
+DELIMITER ;
 
+-- NẠP TIỀN/GỬI TIỀN (không tự quản lý transaction)
+DELIMITER //
+CREATE PROCEDURE deposit_money_in_tx(
+    IN card_number CHAR(6),
+    IN amount INT UNSIGNED,
+    IN transaction_time BIGINT
+)
+BEGIN
     -- 1. Kiểm tra tài khoản đích có tồn tại không
     -- Gần như không bao giờ xảy ra tại tầng ứng dụng, nhưng để tránh sai xót khi code thao tác raw
     IF NOT EXISTS (SELECT 1 FROM cards WHERE number = card_number) THEN
@@ -224,14 +275,32 @@ BEGIN
     -- 3. Ghi vào lịch sử giao dịch
     INSERT INTO transactions (from_card_number, to_card_number, amount, transaction_type, timestamp)
     VALUES (card_number, card_number, amount, 'Deposit', transaction_time);
+END //
+DELIMITER ;
+
+-- NẠP TIỀN/GỬI TIỀN
+DELIMITER //
+CREATE PROCEDURE deposit_money(
+    IN card_number CHAR(6),
+    IN amount INT UNSIGNED,
+    IN transaction_time BIGINT
+)
+BEGIN
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
 
+    START TRANSACTION;
+    CALL deposit_money_in_tx(card_number, amount, transaction_time);
     COMMIT;
 END //
 DELIMITER ;
 
 -- ĐỔI MÃ PIN
 DELIMITER //
-CREATE PROCEDURE change_pin(
+CREATE PROCEDURE change_pin_in_tx(
     IN card_number CHAR(6),
     IN new_pin CHAR(4)
 )
@@ -256,6 +325,17 @@ BEGIN
 END //
 DELIMITER ;
 
+DELIMITER //
+CREATE PROCEDURE change_pin(
+    IN card_number CHAR(6),
+    IN new_pin CHAR(4)
+)
+BEGIN
+    -- Đổi PIN chỉ có 1 lệnh UPDATE, transaction do phía Python commit
+    CALL change_pin_in_tx(card_number, new_pin);
+END //
+DELIMITER ;
+
 -- ĐĂNG NHẬP
 DELIMITER //
 CREATE PROCEDURE login(
@@ -296,6 +376,15 @@ BEGIN
 END //
 DELIMITER ;
 
+-- LẤY SỐ DƯ TẤT CẢ CÁC THẺ (WARM BALANCE CACHE)
+DELIMITER //
+CREATE PROCEDURE get_all_balances()
+BEGIN
+    SELECT number, balance
+    FROM cards;
+END //
+DELIMITER ;
+
 -- LẤY LỊCH SỬ GIAO DỊCH
 DELIMITER //
 CREATE PROCEDURE get_transaction_history(
@@ -308,4 +397,125 @@ BEGIN
     WHERE from_card_number = card_number OR to_card_number = card_number
     ORDER BY timestamp DESC;
 END //
-DELIMITER ;
\ No newline at end of file
+DELIMITER ;
+
+-- LẤY LỊCH SỬ GIAO DỊCH THEO TRANG (KEYSET)
+-- Trang đầu: before_timestamp = NULL. Trang sau: (timestamp, id) của dòng cuối trang trước.
+-- Mỗi nhánh UNION ALL là 1 range scan ngược trên index (thẻ, timestamp, id), chỉ đọc page_limit dòng
+-- since_timestamp (có thể NULL) giới hạn dưới -> MySQL chỉ mở các partition tháng gần đây
+DELIMITER //
+CREATE PROCEDURE get_transaction_history_page(
+    IN card_number CHAR(6),
+    IN before_timestamp BIGINT,
+    IN before_id BIGINT UNSIGNED,
+    IN page_limit INT,
+    IN since_timestamp BIGINT
+)
+BEGIN
+    IF since_timestamp IS NULL THEN
+        SET since_timestamp = 0;
+    END IF;
+
+    IF before_timestamp IS NULL THEN
+        SET before_timestamp = 9223372036854775807;
+        SET before_id = 18446744073709551615;
+    END IF;
+
+    SELECT *
+    FROM (
+        (
+            SELECT *
+            FROM transactions
+            WHERE from_card_number = card_number
+              AND timestamp >= since_timestamp
+              AND (timestamp < before_timestamp OR (timestamp = before_timestamp AND id < before_id))
+            ORDER BY timestamp DESC, id DESC
+            LIMIT page_limit
+        )
+        UNION ALL
+        (
+            -- Rút/nạp có from = to = card_number, đã lấy ở nhánh trên
+            SELECT *
+            FROM transactions
+            WHERE to_card_number = card_number
+              AND from_card_number <> card_number
+              AND timestamp >= since_timestamp
+              AND (timestamp < before_timestamp OR (timestamp = before_timestamp AND id < before_id))
+            ORDER BY timestamp DESC, id DESC
+            LIMIT page_limit
+        )
+    ) AS page
+    ORDER BY timestamp DESC, id DESC
+    LIMIT page_limit;
+END //
+DELIMITER ;
+
+-- LẤY VỊ TRÍ REPLICATION LOG ĐÃ ÁP DỤNG CỦA 1 PEER
+DELIMITER //
+CREATE PROCEDURE get_replication_state(
+    IN p_origin_id INT
+)
+BEGIN
+    SELECT epoch, applied_index
+    FROM replication_state
+    WHERE origin_id = p_origin_id;
+END //
+DELIMITER ;
+
+-- GHI VỊ TRÍ REPLICATION LOG (không tự mở/commit transaction, gọi cùng batch command được áp dụng)
+DELIMITER //
+CREATE PROCEDURE set_replication_state(
+    IN p_origin_id INT,
+    IN p_epoch VARCHAR(32),
+    IN p_applied_index BIGINT UNSIGNED
+)
+BEGIN
+    INSERT INTO replication_state (origin_id, epoch, applied_index)
+    VALUES (p_origin_id, p_epoch, p_applied_index)
+    ON DUPLICATE KEY UPDATE epoch = p_epoch, applied_index = p_applied_index;
+END //
+DELIMITER ;
+
+-- GHI COMMAND ĐÃ ÁP DỤNG (không tự mở/commit transaction)
+-- Command đã có -> lỗi duplicate key (1062), caller coi là command trùng
+DELIMITER //
+CREATE PROCEDURE record_applied_command(
+    IN p_origin_id INT,
+    IN p_seq BIGINT UNSIGNED
+)
+BEGIN
+    INSERT INTO applied_commands (origin_id, seq)
+    VALUES (p_origin_id, p_seq);
+END //
+DELIMITER ;
+
+-- LẤY CÁC COMMAND ĐÃ ÁP DỤNG TRONG CỬA SỔ window_size TÍNH TỪ HIGH-WATER MARK CỦA MỖI ORIGIN
+DELIMITER //
+CREATE PROCEDURE get_applied_commands(
+    IN window_size BIGINT UNSIGNED
+)
+BEGIN
+    SELECT a.origin_id, a.seq
+    FROM applied_commands a
+    JOIN (
+        SELECT origin_id, MAX(seq) AS high_water
+        FROM applied_commands
+        GROUP BY origin_id
+    ) h ON a.origin_id = h.origin_id
+    WHERE a.seq + window_size > h.high_water;
+END //
+DELIMITER ;
+
+-- XÓA CÁC COMMAND ĐÃ RA KHỎI CỬA SỔ (seq < below_seq)
+DELIMITER //
+CREATE PROCEDURE prune_applied_commands(
+    IN p_origin_id INT,
+    IN below_seq BIGINT UNSIGNED
+)
+BEGIN
+    START TRANSACTION;
+    DELETE FROM applied_commands
+    WHERE origin_id = p_origin_id AND seq < below_seq;
+    COMMIT;
+END //
+DELIMITER ;
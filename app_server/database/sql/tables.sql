@@ -19,12 +19,50 @@ CREATE TABLE cards (
     FOREIGN KEY (owner_id) REFERENCES users(id)				-- Khóa ngoại tham chiếu tới cột id trong bảng users
 );
 
+-- Partition theo tháng (UTC) trên timestamp, xem migrations/002-transactions-partitioning.sql
+-- Bảng mới chỉ có p_future, server (TransactionArchiver) tạo p_old và partition
+-- cho các tháng tới khi khởi động
+-- Bảng partition không hỗ trợ FOREIGN KEY: việc kiểm tra thẻ tồn tại do các procedure đảm nhiệm
 CREATE TABLE transactions (
-    from_card_number CHAR(6) NOT NULL,									-- Số tài khoản nguồn (khóa ngoại tham chiếu tới bảng cards)
-    to_card_number CHAR(6) NOT NULL,									-- Số tài khoản đích (khóa ngoại tham chiếu tới bảng cards)
+    id BIGINT UNSIGNED AUTO_INCREMENT,									-- Surrogate key, dùng làm cursor phân trang cùng timestamp
+    from_card_number CHAR(6) NOT NULL,									-- Số tài khoản nguồn
+    to_card_number CHAR(6) NOT NULL,									-- Số tài khoản đích
     amount INT UNSIGNED NOT NULL CHECK(amount > 0),						-- Số tiền giao dịch (không được âm, ràng buộc CHECK)
     transaction_type ENUM('Withdraw', 'Deposit', 'Transfer') NOT NULL,	-- Loại giao dịch (rút tiền, gửi tiền, chuyển khoản)
-    timestamp BIGINT DEFAULT (UNIX_TIMESTAMP()),						-- Thời gian giao dịch (timestamp dạng số nguyên)
-    FOREIGN KEY (from_card_number) REFERENCES cards(number),			-- Khóa ngoại tham chiếu tới số tài khoản nguồn
-    FOREIGN KEY (to_card_number) REFERENCES cards(number)				-- Khóa ngoại tham chiếu tới số tài khoản đích
-);
\ No newline at end of file
+    timestamp BIGINT NOT NULL DEFAULT (UNIX_TIMESTAMP()),				-- Thời gian giao dịch (timestamp dạng số nguyên)
+    PRIMARY KEY (id, timestamp),										-- Khóa unique phải chứa cột partition
+    INDEX idx_transactions_from_time (from_card_number, timestamp),		-- Lịch sử theo thẻ nguồn, mới nhất trước
+    INDEX idx_transactions_to_time (to_card_number, timestamp)			-- Lịch sử theo thẻ đích, mới nhất trước
+)
+PARTITION BY RANGE (timestamp) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+-- Giao dịch cũ được TransactionArchiver chuyển sang đây (nén)
+CREATE TABLE transactions_archive (
+    id BIGINT UNSIGNED NOT NULL,
+    from_card_number CHAR(6) NOT NULL,
+    to_card_number CHAR(6) NOT NULL,
+    amount INT UNSIGNED NOT NULL,
+    transaction_type ENUM('Withdraw', 'Deposit', 'Transfer') NOT NULL,
+    timestamp BIGINT NOT NULL,
+    PRIMARY KEY (id, timestamp),
+    INDEX idx_archive_from_time (from_card_number, timestamp),
+    INDEX idx_archive_to_time (to_card_number, timestamp)
+) ROW_FORMAT=COMPRESSED;
+
+-- Vị trí replication log của peer đã được áp dụng vào database này
+-- Cập nhật trong cùng transaction với các command được áp dụng (xem migrations/003-replication-state.sql)
+CREATE TABLE replication_state (
+    origin_id INT NOT NULL PRIMARY KEY,			-- PEER_ID của server gửi log
+    epoch VARCHAR(32) NOT NULL,					-- Định danh log của server gửi (đổi mỗi lần khởi động)
+    applied_index BIGINT UNSIGNED NOT NULL		-- Index lớn nhất đã áp dụng trong epoch
+);
+
+-- Các command đã áp dụng gần đây (chống áp dụng trùng khi replay/gửi lại)
+-- Ghi trong cùng transaction với command, xem migrations/004-applied-commands.sql
+CREATE TABLE applied_commands (
+    origin_id INT NOT NULL,						-- PEER_ID của server tạo command
+    seq BIGINT UNSIGNED NOT NULL,				-- Phần số của command_id (tăng dần theo thời gian tạo, µs)
+    PRIMARY KEY (origin_id, seq)
+);
@@ -0,0 +1,277 @@
+import time
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from shared.models.server import ATMCommand, ReplicationAck, ReplicationWatermark
+from .command_executor import CommandExecutor
+from .database.main import DatabaseReader, WriteBatch
+from .database.exceptions import CommandFailedError
+from .config import PEER_ID
+
+
+class ReplicationError(RuntimeError):
+    """Peer không áp dụng hết đoạn log được gửi (log bị hở/chờ log server khác, cần gửi lại)"""
+
+
+class ReplicationReceiver:
+    """
+    Áp dụng replication log peer gửi sang (PeerService.replicate).
+
+    - Mỗi command có log index tăng dần trong 1 epoch của peer gửi
+      (ReplicationBacklog.epoch, đổi khi peer bắt đầu log mới)
+    - Chỉ áp dụng phần nối tiếp applied_index: phần đã áp dụng (gửi lại do mất
+      ack) bị bỏ qua, đoạn log bị hở (first_index > applied + 1) bị từ chối
+    - Các command và applied_index mới được commit trong cùng 1 transaction,
+      nên vị trí trong bảng replication_state luôn khớp với dữ liệu kể cả khi crash
+    - Áp dụng đồng bộ trong lời gọi RPC: index trả về là index đã thực sự được ghi
+    - Từ 3 server: command có depends_on (vị trí log các server khác peer gửi đã
+      áp dụng lúc thực thi) chờ tới khi log của các server đó được áp dụng tới đó.
+      Chỉ phần trước command đó được áp dụng, peer gửi lại phần còn lại sau: log
+      đến không đúng thứ tự (VD: withdraw đến trước deposit của server thứ 3) chỉ
+      làm chậm chứ không làm lỗi
+    - Command trong log đã thành công tại peer gửi, sau mọi command nó phụ thuộc,
+      nên không được lỗi ở đây. Lỗi nghĩa là dữ liệu đã lệch: cả đoạn log bị
+      rollback, applied_index giữ nguyên thay vì áp dụng tiếp
+    - watermarks()/caught_up(): server trao shard gửi kèm vị trí đã áp dụng của
+      mình, server nhận chỉ dùng shard khi đã áp dụng tới đó (đã thấy mọi command
+      các chủ cũ của shard thực thi). remaining() cho biết tiến độ catch-up
+    """
+
+    def __init__(
+        self,
+        executor: CommandExecutor,
+        database_reader: DatabaseReader,
+        node_id: int = PEER_ID,
+    ):
+        """
+        Args:
+            node_id: ID của server này (depends_on vào log của chính nó luôn thỏa)
+        """
+        self.executor = executor
+        self.database_reader = database_reader
+        self.node_id = node_id
+
+        # Các lần receive chạy lần lượt; _lock chỉ giữ state (không giữ khi đang
+        # ghi database) để caught_up/remaining không phải chờ 1 đoạn log dài
+        self._apply_lock = Lock()
+        self._lock = Lock()
+        # origin_id -> (epoch, applied_index), nạp từ database khi cần
+        self._applied: Dict[int, Tuple[str, int]] = {}
+        # Origin chưa có trong database (không hỏi lại database mỗi lần)
+        self._unknown: Set[int] = set()
+        # origin_id -> vị trí đang commit: watermarks() tính cả phần này để
+        # worker (đọc sau khi thực thi) không bỏ sót dữ liệu đã thấy
+        self._committing: Dict[int, Tuple[str, int]] = {}
+        # Origin đang chờ log của server khác (depends_on), để chỉ log 1 lần
+        self._waiting: Set[int] = set()
+        # origin_id -> vị trí cần áp dụng tới (catch-up), để báo tiến độ
+        self._targets: Dict[int, ReplicationWatermark] = {}
+        self._last_applied_at: Optional[float] = None
+        self._rate = 0.0  # Command/s của lần áp dụng gần nhất
+        self._stats = {
+            "applied": 0,
+            "duplicates": 0,
+            "gaps": 0,
+            "waits": 0,
+            "failed": 0,
+        }
+
+    def receive(
+        self, origin_id: int, epoch: str, first_index: int, commands: List[ATMCommand]
+    ) -> ReplicationAck:
+        """
+        Áp dụng logs[i] (index first_index + i) của peer origin_id.
+
+        Raises:
+            CommandFailedError: Nếu có command bị lỗi: dữ liệu đã lệch với peer,
+                applied_index giữ nguyên
+            SQLException: Nếu transaction bị lỗi, không command nào được ghi
+        """
+        with self._apply_lock:
+            with self._lock:
+                applied = self._applied_index(origin_id, epoch)
+
+            if first_index > applied + 1:
+                print(
+                    f">> [REPLICATION] Log của peer {origin_id} bị hở: "
+                    f"đã áp dụng {applied}, nhận từ {first_index}"
+                )
+                with self._lock:
+                    self._stats["gaps"] += 1
+                return {"epoch": epoch, "received": applied, "applied": applied}
+
+            skipped = applied + 1 - first_index
+            fresh = commands[skipped:]
+            with self._lock:
+                ready = self._ready_count(fresh)
+                self._track_waiting(origin_id, fresh, ready)
+            fresh = fresh[:ready]
+
+            if fresh:
+                last_index = applied + len(fresh)
+
+                def save_state(batch: WriteBatch):
+                    batch.set_replication_state(origin_id, epoch, last_index)
+                    with self._lock:
+                        self._committing[origin_id] = (epoch, last_index)
+
+                started = time.monotonic()
+                try:
+                    self.executor.exec_in_transaction(fresh, save_state)
+                except CommandFailedError as e:
+                    with self._lock:
+                        self._stats["failed"] += 1
+                    print(
+                        f">> [REPLICATION] Peer {origin_id}: {e.message}."
+                        f" Dữ liệu đã lệch, dừng áp dụng tại index {applied}"
+                    )
+                    raise
+                finally:
+                    with self._lock:
+                        self._committing.pop(origin_id, None)
+                now = time.monotonic()
+
+                with self._lock:
+                    self._applied[origin_id] = (epoch, last_index)
+                    self._stats["applied"] += len(fresh)
+                    self._last_applied_at = now
+                    if now > started:
+                        self._rate = len(fresh) / (now - started)
+                    remaining = self._remaining(self._targets.get(origin_id))
+                applied = last_index
+
+                if remaining:
+                    # Đang catch-up (nhận shard/khởi động): báo tiến độ
+                    print(
+                        f">> [REPLICATION] Peer {origin_id}: áp dụng {len(fresh)} command"
+                        f" tới index {last_index} ({self._rate:.0f} command/s),"
+                        f" còn {remaining} command"
+                    )
+
+            with self._lock:
+                self._stats["duplicates"] += min(skipped, len(commands))
+            return {"epoch": epoch, "received": applied, "applied": applied}
+
+    def watermarks(self, origin_ids: Iterable[int]) -> List[ReplicationWatermark]:
+        """
+        Vị trí đã áp dụng log của các origin_ids (bỏ qua origin chưa nhận gì),
+        tính cả đoạn đang commit: không nhỏ hơn phần dữ liệu đã thấy được
+        """
+        with self._lock:
+            watermarks: List[ReplicationWatermark] = []
+            for origin_id in origin_ids:
+                state = self._committing.get(origin_id) or self._load_state(origin_id)
+                if state is not None:
+                    epoch, applied = state
+                    watermarks.append(
+                        {"origin_id": origin_id, "epoch": epoch, "applied": applied}
+                    )
+            return watermarks
+
+    def caught_up(self, watermarks: List[ReplicationWatermark]) -> bool:
+        """Đã áp dụng log của mọi origin tới ít nhất watermarks chưa"""
+        return not any(self.remaining(watermarks).values())
+
+    def remaining(self, watermarks: List[ReplicationWatermark]) -> Dict[int, int]:
+        """Số command còn phải áp dụng để tới watermarks, theo origin"""
+        with self._lock:
+            return {
+                watermark["origin_id"]: self._remaining(watermark)
+                for watermark in watermarks
+            }
+
+    def expect(self, watermarks: List[ReplicationWatermark]):
+        """Ghi nhận vị trí cần áp dụng tới (báo tiến độ khi áp dụng)"""
+        with self._lock:
+            for watermark in watermarks:
+                self._targets[watermark["origin_id"]] = watermark
+
+    def last_applied_at(self) -> Optional[float]:
+        """Thời điểm (monotonic) áp dụng xong đoạn log gần nhất"""
+        with self._lock:
+            return self._last_applied_at
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "rate": round(self._rate, 1),
+                "origins": {
+                    origin_id: {
+                        "epoch": epoch,
+                        "applied": applied,
+                        "remaining": self._remaining(self._targets.get(origin_id)),
+                    }
+                    for origin_id, (epoch, applied) in self._applied.items()
+                },
+            }
+
+    def _remaining(self, watermark: Optional[ReplicationWatermark]) -> int:
+        """(gọi khi đang giữ self._lock)"""
+        if watermark is None or watermark["applied"] == 0:
+            # Origin chưa thực thi gì trong epoch đó: không có gì để chờ
+            return 0
+
+        state = self._load_state(watermark["origin_id"])
+        if state is None:
+            return watermark["applied"]
+
+        epoch, applied = state
+        # Epoch tăng dần theo thời gian khởi động: epoch mới hơn thì log của
+        # epoch cũ không còn gì để chờ (phần chưa gửi đã mất cùng backlog)
+        if epoch > watermark["epoch"]:
+            return 0
+        if epoch < watermark["epoch"]:
+            return watermark["applied"]
+        return max(0, watermark["applied"] - applied)
+
+    def _load_state(self, origin_id: int) -> Optional[Tuple[str, int]]:
+        if origin_id not in self._applied and origin_id not in self._unknown:
+            state = self.database_reader.get_replication_state(origin_id)
+            if state is not None:
+                self._applied[origin_id] = state
+            else:
+                self._unknown.add(origin_id)
+        return self._applied.get(origin_id)
+
+    def _ready_count(self, commands: List[ATMCommand]) -> int:
+        """
+        Số command đầu tiên áp dụng được: dừng ở command có depends_on chưa thỏa
+        (gọi khi đang giữ self._lock). Command không có depends_on dùng chung
+        depends_on của command trước, đã thỏa khi command đó được áp dụng
+        """
+        for i, cmd in enumerate(commands):
+            if any(
+                watermark["origin_id"] != self.node_id and self._remaining(watermark)
+                for watermark in cmd.get("depends_on", [])
+            ):
+                return i
+        return len(commands)
+
+    def _track_waiting(self, origin_id: int, commands: List[ATMCommand], ready: int):
+        """(gọi khi đang giữ self._lock)"""
+        if ready == len(commands):
+            self._waiting.discard(origin_id)
+            return
+
+        self._stats["waits"] += 1
+        if origin_id not in self._waiting:
+            self._waiting.add(origin_id)
+            depends_on = commands[ready].get("depends_on", [])
+            print(
+                f">> [REPLICATION] Log của peer {origin_id} chờ log của server khác:"
+                f" còn thiếu {self._remaining_by_origin(depends_on)}"
+            )
+
+    def _remaining_by_origin(self, watermarks: List[ReplicationWatermark]) -> Dict[int, int]:
+        """(gọi khi đang giữ self._lock)"""
+        return {
+            watermark["origin_id"]: self._remaining(watermark)
+            for watermark in watermarks
+            if watermark["origin_id"] != self.node_id
+        }
+
+    def _applied_index(self, origin_id: int, epoch: str) -> int:
+        stored_epoch, applied = self._load_state(origin_id) or (epoch, 0)
+        # Epoch khác: peer đã khởi động lại, log được đánh số lại từ 1
+        return applied if stored_epoch == epoch else 0
@@ -1,38 +1,85 @@
-from typing import List
+from typing import List, Optional
 
 from rmi_framework.v2 import RemoteObject
 
 from shared.interfaces.server import PeerService
-from shared.models.server import ATMCommand
+from shared.models.server import (
+    ATMCommand,
+    ForwardOutcome,
+    ReplicationAck,
+    ReplicationWatermark,
+    TokenLoad,
+)
 
 from ..coordinator import Coordinator
+from ..replication import ReplicationReceiver
 
 
 class PeerServiceImpl(RemoteObject, PeerService):
-    def __init__(self, coordinator: Coordinator):
+    # Coordinator/receiver tự giữ lock; forward_commands chờ kết quả thực thi
+    # (tới SHARD_REQUEST_TIMEOUT), không được chặn replicate/announce_shards
+    concurrent_dispatch = True
+
+    def __init__(self, coordinator: Coordinator, receiver: ReplicationReceiver):
         super().__init__()
         self.coordinator = coordinator
+        self.receiver = receiver
 
-    def request_token(self) -> bool:
-        self.coordinator.set_peer_demanding(True)
-        print(">> [PeerService] Peer requested Token.")
+    def request_shards(
+        self, requester_id: int, shards: List[int], load: Optional[TokenLoad] = None
+    ) -> bool:
+        self.coordinator.on_shards_requested(requester_id, shards, load)
+        print(f">> [PeerService] Peer {requester_id} requested {len(shards)} shards.")
         return True
 
-    def receive_sync(self, logs: List[ATMCommand], pass_token: bool):
-        print("\n>> [PeerService] Received sync request from Peer")
+    def replicate(
+        self,
+        origin_id: int,
+        epoch: str,
+        first_index: int,
+        logs: List[ATMCommand],
+        pass_shards: List[int],
+        watermarks: List[ReplicationWatermark],
+    ) -> ReplicationAck:
+        print(f"\n>> [PeerService] Received sync request from Peer {origin_id}")
+
+        last_index = first_index + len(logs) - 1
+        if logs:
+            print(f"\tReceived {len(logs)} commands (index {first_index}..{last_index}).")
 
+        # Áp dụng xong mới trả lời: ack là index đã commit vào database
+        ack = self.receiver.receive(origin_id, epoch, first_index, logs)
         if logs:
-            print(f"\tReceived {len(logs)} commands.")
-            self.coordinator.handle_incoming_sync(logs)
+            self.coordinator.on_log_applied()
 
-        if pass_token:
-            print("\tToken received")
-            self.coordinator.accept_token()
+        if pass_shards:
+            if ack["applied"] >= last_index:
+                print(f"\t{len(pass_shards)} shards received")
+                self.coordinator.accept_shards(origin_id, pass_shards, watermarks)
+            else:
+                # Peer sẽ gửi lại phần còn thiếu cùng shard
+                print("\tLog is incomplete, shards rejected")
 
         print("\n")
-        return True
+        return ack
 
-    def get_token_status(self):
-        peer_hold_token = self.coordinator.is_holding_token()
+    def forward_commands(
+        self,
+        origin_id: int,
+        commands: List[ATMCommand],
+        position: ReplicationWatermark,
+    ) -> List[ForwardOutcome]:
+        print(f">> [PeerService] Peer {origin_id} forwarded {len(commands)} commands.")
+        return self.coordinator.execute_forwarded(origin_id, commands, position)
+
+    def get_owned_shards(self) -> List[int]:
+        owned = self.coordinator.get_owned_shards()
         self.coordinator.on_peer_alive()
-        return peer_hold_token
+        return owned
+
+    def get_replication_position(self) -> ReplicationWatermark:
+        return self.coordinator.get_replication_position()
+
+    def announce_shards(self, owner_id: int, shards: List[int]) -> bool:
+        self.coordinator.on_shards_announced(owner_id, shards)
+        return True
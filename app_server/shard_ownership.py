@@ -0,0 +1,343 @@
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, TypedDict
+
+from shared.models.server import ATMCommand
+
+
+class ForwardingConfig(TypedDict):
+    enabled: bool  # False = luôn xin shard về như cũ
+    max_batch: int  # Số command tối đa trong 1 lần gọi PeerService.forward_commands
+    # Trao shard cho 1 server khi trong migrate_window giây server đó forward >= migrate_after
+    # command của shard đó và gấp MIGRATE_RATIO lần số command của chính server giữ shard
+    migrate_after: int
+    migrate_window: float  # (s)
+
+
+def shard_of(card_number: str, shard_count: int) -> int:
+    """Shard của số thẻ (crc32 để mọi server, mọi lần chạy cho cùng kết quả)"""
+    return zlib.crc32(card_number.encode()) % shard_count
+
+
+class ShardOwnership:
+    """
+    Quyền sở hữu shard của server này, thay cho 1 token chung cho cả ngân hàng.
+
+    - Không gian số thẻ chia thành shard_count shard, mỗi shard tại 1 thời điểm
+      chỉ thuộc 1 server; các server thực thi song song các shard của mình
+    - Lệnh có kiểm tra trên thẻ nguồn (withdraw, change-pin, transfer) chỉ được
+      thực thi bởi server sở hữu shard của thẻ nguồn
+    - Lệnh chỉ cộng tiền (deposit, phần cộng của transfer) giao hoán với mọi lệnh
+      khác nên server nào cũng thực thi được. Trừ deposit có idempotency key: ATM
+      gửi lại sang server khác phải gặp kết quả cũ, nên cũng chỉ server sở hữu
+      shard thực thi (idempotency key được kiểm tra tại 1 nơi, kết quả theo log
+      sang server nhận shard). Transfer khác shard: server sở hữu
+      thẻ nguồn trừ + cộng trong 1 transaction, các server khác nhận phần cộng qua
+      replicate (số dư thẻ nguồn ở đó luôn >= số dư lúc kiểm tra nên replay không lỗi)
+    - Mỗi server ghi nhận server đang giữ từng shard (owner_of, cập nhật khi trao/
+      nhận shard và khi được báo), có thể cũ: server được hỏi không giữ shard thì
+      từ chối forward / xin shard về rồi trao lại
+    - Command của shard chưa sở hữu được forward cho server giữ shard thực thi.
+      Server giữ shard biết mỗi server dùng shard bao nhiêu nên tự quyết định trao
+      shard (coi như server đó đòi) khi lượng forward của 1 server đủ lớn và vượt
+      hẳn lượng dùng tại chỗ. Khi tắt forward hoặc forward lỗi, shard được xin về
+    - Trao shard: sync log rồi mới trao (như token cũ). Shard bị đòi được trao ngay
+      nếu không dùng trong idle_grace giây, nếu không thì giữ tới hết quantum tính
+      từ lúc nhận. Shard mới nhận có thể phải chờ áp dụng xong log của các server
+      khác (catching up) mới được dùng
+    - Command của 1 thẻ chờ shard (hoặc đang forward) thì các command sau của thẻ
+      đó cũng chờ theo, giữ đúng thứ tự trên từng thẻ
+    """
+
+    # Lượng forward phải gấp bao nhiêu lần lượng dùng tại chỗ thì trao shard
+    MIGRATE_RATIO = 2
+
+    def __init__(
+        self,
+        shard_count: int,
+        idle_grace: float = 0.002,
+        migrate_after: int = 16,
+        migrate_window: float = 1.0,
+        demand_timeout: float = 5.0,
+    ):
+        """
+        Args:
+            demand_timeout: Yêu cầu trao shard quá hạn này thì bỏ (server đòi sẽ
+                xin lại nếu vẫn cần)
+        """
+        self.shard_count = shard_count
+        self.idle_grace = idle_grace
+        self.migrate_after = migrate_after
+        self.migrate_window = migrate_window
+        self.demand_timeout = demand_timeout
+
+        self._lock = threading.Lock()
+        self._owned: Set[int] = set()
+        self._catching_up: Set[int] = set()  # Shard đã nhận nhưng chưa dùng được
+        self._owners: Dict[int, int] = {}  # Shard không giữ -> server đang giữ (đã biết)
+        # Shard bị đòi -> (server đòi, hạn)
+        self._demanded: Dict[int, Tuple[int, float]] = {}
+        self._wanted: Set[int] = set()  # Shard cần xin về thay vì forward
+        self._requested: Dict[int, float] = {}  # Shard đã xin -> hạn chờ được trao
+        # Shard đang giữ -> (đầu cửa sổ, số command theo server gửi, None = tại chỗ)
+        self._usage: Dict[int, Tuple[float, Dict[Optional[int], int]]] = {}
+        self._acquired_at: Dict[int, float] = {}
+        self._last_used: Dict[int, float] = {}
+        self._stats = {
+            "acquired": 0,
+            "seized": 0,
+            "handovers_idle": 0,
+            "handovers_expired": 0,
+            "forwarded": 0,
+            "migrations": 0,
+        }
+
+    def required_shard(self, cmd: ATMCommand) -> Optional[int]:
+        """Shard phải sở hữu để thực thi cmd, None = server nào cũng thực thi được"""
+        if cmd["command_type"] == "deposit" and not cmd.get("idempotency_key"):
+            return None
+        return shard_of(cmd["card_number"], self.shard_count)
+
+    def owned(self) -> List[int]:
+        with self._lock:
+            return sorted(self._owned)
+
+    def owner_of(self, shard: int) -> Optional[int]:
+        """Server đang giữ shard theo thông tin đã biết (None = chưa biết / là mình)"""
+        with self._lock:
+            return self._owners.get(shard)
+
+    def set_owner(self, owner_id: Optional[int], shards: Iterable[int]):
+        """Ghi nhận server đang giữ các shard (bỏ qua shard mình đang giữ)"""
+        with self._lock:
+            for shard in shards:
+                if shard in self._owned:
+                    continue
+                if owner_id is None:
+                    self._owners.pop(shard, None)
+                else:
+                    self._owners[shard] = owner_id
+
+    def assign(self, shards: Iterable[int], catching_up: bool = False):
+        """
+        Nhận shard khi khởi động (không tính là nhận từ server khác)
+
+        Args:
+            catching_up: Chưa dùng được tới khi gọi caught_up
+        """
+        with self._lock:
+            for shard in shards:
+                self._owned.add(shard)
+                self._owners.pop(shard, None)
+                if catching_up:
+                    self._catching_up.add(shard)
+
+    def acquire(
+        self, shards: Iterable[int], seized: bool = False, catching_up: bool = False
+    ):
+        """
+        Nhận shard do server khác trao
+
+        Args:
+            seized: Tự chiếm vì server giữ shard không liên lạc được
+            catching_up: Chưa dùng được tới khi gọi caught_up
+        """
+        now = time.monotonic()
+        with self._lock:
+            for shard in shards:
+                self._owned.add(shard)
+                self._owners.pop(shard, None)
+                if catching_up:
+                    self._catching_up.add(shard)
+                self._acquired_at[shard] = now
+                self._requested.pop(shard, None)
+                self._wanted.discard(shard)
+                self._stats["seized" if seized else "acquired"] += 1
+
+    def caught_up(self, shards: Iterable[int]):
+        """Các shard đã nhận giờ dùng được"""
+        with self._lock:
+            self._catching_up.difference_update(shards)
+
+    def release(self, owner_id: int, shards: Iterable[int]):
+        """Đã trao shard cho server owner_id"""
+        with self._lock:
+            for shard in shards:
+                self._owned.discard(shard)
+                self._owners[shard] = owner_id
+                self._demanded.pop(shard, None)
+                self._usage.pop(shard, None)
+
+    def demand(self, requester_id: int, shards: Iterable[int]):
+        """
+        Server requester_id đòi các shard này. Shard mình không giữ thì xin về
+        (to_request) rồi trao lại
+        """
+        deadline = time.monotonic() + self.demand_timeout
+        with self._lock:
+            for shard in shards:
+                self._demanded[shard] = (requester_id, deadline)
+                if shard not in self._owned:
+                    self._wanted.add(shard)
+
+    def withdraw_demand(self, shards: Iterable[int]):
+        """Bỏ yêu cầu trao shard (trao thất bại, server đòi sẽ xin lại khi hết hạn chờ)"""
+        with self._lock:
+            for shard in shards:
+                self._demanded.pop(shard, None)
+
+    def want(self, shards: Iterable[int]):
+        """Xin các shard này về (không forward command của chúng nữa)"""
+        with self._lock:
+            self._wanted.update(set(shards) - self._owned)
+
+    def is_wanted(self, shard: int) -> bool:
+        with self._lock:
+            return shard in self._wanted
+
+    def is_catching_up(self, shard: Optional[int]) -> bool:
+        with self._lock:
+            return shard in self._catching_up
+
+    def record_forwarded(self, count: int):
+        """Ghi nhận count command được forward cho server khác"""
+        with self._lock:
+            self._stats["forwarded"] += count
+
+    def split(
+        self,
+        commands: List[ATMCommand],
+        busy_cards: Iterable[str] = (),
+        origin_id: Optional[int] = None,
+    ) -> Tuple[List[ATMCommand], List[ATMCommand]]:
+        """
+        Chia commands thành (thực thi được ngay, phải chờ), giữ thứ tự
+
+        Args:
+            busy_cards: Thẻ có command đang forward, command sau phải chờ
+            origin_id: Server đã forward commands sang (tính vào lượng dùng của
+                server đó, đủ lớn thì shard được đánh dấu là server đó đòi)
+        """
+        runnable: List[ATMCommand] = []
+        blocked: List[ATMCommand] = []
+        blocked_cards: Set[str] = set(busy_cards)
+        now = time.monotonic()
+
+        with self._lock:
+            for cmd in commands:
+                shard = self.required_shard(cmd)
+                if cmd["card_number"] in blocked_cards or (
+                    shard is not None
+                    and (shard not in self._owned or shard in self._catching_up)
+                ):
+                    blocked.append(cmd)
+                    blocked_cards.add(cmd["card_number"])
+                    continue
+
+                runnable.append(cmd)
+                if shard is not None:
+                    self._last_used[shard] = now
+                    self._record_use(shard, now, origin_id)
+
+        return runnable, blocked
+
+    def to_request(self, blocked: List[ATMCommand], timeout: float) -> List[int]:
+        """
+        Các shard cần xin về (wanted cho command đang chờ hoặc server khác đòi,
+        chưa xin hoặc đã quá hạn chờ), đánh dấu là đã xin. Shard xin quá hạn thì
+        bỏ thông tin server đang giữ (có thể đã cũ)
+        """
+        needed = {self.required_shard(cmd) for cmd in blocked}
+        now = time.monotonic()
+
+        with self._lock:
+            needed.update(self._demanded)
+            due = sorted(
+                shard
+                for shard in needed
+                if shard in self._wanted
+                and shard not in self._owned
+                and self._requested.get(shard, 0.0) <= now
+            )
+            for shard in due:
+                if shard in self._requested:
+                    self._owners.pop(shard, None)
+                self._requested[shard] = now + timeout
+            return due
+
+    def next_request_deadline(self) -> Optional[float]:
+        """Thời điểm (monotonic) sớm nhất 1 shard đã xin hết hạn chờ"""
+        with self._lock:
+            return min(self._requested.values(), default=None)
+
+    def releasable(self, quantum_of: Callable[[int], float]) -> Dict[int, List[int]]:
+        """
+        Các shard bị đòi trao được ngay (rảnh hoặc đã giữ đủ quantum_of(server đòi)),
+        theo server đòi
+        """
+        now = time.monotonic()
+        shards: Dict[int, List[int]] = {}
+
+        with self._lock:
+            for shard, requester_id in self._live_demands(now):
+                if now - self._last_used.get(shard, 0.0) >= self.idle_grace:
+                    self._stats["handovers_idle"] += 1
+                elif now - self._acquired_at.get(shard, 0.0) >= quantum_of(requester_id):
+                    self._stats["handovers_expired"] += 1
+                else:
+                    continue
+                shards.setdefault(requester_id, []).append(shard)
+
+        return shards
+
+    def handover_delay(self, quantum_of: Callable[[int], float]) -> Optional[float]:
+        """Còn bao lâu thì có shard bị đòi trao được (0 = ngay), None nếu không bị đòi"""
+        now = time.monotonic()
+
+        with self._lock:
+            delays = [
+                min(
+                    self._last_used.get(shard, 0.0) + self.idle_grace,
+                    self._acquired_at.get(shard, 0.0) + quantum_of(requester_id),
+                )
+                - now
+                for shard, requester_id in self._live_demands(now)
+            ]
+        return max(0.0, min(delays)) if delays else None
+
+    def _live_demands(self, now: float) -> List[Tuple[int, int]]:
+        """(shard, server đòi) của các shard đang giữ, dùng được, bị đòi chưa quá hạn"""
+        for shard in [s for s, (_, deadline) in self._demanded.items() if deadline <= now]:
+            del self._demanded[shard]
+
+        return sorted(
+            (shard, requester_id)
+            for shard, (requester_id, _) in self._demanded.items()
+            if shard in self._owned and shard not in self._catching_up
+        )
+
+    def _record_use(self, shard: int, now: float, origin_id: Optional[int]):
+        usage = self._usage.get(shard)
+        if usage is None or now - usage[0] >= self.migrate_window:
+            usage = self._usage[shard] = (now, {})
+        counts = usage[1]
+        counts[origin_id] = counts.get(origin_id, 0) + 1
+
+        if origin_id is None or shard in self._demanded:
+            return
+        remote = counts[origin_id]
+        if remote >= self.migrate_after and remote >= counts.get(None, 0) * self.MIGRATE_RATIO:
+            self._demanded[shard] = (origin_id, now + self.demand_timeout)
+            self._stats["migrations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "owned": len(self._owned),
+                "catching_up": len(self._catching_up),
+                "demanded": len(self._demanded.keys() & self._owned),
+                "wanted": len(self._wanted),
+                "requested": len(self._requested),
+            }
@@ -0,0 +1,135 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from app_server.database.archiver import (
+    DEFAULT_ARCHIVE_CONFIG,
+    TransactionArchiver,
+    month_start,
+)
+
+NOW = datetime(2026, 10, 19, tzinfo=timezone.utc)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        if "information_schema.PARTITIONS" in sql:
+            self._rows = list(self.conn.partitions)
+        else:
+            self.conn.log.append(sql)
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, partitions):
+        # (tên, cận trên) như information_schema.PARTITIONS
+        self.partitions = partitions
+        self.log = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.log.append("COMMIT")
+
+
+class FakeDatabase:
+    def __init__(self, partitions):
+        self.conn = FakeConnection(partitions)
+
+    @contextmanager
+    def write_connection(self):
+        yield self.conn
+
+
+def test_new_table_gets_old_and_future_partitions():
+    database = FakeDatabase([("p_future", "MAXVALUE")])
+
+    TransactionArchiver(database).maintain_partitions(NOW)
+
+    (sql,) = database.conn.log
+    assert sql.startswith("ALTER TABLE transactions REORGANIZE PARTITION p_future INTO")
+    assert f"PARTITION p_old VALUES LESS THAN ({month_start(2026, 10)})" in sql
+    # Tháng hiện tại + 3 tháng tới
+    for name, bound in [
+        ("p202610", month_start(2026, 11)),
+        ("p202611", month_start(2026, 12)),
+        ("p202612", month_start(2027, 1)),
+        ("p202701", month_start(2027, 2)),
+    ]:
+        assert f"PARTITION {name} VALUES LESS THAN ({bound})" in sql
+    assert "p202702" not in sql
+
+
+def test_partitions_extend_from_last_month():
+    database = FakeDatabase(
+        [
+            ("p_old", str(month_start(2026, 9))),
+            ("p202609", str(month_start(2026, 10))),
+            ("p202610", str(month_start(2026, 11))),
+            ("p_future", "MAXVALUE"),
+        ]
+    )
+
+    TransactionArchiver(database).maintain_partitions(NOW)
+
+    (sql,) = database.conn.log
+    assert "p_old" not in sql
+    assert "p202610" not in sql
+    assert f"PARTITION p202611 VALUES LESS THAN ({month_start(2026, 12)})" in sql
+    assert f"PARTITION p202701 VALUES LESS THAN ({month_start(2027, 2)})" in sql
+
+
+def test_maintenance_runs_when_archiving_is_disabled(monkeypatch):
+    database = FakeDatabase([("p_future", "MAXVALUE")])
+    archiver = TransactionArchiver(
+        database, {**DEFAULT_ARCHIVE_CONFIG, "enabled": False}
+    )
+    # Dừng sau lượt đầu tiên
+    monkeypatch.setattr(archiver._stop, "wait", lambda timeout: archiver.stop())
+
+    archiver._loop()
+
+    assert [sql.split(" INTO")[0] for sql in database.conn.log] == [
+        "ALTER TABLE transactions REORGANIZE PARTITION p_future"
+    ]
+
+
+def test_partitions_older_than_retention_are_copied_then_dropped():
+    months = [(2025, month) for month in range(9, 13)] + [
+        (2026, month) for month in range(1, 11)
+    ]
+    database = FakeDatabase(
+        [("p_old", str(month_start(2025, 9)))]
+        + [
+            (f"p{year}{month:02d}", str(month_start(year, month + 1)))
+            for year, month in months
+        ]
+        + [("p_future", "MAXVALUE")]
+    )
+
+    archived = TransactionArchiver(database).run_once(NOW)
+
+    # Giữ 12 tháng: từ 2025-10 trở đi còn trong transactions
+    assert archived == ["p_old", "p202509"]
+    log = [sql.split(" (")[0] for sql in database.conn.log[1:]]
+    assert log == [
+        "INSERT IGNORE INTO transactions_archive",
+        "COMMIT",
+        "ALTER TABLE transactions DROP PARTITION p_old",
+        "INSERT IGNORE INTO transactions_archive",
+        "COMMIT",
+        "ALTER TABLE transactions DROP PARTITION p202509",
+        "COMMIT",
+    ]
+    assert "PARTITION (p202509)" in database.conn.log[4]
@@ -0,0 +1,78 @@
+import pytest
+
+from app_server.database.balance_cache import BalanceCache
+
+
+def command(command_type, card_number, amount, to_card=None):
+    cmd = {
+        "command_type": command_type,
+        "card_number": card_number,
+        "amount": amount,
+        "timestamp": 1,
+        "peer_id": 1,
+    }
+    if to_card is not None:
+        cmd["to_card"] = to_card
+    return cmd
+
+
+def no_load():
+    pytest.fail("không được đọc DB")
+
+
+@pytest.fixture
+def cache():
+    cache = BalanceCache()
+    cache.warm([("1111", 100), ("2222", 50)])
+    return cache
+
+
+def test_apply_updates_cached_balances(cache):
+    cache.apply(command("deposit", "1111", 30))
+    cache.apply(command("withdraw", "2222", 20))
+    cache.apply(command("transfer", "1111", 10, to_card="2222"))
+    cache.apply(command("change_pin", "1111", 0))
+
+    assert cache.get_or_load("1111", no_load) == 120
+    assert cache.get_or_load("2222", no_load) == 40
+    assert cache.stats()["hits"] == 2
+
+
+def test_unknown_card_is_loaded_once_and_then_updated(cache):
+    assert cache.get_or_load("3333", lambda: 7) == 7
+
+    cache.apply(command("deposit", "3333", 3))
+    assert cache.get_or_load("3333", no_load) == 10
+    assert cache.stats()["misses"] == 1
+
+
+def test_apply_to_uncached_card_is_left_to_next_load(cache):
+    cache.apply(command("transfer", "1111", 10, to_card="3333"))
+
+    assert cache.get_or_load("1111", no_load) == 90
+    assert cache.get_or_load("3333", lambda: 10) == 10
+
+
+def test_load_racing_with_apply_is_not_cached(cache):
+    def load():
+        # Lệnh ghi commit trong lúc đang đọc DB: giá trị đọc được có thể đã cũ
+        cache.apply(command("deposit", "3333", 5))
+        return 0
+
+    assert cache.get_or_load("3333", load) == 0
+    assert cache.get_or_load("3333", lambda: 5) == 5
+
+
+def test_verify_reads_db_and_counts_drift():
+    cache = BalanceCache(verify=True)
+    cache.warm([("1111", 100)])
+    cache.apply(command("withdraw", "1111", 40))
+
+    assert cache.get_or_load("1111", lambda: 60) == 60
+    # DB bị sửa trực tiếp, không qua CommandExecutor: trả số dư của DB
+    assert cache.get_or_load("1111", lambda: 75) == 75
+
+    stats = cache.stats()
+    assert stats["verifications"] == 2
+    assert stats["drifts"] == 1
+    assert stats["hits"] == 0
@@ -0,0 +1,138 @@
+from app_server import command_dedupe
+from app_server.command_dedupe import CommandDedupe, new_command_id, parse_command_id
+from app_server.database.exceptions import SQLException
+
+WINDOW = 1_000_000  # window=1s, seq tính theo µs
+
+
+class FakeDatabase:
+    """applied_commands trong RAM (thay cho DatabaseReader/DatabaseWriter)"""
+
+    def __init__(self, rows=None, prune_error=False):
+        self.rows = list(rows or [])
+        self.prunes = []
+        self.prune_error = prune_error
+
+    def get_applied_commands(self, window):
+        return list(self.rows)
+
+    def prune_applied_commands(self, origin_id, below_seq):
+        if self.prune_error:
+            raise SQLException("Lost connection", None, 2013)
+        self.prunes.append((origin_id, below_seq))
+
+
+def make_dedupe(db=None, **kwargs) -> CommandDedupe:
+    db = db or FakeDatabase()
+    return CommandDedupe(db, db, window=1, **kwargs)
+
+
+def test_committed_command_is_applied():
+    dedupe = make_dedupe()
+    dedupe.committed(1, 100)
+
+    assert dedupe.is_applied(1, 100)
+    assert not dedupe.is_applied(1, 101)
+    assert not dedupe.is_applied(2, 100)
+    assert dedupe.stats()["recorded"] == 1
+
+
+def test_window_slides_with_high_water():
+    dedupe = make_dedupe()
+    dedupe.committed(1, 100)
+    dedupe.committed(1, 100 + WINDOW - 1)
+    assert dedupe.is_applied(1, 100)
+
+    dedupe.committed(1, 100 + WINDOW)
+    assert not dedupe.is_applied(1, 100)
+    assert dedupe.is_applied(1, 100 + WINDOW)
+    assert dedupe.stats()["window_entries"] == 2
+
+
+def test_command_older_than_window_is_stale():
+    dedupe = make_dedupe()
+    dedupe.committed(1, 10 * WINDOW)
+
+    assert dedupe.is_stale(1, 5 * WINDOW)
+    assert not dedupe.is_applied(1, 5 * WINDOW)
+    # Trong cửa sổ, chưa áp dụng: được thực thi
+    assert not dedupe.is_stale(1, 10 * WINDOW - 1)
+    # Đã áp dụng thì là trùng, không phải cũ
+    assert not dedupe.is_stale(1, 10 * WINDOW)
+    # Origin chưa có command nào: không có mốc để so
+    assert not dedupe.is_stale(2, 1)
+
+
+def test_out_of_order_commands_inside_window():
+    dedupe = make_dedupe()
+    dedupe.committed(1, 500)
+    dedupe.committed(1, 300)
+
+    assert dedupe.is_applied(1, 300)
+    assert dedupe.is_applied(1, 500)
+    assert not dedupe.is_stale(1, 400)
+
+
+def test_stale_and_duplicate_are_counted():
+    dedupe = make_dedupe()
+    dedupe.duplicate(1, 100)
+    dedupe.stale(1, 50)
+    dedupe.stale(1, 51)
+
+    stats = dedupe.stats()
+    assert stats["duplicates"] == 1
+    assert stats["stale"] == 2
+
+
+def test_load_from_applied_commands():
+    db = FakeDatabase(rows=[(2, 300), (1, 100), (2, 200)])
+    dedupe = make_dedupe(db)
+
+    assert dedupe.is_applied(1, 100)
+    assert dedupe.is_applied(2, 200)
+    assert dedupe.is_applied(2, 300)
+    assert not dedupe.is_applied(1, 150)
+
+
+def test_load_moves_own_command_ids_past_applied_seqs():
+    # seq ở tương lai xa: command_id mới phải lớn hơn dù đồng hồ chưa tới
+    future = new_command_id(1)
+    _, seq = parse_command_id(future)
+    db = FakeDatabase(rows=[(7, seq + 10 * WINDOW), (9, seq + 20 * WINDOW)])
+    make_dedupe(db, origin_id=7)
+
+    _, next_seq = parse_command_id(new_command_id(7))
+    assert next_seq == seq + 10 * WINDOW + 1
+
+
+def test_new_command_ids_increase():
+    seqs = [parse_command_id(new_command_id(1))[1] for _ in range(100)]
+
+    assert seqs == sorted(set(seqs))
+
+
+def test_observe_command_seq_never_moves_back():
+    _, seq = parse_command_id(new_command_id(1))
+    command_dedupe.observe_command_seq(seq - 1000)
+
+    assert parse_command_id(new_command_id(1))[1] > seq
+
+
+def test_prune_below_window_floor():
+    db = FakeDatabase()
+    dedupe = make_dedupe(db, prune_every=3)
+    dedupe.committed(1, 5 * WINDOW)
+    dedupe.committed(2, 3 * WINDOW)
+    assert db.prunes == []
+
+    dedupe.committed(1, 6 * WINDOW)
+    assert sorted(db.prunes) == [(1, 5 * WINDOW + 1), (2, 2 * WINDOW + 1)]
+    assert dedupe.stats()["prunes"] == 1
+
+
+def test_prune_error_is_not_raised():
+    dedupe = make_dedupe(FakeDatabase(prune_error=True), prune_every=1)
+    dedupe.committed(1, 100)
+
+    assert dedupe.is_applied(1, 100)
+    assert dedupe.stats()["prunes"] == 0
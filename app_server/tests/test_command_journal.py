@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+
+import pytest
+
+from app_server import command_journal
+from app_server.command_journal import CommandJournal
+
+
+def command(amount, **extra):
+    return {"type": "deposit", "card_number": "1111", "amount": amount, **extra}
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def open_journal(tmp_path, **kwargs) -> CommandJournal:
+    return CommandJournal(str(tmp_path / "journal.log"), **kwargs)
+
+
+def test_append_returns_increasing_seqs(tmp_path):
+    journal = open_journal(tmp_path)
+
+    assert [journal.append(command(i)) for i in range(3)] == [1, 2, 3]
+    assert journal.stats()["open"] == 3
+
+
+def test_concurrent_appends_share_fsync(tmp_path):
+    journal = open_journal(tmp_path, group_commit_window=0.05)
+    seqs = []
+    lock = threading.Lock()
+
+    def append(i):
+        seq = journal.append(command(i))
+        with lock:
+            seqs.append(seq)
+
+    threads = [threading.Thread(target=append, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = journal.stats()
+    assert sorted(seqs) == list(range(1, 21))
+    assert stats["appends"] == 20
+    assert stats["fsyncs"] < 20
+
+
+def test_recover_returns_commands_not_done(tmp_path):
+    journal = open_journal(tmp_path)
+    for i in range(3):
+        journal.append(command(i))
+    journal.mark_done([1, 3])
+    wait_until(lambda: journal.stats()["open"] == 1)
+
+    reopened = open_journal(tmp_path)
+    pending = reopened.pending_commands()
+    assert [cmd["journal_seq"] for cmd in pending] == [2]
+    assert pending[0]["amount"] == 1
+    # seq tiếp tục sau seq cuối cùng, kể cả của command đã xong
+    assert reopened.append(command(9)) == 4
+
+
+def test_callback_is_not_journaled(tmp_path):
+    journal = open_journal(tmp_path)
+    journal.append(command(1, success_callback=object()))
+
+    (pending,) = open_journal(tmp_path).pending_commands()
+    assert "success_callback" not in pending
+
+
+def test_recover_drops_torn_tail(tmp_path):
+    journal = open_journal(tmp_path)
+    journal.append(command(1))
+    journal.append(command(2))
+
+    with open(journal.path, "ab") as f:
+        f.write(b"\x00\x00\x01\x00garbage")
+
+    pending = open_journal(tmp_path).pending_commands()
+    assert [cmd["amount"] for cmd in pending] == [1, 2]
+
+
+def test_recover_drops_record_with_bad_crc(tmp_path):
+    journal = open_journal(tmp_path)
+    journal.append(command(1))
+    size = os.path.getsize(journal.path)
+    journal.append(command(2))
+
+    with open(journal.path, "r+b") as f:
+        f.seek(size + command_journal._HEADER.size + 5)
+        f.write(b"X")
+
+    pending = open_journal(tmp_path).pending_commands()
+    assert [cmd["amount"] for cmd in pending] == [1]
+
+
+def test_recover_compacts_file(tmp_path):
+    journal = open_journal(tmp_path)
+    for i in range(50):
+        journal.append(command(i))
+    journal.mark_done(list(range(1, 50)))
+    wait_until(lambda: journal.stats()["open"] == 1)
+    size = os.path.getsize(journal.path)
+
+    reopened = open_journal(tmp_path)
+    assert len(reopened.pending_commands()) == 1
+    assert os.path.getsize(journal.path) < size / 10
+    assert not os.path.exists(f"{journal.path}.tmp")
+
+
+def test_rotation_when_nothing_is_open(tmp_path):
+    journal = open_journal(tmp_path, max_bytes=1)
+    journal.append(command(1))
+    journal.append(command(2))
+    assert journal.stats()["rotations"] == 0
+
+    journal.mark_done([1, 2])
+    wait_until(lambda: journal.stats()["rotations"] == 1)
+
+    reopened = open_journal(tmp_path)
+    assert reopened.pending_commands() == []
+    assert reopened.append(command(3)) == 3
+
+
+def test_append_raises_after_write_error(tmp_path, monkeypatch):
+    journal = open_journal(tmp_path)
+
+    def fail(fd):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(command_journal.os, "fsync", fail)
+    with pytest.raises(OSError):
+        journal.append(command(1))
+    with pytest.raises(OSError):
+        journal.append(command(2))
@@ -0,0 +1,93 @@
+from abc import abstractmethod
+from xmlrpc.client import Fault
+
+import pytest
+
+from rmi_framework.v2 import Remote
+from rmi_framework.v2.core.registry import RPCStub
+from rmi_framework.v2.helpers.constants import STALE_HANDLE_MARKER
+from rmi_framework.v2.helpers.utils import get_interface_hash
+
+
+class Echo(Remote):
+    @abstractmethod
+    def echo(self, value: str) -> str:
+        pass
+
+
+class FakeProxy:
+    """Proxy ghi lại các call, open_handle trả về handle theo epoch hiện tại"""
+
+    def __init__(self):
+        self.epoch = "e1"
+        self.calls = []
+        # Fault raise ở lần open_handle tiếp theo
+        self.open_fault = None
+
+    def open_handle(self, service_name, client_hash):
+        self.calls.append("open_handle")
+        if self.open_fault is not None:
+            fault, self.open_fault = self.open_fault, None
+            raise fault
+        return [self.epoch, "h"]
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append(name)
+            if name.startswith("$") and not name.startswith(f"${self.epoch}."):
+                raise Fault(1, f"<class 'LookupError'>:{STALE_HANDLE_MARKER}")
+            return args[-1]
+
+        return call
+
+
+@pytest.fixture
+def proxy():
+    return FakeProxy()
+
+
+def make_stub(proxy):
+    return RPCStub(
+        proxy=proxy,
+        interface=Echo,
+        interface_hash=get_interface_hash(Echo),
+        service_name="echo",
+        compact_handle=True,
+    )
+
+
+def test_handle_is_opened_once(proxy):
+    stub = make_stub(proxy)
+
+    assert stub.echo("a") == "a"
+    assert stub.echo("b") == "b"
+    assert proxy.calls == ["open_handle", "$e1.h@0", "$e1.h@0"]
+
+
+def test_method_not_found_disables_handles(proxy):
+    stub = make_stub(proxy)
+    proxy.open_fault = Fault(1, 'method "open_handle" is not supported')
+
+    assert stub.echo("a") == "a"
+    assert stub.echo("b") == "b"
+    assert proxy.calls == ["open_handle", "echo@echo", "echo@echo"]
+
+
+def test_other_fault_retries_open_on_next_call(proxy):
+    stub = make_stub(proxy)
+    proxy.open_fault = Fault(1, "<class 'AttributeError'>:Service [echo] không tồn tại")
+
+    assert stub.echo("a") == "a"
+    assert stub.echo("b") == "b"
+    assert proxy.calls == ["open_handle", "echo@echo", "open_handle", "$e1.h@0"]
+
+
+def test_stale_epoch_reopens_handle(proxy):
+    stub = make_stub(proxy)
+    stub.echo("a")
+    proxy.calls.clear()
+
+    # Server restart: handle cũ không còn hợp lệ
+    proxy.epoch = "e2"
+    assert stub.echo("b") == "b"
+    assert proxy.calls == ["$e1.h@0", "open_handle", "$e2.h@0"]
@@ -0,0 +1,308 @@
+import threading
+import time
+
+import pytest
+
+from app_server.command_queue import CommandQueue
+from app_server.config import COMMAND_FORWARDING
+from app_server.coordinator import Coordinator
+from app_server.event_emitter import EventEmitter
+from app_server.replication import ReplicationReceiver
+from app_server.replication_backlog import ReplicationBacklog
+from app_server.shard_ownership import shard_of
+
+SHARD_COUNT = 4
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.state = {}
+
+    def get_replication_state(self, origin_id):
+        return self.state.get(origin_id)
+
+
+class FakeBatch:
+    def __init__(self, database):
+        self.database = database
+
+    def set_replication_state(self, origin_id, epoch, applied):
+        self.database.state[origin_id] = (epoch, applied)
+
+
+class FakeExecutor:
+    """Không ghi database, ghi lại các command được thực thi/áp dụng"""
+
+    def __init__(self, database):
+        self.database = database
+        self.executed = []
+        self.applied = []
+        self.lock = threading.Lock()
+
+    def exec_direct(self, commands):
+        with self.lock:
+            self.executed.extend(commands)
+        return commands
+
+    def exec_in_transaction(self, commands, before_commit):
+        before_commit(FakeBatch(self.database))
+        with self.lock:
+            self.applied.extend(commands)
+        return commands
+
+    def submit_forwarded(self, cmd, callback):
+        return True
+
+    def complete_forwarded(self, cmd, outcome):
+        pass
+
+
+def make_receiver(node_id):
+    database = FakeDatabase()
+    executor = FakeExecutor(database)
+    return ReplicationReceiver(executor, database, node_id=node_id), executor
+
+
+class FakePeer:
+    """PeerService giả: áp dụng log bằng ReplicationReceiver thật, không nhận forward"""
+
+    def __init__(self, node_id, alive=True):
+        self.node_id = node_id
+        self.alive = alive
+        self.owned = []
+        self.receiver, self.executor = make_receiver(node_id)
+        # (first_index, logs, pass_shards, applied) của từng lần replicate
+        self.replicated = []
+        self.forwarded = []
+        self.positions = []
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def _check_alive(self):
+        if not self.alive:
+            raise ConnectionRefusedError()
+
+    def request_shards(self, requester_id, shards, load=None):
+        self._check_alive()
+        self.requested.append(shards)
+        return True
+
+    def replicate(self, origin_id, epoch, first_index, logs, pass_shards, watermarks):
+        self._check_alive()
+        ack = self.receiver.receive(origin_id, epoch, first_index, logs)
+        if pass_shards and ack["applied"] >= first_index + len(logs) - 1:
+            self.owned.extend(pass_shards)
+        with self.lock:
+            self.replicated.append((first_index, logs, pass_shards, ack["applied"]))
+        return ack
+
+    def forward_commands(self, origin_id, commands, position):
+        self._check_alive()
+        self.forwarded.extend(commands)
+        self.positions.append(position)
+        # Không giữ shard (VD: vừa trao đi): từ chối mọi command
+        return [{"accepted": False, "notify": []} for _ in commands]
+
+    def get_owned_shards(self):
+        self._check_alive()
+        return list(self.owned)
+
+    def get_replication_position(self):
+        self._check_alive()
+        return {"origin_id": self.node_id, "epoch": "peer", "applied": 0}
+
+    def announce_shards(self, owner_id, shards):
+        return True
+
+    def applied_timestamps(self):
+        with self.lock:
+            return [cmd["timestamp"] for cmd in self.executor.applied]
+
+
+def make_coordinator(tmp_path, peers, forwarding=False):
+    queue = CommandQueue()
+    database = FakeDatabase()
+    executor = FakeExecutor(database)
+    coordinator = Coordinator(
+        queue,
+        executor,
+        EventEmitter(),
+        ReplicationBacklog(str(tmp_path / "backlog"), peer_ids=list(peers)),
+        ReplicationReceiver(executor, database, node_id=1),
+        peer_service_proxies=peers,
+        node_id=1,
+        shard_count=SHARD_COUNT,
+        forwarding={**COMMAND_FORWARDING, "enabled": forwarding},
+    )
+    return coordinator, queue, executor
+
+
+def card_in_shard(shard):
+    return next(
+        card
+        for card in (f"{i:06d}" for i in range(1000))
+        if shard_of(card, SHARD_COUNT) == shard
+    )
+
+
+def withdraw(card_number, timestamp):
+    return {
+        "command_type": "withdraw",
+        "peer_id": 0,
+        "card_number": card_number,
+        "amount": 1,
+        "timestamp": timestamp,
+    }
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def peer():
+    return FakePeer(2)
+
+
+def test_shards_are_passed_after_log_is_applied(tmp_path, peer):
+    coordinator, queue, _ = make_coordinator(tmp_path, {2: peer})
+    # Cùng khởi động: shard chia theo ID, server 1 giữ shard chẵn
+    assert coordinator.get_owned_shards() == [0, 2]
+
+    queue.add(withdraw(card_in_shard(0), 1))
+    coordinator.on_shards_requested(2, [0])
+    wait_until(lambda: 0 not in coordinator.get_owned_shards())
+
+    assert peer.owned == [0]
+    passes = [entry for entry in peer.replicated if entry[2]]
+    # Shard được trao trong lần replicate có log cuối cùng, sau khi đã áp dụng
+    assert [(pass_shards, applied) for _, _, pass_shards, applied in passes] == [
+        ([0], 1)
+    ]
+    assert peer.applied_timestamps() == [1]
+
+
+def test_forward_refused_by_non_owner_is_executed_locally(tmp_path, peer):
+    coordinator, queue, executor = make_coordinator(
+        tmp_path, {2: peer}, forwarding=True
+    )
+    card_number = card_in_shard(1)
+
+    queue.add(withdraw(card_number, 1))
+    wait_until(lambda: executor.executed)
+
+    # Server 2 từ chối, không ai giữ shard: server 1 chiếm shard và tự thực thi 1 lần
+    assert [cmd["timestamp"] for cmd in peer.forwarded] == [1]
+    # Gửi kèm cuối log lúc forward (chưa thực thi command nào)
+    assert peer.positions == [
+        {"origin_id": 1, "epoch": coordinator.backlog.epoch, "applied": 0}
+    ]
+    assert [cmd["timestamp"] for cmd in executor.executed] == [1]
+    assert 1 in coordinator.get_owned_shards()
+
+
+def test_forwarded_commands_wait_for_log_of_origin(tmp_path, peer):
+    coordinator, _, executor = make_coordinator(tmp_path, {2: peer}, forwarding=True)
+    card_number = card_in_shard(coordinator.get_owned_shards()[0])
+    outcomes = []
+    forward = threading.Thread(
+        target=lambda: outcomes.extend(
+            coordinator.execute_forwarded(
+                2,
+                [withdraw(card_number, 2)],
+                {"origin_id": 2, "epoch": "e2", "applied": 1},
+            )
+        )
+    )
+    forward.start()
+    time.sleep(0.1)
+
+    # Chưa áp dụng log của server 2 tới vị trí lúc forward: chưa thực thi
+    assert executor.executed == []
+
+    coordinator.receiver.receive(2, "e2", 1, [withdraw(card_number, 1)])
+    coordinator.on_log_applied()
+    forward.join(5.0)
+
+    assert [cmd["timestamp"] for cmd in executor.executed] == [2]
+    assert [outcome["accepted"] for outcome in outcomes] == [True]
+
+
+def test_resends_log_when_peer_lost_replication_state(tmp_path, peer):
+    # Server 3 tắt: backlog còn giữ log server 2 đã xác nhận
+    coordinator, queue, _ = make_coordinator(
+        tmp_path, {2: peer, 3: FakePeer(3, alive=False)}
+    )
+    card_number = card_in_shard(coordinator.get_owned_shards()[0])
+
+    queue.add(withdraw(card_number, 1))
+    wait_until(lambda: peer.applied_timestamps() == [1])
+
+    # Server 2 mất replication_state (VD: database được khôi phục từ bản cũ)
+    peer.receiver, peer.executor = make_receiver(2)
+    queue.add(withdraw(card_number, 2))
+
+    wait_until(lambda: peer.applied_timestamps() == [1, 2])
+    assert coordinator.backlog.pending_count(2) == 0
+
+
+def test_log_carries_positions_applied_from_other_servers(tmp_path, peer):
+    coordinator, queue, _ = make_coordinator(
+        tmp_path, {2: peer, 3: FakePeer(3, alive=False)}
+    )
+    card_number = card_in_shard(coordinator.get_owned_shards()[0])
+
+    queue.add(withdraw(card_number, 1))
+    wait_until(lambda: peer.applied_timestamps() == [1])
+    coordinator.receiver.receive(3, "e3", 1, [withdraw("999999", 101)])
+    queue.add(withdraw(card_number, 2))
+    queue.add(withdraw(card_number, 3))
+    wait_until(lambda: peer.receiver.stats()["waits"] > 0)
+
+    logs = [cmd for _, entries, _, _ in peer.replicated for cmd in entries]
+    assert "depends_on" not in logs[0]
+    # Server 2 chưa nhận log của server 3: chờ, không áp dụng command 2
+    assert logs[1]["depends_on"] == [{"origin_id": 3, "epoch": "e3", "applied": 1}]
+    assert peer.applied_timestamps() == [1]
+
+    peer.receiver.receive(3, "e3", 1, [withdraw("999999", 101)])
+    wait_until(lambda: peer.applied_timestamps() == [1, 101, 2, 3])
+
+
+def test_queue_listener_runs_outside_queue_lock():
+    queue = CommandQueue()
+    drained = []
+    # get_all lấy lock của queue: listener chạy trong lock sẽ bị treo
+    queue.subscribe(lambda: drained.extend(queue.get_all()))
+
+    queue.add(withdraw("1111", 1))
+
+    assert [cmd["timestamp"] for cmd in drained] == [1]
+
+
+def test_idle_worker_sleeps_until_command_arrives(tmp_path, peer, monkeypatch):
+    coordinator, queue, executor = make_coordinator(tmp_path, {2: peer})
+    card_number = card_in_shard(coordinator.get_owned_shards()[0])
+    timeouts = []
+    wait = coordinator.state_changed.wait
+
+    def recording_wait(timeout=None):
+        timeouts.append(timeout)
+        return wait(timeout)
+
+    monkeypatch.setattr(coordinator.state_changed, "wait", recording_wait)
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    queue.add(withdraw(card_number, 1))
+    wait_until(lambda: executor.executed)
+    elapsed = time.monotonic() - started
+    wait_until(lambda: timeouts)
+
+    # Được đánh thức ngay (không chờ tới chu kỳ poll 250 ms cũ), không có việc
+    # thì ngủ không timeout
+    assert elapsed < 0.2
+    assert set(timeouts) == {None}
@@ -0,0 +1,263 @@
+import pytest
+
+from app_server import idempotency
+from app_server.command_executor import CommandExecutor
+from app_server.idempotency import BUSY, IdempotencyStore
+
+SUCCESS = ("Giao dịch thành công!", "success")
+FAILED = ("Số dư không đủ", "error")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Callback:
+    def __init__(self):
+        self.outcomes = []
+
+    def notify(self, message, type):
+        self.outcomes.append((message, type))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(idempotency, "time", clock)
+    return clock
+
+
+def command(key, command_id, card_number="1111"):
+    return {
+        "card_number": card_number,
+        "idempotency_key": key,
+        "command_id": command_id,
+    }
+
+
+def test_first_submit_creates_command(clock):
+    store = IdempotencyStore()
+
+    assert store.submit("1111", "k1", "1-1", Callback())
+    assert store.submit("2222", "k1", "1-2", Callback())
+    assert store.stats()["entries"] == 2
+
+
+def test_resubmit_waits_for_pending_result(clock):
+    store = IdempotencyStore()
+    store.submit("1111", "k1", "1-1", Callback())
+    waiter = Callback()
+
+    assert not store.submit("1111", "k1", None, waiter)
+    assert waiter.outcomes == []
+
+    store.complete(command("k1", "1-1"), SUCCESS)
+    assert waiter.outcomes == [SUCCESS]
+    assert store.stats()["waited"] == 1
+
+
+def test_resubmit_replays_completed_result(clock):
+    store = IdempotencyStore()
+    store.submit("1111", "k1", "1-1", Callback())
+    store.complete(command("k1", "1-1"), FAILED)
+    retry = Callback()
+
+    assert not store.submit("1111", "k1", None, retry)
+    assert retry.outcomes == [FAILED]
+    assert store.stats()["replayed"] == 1
+
+
+def test_first_outcome_is_kept(clock):
+    store = IdempotencyStore()
+    store.complete(command("k1", "2-1"), SUCCESS)
+    store.complete(command("k1", "1-1"), FAILED)
+    retry = Callback()
+
+    store.submit("1111", "k1", None, retry)
+    assert retry.outcomes == [SUCCESS]
+
+
+def test_other_command_with_completed_key_is_skipped(clock):
+    store = IdempotencyStore()
+    store.complete(command("k1", "2-1"), SUCCESS)
+
+    assert store.completed_outcome(command("k1", "1-1")) == SUCCESS
+    assert store.completed_outcome(command("k1", "2-1")) is None
+    assert store.completed_outcome(command("k2", "1-1")) is None
+    assert store.completed_outcome(command(None, "1-1")) is None
+    assert store.stats()["skipped"] == 1
+
+
+def test_completed_key_expires_after_ttl(clock):
+    store = IdempotencyStore(ttl=10)
+    store.submit("1111", "k1", "1-1", Callback())
+    store.complete(command("k1", "1-1"), SUCCESS)
+
+    clock.now += 9
+    assert not store.submit("1111", "k1", None, Callback())
+
+    clock.now += 2
+    assert store.submit("1111", "k1", "1-2", Callback())
+
+
+def test_pending_key_does_not_expire(clock):
+    store = IdempotencyStore(ttl=10)
+    store.submit("1111", "k1", "1-1", Callback())
+    clock.now += 100
+    waiter = Callback()
+
+    assert not store.submit("1111", "k1", None, waiter)
+    store.complete(command("k1", "1-1"), SUCCESS)
+    assert waiter.outcomes == [SUCCESS]
+
+
+def test_pending_key_behind_completed_keys_does_not_expire(clock):
+    store = IdempotencyStore(ttl=10)
+    store.submit("1111", "k1", "1-1", Callback())
+    store.submit("1111", "k2", "1-2", Callback())
+    store.complete(command("k2", "1-2"), SUCCESS)
+    clock.now += 100
+
+    store.submit("1111", "k3", "1-3", Callback())
+    assert not store.submit("1111", "k1", None, Callback())
+    assert store.submit("1111", "k2", "1-4", Callback())
+
+
+def test_eviction_drops_oldest_completed_key(clock):
+    store = IdempotencyStore(max_entries=2)
+    store.submit("1111", "k1", "1-1", Callback())
+    store.submit("1111", "k2", "1-2", Callback())
+    store.complete(command("k1", "1-1"), SUCCESS)
+    store.complete(command("k2", "1-2"), SUCCESS)
+
+    assert store.submit("1111", "k3", "1-3", Callback())
+    stats = store.stats()
+    assert stats["evicted"] == 1
+    assert stats["entries"] == 2
+    # k1 bị loại: gửi lại tạo command mới
+    assert store.submit("1111", "k1", "1-4", Callback())
+
+
+def test_eviction_keeps_pending_keys(clock):
+    store = IdempotencyStore(max_entries=2)
+    store.submit("1111", "k1", "1-1", Callback())
+    store.submit("1111", "k2", "1-2", Callback())
+    store.complete(command("k2", "1-2"), SUCCESS)
+
+    assert store.submit("1111", "k3", "1-3", Callback())
+    waiter = Callback()
+    assert not store.submit("1111", "k1", None, waiter)
+    store.complete(command("k1", "1-1"), SUCCESS)
+    assert waiter.outcomes == [SUCCESS]
+
+
+def test_new_key_rejected_when_all_keys_pending(clock):
+    store = IdempotencyStore(max_entries=2)
+    store.submit("1111", "k1", "1-1", Callback())
+    store.submit("1111", "k2", "1-2", Callback())
+    rejected = Callback()
+
+    assert not store.submit("1111", "k3", "1-3", rejected)
+    assert rejected.outcomes == [BUSY]
+    assert store.stats()["rejected"] == 1
+
+    store.complete(command("k1", "1-1"), SUCCESS)
+    assert store.submit("1111", "k3", "1-4", Callback())
+
+
+def test_discard_drops_pending_key_only(clock):
+    store = IdempotencyStore()
+    store.submit("1111", "k1", "1-1", Callback())
+    store.discard(command("k1", "1-1"))
+    assert store.submit("1111", "k1", "1-2", Callback())
+
+    store.complete(command("k1", "1-2"), SUCCESS)
+    store.discard(command("k1", "1-2"))
+    assert not store.submit("1111", "k1", None, Callback())
+
+
+def test_disconnected_callback_does_not_block_others(clock):
+    class Disconnected:
+        def notify(self, message, type):
+            raise ConnectionError("ATM offline")
+
+    store = IdempotencyStore()
+    store.submit("1111", "k1", "1-1", Callback())
+    store.submit("1111", "k1", None, Disconnected())
+    waiter = Callback()
+    store.submit("1111", "k1", None, waiter)
+
+    store.complete(command("k1", "1-1"), SUCCESS)
+    assert waiter.outcomes == [SUCCESS]
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.deposits = []
+
+    def deposit_money(self, card_number, amount, transaction_time):
+        self.deposits.append(transaction_time)
+
+
+def deposit(key, command_id, timestamp, callback):
+    return {
+        "command_type": "deposit",
+        "card_number": "1111",
+        "amount": 100,
+        "timestamp": timestamp,
+        "peer_id": 1,
+        "idempotency_key": key,
+        "command_id": command_id,
+        "success_callback": callback,
+    }
+
+
+@pytest.fixture
+def executor(clock):
+    return CommandExecutor(
+        command_queue=None,
+        database_writer=RecordingWriter(),
+        idempotency=IdempotencyStore(),
+    )
+
+
+def test_duplicate_key_in_batch_runs_once(executor):
+    first, retry = Callback(), Callback()
+
+    success = executor.exec_direct(
+        [deposit("k1", "1-1", 1, first), deposit("k1", "2-1", 2, retry)]
+    )
+
+    assert [cmd["timestamp"] for cmd in success] == [1]
+    assert executor.database_writer.deposits == [1]
+    assert first.outcomes == [SUCCESS]
+    assert retry.outcomes == [SUCCESS]
+
+
+def test_forwarded_retry_waits_for_local_command(executor):
+    # ATM gửi lại thẳng tới server giữ shard trước khi lệnh forward tới nơi
+    local = deposit("k1", "1-1", 1, Callback())
+    executor.idempotency.submit("1111", "k1", "1-1", local["success_callback"])
+    collector = Callback()
+
+    assert not executor.submit_forwarded(deposit("k1", "2-1", 2, None), collector)
+    executor.exec_direct([local])
+
+    assert executor.database_writer.deposits == [1]
+    assert collector.outcomes == [SUCCESS]
+
+
+def test_forwarded_command_with_new_key_is_executed(executor):
+    collector = Callback()
+    forwarded = deposit("k1", "2-1", 2, collector)
+
+    assert executor.submit_forwarded(forwarded, collector)
+    executor.exec_direct([forwarded])
+    retry = Callback()
+
+    assert not executor.idempotency.submit("1111", "k1", None, retry)
+    assert retry.outcomes == [SUCCESS]
@@ -0,0 +1,177 @@
+from contextlib import contextmanager
+
+import pytest
+
+from app_server.database import inline
+from app_server.database.exceptions import SQLException
+from app_server.database.inline import InlineDatabaseWriter
+
+
+class FakePreparedCursor:
+    """Prepared cursor giả: chạy các câu SQL của backend inline trên bảng cards trong RAM"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, sql, params):
+        self.conn.log.append((sql, params))
+        cards = self.conn.cards
+        self.rows = []
+        self.rowcount = 0
+
+        if sql == inline.SQL_LOCK_BALANCE:
+            self.rows = [(cards[params[0]]["balance"],)] if params[0] in cards else []
+        elif sql == inline.SQL_LOCK_TRANSFER_CARDS:
+            self.rows = [
+                (number, cards[number]["balance"])
+                for number in sorted(set(params))
+                if number in cards
+            ]
+        elif sql == inline.SQL_LOCK_PIN:
+            self.rows = [(cards[params[0]]["pin"],)] if params[0] in cards else []
+        elif sql in (inline.SQL_DEBIT, inline.SQL_CREDIT):
+            amount, number = params
+            if number in cards:
+                sign = -1 if sql == inline.SQL_DEBIT else 1
+                cards[number]["balance"] += sign * amount
+                self.rowcount = 1
+        elif sql == inline.SQL_UPDATE_PIN:
+            cards[params[1]]["pin"] = params[0]
+            self.rowcount = 1
+        elif sql == inline.SQL_INSERT_TRANSACTION:
+            self.conn.transactions.append(params)
+            self.rowcount = 1
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cards):
+        self.cards = {
+            number: {"balance": balance, "pin": "0000"}
+            for number, balance in cards.items()
+        }
+        self.transactions = []
+        self.log = []
+        self.prepared_cursors = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, prepared=False):
+        if prepared:
+            self.prepared_cursors += 1
+        return FakePreparedCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeReader:
+    def forget_cards(self, card_numbers):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self, cards):
+        self.conn = FakeConnection(cards)
+
+    @contextmanager
+    def write_connection(self):
+        yield self.conn
+
+    def reader(self):
+        return FakeReader()
+
+
+@pytest.fixture
+def database():
+    return FakeDatabase({"1111": 100, "2222": 0})
+
+
+@pytest.fixture
+def writer(database):
+    return InlineDatabaseWriter(database)
+
+
+def balances(database):
+    return {number: card["balance"] for number, card in database.conn.cards.items()}
+
+
+def test_statement_is_prepared_once_per_connection(writer, database):
+    writer.deposit_money("1111", 10, 1)
+    writer.deposit_money("2222", 20, 2)
+
+    # 1 cursor cho UPDATE, 1 cursor cho INSERT transactions
+    assert database.conn.prepared_cursors == 2
+    assert balances(database) == {"1111": 110, "2222": 20}
+    assert database.conn.transactions == [
+        ("1111", "1111", 10, "Deposit", 1),
+        ("2222", "2222", 20, "Deposit", 2),
+    ]
+
+
+def test_withdraw_more_than_balance_is_business_error(writer, database):
+    with pytest.raises(SQLException) as raised:
+        writer.withdraw_money("1111", 500, 1)
+
+    assert raised.value.is_business_error()
+    assert raised.value.message == "Số dư hiện tại không đủ."
+    assert balances(database) == {"1111": 100, "2222": 0}
+    assert database.conn.rollbacks == 1
+
+
+def test_transfer_moves_balance_and_locks_cards_in_order(writer, database):
+    writer.transfer_money("2222", "1111", 0, 1)
+    writer.transfer_money("1111", "2222", 30, 2)
+
+    assert balances(database) == {"1111": 70, "2222": 30}
+    locks = [
+        params
+        for sql, params in database.conn.log
+        if sql == inline.SQL_LOCK_TRANSFER_CARDS
+    ]
+    assert locks == [("2222", "1111"), ("1111", "2222")]
+    assert database.conn.transactions[-1] == ("1111", "2222", 30, "Transfer", 2)
+
+
+@pytest.mark.parametrize(
+    "to_card, message",
+    [
+        ("1111", "Không thể chuyển khoản cho chính mình."),
+        ("9999", "Số tài khoản đối ứng không tồn tại."),
+    ],
+)
+def test_transfer_rejects_invalid_target(writer, database, to_card, message):
+    with pytest.raises(SQLException) as raised:
+        writer.transfer_money("1111", to_card, 10, 1)
+
+    assert raised.value.message == message
+    assert balances(database) == {"1111": 100, "2222": 0}
+    assert database.conn.transactions == []
+
+
+def test_deposit_to_unknown_card_is_business_error(writer, database):
+    with pytest.raises(SQLException) as raised:
+        writer.deposit_money("9999", 10, 1)
+
+    assert raised.value.message == "Số thẻ không tồn tại."
+    assert database.conn.transactions == []
+
+
+def test_change_pin_to_same_pin_is_rejected(writer, database):
+    with pytest.raises(SQLException) as raised:
+        writer.change_pin("1111", "0000")
+
+    assert raised.value.message == "Mã PIN mới không được trùng với mã PIN cũ."
+
+    writer.change_pin("1111", "1234")
+    assert database.conn.cards["1111"]["pin"] == "1234"
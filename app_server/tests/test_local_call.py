@@ -0,0 +1,93 @@
+from abc import abstractmethod
+from typing import List
+from xmlrpc.client import Fault
+
+import pytest
+
+from rmi_framework.v2 import Remote, RemoteObject
+from rmi_framework.v2.core.registry import LocalRegistry, LocateRegistry, RPCStub
+from rmi_framework.v2.helpers.utils import get_interface_hash
+
+PORT = 29999
+
+
+class Store(Remote):
+    @abstractmethod
+    def add(self, items: List[str], item: str) -> List[str]:
+        pass
+
+    @abstractmethod
+    def fail(self) -> str:
+        pass
+
+
+class StoreImpl(RemoteObject, Store):
+    def add(self, items: List[str], item: str) -> List[str]:
+        items.append(item)
+        return items
+
+    def fail(self) -> str:
+        raise ValueError("boom")
+
+
+class UnusedProxy:
+    """Proxy tới registry: ghi lại các call đi qua mạng"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append(name)
+            return ["remote"]
+
+        return call
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = LocalRegistry(host="10.0.0.1", port=PORT)
+    registry.bind("store", StoreImpl())
+    monkeypatch.setattr(registry, "_is_running", True)
+    monkeypatch.setattr(LocateRegistry, "_current_local_registry", registry)
+    return registry
+
+
+def make_stub(proxy, address):
+    return RPCStub(
+        proxy=proxy,
+        interface=Store,
+        interface_hash=get_interface_hash(Store),
+        service_name="store",
+        address=address,
+    )
+
+
+@pytest.mark.parametrize("host", ["10.0.0.1", "127.0.0.1", "localhost"])
+def test_call_to_own_registry_skips_network(registry, host):
+    proxy = UnusedProxy()
+
+    assert make_stub(proxy, (host, PORT)).add([], "a") == ["a"]
+    assert proxy.calls == []
+
+
+def test_call_to_other_port_goes_remote(registry):
+    proxy = UnusedProxy()
+
+    assert make_stub(proxy, ("127.0.0.1", PORT + 1)).add([], "a") == ["remote"]
+    assert proxy.calls == ["store@add"]
+
+
+def test_local_call_copies_arguments(registry):
+    items = ["a"]
+
+    result = make_stub(UnusedProxy(), ("127.0.0.1", PORT)).add(items, "b")
+
+    # Như XML-RPC: service không sửa được object của caller
+    assert result == ["a", "b"]
+    assert items == ["a"]
+
+
+def test_local_call_error_is_raised_as_fault(registry):
+    with pytest.raises(Fault, match="boom"):
+        make_stub(UnusedProxy(), ("127.0.0.1", PORT)).fail()
@@ -0,0 +1,256 @@
+import socket
+import threading
+import time
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from xmlrpc.client import Fault, ServerProxy
+
+import pytest
+
+from rmi_framework.v2 import Remote, RemoteObject
+from rmi_framework.v2.core import transport
+from rmi_framework.v2.core.registry import RMIServer, ServiceWrapper
+from rmi_framework.v2.core.transport import MuxConnection
+
+
+class MuxServer:
+    """Server chỉ nhận mux connection, dispatch qua methods"""
+
+    def __init__(self, methods):
+        self.methods = methods
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        self.executor = ThreadPoolExecutor(max_workers=8)
+        self.connections = []
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections.append(sock)
+            threading.Thread(
+                target=transport.serve_mux_connection,
+                args=(sock, self._dispatch, self.executor),
+                daemon=True,
+            ).start()
+
+    def _dispatch(self, method, params):
+        return self.methods[method](*params)
+
+    def drop_connections(self):
+        for sock in self.connections:
+            sock.shutdown(socket.SHUT_RDWR)
+        self.connections.clear()
+
+    def close(self):
+        self.listener.close()
+        self.executor.shutdown(wait=False)
+
+
+@pytest.fixture
+def released():
+    return threading.Event()
+
+
+@pytest.fixture
+def server(released):
+    def fail():
+        raise ValueError("boom")
+
+    server = MuxServer(
+        {
+            "echo": lambda value: value,
+            "wait": lambda: released.wait(5.0),
+            "release": released.set,
+            "fail": fail,
+        }
+    )
+    yield server
+    released.set()
+    server.close()
+
+
+def call_in_thread(conn, method, *params):
+    result = {}
+
+    def run():
+        try:
+            result["value"] = conn.call(method, params)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def wait_for_in_flight(conn, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while conn.in_flight() < count:
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_frame_round_trip():
+    left, right = socket.socketpair()
+    try:
+        left.sendall(transport._encode_frame(7, b"hello"))
+        left.sendall(transport._encode_frame(2**40, b""))
+
+        assert transport._read_frame(right) == (7, b"hello")
+        assert transport._read_frame(right) == (2**40, b"")
+    finally:
+        left.close()
+        right.close()
+
+
+def test_read_frame_raises_on_truncated_frame():
+    left, right = socket.socketpair()
+    left.sendall(transport._encode_frame(1, b"hello")[:-2])
+    left.close()
+
+    with pytest.raises(ConnectionResetError):
+        transport._read_frame(right)
+    right.close()
+
+
+def test_responses_complete_out_of_order(server):
+    conn = MuxConnection("127.0.0.1", server.port, timeout=5.0)
+    slow, result = call_in_thread(conn, "wait")
+    wait_for_in_flight(conn, 1)
+
+    # Call sau không phải chờ call trước trên cùng connection
+    assert conn.call("echo", ("x",)) == "x"
+    conn.call("release", ())
+    slow.join()
+    assert result == {"value": True}
+    conn.close()
+
+
+def test_fault_is_raised_in_caller(server):
+    conn = MuxConnection("127.0.0.1", server.port, timeout=5.0)
+
+    with pytest.raises(Fault, match="boom"):
+        conn.call("fail", ())
+    # Connection vẫn dùng được
+    assert conn.call("echo", (1,)) == 1
+    conn.close()
+
+
+def test_broken_connection_fails_all_pending_calls(server):
+    conn = MuxConnection("127.0.0.1", server.port, timeout=5.0)
+    calls = [call_in_thread(conn, "wait") for _ in range(3)]
+    wait_for_in_flight(conn, 3)
+
+    server.drop_connections()
+    for thread, result in calls:
+        thread.join()
+        assert isinstance(result["error"], ConnectionResetError)
+    assert conn.in_flight() == 0
+
+    # Call tiếp theo tự kết nối lại
+    assert conn.call("echo", ("again",)) == "again"
+    conn.close()
+
+
+def test_send_on_socket_closed_by_reader_raises_connection_reset():
+    class ClosedSocket:
+        def sendall(self, data):
+            raise OSError(9, "Bad file descriptor")
+
+        def close(self):
+            pass
+
+    conn = MuxConnection("127.0.0.1", 1, timeout=5.0)
+    conn._sock = ClosedSocket()
+
+    with pytest.raises(ConnectionResetError):
+        conn.call("echo", ("x",))
+    assert conn.in_flight() == 0
+
+
+def test_call_times_out_and_late_response_is_ignored(server):
+    conn = MuxConnection("127.0.0.1", server.port, timeout=0.05)
+
+    with pytest.raises(TimeoutError):
+        conn.call("wait", ())
+    assert conn.in_flight() == 0
+
+    conn.timeout = 5.0
+    conn.call("release", ())
+    assert conn.call("echo", ("after",)) == "after"
+    conn.close()
+
+
+def test_silent_connection_does_not_block_other_clients():
+    server = RMIServer(("127.0.0.1", 0), allow_none=True, logRequests=False)
+    server.register_function(lambda value: value, "echo")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    # Kết nối nhưng không gửi preamble/request nào
+    silent = socket.create_connection(("127.0.0.1", port))
+    try:
+        started = time.monotonic()
+        proxy = ServerProxy(f"http://127.0.0.1:{port}/", allow_none=True)
+        assert proxy.echo("http") == "http"
+
+        conn = MuxConnection("127.0.0.1", port, timeout=5.0)
+        assert conn.call("echo", ("mux",)) == "mux"
+        conn.close()
+        assert time.monotonic() - started < 1.0
+    finally:
+        silent.close()
+        server.shutdown()
+        server.server_close()
+
+
+class Counter(Remote):
+    @abstractmethod
+    def enter(self) -> int:
+        pass
+
+
+class CounterImpl(RemoteObject, Counter):
+    def __init__(self):
+        super().__init__()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def enter(self) -> int:
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        return self.max_active
+
+
+class ConcurrentCounterImpl(CounterImpl):
+    concurrent_dispatch = True
+
+
+def run_concurrently(service, calls=4):
+    wrapper = ServiceWrapper(service)
+    threads = [
+        threading.Thread(target=wrapper.enter, args=(service.signature_hash,))
+        for _ in range(calls)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return service.max_active
+
+
+def test_service_runs_one_call_at_a_time_by_default():
+    assert run_concurrently(CounterImpl()) == 1
+
+
+def test_concurrent_service_calls_overlap():
+    assert run_concurrently(ConcurrentCounterImpl()) > 1
@@ -0,0 +1,86 @@
+import threading
+
+from app_server.command_executor import CommandExecutor, partition_commands
+from app_server.database.exceptions import SQLException
+
+
+def deposit(card_number, timestamp=0):
+    return {
+        "command_type": "deposit",
+        "card_number": card_number,
+        "amount": 1,
+        "timestamp": timestamp,
+        "peer_id": 1,
+    }
+
+
+def transfer(from_card, to_card, timestamp=0):
+    return {
+        "command_type": "transfer",
+        "card_number": from_card,
+        "to_card": to_card,
+        "amount": 1,
+        "timestamp": timestamp,
+        "peer_id": 1,
+    }
+
+
+def test_commands_of_different_cards_are_separate_groups():
+    commands = [deposit("A"), deposit("B"), deposit("A"), deposit("C")]
+
+    assert partition_commands(commands) == [[0, 2], [1], [3]]
+
+
+def test_transfer_joins_groups_of_both_cards():
+    commands = [deposit("A"), deposit("B"), transfer("B", "C"), deposit("D")]
+
+    # B-C nối nhóm của B với C, D vẫn tách riêng
+    assert partition_commands(commands) == [[0], [1, 2], [3]]
+
+
+def test_transfer_chain_merges_groups_seen_earlier():
+    commands = [
+        deposit("A"),
+        deposit("B"),
+        deposit("C"),
+        transfer("A", "B"),
+        transfer("C", "B"),
+    ]
+
+    # Nhóm giữ thứ tự gốc của command dù được nối sau
+    assert partition_commands(commands) == [[0, 1, 2, 3, 4]]
+
+
+def test_empty_batch_has_no_groups():
+    assert partition_commands([]) == []
+
+
+class RecordingWriter:
+    """Ghi lại thứ tự lệnh theo thẻ, lệnh có amount < 0 bị lỗi nghiệp vụ"""
+
+    def __init__(self):
+        self.applied = []
+        self.lock = threading.Lock()
+
+    def deposit_money(self, card_number, amount, transaction_time):
+        if amount < 0:
+            raise SQLException("Số tiền không hợp lệ.", "45000")
+        with self.lock:
+            self.applied.append((card_number, transaction_time))
+
+
+def test_parallel_groups_keep_order_per_card_and_in_result():
+    writer = RecordingWriter()
+    executor = CommandExecutor(
+        command_queue=None, database_writer=writer, parallelism=4
+    )
+    commands = [deposit(card, i) for i, card in enumerate("ABABCA")]
+    commands[3]["amount"] = -1
+
+    success = executor.exec_direct(commands)
+
+    # Kết quả theo thứ tự gốc, bỏ command lỗi
+    assert [cmd["timestamp"] for cmd in success] == [0, 1, 2, 4, 5]
+    for card in "ABC":
+        applied = [t for c, t in writer.applied if c == card]
+        assert applied == sorted(applied)
@@ -0,0 +1,202 @@
+import threading
+
+import mysql.connector
+import pytest
+
+from app_server.database.exceptions import PoolTimeoutError
+from app_server.database.pool import DEFAULT_POOL_CONFIG, ConnectionPool, PoolConfig
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.connected = True
+        self.closed = False
+        self.pings = 0
+
+    def is_connected(self):
+        self.pings += 1
+        return self.connected
+
+    def close(self):
+        self.closed = True
+
+
+class Factory:
+    """Tạo FakeConnection, lỗi failures lần đầu"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.created = []
+
+    def __call__(self):
+        if self.failures > 0:
+            self.failures -= 1
+            raise mysql.connector.OperationalError("Can't connect to MySQL server")
+        conn = FakeConnection(len(self.created) + 1)
+        self.created.append(conn)
+        return conn
+
+
+def make_pool(factory=None, **config) -> ConnectionPool:
+    pool_config: PoolConfig = {
+        **DEFAULT_POOL_CONFIG,
+        "validate_idle_after": 60.0,
+        "reconnect_backoff": 0.001,
+        **config,
+    }
+    return ConnectionPool("test", factory or Factory(), pool_config)
+
+
+def test_min_size_connections_opened_up_front():
+    factory = Factory()
+    pool = make_pool(factory, min_size=2)
+
+    assert len(factory.created) == 2
+    assert pool.stats()["idle"] == 2
+
+
+def test_idle_connections_reused_lifo():
+    factory = Factory()
+    pool = make_pool(factory, min_size=0)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    assert pool.acquire() is second
+    assert pool.acquire() is first
+    assert len(factory.created) == 2
+
+
+def test_grows_to_max_size_then_times_out():
+    pool = make_pool(min_size=0, max_size=2, checkout_timeout=0.05)
+    pool.acquire()
+    pool.acquire()
+
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+
+    stats = pool.stats()
+    assert stats["size"] == 2
+    assert stats["in_use"] == 2
+    assert stats["utilization"] == 1.0
+    assert stats["timeouts"] == 1
+
+
+def test_waiter_gets_released_connection():
+    pool = make_pool(min_size=0, max_size=1, checkout_timeout=5.0)
+    conn = pool.acquire()
+    acquired = []
+
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    threading.Timer(0.05, pool.release, args=(conn,)).start()
+    waiter.join(5.0)
+
+    assert acquired == [conn]
+    assert pool.stats()["waits"] == 1
+
+
+def test_create_retries_with_backoff():
+    factory = Factory(failures=2)
+    pool = make_pool(factory, min_size=0, reconnect_attempts=3)
+
+    assert pool.acquire() is factory.created[0]
+    assert pool.stats()["reconnect_retries"] == 2
+
+
+def test_create_failure_frees_slot():
+    factory = Factory(failures=3)
+    pool = make_pool(factory, min_size=0, max_size=1, reconnect_attempts=3)
+
+    with pytest.raises(mysql.connector.OperationalError):
+        pool.acquire()
+    assert pool.stats()["size"] == 0
+
+    assert pool.acquire() is factory.created[0]
+
+
+def test_connection_error_discards_connection():
+    factory = Factory()
+    pool = make_pool(factory, min_size=0)
+
+    with pytest.raises(mysql.connector.InterfaceError):
+        with pool.connection():
+            raise mysql.connector.InterfaceError("Lost connection")
+
+    assert factory.created[0].closed
+    stats = pool.stats()
+    assert stats["size"] == 0
+    assert stats["discarded"] == 1
+
+
+def test_other_errors_keep_connection():
+    pool = make_pool(min_size=0)
+
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("bad input")
+
+    assert pool.stats()["idle"] == 1
+
+
+def test_close_discards_idle_and_returned_connections():
+    factory = Factory()
+    pool = make_pool(factory, min_size=2)
+    conn = pool.acquire()
+    pool.close()
+
+    assert [c.closed for c in factory.created if c is not conn] == [True]
+    assert not conn.closed
+    pool.release(conn)
+    assert conn.closed
+    assert pool.stats()["size"] == 0
+
+
+def test_recently_used_connection_not_pinged():
+    factory = Factory()
+    pool = make_pool(factory, min_size=1)
+    pool.release(pool.acquire())
+    pool.acquire()
+
+    assert factory.created[0].pings == 0
+    assert pool.stats()["validations"] == 0
+
+
+def test_long_idle_connection_pinged():
+    factory = Factory()
+    pool = make_pool(factory, min_size=1, validate_idle_after=0.0)
+    pool.acquire()
+
+    assert factory.created[0].pings == 1
+    assert pool.stats()["validations"] == 1
+
+
+def test_dead_idle_connection_replaced():
+    factory = Factory()
+    pool = make_pool(factory, min_size=1, validate_idle_after=0.0)
+    factory.created[0].connected = False
+
+    assert pool.acquire() is factory.created[1]
+    assert factory.created[0].closed
+    assert pool.stats()["size"] == 1
+
+
+def test_connection_error_marks_idle_connections_suspect():
+    factory = Factory()
+    pool = make_pool(factory, min_size=0)
+    idle, broken = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    # Server restart: connection idle cũng đã hỏng
+    idle.connected = False
+    pool.release(broken, broken=True)
+
+    conn = pool.acquire()
+    assert idle.pings == 1
+    assert idle.closed
+    assert conn is factory.created[2]
+
+    # Connection trả về sau lần lỗi không bị ping lại
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert conn.pings == 0
@@ -0,0 +1,196 @@
+import pytest
+
+from app_server.database.exceptions import CommandFailedError, SQLException
+from app_server.replication import ReplicationReceiver
+
+
+class FakeDatabase:
+    """replication_state trong RAM"""
+
+    def __init__(self):
+        self.state = {}
+
+    def get_replication_state(self, origin_id):
+        return self.state.get(origin_id)
+
+
+class FakeBatch:
+    def __init__(self, database):
+        self.database = database
+        self.state = {}
+
+    def set_replication_state(self, origin_id, epoch, applied):
+        self.state[origin_id] = (epoch, applied)
+
+
+class FakeExecutor:
+    """Ghi lại command được áp dụng, replication_state chỉ được ghi khi commit"""
+
+    def __init__(self, database):
+        self.database = database
+        self.applied = []
+        # timestamp -> command bị lỗi khi áp dụng
+        self.failing = set()
+        # Gọi giữa before_commit và commit
+        self.on_commit = None
+
+    def exec_in_transaction(self, commands, before_commit):
+        for cmd in commands:
+            if cmd["timestamp"] in self.failing:
+                raise CommandFailedError(
+                    cmd.get("command_id"), SQLException("Số dư không đủ", "45000")
+                )
+
+        batch = FakeBatch(self.database)
+        before_commit(batch)
+        if self.on_commit is not None:
+            self.on_commit()
+        self.database.state.update(batch.state)
+        self.applied.extend(cmd["timestamp"] for cmd in commands)
+        return commands
+
+
+def command(timestamp, depends_on=None):
+    cmd = {
+        "command_type": "deposit",
+        "card_number": "1111",
+        "amount": 1,
+        "timestamp": timestamp,
+        "peer_id": 1,
+    }
+    if depends_on is not None:
+        cmd["depends_on"] = depends_on
+    return cmd
+
+
+def watermark(origin_id, applied, epoch="e1"):
+    return {"origin_id": origin_id, "epoch": epoch, "applied": applied}
+
+
+@pytest.fixture
+def database():
+    return FakeDatabase()
+
+
+@pytest.fixture
+def executor(database):
+    return FakeExecutor(database)
+
+
+@pytest.fixture
+def receiver(executor, database):
+    return ReplicationReceiver(executor, database, node_id=9)
+
+
+def test_waits_for_depends_on_of_other_origin(receiver, executor):
+    logs = [command(1), command(2, depends_on=[watermark(3, 2)]), command(3)]
+
+    ack = receiver.receive(1, "e1", 1, logs)
+
+    # Chỉ áp dụng phần trước command chờ log của server 3
+    assert ack["applied"] == 1
+    assert executor.applied == [1]
+    assert receiver.stats()["waits"] == 1
+
+    receiver.receive(3, "e1", 1, [command(101), command(102)])
+    ack = receiver.receive(1, "e1", 2, logs[1:])
+    assert ack["applied"] == 3
+    assert executor.applied == [1, 101, 102, 2, 3]
+
+
+def test_depends_on_own_log_is_ignored(receiver, executor):
+    ack = receiver.receive(1, "e1", 1, [command(1, depends_on=[watermark(9, 50)])])
+
+    assert ack["applied"] == 1
+    assert executor.applied == [1]
+
+
+def test_depends_on_older_epoch_is_satisfied(receiver, executor):
+    receiver.receive(3, "e2", 1, [command(101)])
+
+    # Server 3 đã bắt đầu log mới: log của epoch cũ không còn gì để chờ
+    ack = receiver.receive(1, "e1", 1, [command(1, depends_on=[watermark(3, 7, "e1")])])
+    assert ack["applied"] == 1
+
+
+def test_unknown_origin_is_loaded_once(receiver, database, monkeypatch):
+    calls = []
+    load = database.get_replication_state
+
+    def get_replication_state(origin_id):
+        calls.append(origin_id)
+        return load(origin_id)
+
+    monkeypatch.setattr(database, "get_replication_state", get_replication_state)
+    for _ in range(3):
+        receiver.watermarks([3])
+
+    assert calls == [3]
+
+
+def test_watermarks_include_range_being_committed(receiver, executor):
+    seen = []
+    executor.on_commit = lambda: seen.append(receiver.watermarks([1]))
+
+    receiver.receive(1, "e1", 1, [command(1), command(2)])
+
+    assert seen == [[watermark(1, 2)]]
+    assert receiver.watermarks([1]) == [watermark(1, 2)]
+
+
+def test_failed_command_keeps_applied_index(receiver, executor):
+    receiver.receive(1, "e1", 1, [command(1)])
+    executor.failing.add(3)
+
+    with pytest.raises(CommandFailedError):
+        receiver.receive(1, "e1", 2, [command(2), command(3)])
+
+    assert receiver.watermarks([1]) == [watermark(1, 1)]
+    assert receiver.stats()["failed"] == 1
+
+
+def test_gap_is_not_applied(receiver, executor):
+    receiver.receive(1, "e1", 1, [command(1)])
+
+    ack = receiver.receive(1, "e1", 3, [command(3)])
+
+    # Thiếu index 2: báo lại vị trí đã áp dụng để peer gửi lại từ đó
+    assert ack == {"epoch": "e1", "received": 1, "applied": 1}
+    assert executor.applied == [1]
+    assert receiver.stats()["gaps"] == 1
+
+
+def test_resent_prefix_is_skipped(receiver, executor, database):
+    receiver.receive(1, "e1", 1, [command(1), command(2)])
+
+    ack = receiver.receive(1, "e1", 1, [command(1), command(2), command(3)])
+
+    assert ack["applied"] == 3
+    assert executor.applied == [1, 2, 3]
+    assert receiver.stats()["duplicates"] == 2
+    assert database.state[1] == ("e1", 3)
+
+
+def test_fully_applied_range_is_acked_without_executing(receiver, executor):
+    receiver.receive(1, "e1", 1, [command(1), command(2)])
+
+    ack = receiver.receive(1, "e1", 2, [command(2)])
+
+    assert ack["applied"] == 2
+    assert executor.applied == [1, 2]
+
+
+def test_new_epoch_restarts_index(receiver, executor, database):
+    receiver.receive(1, "e1", 1, [command(1), command(2)])
+
+    # Peer khởi động lại: log mới đánh số lại từ 1
+    ack = receiver.receive(1, "e2", 1, [command(11)])
+
+    assert ack == {"epoch": "e2", "received": 1, "applied": 1}
+    assert executor.applied == [1, 2, 11]
+    assert database.state[1] == ("e2", 1)
+
+    # Log mới không bắt đầu từ 1 là bị hở
+    receiver.receive(3, "e1", 1, [command(101)])
+    ack = receiver.receive(3, "e2", 2, [command(102)])
+    assert ack["applied"] == 0
@@ -0,0 +1,174 @@
+import os
+
+from app_server.replication_backlog import ReplicationBacklog
+
+
+def command(i):
+    return {"type": "deposit", "card_number": "1111", "amount": i}
+
+
+def open_backlog(tmp_path, **kwargs) -> ReplicationBacklog:
+    kwargs.setdefault("peer_ids", (1, 2))
+    return ReplicationBacklog(str(tmp_path / "backlog"), **kwargs)
+
+
+def amounts(entries):
+    return [(seq, cmd["amount"]) for seq, cmd in entries]
+
+
+def test_append_and_read(tmp_path):
+    backlog = open_backlog(tmp_path)
+
+    assert backlog.append([command(1), command(2)]) == 2
+    assert backlog.append([command(3)]) == 3
+    assert amounts(backlog.read(1, 10)) == [(1, 1), (2, 2), (3, 3)]
+    assert amounts(backlog.read(2, 1)) == [(2, 2)]
+    assert backlog.append([]) == 3
+
+
+def test_spilled_entries_are_read_from_segments(tmp_path):
+    backlog = open_backlog(tmp_path, memory_entries=2)
+    backlog.append([command(i) for i in range(1, 6)])
+
+    stats = backlog.stats()
+    assert stats["spilled"] == 3
+    assert stats["in_memory"] == 2
+    assert amounts(backlog.read(1, 10)) == [(i, i) for i in range(1, 6)]
+    # Giới hạn rơi vào phần trên đĩa / giữa đĩa và RAM
+    assert amounts(backlog.read(2, 2)) == [(2, 2), (3, 3)]
+    assert amounts(backlog.read(3, 2)) == [(3, 3), (4, 4)]
+
+
+def test_read_skips_entries_acked_by_all_peers(tmp_path):
+    backlog = open_backlog(tmp_path)
+    backlog.append([command(i) for i in range(1, 5)])
+    backlog.ack(1, 2)
+    backlog.ack(2, 3)
+
+    assert backlog.acked_seq() == 2
+    assert amounts(backlog.read(1, 10)) == [(3, 3), (4, 4)]
+    assert amounts(backlog.read_pending(2, 10)) == [(4, 4)]
+    assert backlog.pending_count() == 2
+    assert backlog.pending_count(2) == 1
+
+
+def test_ack_never_moves_back_or_past_end(tmp_path):
+    backlog = open_backlog(tmp_path)
+    backlog.append([command(1), command(2)])
+    backlog.ack(1, 2)
+    backlog.ack(1, 1)
+    assert backlog.acked_seq(1) == 2
+
+    backlog.ack(2, 99)
+    assert backlog.acked_seq(2) == 2
+
+
+def test_segments_deleted_when_acked_by_all_peers(tmp_path):
+    backlog = open_backlog(tmp_path, memory_entries=1, segment_bytes=1)
+    backlog.append([command(i) for i in range(1, 5)])
+    assert backlog.stats()["segments"] == 4
+
+    backlog.ack(1, 3)
+    assert backlog.stats()["segments"] == 4
+
+    backlog.ack(2, 3)
+    stats = backlog.stats()
+    assert stats["segments"] == 1
+    assert stats["segments_deleted"] == 3
+    assert len([n for n in os.listdir(backlog.directory) if n.endswith(".seg")]) == 1
+    assert amounts(backlog.read(1, 10)) == [(4, 4)]
+
+
+def test_slow_peer_keeps_everything(tmp_path):
+    backlog = open_backlog(tmp_path)
+    backlog.append([command(i) for i in range(1, 101)])
+    backlog.ack(1, 100)
+
+    assert backlog.pending_count(2) == 100
+    assert len(backlog.read_pending(2, 1000)) == 100
+
+
+def test_rewind(tmp_path):
+    backlog = open_backlog(tmp_path)
+    backlog.append([command(i) for i in range(1, 5)])
+    backlog.ack(1, 4)
+    backlog.ack(2, 2)
+
+    assert backlog.rewind(1, 3)
+    assert amounts(backlog.read_pending(1, 10)) == [(4, 4)]
+    # Phần <= 2 đã được dọn
+    assert not backlog.rewind(1, 1)
+
+
+def test_restart_keeps_epoch_acks_and_entries(tmp_path):
+    backlog = open_backlog(
+        tmp_path, memory_entries=2, segment_bytes=64, state_interval=0
+    )
+    backlog.append([command(i) for i in range(1, 6)])
+    backlog.ack(1, 4)
+    backlog.ack(2, 2)
+
+    reopened = open_backlog(tmp_path, memory_entries=2, segment_bytes=64)
+    assert reopened.epoch == backlog.epoch
+    assert reopened.last_seq() == 5
+    assert reopened.acked_seq(1) == 4
+    assert reopened.acked_seq(2) == 2
+    assert amounts(reopened.read_pending(2, 10)) == [(3, 3), (4, 4), (5, 5)]
+
+    assert reopened.append([command(6)]) == 6
+    assert amounts(reopened.read_pending(1, 10)) == [(5, 5), (6, 6)]
+
+
+def test_restart_adds_new_peer_at_acked_seq(tmp_path):
+    backlog = open_backlog(tmp_path, state_interval=0)
+    backlog.append([command(i) for i in range(1, 4)])
+    backlog.ack(1, 3)
+    backlog.ack(2, 1)
+
+    reopened = open_backlog(tmp_path, peer_ids=(1, 2, 3))
+    assert reopened.acked_seq(3) == 1
+    assert amounts(reopened.read_pending(3, 10)) == [(2, 2), (3, 3)]
+
+
+def test_acks_are_saved_before_segments_are_deleted(tmp_path):
+    backlog = open_backlog(tmp_path, segment_bytes=64, state_interval=3600)
+    backlog.append([command(i) for i in range(1, 6)])
+    saves = backlog.stats()["state_saves"]
+
+    # Không xóa segment nào: chỉ cập nhật mốc ack trong RAM
+    backlog.ack(1, 5)
+    assert backlog.stats()["state_saves"] == saves
+    assert open_backlog(tmp_path).acked_seq(1) == 0
+
+    backlog.ack(2, 2)
+    assert backlog.stats()["segments_deleted"] > 0
+    assert backlog.stats()["state_saves"] == saves + 1
+    reopened = open_backlog(tmp_path)
+    assert reopened.acked_seq(1) == 5
+    assert amounts(reopened.read_pending(2, 10)) == [(3, 3), (4, 4), (5, 5)]
+
+
+def test_restart_drops_torn_last_entry(tmp_path):
+    backlog = open_backlog(tmp_path)
+    backlog.append([command(1), command(2)])
+    (segment,) = [n for n in os.listdir(backlog.directory) if n.endswith(".seg")]
+
+    with open(os.path.join(backlog.directory, segment), "ab") as f:
+        f.write(b'{"type": "depo')
+
+    reopened = open_backlog(tmp_path)
+    assert reopened.last_seq() == 2
+    assert reopened.append([command(3)]) == 3
+    assert amounts(reopened.read(1, 10)) == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_missing_state_starts_new_log(tmp_path):
+    backlog = open_backlog(tmp_path)
+    backlog.append([command(1), command(2)])
+    os.remove(os.path.join(backlog.directory, ReplicationBacklog.STATE_FILE))
+
+    reopened = open_backlog(tmp_path)
+    assert reopened.epoch != backlog.epoch
+    assert reopened.last_seq() == 0
+    assert reopened.read(1, 10) == []
+    assert not [n for n in os.listdir(reopened.directory) if n.endswith(".seg")]
@@ -0,0 +1,209 @@
+import itertools
+
+import pytest
+
+from app_server import shard_ownership
+from app_server.shard_ownership import ShardOwnership, shard_of
+
+SHARDS = 4
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(shard_ownership, "time", clock)
+    return clock
+
+
+def card_in(shard):
+    """Số thẻ thuộc shard"""
+    return next(
+        card
+        for card in (str(n) for n in itertools.count(1000))
+        if shard_of(card, SHARDS) == shard
+    )
+
+
+def cmd(command_type, card_number, **extra):
+    return {"command_type": command_type, "card_number": card_number, **extra}
+
+
+def test_shard_of_is_stable():
+    assert shard_of("123456", SHARDS) == shard_of("123456", SHARDS)
+    assert {shard_of(str(n), SHARDS) for n in range(100)} == set(range(SHARDS))
+
+
+def test_required_shard():
+    ownership = ShardOwnership(SHARDS)
+    card = card_in(2)
+
+    assert ownership.required_shard(cmd("deposit", card)) is None
+    assert ownership.required_shard(cmd("deposit", card, idempotency_key="k")) == 2
+    for command_type in ("withdraw", "transfer", "change-pin"):
+        assert ownership.required_shard(cmd(command_type, card)) == 2
+
+
+def test_split_by_owned_shards(clock):
+    ownership = ShardOwnership(SHARDS)
+    ownership.assign([0])
+    mine, other = card_in(0), card_in(1)
+    commands = [
+        cmd("withdraw", mine),
+        cmd("withdraw", other),
+        cmd("deposit", card_in(3)),
+    ]
+
+    runnable, blocked = ownership.split(commands)
+    assert runnable == [commands[0], commands[2]]
+    assert blocked == [commands[1]]
+
+
+def test_split_keeps_order_per_card(clock):
+    ownership = ShardOwnership(SHARDS)
+    ownership.assign([0])
+    other = card_in(1)
+    commands = [cmd("withdraw", other), cmd("deposit", other)]
+
+    runnable, blocked = ownership.split(commands)
+    # deposit chạy được ở mọi server nhưng phải chờ lệnh trước của cùng thẻ
+    assert runnable == []
+    assert blocked == commands
+
+
+def test_split_waits_for_busy_cards(clock):
+    ownership = ShardOwnership(SHARDS)
+    ownership.assign([0])
+    card = card_in(0)
+
+    runnable, blocked = ownership.split([cmd("withdraw", card)], busy_cards=[card])
+    assert runnable == []
+    assert len(blocked) == 1
+
+
+def test_catching_up_shard_is_not_usable(clock):
+    ownership = ShardOwnership(SHARDS)
+    ownership.acquire([0], catching_up=True)
+    commands = [cmd("withdraw", card_in(0))]
+
+    assert ownership.split(commands) == ([], commands)
+    ownership.caught_up([0])
+    assert ownership.split(commands) == (commands, [])
+
+
+def test_forwarded_use_migrates_shard(clock):
+    ownership = ShardOwnership(SHARDS, migrate_after=4)
+    ownership.assign([0])
+    card = card_in(0)
+
+    ownership.split([cmd("withdraw", card)] * 3, origin_id=2)
+    assert ownership.stats()["migrations"] == 0
+
+    ownership.split([cmd("withdraw", card)], origin_id=2)
+    assert ownership.stats()["migrations"] == 1
+    assert ownership.stats()["demanded"] == 1
+
+
+def test_local_use_prevents_migration(clock):
+    ownership = ShardOwnership(SHARDS, migrate_after=4)
+    ownership.assign([0])
+    card = card_in(0)
+
+    ownership.split([cmd("withdraw", card)] * 3)
+    ownership.split([cmd("withdraw", card)] * 5, origin_id=2)
+    assert ownership.stats()["migrations"] == 0
+
+    # Gấp MIGRATE_RATIO lần lượng dùng tại chỗ
+    ownership.split([cmd("withdraw", card)], origin_id=2)
+    assert ownership.stats()["migrations"] == 1
+
+
+def test_migration_window_resets_counts(clock):
+    ownership = ShardOwnership(SHARDS, migrate_after=4, migrate_window=1.0)
+    ownership.assign([0])
+    card = card_in(0)
+
+    ownership.split([cmd("withdraw", card)] * 3, origin_id=2)
+    clock.now += 1.0
+    ownership.split([cmd("withdraw", card)] * 3, origin_id=2)
+    assert ownership.stats()["migrations"] == 0
+
+
+def test_idle_demanded_shard_is_released(clock):
+    ownership = ShardOwnership(SHARDS, idle_grace=0.01)
+    ownership.acquire([0, 1])
+    ownership.split([cmd("withdraw", card_in(0))])
+    ownership.demand(2, [0, 1])
+
+    # Shard 0 vừa dùng, chưa giữ đủ quantum; shard 1 rảnh
+    assert ownership.releasable(lambda requester_id: 0.5) == {2: [1]}
+    assert ownership.handover_delay(lambda requester_id: 0.5) == 0.0
+
+    ownership.release(2, [1])
+    assert ownership.owner_of(1) == 2
+    assert ownership.handover_delay(lambda requester_id: 0.5) == pytest.approx(0.01)
+
+    clock.now += 0.02
+    assert ownership.releasable(lambda requester_id: 0.5) == {2: [0]}
+
+
+def test_busy_demanded_shard_is_released_after_quantum(clock):
+    ownership = ShardOwnership(SHARDS, idle_grace=0.01)
+    ownership.acquire([0])
+    ownership.demand(2, [0])
+
+    for _ in range(5):
+        clock.now += 0.1
+        ownership.split([cmd("withdraw", card_in(0))])
+        if ownership.releasable(lambda requester_id: 0.5):
+            break
+
+    assert clock.now == pytest.approx(1000.5)
+    assert ownership.stats()["handovers_expired"] == 1
+
+
+def test_demand_expires(clock):
+    ownership = ShardOwnership(SHARDS, idle_grace=1.0, demand_timeout=5.0)
+    ownership.assign([0])
+    ownership.split([cmd("withdraw", card_in(0))])
+    ownership.demand(2, [0])
+
+    clock.now += 5.0
+    assert ownership.releasable(lambda requester_id: 10.0) == {}
+    assert ownership.handover_delay(lambda requester_id: 10.0) is None
+
+
+def test_to_request_waits_for_timeout(clock):
+    ownership = ShardOwnership(SHARDS)
+    ownership.set_owner(2, [1])
+    ownership.want([1])
+    blocked = [cmd("withdraw", card_in(1))]
+
+    assert ownership.to_request(blocked, timeout=1.0) == [1]
+    assert ownership.to_request(blocked, timeout=1.0) == []
+    assert ownership.next_request_deadline() == pytest.approx(1001.0)
+    assert ownership.owner_of(1) == 2
+
+    # Quá hạn: xin lại, thông tin server đang giữ có thể đã cũ
+    clock.now += 1.0
+    assert ownership.to_request(blocked, timeout=1.0) == [1]
+    assert ownership.owner_of(1) is None
+
+    ownership.acquire([1])
+    assert ownership.to_request(blocked, timeout=1.0) == []
+    assert ownership.next_request_deadline() is None
+
+
+def test_demand_for_shard_not_owned_is_requested(clock):
+    ownership = ShardOwnership(SHARDS)
+    ownership.demand(3, [2])
+
+    assert ownership.is_wanted(2)
+    assert ownership.to_request([], timeout=1.0) == [2]
@@ -0,0 +1,114 @@
+import threading
+import time
+
+
+from app_server.database.singleflight import SingleFlight
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class BlockingQuery:
+    """Query chỉ trả kết quả khi được release, đếm số lần thực thi"""
+
+    def __init__(self, result="rows", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.released = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.released.wait(5.0)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def call_in_threads(flight, query, count, key="1111"):
+    results = []
+    lock = threading.Lock()
+
+    def run():
+        try:
+            value = flight.do("check_balance", key, query)
+        except BaseException as e:
+            value = e
+        with lock:
+            results.append(value)
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    query = BlockingQuery()
+
+    threads, results = call_in_threads(flight, query, 4)
+    wait_until(lambda: flight.stats()["check_balance"]["calls"] == 4)
+    query.released.set()
+    for thread in threads:
+        thread.join()
+
+    assert query.calls == 1
+    assert results == ["rows"] * 4
+    assert flight.stats()["check_balance"] == {
+        "calls": 4,
+        "executed": 1,
+        "coalesced": 3,
+    }
+
+
+def test_error_is_raised_in_every_caller():
+    flight = SingleFlight()
+    query = BlockingQuery(error=ValueError("boom"))
+
+    threads, results = call_in_threads(flight, query, 3)
+    wait_until(lambda: flight.stats()["check_balance"]["calls"] == 3)
+    query.released.set()
+    for thread in threads:
+        thread.join()
+
+    assert query.calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_result_is_not_cached():
+    flight = SingleFlight()
+
+    assert flight.do("check_balance", "1111", lambda: 1) == 1
+    assert flight.do("check_balance", "1111", lambda: 2) == 2
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    query = BlockingQuery()
+    query.released.set()
+
+    flight.do("check_balance", "1111", query)
+    flight.do("check_balance", "2222", query)
+
+    assert query.calls == 2
+
+
+def test_forget_starts_new_execution():
+    flight = SingleFlight()
+    stale = BlockingQuery(result="old")
+    threads, results = call_in_threads(flight, stale, 1)
+    wait_until(lambda: stale.calls == 1)
+
+    # Thẻ vừa được ghi: lời gọi sau không dùng query đã bắt đầu trước đó
+    flight.forget("check_balance", "1111")
+    assert flight.do("check_balance", "1111", lambda: "new") == "new"
+
+    stale.released.set()
+    threads[0].join()
+    assert results == ["old"]
+    assert flight.stats()["check_balance"]["coalesced"] == 0
@@ -0,0 +1,102 @@
+import pytest
+
+from app_server import sync_window
+from app_server.sync_window import SyncWindow
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sync_window, "time", clock)
+    return clock
+
+
+def feed(window, clock, rate, batches, start_seq=0):
+    """batches batch 1 command, cách nhau 1/rate giây"""
+    seq = start_seq
+    for _ in range(batches):
+        clock.now += 1 / rate
+        seq += 1
+        window.on_append(seq, 1)
+    return seq
+
+
+def test_no_delay_before_first_sync(clock):
+    window = SyncWindow()
+    feed(window, clock, rate=10_000, batches=10)
+
+    assert window.delay() == 0.0
+
+
+def test_no_delay_when_nothing_arrives_within_rtt(clock):
+    window = SyncWindow(smoothing=1.0)
+    seq = feed(window, clock, rate=10, batches=5)
+    window.on_synced(seq, 5, rtt=0.01)
+
+    # 10 command/s * 10ms < 1 command: chờ cũng không gom được gì
+    assert window.delay() == 0.0
+
+
+def test_delay_is_one_rtt_under_load(clock):
+    window = SyncWindow(max_delay=0.05, smoothing=1.0)
+    seq = feed(window, clock, rate=1000, batches=5)
+    window.on_synced(seq, 5, rtt=0.01)
+
+    assert window.delay() == pytest.approx(0.01)
+
+
+def test_delay_capped_by_max_delay(clock):
+    window = SyncWindow(max_delay=0.05, smoothing=1.0)
+    seq = feed(window, clock, rate=1000, batches=5)
+    window.on_synced(seq, 5, rtt=0.2)
+
+    assert window.delay() == pytest.approx(0.05)
+
+
+def test_rate_and_rtt_are_smoothed(clock):
+    window = SyncWindow(smoothing=0.5)
+    seq = feed(window, clock, rate=100, batches=2)
+    window.on_synced(seq, 2, rtt=0.1)
+    window.on_synced(seq, 0, rtt=0.3)
+
+    stats = window.stats(pending=0)
+    # Lần append đầu chưa có mẫu: 0 -> 50 (rate 100, smoothing 0.5)
+    assert stats["rate"] == pytest.approx(50.0)
+    assert stats["rtt_ms"] == pytest.approx(200.0)
+
+
+def test_is_full():
+    window = SyncWindow(max_commands=10, max_bytes=100)
+
+    assert not window.is_full(9, 99)
+    assert window.is_full(10, 0)
+    assert window.is_full(0, 100)
+
+
+def test_lag_tracks_oldest_unacked_batch(clock):
+    window = SyncWindow()
+    window.on_append(5, 5)
+    clock.now += 0.1
+    window.on_append(8, 3)
+    clock.now += 0.1
+
+    assert window.stats(pending=8)["lag_ms"] == pytest.approx(200.0)
+
+    window.on_synced(5, 5, rtt=0.01)
+    stats = window.stats(pending=3)
+    assert stats["lag_ms"] == pytest.approx(100.0)
+    assert stats["lag_commands"] == 3
+
+    window.on_synced(8, 3, rtt=0.01)
+    stats = window.stats(pending=0)
+    assert stats["lag_ms"] == 0.0
+    assert stats["syncs"] == 2
+    assert stats["commands_per_sync"] == pytest.approx(4.0)
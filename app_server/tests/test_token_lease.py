@@ -0,0 +1,93 @@
+import pytest
+
+from app_server import token_lease
+from app_server.token_lease import TokenLease
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(token_lease, "time", clock)
+    return clock
+
+
+def load(queue_depth=0, arrival_rate=0.0):
+    return {"queue_depth": queue_depth, "arrival_rate": arrival_rate}
+
+
+def test_quantum_without_load_is_midpoint(clock):
+    lease = TokenLease(min_quantum=0.02, max_hold=0.2)
+
+    assert lease.quantum(0, peer_id=2) == pytest.approx(0.11)
+
+
+def test_quantum_bounds(clock):
+    lease = TokenLease(min_quantum=0.02, max_hold=0.2)
+
+    # Chỉ server này có việc: giữ tối đa
+    assert lease.quantum(10, peer_id=2) == pytest.approx(0.2)
+
+    # Chỉ server đòi có việc: trao sau min_quantum
+    lease.set_peer_load(2, load(queue_depth=10))
+    assert lease.quantum(0, peer_id=2) == pytest.approx(0.02)
+
+
+def test_quantum_split_by_load_share(clock):
+    lease = TokenLease(min_quantum=0.02, max_hold=0.2)
+    lease.set_peer_load(2, load(queue_depth=3))
+    lease.set_peer_load(3, load(arrival_rate=50.0))
+
+    # Tải server này 1 / 0.02 = 50 command/s
+    assert lease.quantum(1, peer_id=2) == pytest.approx(0.02 + 0.18 * 50 / 200)
+    assert lease.quantum(1, peer_id=3) == pytest.approx(0.11)
+
+
+def test_peer_load_removed(clock):
+    lease = TokenLease(min_quantum=0.02, max_hold=0.2)
+    lease.set_peer_load(2, load(queue_depth=10))
+    lease.set_peer_load(2, None)
+
+    assert lease.quantum(10, peer_id=2) == pytest.approx(0.2)
+    assert lease.stats(0)["peer_loads"] == {}
+
+
+def test_max_hold_not_below_min_quantum(clock):
+    lease = TokenLease(min_quantum=0.05, max_hold=0.01)
+
+    assert lease.quantum(0, peer_id=2) == pytest.approx(0.05)
+    assert lease.quantum(10, peer_id=2) == pytest.approx(0.05)
+
+
+def test_arrival_rate_measured_per_interval(clock):
+    lease = TokenLease(min_quantum=0.25, smoothing=0.5)
+
+    # Các command trong cùng khoảng chưa tạo mẫu
+    for _ in range(9):
+        lease.on_arrival()
+    assert lease.local_load(0)["arrival_rate"] == 0.0
+
+    clock.now += 0.25
+    lease.on_arrival()
+    # 10 command / 0.25s = 40/s, EWMA 0 -> 20
+    assert lease.local_load(4) == {"queue_depth": 4, "arrival_rate": 20.0}
+
+    clock.now += 0.5
+    lease.on_arrival()
+    # 1 command / 0.5s = 2/s
+    assert lease.local_load(0)["arrival_rate"] == 11.0
+
+
+def test_stats_quantum_per_peer(clock):
+    lease = TokenLease(min_quantum=0.02, max_hold=0.2)
+    lease.set_peer_load(2, load(queue_depth=1))
+
+    stats = lease.stats(1)
+    assert stats["quantum_ms"] == {2: pytest.approx(110.0)}
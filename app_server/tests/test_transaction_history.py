@@ -0,0 +1,65 @@
+import pytest
+
+from app_server.database import main
+from app_server.database.main import DatabaseReader
+
+NOW = 1_700_000_000
+WINDOW = DatabaseReader.RECENT_HISTORY_WINDOW
+
+
+class FakeDatabase:
+    coalesced_reads = set()
+
+
+class FakeReader(DatabaseReader):
+    """Ghi lại các lần gọi procedure, trả về rows theo since (None = toàn bộ bảng)"""
+
+    def __init__(self, recent_rows, all_rows):
+        super().__init__(FakeDatabase())
+        self.rows = {"recent": recent_rows, "all": all_rows}
+        self.calls = []
+
+    def _call_procedure(self, proc_name, params, dictionary):
+        self.calls.append((proc_name, params))
+        if proc_name == "get_transaction_history":
+            return self.rows["all"]
+        return self.rows["recent" if params[-1] is not None else "all"]
+
+
+def transaction(id):
+    return {"id": id, "timestamp": NOW - id}
+
+
+@pytest.fixture(autouse=True)
+def fixed_now(monkeypatch):
+    monkeypatch.setattr(main, "now", lambda: NOW)
+
+
+def test_first_page_is_read_from_recent_window():
+    rows = [transaction(1), transaction(2)]
+    reader = FakeReader(recent_rows=rows, all_rows=[])
+
+    assert reader.get_transaction_history("1111", limit=2) == rows
+    assert reader.calls == [
+        ("get_transaction_history_page", ["1111", None, None, 2, NOW - WINDOW])
+    ]
+
+
+def test_short_recent_page_falls_back_to_whole_table():
+    rows = [transaction(1), transaction(2), transaction(3)]
+    reader = FakeReader(recent_rows=rows[:1], all_rows=rows)
+
+    assert reader.get_transaction_history("1111", before=(NOW, 9), limit=3) == rows
+    # Cửa sổ tính từ cursor của trang, lần đọc lại không giới hạn thời gian
+    assert reader.calls == [
+        ("get_transaction_history_page", ["1111", NOW, 9, 3, NOW - WINDOW]),
+        ("get_transaction_history_page", ["1111", NOW, 9, 3, None]),
+    ]
+
+
+def test_no_limit_reads_whole_history():
+    rows = [transaction(1)]
+    reader = FakeReader(recent_rows=[], all_rows=rows)
+
+    assert reader.get_transaction_history("1111") == rows
+    assert reader.calls == [("get_transaction_history", ["1111"])]
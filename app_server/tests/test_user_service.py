@@ -0,0 +1,33 @@
+from app_server.services.user_service import UserServiceImpl
+
+
+class FakeReader:
+    def __init__(self):
+        self.calls = []
+
+    def get_transaction_history(self, card_number, before=None, limit=None):
+        self.calls.append((card_number, before, limit))
+        return []
+
+
+def make_service(reader):
+    user = {"card_number": "1111", "name": "A"}
+    return UserServiceImpl("s1", user, None, None, reader)
+
+
+def test_history_is_paginated_by_default():
+    reader = FakeReader()
+
+    make_service(reader).get_transaction_history()
+
+    assert reader.calls == [("1111", None, UserServiceImpl.HISTORY_PAGE_SIZE)]
+
+
+def test_history_page_after_cursor_with_capped_limit():
+    reader = FakeReader()
+
+    make_service(reader).get_transaction_history([1700000000, 42], 10_000)
+
+    assert reader.calls == [
+        ("1111", (1700000000, 42), UserServiceImpl.HISTORY_PAGE_MAX)
+    ]
@@ -0,0 +1,268 @@
+from contextlib import contextmanager
+
+import mysql.connector
+import pytest
+
+from app_server.command_dedupe import CommandDedupe
+from app_server.command_executor import CommandExecutor
+from app_server.command_journal import CommandJournal
+from app_server.database.exceptions import DuplicateCommandError, SQLException
+from app_server.database.main import DatabaseWriter
+
+BUSINESS_ERROR = mysql.connector.DatabaseError(
+    msg="Số dư không đủ", errno=1644, sqlstate="45000"
+)
+DEADLOCK = mysql.connector.DatabaseError(
+    msg="Deadlock found", errno=1213, sqlstate="40001"
+)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.log.append(sql)
+
+    def callproc(self, proc_name, params):
+        self.conn.log.append(proc_name)
+        error = self.conn.errors.pop(proc_name, None)
+        if error is not None:
+            raise error
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.log = []
+        # procedure -> lỗi raise ở lần gọi tiếp theo
+        self.errors = {}
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def start_transaction(self):
+        self.log.append("START TRANSACTION")
+
+    def commit(self):
+        self.log.append("COMMIT")
+
+    def rollback(self):
+        self.log.append("ROLLBACK")
+
+
+class FakeReader:
+    def __init__(self):
+        self.forgotten = []
+
+    def forget_cards(self, card_numbers):
+        self.forgotten.extend(card_numbers)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.conn = FakeConnection()
+        self._reader = FakeReader()
+
+    @contextmanager
+    def write_connection(self):
+        yield self.conn
+
+    def reader(self):
+        return self._reader
+
+
+class FakeAppliedCommands:
+    """applied_commands của server 1 đã đi xa hơn cửa sổ chống trùng"""
+
+    def get_applied_commands(self, window):
+        return [(1, 10 * window)]
+
+
+class Callback:
+    def __init__(self):
+        self.outcomes = []
+
+    def notify(self, message, type):
+        self.outcomes.append((message, type))
+
+
+@pytest.fixture
+def database():
+    return FakeDatabase()
+
+
+def test_batch_commits_once_with_savepoint_per_command(database):
+    writer = DatabaseWriter(database)
+
+    with writer.batch() as batch:
+        batch.deposit_money("1111", 100, 1)
+        batch.transfer_money("1111", "2222", 50, 2)
+
+    assert database.conn.log == [
+        "START TRANSACTION",
+        "SAVEPOINT batch_command",
+        "deposit_money_in_tx",
+        "SAVEPOINT batch_command",
+        "transfer_money_in_tx",
+        "COMMIT",
+    ]
+    assert sorted(database.reader().forgotten) == ["1111", "2222"]
+
+
+def test_business_error_rolls_back_to_savepoint_only(database):
+    writer = DatabaseWriter(database)
+    database.conn.errors["withdraw_money_in_tx"] = BUSINESS_ERROR
+
+    with writer.batch() as batch:
+        batch.deposit_money("1111", 100, 1)
+        with pytest.raises(SQLException) as raised:
+            batch.withdraw_money("1111", 500, 2)
+        batch.deposit_money("1111", 10, 3)
+
+    assert raised.value.is_business_error()
+    assert raised.value.errno == 1644
+    log = database.conn.log
+    assert "ROLLBACK TO SAVEPOINT batch_command" in log
+    assert "ROLLBACK" not in log
+    assert log[-1] == "COMMIT"
+
+
+def test_other_error_rolls_back_whole_batch_with_errno(database):
+    writer = DatabaseWriter(database)
+    database.conn.errors["deposit_money_in_tx"] = DEADLOCK
+
+    with pytest.raises(SQLException) as raised:
+        with writer.batch() as batch:
+            batch.deposit_money("1111", 100, 1)
+
+    assert raised.value.is_transient()
+    assert database.conn.log[-1] == "ROLLBACK"
+    assert "COMMIT" not in database.conn.log
+    assert database.reader().forgotten == []
+
+
+def test_apply_once_duplicate_skips_block(database):
+    writer = DatabaseWriter(database)
+    database.conn.errors["record_applied_command"] = mysql.connector.IntegrityError(
+        msg="Duplicate entry", errno=1062, sqlstate="23000"
+    )
+    ran = []
+
+    with writer.batch() as batch:
+        with pytest.raises(DuplicateCommandError):
+            with batch.apply_once(1, 7):
+                ran.append(True)
+
+    assert ran == []
+    assert "ROLLBACK TO SAVEPOINT apply_once" in database.conn.log
+    assert database.conn.log[-1] == "COMMIT"
+
+
+def test_apply_once_business_error_drops_record(database):
+    writer = DatabaseWriter(database)
+    database.conn.errors["withdraw_money_in_tx"] = BUSINESS_ERROR
+
+    with writer.batch() as batch:
+        with pytest.raises(SQLException):
+            with batch.apply_once(1, 7):
+                batch.withdraw_money("1111", 500, 2)
+
+    # Bản ghi applied_commands cũng bị rollback: lần thử lại vẫn chạy được
+    assert database.conn.log[-2:] == ["ROLLBACK TO SAVEPOINT apply_once", "COMMIT"]
+
+
+def test_single_procedure_keeps_errno(database):
+    writer = DatabaseWriter(database)
+    database.conn.errors["deposit_money"] = DEADLOCK
+
+    with pytest.raises(SQLException) as raised:
+        writer.deposit_money("1111", 100, 1)
+
+    assert raised.value.errno == 1213
+    assert raised.value.is_transient()
+    assert database.conn.log[-1] == "ROLLBACK"
+
+
+def test_unexpected_error_notifies_atm(database):
+    class BrokenWriter:
+        def deposit_money(self, card_number, amount, transaction_time):
+            raise RuntimeError("boom")
+
+    executor = CommandExecutor(command_queue=None, database_writer=BrokenWriter())
+    callback = Callback()
+    command = {
+        "command_type": "deposit",
+        "card_number": "1111",
+        "amount": 100,
+        "timestamp": 1,
+        "peer_id": 1,
+        "success_callback": callback,
+    }
+
+    assert executor.exec_direct([command]) == []
+    assert callback.outcomes == [CommandExecutor.INTERNAL_ERROR]
+
+
+def stale_deposit():
+    return {
+        "command_type": "deposit",
+        "card_number": "1111",
+        "amount": 100,
+        "timestamp": 1,
+        "peer_id": 1,
+        "command_id": "1-5",
+    }
+
+
+def make_executor(database):
+    applied = FakeAppliedCommands()
+    return CommandExecutor(
+        command_queue=None,
+        database_writer=DatabaseWriter(database),
+        dedupe=CommandDedupe(applied, applied, window=1),
+    )
+
+
+def test_stale_replicated_command_is_treated_as_applied(database):
+    executor = make_executor(database)
+    committed = []
+
+    assert executor.exec_in_transaction([stale_deposit()], committed.append)
+
+    # Không chạy lại command, replication_state vẫn được ghi cùng transaction
+    assert "deposit_money_in_tx" not in database.conn.log
+    assert len(committed) == 1
+    assert database.conn.log[-1] == "COMMIT"
+    assert executor.dedupe.stats()["stale"] == 1
+
+
+def test_stale_command_from_queue_is_rejected(database):
+    executor = make_executor(database)
+
+    assert executor.exec_direct([stale_deposit()]) == []
+    assert "deposit_money_in_tx" not in database.conn.log
+
+
+def test_replayed_journal_command_is_not_applied_twice(tmp_path, database):
+    class AppliedCommands:
+        def get_applied_commands(self, window):
+            return [(1, 5)]
+
+    path = str(tmp_path / "journal.log")
+    # Đã thực thi (command_id trong applied_commands) nhưng checkpoint chưa fsync
+    CommandJournal(path).append(stale_deposit())
+    (replayed,) = CommandJournal(path).pending_commands()
+
+    applied = AppliedCommands()
+    executor = CommandExecutor(
+        command_queue=None,
+        database_writer=DatabaseWriter(database),
+        dedupe=CommandDedupe(applied, applied, window=1),
+    )
+
+    assert executor.exec_direct([replayed]) == [replayed]
+    assert "deposit_money_in_tx" not in database.conn.log
+    assert executor.dedupe.stats()["duplicates"] == 1
@@ -6,24 +6,45 @@ Module này cung cấp registry để bind/lookup remote services:
 - RemoteRegistry: Client-side proxy để lookup services
 - LocateRegistry: Factory để tạo/lấy registry
 - RPCStub: Client-side stub để gọi remote methods
+- RMIServer: XML-RPC server nhận thêm mux connection trên cùng port
 """
 
+import copy
 import inspect
+import secrets
 import threading
 import socket
-from typing import TypeVar, Type, cast, get_type_hints, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import TypeVar, Type, cast, get_type_hints, Optional, Union
 
 from xmlrpc.server import SimpleXMLRPCServer
-from xmlrpc.client import ServerProxy
-
-from ..helpers.constants import METHOD_SPLITOR, SERVICE_NAME_SPLITOR, DEFAULT_RMI_PORT
+from xmlrpc.client import ServerProxy, Fault
+
+from ..helpers.constants import (
+    METHOD_SPLITOR,
+    SERVICE_NAME_SPLITOR,
+    DEFAULT_RMI_PORT,
+    MUX_MAX_WORKERS,
+    LOCAL_CALL_ENABLED,
+    LOCAL_CALL_VALIDATE_HASH,
+    LOCAL_CALL_COPY,
+    LOOPBACK_HOSTS,
+    HANDLE_PREFIX,
+    HANDLE_EPOCH_SPLITOR,
+    STALE_HANDLE_MARKER,
+    COMPACT_HANDLES,
+)
 from ..helpers.types import valid_inet4_address, RemoteReference
-from ..helpers.utils import get_interface_hash
+from ..helpers.utils import get_interface_hash, get_interface_methods
 
 from .remote import RemoteObject, Remote
+from .transport import MuxServerProxy, is_mux_connection, serve_mux_connection
 
 T = TypeVar("T")
 
+Proxy = Union[ServerProxy, MuxServerProxy]
+
 
 def get_local_inet_address() -> str:
     """
@@ -48,6 +69,68 @@ def get_local_inet_address() -> str:
         s.close()
 
 
+def make_proxy(host: str, port: int, multiplexed: bool = False) -> Proxy:
+    """
+    Tạo proxy tới registry tại host:port.
+
+    Args:
+        host: Server IP
+        port: Server port
+        multiplexed: True -> dùng mux connection dùng chung (thread-safe,
+                     nhiều call đồng thời trên một socket), False -> ServerProxy
+
+    Returns:
+        Proxy: MuxServerProxy hoặc ServerProxy
+    """
+    if multiplexed:
+        return MuxServerProxy(host, port)
+
+    return ServerProxy(f"http://{host}:{port}/", allow_none=True)
+
+
+class RMIServer(SimpleXMLRPCServer):
+    """
+    SimpleXMLRPCServer nhận thêm mux connection trên cùng port.
+
+    Mỗi connection được nhận diện (đọc preamble) trên thread riêng, accept
+    thread không bị chặn bởi client kết nối mà chưa gửi gì.
+    HTTP request vẫn được xử lý lần lượt từng request như SimpleXMLRPCServer.
+    Mux connection được tách sang thread riêng và các request trên đó
+    được dispatch song song qua thread pool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._mux_executor = ThreadPoolExecutor(
+            max_workers=MUX_MAX_WORKERS, thread_name_prefix="rmi-mux"
+        )
+        self._http_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        threading.Thread(
+            target=self._serve_connection,
+            args=(request, client_address),
+            daemon=True,
+        ).start()
+
+    def _serve_connection(self, request, client_address):
+        if is_mux_connection(request):
+            serve_mux_connection(request, self._dispatch, self._mux_executor)
+            return
+
+        with self._http_lock:
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._mux_executor.shutdown(wait=False)
+
+
 class ServiceWrapper:
     """
     Wrapper để validate interface hash trước khi gọi method.
@@ -65,6 +148,37 @@ class ServiceWrapper:
         self.service = service
         self._expected_hash = service.signature_hash
 
+        # Service không khai báo concurrent_dispatch chỉ chạy 1 call 1 lúc
+        # (mux connection dispatch song song). RLock: callback gọi ngược vào
+        # chính service trong cùng thread (local call) không bị deadlock
+        self._dispatch_lock = (
+            nullcontext()
+            if getattr(service, "concurrent_dispatch", False)
+            else threading.RLock()
+        )
+
+        # Method ID (dùng cho compact handle) = vị trí trong danh sách đã sắp xếp
+        self.method_names = (
+            get_interface_methods(service.remote_interface)
+            if service.remote_interface
+            else []
+        )
+
+    def assert_hash(self, client_hash: str):
+        """
+        Validate interface hash của client.
+
+        Raises:
+            ValueError: Nếu interface hash không khớp
+        """
+        if client_hash != self._expected_hash:
+            raise ValueError(
+                f"Interface mismatch giữa client và server!\n"
+                f"Server interface hash: {self._expected_hash}\n"
+                f"Client interface hash: {client_hash}\n"
+                f"Cần đảm bảo cả 2 peer dùng cùng phiên bản interface."
+            )
+
     def __getattr__(self, name: str):
         """
         Intercept method calls để validate hash và deserialize arguments.
@@ -110,19 +224,14 @@ class ServiceWrapper:
                 ValueError: Nếu interface hash không khớp
             """
             # Validate interface hash
-            if client_hash != self._expected_hash:
-                raise ValueError(
-                    f"Interface mismatch giữa client và server!\n"
-                    f"Server interface hash: {self._expected_hash}\n"
-                    f"Client interface hash: {client_hash}\n"
-                    f"Cần đảm bảo cả 2 peer dùng cùng phiên bản interface."
-                )
+            self.assert_hash(client_hash)
 
             # Deserialize arguments (remote refs -> stubs)
             deserialized_args = self._deserialize_arguments(method, args)
 
             # Gọi method gốc
-            result = method(*deserialized_args, **kwargs)
+            with self._dispatch_lock:
+                result = method(*deserialized_args, **kwargs)
 
             # Note: Nếu result là RemoteObject, LocalRegistry.__getattr__
             # sẽ tự động serialize thành remote_ref trước khi trả về client
@@ -173,13 +282,11 @@ class ServiceWrapper:
                 ):
                     # Tạo stub để gọi về client
                     stub = RPCStub(
-                        proxy=ServerProxy(
-                            f"http://{arg_value['host']}:{arg_value['port']}/",
-                            allow_none=True,
-                        ),
+                        proxy=make_proxy(arg_value["host"], arg_value["port"]),
                         interface=expected_type,
                         interface_hash=arg_value["signature_hash"],
                         service_name=arg_value["service_name"],
+                        address=(arg_value["host"], arg_value["port"]),
                     )
                     deserialized.append(stub)
                 else:
@@ -216,9 +323,24 @@ class LocalRegistry:
         self.lock = threading.RLock()
 
         self._services: dict[str, ServiceWrapper] = {}
-        self._server: Optional[SimpleXMLRPCServer] = None
+        self._server: Optional[RMIServer] = None
         self._is_running = False
 
+        # Local-call short-circuit: stub trỏ về chính registry này
+        # thì gọi thẳng service, bỏ qua serialize + HTTP loopback
+        self.local_call_enabled = LOCAL_CALL_ENABLED
+        self.local_call_validate_hash = LOCAL_CALL_VALIDATE_HASH
+        self.local_call_copy = LOCAL_CALL_COPY
+
+        # Compact handle: token thay cho serviceName + interface hash.
+        # Handle là token ngẫu nhiên không đoán được (như session_id trong tên
+        # service): biết handle mới gọi được service, không dò được handle của
+        # client khác. Epoch ngẫu nhiên mỗi lần tạo registry để handle cũ (trước
+        # khi restart) được báo StaleHandle
+        self._handle_epoch = secrets.token_hex(4)
+        self._handles: dict[str, ServiceWrapper] = {}
+        self._handle_of: dict[str, str] = {}
+
     @staticmethod
     def _assert_valid_remote_object(remote_object: RemoteObject):
         """
@@ -271,6 +393,7 @@ class LocalRegistry:
                 )
 
             # Wrap service với validation layer
+            self._drop_handle(name)
             self._services[name] = ServiceWrapper(remote_object)
             remote_object.exported_name = name
             print(f"[Registry-{self.host}:{self.port}] Bound service: [{name}]")
@@ -311,6 +434,7 @@ class LocalRegistry:
                     f"[Registry-{self.host}:{self.port}] Binding new service: [{name}]"
                 )
 
+            self._drop_handle(name)
             self._services[name] = ServiceWrapper(remote_object)
             remote_object.exported_name = name
 
@@ -332,6 +456,7 @@ class LocalRegistry:
 
             self._services[name].service.exported_name = None
             del self._services[name]
+            self._drop_handle(name)
 
             print(f"[Registry-{self.host}:{self.port}] Unbound service: [{name}]")
 
@@ -345,6 +470,105 @@ class LocalRegistry:
         with self.lock:
             return list(self._services.keys())
 
+    def open_handle(self, service_name: str, client_hash: str) -> list:
+        """
+        Cấp compact handle cho service (client gọi qua RPC ở call đầu tiên).
+
+        Interface hash chỉ được validate một lần ở đây, các call sau qua
+        handle chỉ gửi handle + method ID.
+
+        Args:
+            service_name: Tên service trong registry
+            client_hash: Interface hash phía client
+
+        Returns:
+            list: [epoch, handle]
+
+        Raises:
+            AttributeError: Nếu service không tồn tại
+            ValueError: Nếu interface hash không khớp
+        """
+        with self.lock:
+            if service_name not in self._services:
+                raise AttributeError(
+                    f"Service [{service_name}] không tồn tại trong registry"
+                )
+
+            service_wrapper = self._services[service_name]
+            service_wrapper.assert_hash(client_hash)
+
+            handle = self._handle_of.get(service_name)
+            if handle is None:
+                handle = secrets.token_hex(16)
+                self._handles[handle] = service_wrapper
+                self._handle_of[service_name] = handle
+
+            return [self._handle_epoch, handle]
+
+    def _drop_handle(self, name: str):
+        """Hủy handle của service (khi unbind/rebind). Gọi trong self.lock."""
+        handle = self._handle_of.pop(name, None)
+        if handle is not None:
+            del self._handles[handle]
+
+    def is_local_address(self, host: str, port: int) -> bool:
+        """
+        Check xem (host, port) có trỏ về chính registry này không.
+
+        Returns:
+            bool: True nếu registry đang chạy và địa chỉ trùng khớp
+        """
+        return (
+            self.local_call_enabled
+            and self._is_running
+            and port == self.port
+            and (host == self.host or host in LOOPBACK_HOSTS)
+        )
+
+    def invoke_local(
+        self, service_name: str, method_name: str, client_hash: str, args: tuple
+    ):
+        """
+        Gọi trực tiếp service đã bind trong process hiện tại.
+
+        Đi qua cùng đường dispatch với XML-RPC (validate hash, deserialize
+        remote ref, auto-export RemoteObject trả về) nhưng không serialize.
+        Lỗi được bọc thành Fault giống remote call để caller xử lý như cũ.
+
+        Args:
+            service_name: Tên service trong registry
+            method_name: Tên method
+            client_hash: Interface hash phía stub
+            args: Arguments gốc (RemoteObject được truyền nguyên object)
+
+        Returns:
+            Kết quả của method (remote ref nếu là RemoteObject)
+
+        Raises:
+            Fault: Nếu service/method không tồn tại hoặc method raise lỗi
+        """
+        if not self.local_call_validate_hash:
+            with self.lock:
+                wrapper = self._services.get(service_name)
+            if wrapper is not None:
+                client_hash = wrapper._expected_hash
+
+        if self.local_call_copy:
+            # Giả lập copy semantics của XML-RPC (không chia sẻ object mutable)
+            args = tuple(
+                arg if isinstance(arg, RemoteObject) else copy.deepcopy(arg)
+                for arg in args
+            )
+
+        try:
+            rpc_method = getattr(self, f"{service_name}{METHOD_SPLITOR}{method_name}")
+            result = rpc_method(client_hash, *args)
+        except Exception as e:
+            # Cùng format với SimpleXMLRPCDispatcher._marshaled_dispatch
+            raise Fault(1, f"{type(e)}:{e}")
+
+        return copy.deepcopy(result) if self.local_call_copy else result
+
     def listen(self, background: bool = False):
         """
         Start RPC server.
@@ -363,7 +587,7 @@ class LocalRegistry:
 
         # Tạo XML-RPC server
         if self._server is None:
-            self._server = SimpleXMLRPCServer(
+            self._server = RMIServer(
                 addr=(str(self.host), self.port),
                 allow_none=True,
                 logRequests=False,
@@ -393,17 +617,21 @@ class LocalRegistry:
         """
         Route XML-RPC calls đến đúng service.
 
-        Format: serviceName@methodName
+        Format: serviceName@methodName hoặc $epoch.handle@methodId
 
         Args:
-            name: RPC method name (serviceName@methodName)
+            name: RPC method name
 
         Returns:
             Callable: Method wrapper để XML-RPC gọi
 
         Raises:
             AttributeError: Nếu format sai hoặc service/method không tồn tại
+            LookupError: Nếu handle không còn hợp lệ (StaleHandle)
         """
+        if name.startswith(HANDLE_PREFIX):
+            return self._resolve_handle(name)
+
         # Validate format
         if METHOD_SPLITOR not in name:
             raise AttributeError(
@@ -429,6 +657,48 @@ class LocalRegistry:
                 f"Method [{method_name}] không tồn tại trong service [{service_name}]"
             )
 
+        return self._make_rpc_method(service_wrapper, method_name)
+
+    def _resolve_handle(self, name: str):
+        """
+        Route call dạng $epoch.handle@methodId.
+
+        Hash đã validate lúc open_handle nên call không cần gửi lại hash.
+        """
+        try:
+            target, method_id = name[len(HANDLE_PREFIX) :].split(METHOD_SPLITOR, 1)
+            epoch, handle = target.split(HANDLE_EPOCH_SPLITOR, 1)
+            method_index = int(method_id)
+        except ValueError:
+            raise AttributeError(f"Invalid handle call format: [{name}]")
+
+        with self.lock:
+            service_wrapper = (
+                self._handles.get(handle)
+                if epoch == self._handle_epoch
+                else None
+            )
+
+        if service_wrapper is None:
+            raise LookupError(
+                f"{STALE_HANDLE_MARKER}: Handle [{target}] không còn hợp lệ"
+            )
+
+        if not 0 <= method_index < len(service_wrapper.method_names):
+            raise AttributeError(f"Method ID [{method_index}] không tồn tại")
+
+        rpc_method = self._make_rpc_method(
+            service_wrapper, service_wrapper.method_names[method_index]
+        )
+        expected_hash = service_wrapper._expected_hash
+
+        def handle_method(*args):
+            return rpc_method(expected_hash, *args)
+
+        return handle_method
+
+    def _make_rpc_method(self, service_wrapper: ServiceWrapper, method_name: str):
+        """Tạo wrapper cuối cùng cho XML-RPC call tới method của service."""
         # Lấy validated method
         method = getattr(service_wrapper, method_name)
 
@@ -505,13 +775,19 @@ class LocateRegistry:
         return LocateRegistry._current_local_registry
 
     @staticmethod
-    def get_registry(address: Optional[str] = None, port: Optional[int] = None):
+    def get_registry(
+        address: Optional[str] = None,
+        port: Optional[int] = None,
+        multiplexed: bool = False,
+    ):
         """
         Lấy remote registry (client-side proxy).
 
         Args:
             address: Server IP (None = local IP)
             port: Server port (None = DEFAULT_RMI_PORT)
+            multiplexed: True -> các stub lookup từ registry này dùng chung
+                         một mux connection, an toàn khi gọi từ nhiều thread
 
         Returns:
             RemoteRegistry: Client-side registry proxy
@@ -524,8 +800,8 @@ class LocateRegistry:
 
         assert valid_inet4_address(host), f"Invalid IPv4 address: {host}"
 
-        proxy = ServerProxy(f"http://{host}:{port}/", allow_none=True)
-        return RemoteRegistry(proxy)
+        proxy = make_proxy(host, port, multiplexed)
+        return RemoteRegistry(proxy, multiplexed, address=(host, port))
 
     @staticmethod
     def get_local_registry() -> Optional[LocalRegistry]:
@@ -543,12 +819,21 @@ class RemoteRegistry:
     Client-side registry để lookup remote services.
     """
 
-    def __init__(self, proxy: ServerProxy):
+    def __init__(
+        self,
+        proxy: Proxy,
+        multiplexed: bool = False,
+        address: Optional[tuple[str, int]] = None,
+    ):
         """
         Args:
-            proxy: XML-RPC ServerProxy tới remote registry
+            proxy: ServerProxy/MuxServerProxy tới remote registry
+            multiplexed: Proxy có phải mux proxy không
+            address: (host, port) của registry, dùng cho local-call short-circuit
         """
         self.__proxy = proxy
+        self.__multiplexed = multiplexed
+        self.__address = address
 
     def lookup(self, service_name: str, interface: Type[T]) -> T:
         """
@@ -562,7 +847,15 @@ class RemoteRegistry:
             T: Stub object (type cast về interface type)
         """
         interface_hash = get_interface_hash(interface)
-        stub_obj = RPCStub(self.__proxy, interface, interface_hash, service_name)
+        stub_obj = RPCStub(
+            self.__proxy,
+            interface,
+            interface_hash,
+            service_name,
+            multiplexed=self.__multiplexed,
+            address=self.__address,
+            compact_handle=COMPACT_HANDLES,
+        )
 
         return cast(T, stub_obj)
 
@@ -574,22 +867,39 @@ class RPCStub:
 
     def __init__(
         self,
-        proxy: ServerProxy,
+        proxy: Proxy,
         interface: Type,
         interface_hash: str,
         service_name: str,
+        multiplexed: bool = False,
+        address: Optional[tuple[str, int]] = None,
+        compact_handle: bool = False,
     ):
         """
         Args:
-            proxy: XML-RPC ServerProxy
+            proxy: ServerProxy/MuxServerProxy
             interface: Interface class
             interface_hash: Interface signature hash
             service_name: Service name trong registry
+            multiplexed: Stub trả về từ remote call có dùng mux proxy không
+            address: (host, port) của registry đích, None = luôn gọi remote
+            compact_handle: Xin handle ở call đầu tiên, các call sau chỉ gửi
+                            handle + method ID (hợp với stub được gọi nhiều lần)
         """
         self.__proxy = proxy
         self.__interface = interface
         self.__interface_hash = interface_hash
         self.__service_name = service_name
+        self.__multiplexed = multiplexed
+        self.__address = address
+
+        self.__compact_handle = compact_handle
+        self.__handle_prefix: Optional[str] = None
+        self.__handle_lock = threading.Lock()
+        self.__method_ids = {
+            method_name: method_id
+            for method_id, method_name in enumerate(get_interface_methods(interface))
+        }
 
     def __getattr__(self, name: str):
         """
@@ -642,16 +952,19 @@ class RPCStub:
             except TypeError as e:
                 raise TypeError(f"Lỗi tham số khi gọi method [{name}]: {e}")
 
-            # Serialize arguments (RemoteObject -> remote ref)
-            # AUTO-EXPORT nếu chưa bind
-            serialized_args = self._serialize_arguments(args)
+            local_registry = self._same_process_registry()
 
-            # Gọi XML-RPC với format: serviceName@methodName
-            rpc_method_name = f"{self.__service_name}{METHOD_SPLITOR}{name}"
-            rpc_method = getattr(self.__proxy, rpc_method_name)
+            if local_registry is not None:
+                # Đích là chính process này -> gọi thẳng, không qua mạng
+                result = local_registry.invoke_local(
+                    self.__service_name, name, self.__interface_hash, args
+                )
+            else:
+                # Serialize arguments (RemoteObject -> remote ref)
+                # AUTO-EXPORT nếu chưa bind
+                serialized_args = self._serialize_arguments(args)
 
-            # RPC call với interface hash
-            result = rpc_method(self.__interface_hash, *serialized_args)
+                result = self._remote_invoke(name, serialized_args)
 
             # Deserialize result nếu là remote reference (callback)
             if isinstance(result, dict) and result.get("__remote_ref__"):
@@ -662,18 +975,106 @@ class RPCStub:
                 remote_port = result["port"]
 
                 return RPCStub(
-                    proxy=ServerProxy(
-                        uri=f"http://{remote_host}:{remote_port}/", allow_none=True
-                    ),
+                    proxy=make_proxy(remote_host, remote_port, self.__multiplexed),
                     interface=self.__interface,
                     interface_hash=result["signature_hash"],
                     service_name=result["service_name"],
+                    multiplexed=self.__multiplexed,
+                    address=(remote_host, remote_port),
+                    compact_handle=self.__compact_handle,
                 )
 
             return result
 
         return remote_call
 
+    def _remote_invoke(self, name: str, serialized_args: list):
+        """
+        Gửi call qua proxy, ưu tiên compact handle nếu có.
+
+        Handle hết hạn (server restart / service rebind, epoch đổi) -> xin
+        handle mới rồi gọi lại; không xin được thì gọi bằng format đầy đủ.
+        """
+        method_id = self.__method_ids.get(name)
+
+        for _ in range(2):
+            handle_prefix = self._get_handle_prefix()
+            if handle_prefix is None or method_id is None:
+                break
+
+            rpc_method = getattr(
+                self.__proxy, f"{handle_prefix}{METHOD_SPLITOR}{method_id}"
+            )
+            try:
+                return rpc_method(*serialized_args)
+            except Fault as f:
+                if STALE_HANDLE_MARKER not in str(f.faultString):
+                    raise
+                with self.__handle_lock:
+                    if self.__handle_prefix == handle_prefix:
+                        self.__handle_prefix = None
+
+        # Gọi XML-RPC với format: serviceName@methodName
+        rpc_method_name = f"{self.__service_name}{METHOD_SPLITOR}{name}"
+        rpc_method = getattr(self.__proxy, rpc_method_name)
+
+        # RPC call với interface hash
+        return rpc_method(self.__interface_hash, *serialized_args)
+
+    def _get_handle_prefix(self) -> Optional[str]:
+        """
+        Lấy (hoặc xin mới) compact handle dạng $epoch.handle.
+
+        Returns:
+            Optional[str]: Prefix của handle, None nếu không dùng handle
+        """
+        if not self.__compact_handle:
+            return None
+
+        with self.__handle_lock:
+            if self.__handle_prefix is None:
+                try:
+                    epoch, handle = self.__proxy.open_handle(
+                        self.__service_name, self.__interface_hash
+                    )
+                except Fault as f:
+                    if self._is_method_not_found(f):
+                        # Server không hỗ trợ handle -> luôn dùng format đầy đủ
+                        self.__compact_handle = False
+                    # Lỗi khác (service chưa bind, hash mismatch...): call này
+                    # dùng format đầy đủ (lỗi thật hiện ở call), call sau xin lại
+                    return None
+
+                self.__handle_prefix = (
+                    f"{HANDLE_PREFIX}{epoch}{HANDLE_EPOCH_SPLITOR}{handle}"
+                )
+
+            return self.__handle_prefix
+
+    @staticmethod
+    def _is_method_not_found(fault: Fault) -> bool:
+        """
+        Fault do server không có method open_handle: registry cũ báo sai format
+        tên method, SimpleXMLRPCServer báo 'method "open_handle" is not supported'
+        """
+        return "open_handle" in str(fault.faultString)
+
+    def _same_process_registry(self) -> Optional[LocalRegistry]:
+        """
+        Trả về local registry nếu stub trỏ về chính process hiện tại.
+
+        Returns:
+            Optional[LocalRegistry]: Registry để gọi trực tiếp, None nếu phải gọi remote
+        """
+        if self.__address is None:
+            return None
+
+        reg = LocateRegistry.get_local_registry()
+        if reg is not None and reg.is_local_address(*self.__address):
+            return reg
+
+        return None
+
     def _serialize_arguments(self, args: tuple):
         """
         Serialize arguments, chuyển RemoteObject thành remote reference.
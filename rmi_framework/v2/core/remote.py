@@ -57,6 +57,10 @@ class RemoteObject:
             registry.unbind(my_service.exported_name)
     """
 
+    # True = các method tự đồng bộ, được gọi đồng thời từ nhiều connection
+    # (mux dispatch song song). Mặc định mỗi object chỉ chạy 1 call 1 lúc
+    concurrent_dispatch = False
+
     # Class-level state cho ID generation
     __object_id = 0
     __id_lock = threading.Lock()
@@ -93,6 +97,7 @@ class RemoteObject:
         self.object_id = RemoteObject.__next_object_ID()
 
         # Tìm abstract interface và tính hash
+        self.remote_interface: Optional[type] = None
         self.signature_hash = self._find_and_hash_interface()
 
         # Validate signature hash
@@ -115,6 +120,8 @@ class RemoteObject:
         Duyệt qua method resolution order (MRO) để tìm abstract class
         đầu tiên kế thừa Remote (không phải chính Remote).
 
+        Lưu interface tìm được vào self.remote_interface.
+
         Returns:
             str: Interface hash hoặc empty string nếu không tìm thấy
         """
@@ -130,6 +137,7 @@ class RemoteObject:
 
             # Tìm abstract class kế thừa Remote
             if isabstract(cls) and issubclass(cls, Remote):
+                self.remote_interface = cls
                 return get_interface_hash(cls)
 
         # Không tìm thấy interface hợp lệ
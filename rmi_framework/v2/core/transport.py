@@ -0,0 +1,370 @@
+"""
+Multiplexed Transport
+
+Module này cung cấp transport dạng frame để nhiều RPC call đồng thời
+dùng chung một TCP connection:
+- MuxConnection: Client-side connection, gắn request ID cho mỗi call,
+  response được trả về theo thứ tự hoàn thành (out-of-order)
+- MuxServerProxy: Thay thế ServerProxy (cùng cách gọi proxy.method(*args))
+- is_mux_connection / serve_mux_connection: Server-side, nhận diện và
+  xử lý mux connection trên cùng port với XML-RPC
+
+Payload của mỗi frame vẫn là XML-RPC (dumps/loads) nên kiểu dữ liệu,
+Fault và allow_none giữ nguyên như khi dùng ServerProxy.
+
+Frame format: [length: uint32][request_id: uint64][payload: length bytes]
+"""
+
+import itertools
+import socket
+import struct
+import threading
+from concurrent.futures import Executor
+from typing import Callable, Optional
+from xmlrpc.client import Fault, dumps, loads
+
+from ..helpers.constants import MUX_MAGIC
+
+_HEADER = struct.Struct("!IQ")
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    """
+    Đọc đúng `size` bytes từ socket.
+
+    Raises:
+        ConnectionResetError: Nếu connection bị đóng giữa chừng
+    """
+    chunks = []
+    remaining = size
+
+    while remaining > 0:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            raise ConnectionResetError("Mux connection closed by remote")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def _read_frame(sock: socket.socket) -> tuple[int, bytes]:
+    length, request_id = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return request_id, _recv_exact(sock, length)
+
+
+def _encode_frame(request_id: int, payload: bytes) -> bytes:
+    return _HEADER.pack(len(payload), request_id) + payload
+
+
+class _PendingCall:
+    """Một call đang chờ response."""
+
+    __slots__ = ("done", "payload", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.payload: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+
+
+class MuxConnection:
+    """
+    Client-side connection dùng chung cho nhiều thread.
+
+    - Mỗi call được gắn request ID, gửi đi dưới send lock
+    - Một reader thread nhận response và đánh thức đúng call theo ID
+    - Connection bị đứt -> tất cả call đang chờ nhận ConnectionResetError
+      (OSError), call tiếp theo tự kết nối lại
+    """
+
+    _shared: dict[tuple[str, int], "MuxConnection"] = {}
+    _shared_lock = threading.Lock()
+
+    # Thời gian chờ kết nối TCP mặc định (s): peer không liên lạc được thì
+    # call báo lỗi thay vì treo mãi
+    CONNECT_TIMEOUT = 5.0
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        connect_timeout: float = CONNECT_TIMEOUT,
+    ):
+        """
+        Args:
+            host: Server IP
+            port: Server port
+            timeout: Thời gian chờ response tối đa mỗi call (None = chờ mãi)
+            connect_timeout: Thời gian chờ kết nối tối đa
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+
+        self._sock: Optional[socket.socket] = None
+        self._state_lock = threading.Lock()
+        # Chỉ 1 thread kết nối 1 lúc; kết nối không giữ _state_lock nên
+        # in_flight/_fail_all/reader thread không phải chờ
+        self._connect_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending: dict[int, _PendingCall] = {}
+        self._request_ids = itertools.count(1)
+
+    @staticmethod
+    def shared(host: str, port: int) -> "MuxConnection":
+        """
+        Lấy connection dùng chung tới (host, port), tạo mới nếu chưa có.
+
+        Returns:
+            MuxConnection: Connection được cache theo địa chỉ
+        """
+        key = (host, port)
+
+        with MuxConnection._shared_lock:
+            conn = MuxConnection._shared.get(key)
+            if conn is None:
+                conn = MuxConnection(host, port)
+                MuxConnection._shared[key] = conn
+
+            return conn
+
+    def in_flight(self) -> int:
+        """Số call đang chờ response."""
+        with self._state_lock:
+            return len(self._pending)
+
+    def _ensure_connected(self) -> socket.socket:
+        """
+        Không được gọi trong _state_lock.
+
+        Raises:
+            OSError: Nếu không kết nối được trong connect_timeout
+        """
+        with self._state_lock:
+            if self._sock is not None:
+                return self._sock
+
+        with self._connect_lock:
+            # Thread khác vừa kết nối xong
+            with self._state_lock:
+                if self._sock is not None:
+                    return self._sock
+
+            sock = socket.create_connection(
+                (self.host, self.port), timeout=self.connect_timeout
+            )
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.sendall(MUX_MAGIC)
+                # Reader thread chờ response không giới hạn, timeout tính theo từng call
+                sock.settimeout(None)
+            except OSError:
+                sock.close()
+                raise
+
+            with self._state_lock:
+                self._sock = sock
+
+        threading.Thread(target=self._reader_loop, args=(sock,), daemon=True).start()
+        return sock
+
+    def call(self, method_name: str, params: tuple):
+        """
+        Gọi remote method qua connection dùng chung.
+
+        Args:
+            method_name: Tên RPC method (serviceName@methodName)
+            params: Tuple arguments (đã serialize)
+
+        Returns:
+            Kết quả đã unmarshal
+
+        Raises:
+            Fault: Nếu server trả về lỗi
+            OSError: Nếu không kết nối được hoặc connection bị đứt
+            TimeoutError: Nếu quá timeout mà chưa có response
+        """
+        payload = dumps(tuple(params), method_name, allow_none=True).encode()
+        pending = _PendingCall()
+
+        sock = self._ensure_connected()
+        with self._state_lock:
+            if self._sock is not sock:
+                # Connection vừa bị đứt, call tiếp theo sẽ kết nối lại
+                raise ConnectionResetError(
+                    f"Mux connection tới {self.host}:{self.port} bị đứt"
+                )
+            request_id = next(self._request_ids)
+            self._pending[request_id] = pending
+
+        try:
+            with self._send_lock:
+                sock.sendall(_encode_frame(request_id, payload))
+        except OSError as e:
+            # Reader thread có thể đã đóng socket trước (EBADF): vẫn báo như connection bị đứt
+            self._fail_all(sock, e)
+            raise ConnectionResetError(
+                f"Mux connection tới {self.host}:{self.port} bị đứt: {e}"
+            ) from e
+
+        if not pending.done.wait(self.timeout):
+            with self._state_lock:
+                self._pending.pop(request_id, None)
+            raise TimeoutError(
+                f"Mux call [{method_name}] tới {self.host}:{self.port} quá thời gian chờ"
+            )
+
+        if pending.error is not None:
+            raise pending.error
+
+        # Unmarshal ở thread của caller, loads tự raise Fault nếu có
+        assert pending.payload is not None
+        result, _ = loads(pending.payload, use_builtin_types=False)
+        return result[0]
+
+    def _reader_loop(self, sock: socket.socket):
+        try:
+            while True:
+                request_id, payload = _read_frame(sock)
+
+                with self._state_lock:
+                    pending = self._pending.pop(request_id, None)
+
+                # Call đã timeout thì bỏ qua response
+                if pending is not None:
+                    pending.payload = payload
+                    pending.done.set()
+
+        except OSError as e:
+            self._fail_all(sock, e)
+
+    def _fail_all(self, sock: socket.socket, error: BaseException):
+        """Đóng connection hỏng và báo lỗi cho tất cả call đang chờ."""
+        with self._state_lock:
+            if self._sock is not sock:
+                return
+
+            self._sock = None
+            pending_calls = list(self._pending.values())
+            self._pending.clear()
+
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+        for pending in pending_calls:
+            pending.error = ConnectionResetError(
+                f"Mux connection tới {self.host}:{self.port} bị đứt: {error}"
+            )
+            pending.done.set()
+
+    def close(self):
+        with self._state_lock:
+            sock = self._sock
+
+        if sock is not None:
+            self._fail_all(sock, ConnectionAbortedError("closed"))
+
+
+class MuxServerProxy:
+    """
+    Proxy có cùng cách dùng với xmlrpc.client.ServerProxy
+    (getattr(proxy, name)(*args)) nhưng đi qua MuxConnection dùng chung.
+
+    An toàn khi dùng từ nhiều thread.
+    """
+
+    def __init__(self, host: str, port: int):
+        """
+        Args:
+            host: Server IP
+            port: Server port
+        """
+        self.__connection = MuxConnection.shared(host, port)
+
+    def __getattr__(self, name: str):
+        connection = self.__connection
+
+        def mux_call(*args):
+            return connection.call(name, args)
+
+        return mux_call
+
+
+def is_mux_connection(sock: socket.socket, timeout: float = 5.0) -> bool:
+    """
+    Peek các bytes đầu tiên để phân biệt mux connection với HTTP request.
+
+    Không tiêu thụ dữ liệu, HTTP request vẫn được xử lý bình thường.
+    """
+    previous_timeout = sock.gettimeout()
+    sock.settimeout(timeout)
+
+    try:
+        while True:
+            data = sock.recv(len(MUX_MAGIC), socket.MSG_PEEK)
+
+            if not data or not MUX_MAGIC.startswith(data):
+                return False
+            if len(data) == len(MUX_MAGIC):
+                return True
+
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(previous_timeout)
+
+
+def serve_mux_connection(
+    sock: socket.socket,
+    dispatch: Callable[[str, tuple], object],
+    executor: Executor,
+):
+    """
+    Xử lý một mux connection cho tới khi client đóng.
+
+    Mỗi request được dispatch trên executor nên các call chậm không chặn
+    các call khác trên cùng connection; response ghi lại dưới write lock.
+
+    Args:
+        sock: Socket đã được xác nhận là mux connection
+        dispatch: Hàm dispatch(method, params) (SimpleXMLRPCServer._dispatch)
+        executor: Thread pool thực thi request
+    """
+    write_lock = threading.Lock()
+
+    def handle(request_id: int, payload: bytes):
+        try:
+            params, method = loads(payload, use_builtin_types=False)
+            result = dispatch(method or "", params)
+            response = dumps((result,), methodresponse=True, allow_none=True)
+        except Fault as fault:
+            response = dumps(fault, allow_none=True)
+        except BaseException as e:
+            # Cùng format với SimpleXMLRPCDispatcher._marshaled_dispatch
+            response = dumps(Fault(1, f"{type(e)}:{e}"), allow_none=True)
+
+        try:
+            with write_lock:
+                sock.sendall(_encode_frame(request_id, response.encode()))
+        except OSError:
+            pass
+
+    try:
+        _recv_exact(sock, len(MUX_MAGIC))
+
+        while True:
+            request_id, payload = _read_frame(sock)
+            executor.submit(handle, request_id, payload)
+
+    except OSError:
+        pass
+    finally:
+        try:
+            sock.close()
+        except OSError:
+            pass
@@ -1,3 +1,20 @@
 METHOD_SPLITOR = "@"
 SERVICE_NAME_SPLITOR = "#"
 DEFAULT_RMI_PORT = 1099
+
+# Preamble đầu mỗi mux connection, dùng để phân biệt với HTTP (XML-RPC)
+MUX_MAGIC = b"RMUX"
+MUX_MAX_WORKERS = 32
+
+# Local-call short-circuit (stub trỏ về registry của chính process)
+LOCAL_CALL_ENABLED = True
+LOCAL_CALL_VALIDATE_HASH = True
+LOCAL_CALL_COPY = True
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost")
+
+# Compact handle: serviceName + interface hash được thay bằng handle ngắn
+# Format method name: $<epoch>.<handle>@<method_id>
+HANDLE_PREFIX = "$"
+HANDLE_EPOCH_SPLITOR = "."
+STALE_HANDLE_MARKER = "StaleHandle"
+COMPACT_HANDLES = True
@@ -3,6 +3,21 @@ import hashlib
 from typing import Type
 
 
+def get_interface_methods(interface_class: Type) -> list[str]:
+    """
+    Lấy danh sách tên các phương thức của interface, đã sắp xếp.
+    Vị trí trong danh sách được dùng làm method ID khi gọi qua compact handle
+    (2 phía cùng interface hash thì cùng thứ tự).
+    """
+    methods = [
+        name
+        for name in dir(interface_class)
+        if callable(getattr(interface_class, name)) and not name.startswith("__")
+    ]
+    methods.sort()
+    return methods
+
+
 def get_interface_hash(interface_class: Type) -> str:
     """
     Tính hash của class interface chỉ dựa trên chữ ký của các phương thức.
@@ -14,12 +29,7 @@ def get_interface_hash(interface_class: Type) -> str:
     hasher.update(interface_class.__name__.encode())
 
     # Lấy và sắp xếp tất cả các phương thức callable
-    methods = [
-        name
-        for name in dir(interface_class)
-        if callable(getattr(interface_class, name)) and not name.startswith("__")
-    ]
-    methods.sort()
+    methods = get_interface_methods(interface_class)
 
     # Cập nhật từng tên và chữ ký hàm vào hash
     for method_name in methods:
@@ -1,27 +1,88 @@
 from abc import abstractmethod
-from typing import List
+from typing import List, Optional
 
 from rmi_framework.v2 import Remote
 
 from .client import SuccessCallback
 
-from ..models.server import LoginResult, TransactionData, UserData, ATMCommand
+from ..models.server import (
+    LoginResult,
+    TransactionData,
+    UserData,
+    ATMCommand,
+    ReplicationAck,
+    ReplicationWatermark,
+    TokenLoad,
+    ForwardOutcome,
+)
 
 
 class PeerService(Remote):
     @abstractmethod
-    def request_token(self) -> bool:
-        """Peer gọi hàm này để báo nó cần token"""
+    def request_shards(
+        self, requester_id: int, shards: List[int], load: Optional[TokenLoad] = None
+    ) -> bool:
+        """
+        Server requester_id gọi hàm này để báo nó cần các shard, kèm tải hiện tại.
+        Shard được trao sau (qua replicate của server này), không trong lời gọi này.
+        Shard server này không giữ thì nó xin về từ server đang giữ rồi trao lại.
+        """
         pass
 
     @abstractmethod
-    def receive_sync(self, logs: List[ATMCommand], pass_token: bool) -> bool:
-        """Peer gọi hàm này để đẩy dữ liệu + Trao Token"""
+    def replicate(
+        self,
+        origin_id: int,
+        epoch: str,
+        first_index: int,
+        logs: List[ATMCommand],
+        pass_shards: List[int],
+        watermarks: List[ReplicationWatermark],
+    ) -> ReplicationAck:
+        """
+        Peer gọi hàm này để đẩy log + Trao các shard trong pass_shards (có thể rỗng).
+        logs[i] có log index first_index + i trong epoch của peer gửi.
+        Shard chỉ được nhận khi đã áp dụng hết logs, và chỉ được dùng khi log
+        của các server khác đã áp dụng tới watermarks (vị trí của peer gửi).
+        Command có depends_on chỉ được áp dụng (cùng các command sau nó) khi log
+        của các server đó đã áp dụng tới đó, chưa tới thì chỉ áp dụng phần trước.
+        Trả về index lớn nhất đã được áp dụng, peer gửi tiếp từ index đó.
+        """
         pass
 
     @abstractmethod
-    def get_token_status(self) -> bool:
-        """Trả về trạng thái giữ Token của peer."""
+    def forward_commands(
+        self,
+        origin_id: int,
+        commands: List[ATMCommand],
+        position: ReplicationWatermark,
+    ) -> List[ForwardOutcome]:
+        """
+        Peer forward các command thuộc shard server này giữ để server này thực thi.
+        position là cuối log của peer lúc forward: server này áp dụng log của peer
+        tới đó rồi mới thực thi (command forward thấy mọi command peer đã thực thi
+        trước đó), peer vẫn đẩy log qua replicate.
+        Trả về kết quả theo đúng thứ tự commands; command được thực thi đi vào
+        log của server này (peer nhận lại qua replicate).
+        """
+        pass
+
+    @abstractmethod
+    def get_owned_shards(self) -> List[int]:
+        """Trả về các shard peer đang giữ."""
+        pass
+
+    @abstractmethod
+    def get_replication_position(self) -> ReplicationWatermark:
+        """
+        Trả về vị trí cuối log của peer: áp dụng log của peer tới đó là bắt kịp
+        (server vừa khởi động/chiếm shard chờ bắt kịp rồi mới dùng shard).
+        """
+        pass
+
+    @abstractmethod
+    def announce_shards(self, owner_id: int, shards: List[int]) -> bool:
+        """Server owner_id báo vừa nhận các shard (để forward/xin shard đúng server)."""
         pass
 
 
@@ -39,27 +100,58 @@ class UserService(Remote):
         pass
 
     @abstractmethod
-    def get_transaction_history(self) -> List[TransactionData]:
+    def get_transaction_history(
+        self, before: Optional[List[int]] = None, limit: Optional[int] = None
+    ) -> List[TransactionData]:
+        """
+        1 trang lịch sử giao dịch, mới nhất trước.
+        before: [timestamp, id] của giao dịch cuối trang trước, None = trang đầu.
+        limit: Số giao dịch mỗi trang, None = mặc định của server.
+        """
         pass
 
     @abstractmethod
     def get_info(self) -> UserData:
         pass
 
+    # idempotency_key: Do ATM tạo cho mỗi giao dịch, gửi lại cùng key (kể cả sang
+    # server kia) sẽ nhận kết quả của lần đầu thay vì tạo giao dịch mới
+
     @abstractmethod
-    def change_pin(self, new_pin: str, callback: SuccessCallback):
+    def change_pin(
+        self,
+        new_pin: str,
+        callback: SuccessCallback,
+        idempotency_key: Optional[str] = None,
+    ):
         pass
 
     @abstractmethod
-    def deposit(self, amount: int, callback: SuccessCallback):
+    def deposit(
+        self,
+        amount: int,
+        callback: SuccessCallback,
+        idempotency_key: Optional[str] = None,
+    ):
         pass
 
     @abstractmethod
-    def withdraw(self, amount: int, callback: SuccessCallback):
+    def withdraw(
+        self,
+        amount: int,
+        callback: SuccessCallback,
+        idempotency_key: Optional[str] = None,
+    ):
         pass
 
     @abstractmethod
-    def transfer(self, to_card: str, amount: int, callback: SuccessCallback):
+    def transfer(
+        self,
+        to_card: str,
+        amount: int,
+        callback: SuccessCallback,
+        idempotency_key: Optional[str] = None,
+    ):
         pass
 
     @abstractmethod
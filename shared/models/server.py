@@ -27,6 +27,7 @@ class CardData(TypedDict):
 
 
 class TransactionData(TypedDict):
+    id: NotRequired[int]  # Có sau migration 001-transactions-keyset
     amount: int
     transaction_type: str
     from_card_number: str
@@ -42,6 +43,13 @@ class BaseCommand(TypedDict):
     card_number: str
     timestamp: int
     success_callback: NotRequired[SuccessCallback]
+    journal_seq: NotRequired[int]  # Số thứ tự trong command journal của server nhận lệnh
+    command_id: NotRequired[str]  # "<peer_id>-<seq>", duy nhất giữa các server (chống áp dụng trùng)
+    idempotency_key: NotRequired[str]  # Key do ATM gửi kèm, gửi lại cùng key nhận kết quả cũ
+    # Vị trí log của các server khác mà server thực thi đã áp dụng lúc thực thi
+    # (chỉ gắn khi thay đổi, áp dụng cho cả các command sau trong log): server
+    # nhận log chỉ áp dụng command khi đã áp dụng tới đó (PeerService.replicate)
+    depends_on: NotRequired[List["ReplicationWatermark"]]
 
 
 class TransactionCommand(BaseCommand):
@@ -75,5 +83,35 @@ class TransferCommand(TransactionCommand):
 ATMCommand = Union[ChangePinCommand, WithdrawCommand, DepositCommand, TransferCommand]
 
 
+class ReplicationAck(TypedDict):
+    """Kết quả PeerService.replicate: vị trí log peer đã nhận/áp dụng"""
+
+    epoch: str
+    received: int  # Index lớn nhất đã nhận liên tục
+    applied: int  # Index lớn nhất đã commit vào database
+
+
+class ReplicationWatermark(TypedDict):
+    """Vị trí đã áp dụng log của 1 server, gửi kèm khi trao shard (PeerService.replicate)"""
+
+    origin_id: int
+    epoch: str
+    applied: int  # Index lớn nhất đã commit vào database
+
+
+class TokenLoad(TypedDict):
+    """Tải của server xin shard, gửi kèm PeerService.request_shards"""
+
+    queue_depth: int  # Số command đang chờ
+    arrival_rate: float  # EWMA số command nhận được mỗi giây
+
+
+class ForwardOutcome(TypedDict):
+    """Kết quả của 1 command trong PeerService.forward_commands"""
+
+    accepted: bool  # False = peer không giữ shard của command, không thực thi
+    notify: List[str]  # Tham số SuccessCallback.notify cho ATM (rỗng = không báo)
+
+
 class Token(TypedDict):
     results: List[ATMCommand]
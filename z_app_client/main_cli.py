@@ -59,6 +59,10 @@ def run_client():
     print("Syntax: <command>, <arg1>, <arg2>...")
     print("Commands: balance, info, history, deposit, withdraw, transfer, pin, logout")
     print("Example: 'deposit, 50000' or 'transfer, 999999, 10000'")
+    print("History: 'history' (trang đầu), 'history, more' (trang tiếp theo)")
+
+    # [timestamp, id] của giao dịch cuối trang lịch sử vừa xem
+    history_before = None
 
     while True:
         try:
@@ -88,7 +92,17 @@ def run_client():
                 print(f">> Info: {info}")
 
             elif cmd == "history":
-                history = user_service.get_transaction_history()
+                more = bool(args) and args[0].lower() == "more"
+                if more and history_before is None:
+                    print(">> Không còn giao dịch cũ hơn")
+                    continue
+                history = user_service.get_transaction_history(
+                    history_before if more else None
+                )
+                last = history[-1] if history else None
+                history_before = (
+                    [last["timestamp"], last["id"]] if last and "id" in last else None
+                )
                 print(f"{'TIME':<15} | {'TYPE':<10} | {'AMOUNT'}")
                 print("-" * 40)
                 for rec in history:
@@ -0,0 +1,355 @@
+"""
+Benchmark: chuyển shard / forward command giữa các Coordinator
+Chạy: python -m app_server.bench_handoff
+
+Các Coordinator chạy trong cùng 1 process, gọi nhau trực tiếp qua PeerServiceImpl
+(không database, RTT và chi phí thực thi được giả lập), log bị ẩn khi đo.
+
+- Độ trễ khi thẻ thuộc shard của peer: lệnh rút tiền được đưa vào queue của
+  server KHÔNG giữ shard của thẻ -> xin shard (peer sync và trao shard), hoặc
+  forward lệnh cho peer thực thi -> command được thực thi
+- Throughput khi tải đối xứng: mỗi server có CLIENTS ATM, mỗi ATM rút tiền từ 1
+  thẻ ngẫu nhiên trong CARDS thẻ, gửi lệnh tiếp theo ngay khi lệnh trước được
+  thực thi (closed loop) trong DURATION giây. So sánh 1 shard (= 1 token chung,
+  thiết kế cũ) với SHARD_COUNT shard (có/không forward), khi thẻ được chọn đều
+  và khi LOCALITY lệnh của mỗi server là thẻ "gần" server đó (nửa số shard,
+  như ATM theo khu vực). Thêm 1 lần đo với CLUSTER_SIZE server
+"""
+
+import contextlib
+import io
+import itertools
+import random
+import statistics
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+from shared.interfaces.server import PeerService
+from shared.models.server import (
+    ATMCommand,
+    ForwardOutcome,
+    ReplicationAck,
+    ReplicationWatermark,
+    TokenLoad,
+)
+
+from .command_queue import CommandQueue
+from .coordinator import Coordinator
+from .config import COMMAND_FORWARDING, SHARD_COUNT
+from .event_emitter import EventEmitter
+from .replication_backlog import ReplicationBacklog
+from .replication import ReplicationReceiver
+from .idempotency import Outcome
+from .services.peer_service import PeerServiceImpl
+from .shard_ownership import ForwardingConfig, shard_of
+
+HANDOFFS = 40
+# Nghỉ ngẫu nhiên giữa 2 lần đo (s), để thời điểm gửi command không trùng nhịp của worker
+IDLE_BETWEEN = (0.02, 0.3)
+
+CLIENTS = 8
+CARDS = 1000
+# Tỉ lệ lệnh dùng thẻ "gần" server nhận lệnh trong kịch bản có locality
+LOCALITY = 0.9
+DURATION = 5.0
+CLUSTER_SIZE = 3
+# Chi phí giả lập: mỗi batch (commit) và mỗi command (s), RTT của 1 lời gọi peer (s)
+BATCH_COST = 0.001
+COMMAND_COST = 0.00005
+PEER_RTT = 0.001
+
+_markers = itertools.count()
+
+
+def print_separator(title: str):
+    """In dòng phân cách đẹp"""
+    print(f"\n{'='*60}")
+    print(f"  {title}")
+    print(f"{'='*60}")
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class RecordingExecutor:
+    """Thay CommandExecutor: không ghi database, chỉ báo khi command được thực thi"""
+
+    def __init__(self, batch_cost: float = 0.0, command_cost: float = 0.0):
+        self.batch_cost = batch_cost
+        self.command_cost = command_cost
+        self.executed: Dict[int, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def expect(self, marker: int) -> threading.Event:
+        with self._lock:
+            return self.executed.setdefault(marker, threading.Event())
+
+    def exec_direct(self, commands: List[ATMCommand]) -> List[ATMCommand]:
+        if self.batch_cost or self.command_cost:
+            time.sleep(self.batch_cost + self.command_cost * len(commands))
+        for cmd in commands:
+            self.expect(cmd["timestamp"]).set()
+        return commands
+
+    def exec_in_transaction(self, commands, before_commit):
+        return commands
+
+    def submit_forwarded(self, cmd: ATMCommand, callback: Any) -> bool:
+        return True
+
+    def complete_forwarded(self, cmd: ATMCommand, outcome: Optional[Outcome]):
+        self.expect(cmd["timestamp"]).set()
+
+
+class NoDatabase:
+    """Thay DatabaseReader cho ReplicationReceiver: chưa áp dụng log nào"""
+
+    def get_replication_state(self, origin_id: int) -> Optional[Tuple[str, int]]:
+        return None
+
+
+class InProcessPeer:
+    """Proxy PeerService gọi thẳng vào PeerServiceImpl của server khác (có RTT giả lập)"""
+
+    def __init__(self, rtt: float = 0.0):
+        self.rtt = rtt
+        self.target: Optional[PeerService] = None
+
+    def _service(self) -> PeerService:
+        if self.target is None:
+            # Server chưa khởi động
+            raise ConnectionRefusedError()
+        if self.rtt:
+            time.sleep(self.rtt)
+        return self.target
+
+    def request_shards(
+        self, requester_id: int, shards: List[int], load: Optional[TokenLoad] = None
+    ) -> bool:
+        return self._service().request_shards(requester_id, shards, load)
+
+    def replicate(
+        self,
+        origin_id: int,
+        epoch: str,
+        first_index: int,
+        logs: List[ATMCommand],
+        pass_shards: List[int],
+        watermarks: List[ReplicationWatermark],
+    ) -> ReplicationAck:
+        return self._service().replicate(
+            origin_id, epoch, first_index, logs, pass_shards, watermarks
+        )
+
+    def forward_commands(
+        self,
+        origin_id: int,
+        commands: List[ATMCommand],
+        position: ReplicationWatermark,
+    ) -> List[ForwardOutcome]:
+        return self._service().forward_commands(origin_id, commands, position)
+
+    def get_owned_shards(self) -> List[int]:
+        return self._service().get_owned_shards()
+
+    def get_replication_position(self) -> ReplicationWatermark:
+        return self._service().get_replication_position()
+
+    def announce_shards(self, owner_id: int, shards: List[int]) -> bool:
+        return self._service().announce_shards(owner_id, shards)
+
+
+Server = Tuple[Coordinator, CommandQueue, RecordingExecutor]
+
+
+def start_cluster(
+    directory: str,
+    size: int = 2,
+    rtt: float = 0.0,
+    shard_count: int = SHARD_COUNT,
+    forwarding: bool = True,
+    **executor_costs,
+) -> List[Server]:
+    """
+    Khởi động lần lượt size server (ID 1..size): server đầu không thấy ai ->
+    giữ mọi shard, các server sau thấy shard đã có người giữ -> chờ
+    """
+    servers: List[Server] = []
+    node_ids = range(1, size + 1)
+    # proxies[a][b]: proxy server a dùng để gọi server b
+    proxies = {a: {b: InProcessPeer(rtt) for b in node_ids if b != a} for a in node_ids}
+    forwarding_config: ForwardingConfig = {**COMMAND_FORWARDING, "enabled": forwarding}
+
+    for node_id in node_ids:
+        queue = CommandQueue()
+        executor = RecordingExecutor(**executor_costs)
+        receiver = ReplicationReceiver(
+            cast(Any, executor), cast(Any, NoDatabase()), node_id=node_id
+        )
+        coordinator = Coordinator(
+            queue,
+            cast(Any, executor),
+            EventEmitter(),
+            ReplicationBacklog(f"{directory}/{node_id}", peer_ids=proxies[node_id]),
+            receiver,
+            peer_service_proxies=cast(Dict[int, PeerService], proxies[node_id]),
+            node_id=node_id,
+            shard_count=shard_count,
+            forwarding=forwarding_config,
+        )
+        # Proxy trỏ tới server này được nối ngay để server sau thấy nó đang chạy
+        service = PeerServiceImpl(coordinator, receiver)
+        for other_id in node_ids:
+            if other_id != node_id:
+                proxies[other_id][node_id].target = service
+        servers.append((coordinator, queue, executor))
+
+    return servers
+
+
+def submit(server: Server, card_number: str) -> threading.Event:
+    """Gửi 1 lệnh rút tiền, trả về event được set khi command được thực thi"""
+    _, queue, executor = server
+    marker = next(_markers)
+    done = executor.expect(marker)
+    queue.add(
+        cast(
+            ATMCommand,
+            {
+                "command_type": "withdraw",
+                "peer_id": 0,
+                "card_number": card_number,
+                "amount": 1,
+                "timestamp": marker,
+            },
+        )
+    )
+    return done
+
+
+def measure_handoffs(forwarding: bool) -> List[float]:
+    # Thread của cluster cũ (không dừng) có thể vẫn ghi backlog lúc dọn thư mục
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        a, b = start_cluster(directory, forwarding=forwarding)
+
+        card_number = "000000"
+        shard = shard_of(card_number, SHARD_COUNT)
+
+        def holds(server: Server) -> bool:
+            return shard in server[0].get_owned_shards()
+
+        latencies = []
+        for _ in range(HANDOFFS):
+            time.sleep(random.uniform(*IDLE_BETWEEN))
+            # Bên trao shard chỉ bỏ shard khỏi danh sách sau khi peer đã nhận
+            while holds(a) == holds(b):
+                time.sleep(0.001)
+
+            # Luôn gửi command cho server không giữ shard
+            started = time.perf_counter()
+            done = submit(b if holds(a) else a, card_number)
+            if not done.wait(timeout=10):
+                raise RuntimeError("Command không được thực thi sau 10s")
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        return latencies
+
+
+def measure_throughput(
+    shard_count: int, forwarding: bool, locality: float = 0.0, size: int = 2
+) -> Tuple[List[int], List[float]]:
+    """
+    Số command mỗi server thực thi được và độ trễ (ms) của từng command
+
+    Args:
+        locality: Tỉ lệ lệnh chọn thẻ trong 1/size số shard (theo SHARD_COUNT)
+            gần server nhận lệnh, còn lại chọn đều trong mọi thẻ
+        size: Số server
+    """
+    cards = [f"{number:06d}" for number in range(CARDS)]
+    nearby = [
+        [card for card in cards if shard_of(card, SHARD_COUNT) % size == index]
+        for index in range(size)
+    ]
+
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        servers = start_cluster(
+            directory,
+            size,
+            PEER_RTT,
+            shard_count,
+            forwarding,
+            batch_cost=BATCH_COST,
+            command_cost=COMMAND_COST,
+        )
+        stop = threading.Event()
+        completed = [0] * size
+        latencies: List[float] = []
+        lock = threading.Lock()
+
+        def client(index: int):
+            while not stop.is_set():
+                pool = nearby[index] if random.random() < locality else cards
+                card_number = random.choice(pool)
+                started = time.perf_counter()
+                if not submit(servers[index], card_number).wait(timeout=10):
+                    raise RuntimeError("Command không được thực thi sau 10s")
+                with lock:
+                    completed[index] += 1
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+        threads = [
+            threading.Thread(target=client, args=(index,), daemon=True)
+            for index in range(size)
+            for _ in range(CLIENTS)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(DURATION)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        return completed, latencies
+
+
+if __name__ == "__main__":
+    for forwarding in (False, True):
+        mode = "FORWARD COMMAND" if forwarding else "CHUYỂN SHARD"
+        print_separator(f"ĐỘ TRỄ KHI THẺ THUỘC SHARD CỦA PEER - {mode} ({HANDOFFS} LẦN)")
+        with contextlib.redirect_stdout(io.StringIO()):
+            handoffs = measure_handoffs(forwarding)
+
+        print(f"Trung bình : {statistics.mean(handoffs):8.2f} ms")
+        print(f"p50        : {percentile(handoffs, 0.5):8.2f} ms")
+        print(f"p95        : {percentile(handoffs, 0.95):8.2f} ms")
+        print(f"Max        : {max(handoffs):8.2f} ms")
+
+    designs = [
+        ("1 token chung", 1, False, 2),
+        (f"{SHARD_COUNT} shard", SHARD_COUNT, False, 2),
+        (f"{SHARD_COUNT} shard + forward", SHARD_COUNT, True, 2),
+        (f"{SHARD_COUNT} shard + forward", SHARD_COUNT, True, CLUSTER_SIZE),
+    ]
+    for locality, (design, shard_count, forwarding, size) in itertools.product(
+        (0.0, LOCALITY), designs
+    ):
+        print_separator(
+            f"THROUGHPUT - {design}, {size} server, locality {locality:.0%}"
+            f" ({CLIENTS} ATM/server, {DURATION:.0f}s)"
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            completed, latencies = measure_throughput(
+                shard_count, forwarding, locality, size
+            )
+
+        for index, count in enumerate(completed):
+            print(f"Server {index + 1:<4}: {count / DURATION:8.0f} command/s")
+        print(f"Tổng       : {sum(completed) / DURATION:8.0f} command/s")
+        print(f"p50        : {percentile(latencies, 0.5):8.2f} ms")
+        print(f"p99        : {percentile(latencies, 0.99):8.2f} ms")
+        print(f"Max        : {max(latencies):8.2f} ms")
@@ -1,59 +1,519 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Union, cast
+
+import mysql.connector
+
+from shared.interfaces.client import SuccessCallback
 from shared.models.server import ATMCommand
-from .database.main import DatabaseWriter, SQLException
+from .database.main import DatabaseWriter, SQLException, WriteBatch
+from .database.exceptions import (
+    CommandFailedError,
+    DuplicateCommandError,
+    StaleCommandError,
+)
+from .database.balance_cache import BalanceCache
+from .command_dedupe import CommandDedupe
+from .idempotency import IdempotencyStore, Outcome
 from .command_queue import CommandQueue
-from .config import PEER_ID
+
+
+def command_cards(cmd: ATMCommand) -> list[str]:
+    """Các thẻ mà command đọc/ghi (chuyển khoản: cả 2 phía)"""
+    if cmd["command_type"] == "transfer":
+        return [cmd["card_number"], cmd["to_card"]]
+    return [cmd["card_number"]]
+
+
+def partition_commands(commands: list[ATMCommand]) -> list[list[int]]:
+    """
+    Chia các command thành các nhóm không xung đột (không dùng chung thẻ nào).
+
+    Union-find trên số thẻ: 2 command chạm cùng 1 thẻ (trực tiếp hoặc qua
+    chuỗi chuyển khoản) nằm chung nhóm. Mỗi nhóm giữ thứ tự gốc của các command,
+    các nhóm được sắp theo command đầu tiên.
+
+    Returns:
+        list[list[int]]: Index của các command trong mỗi nhóm
+    """
+    parent: dict[str, str] = {}
+
+    def find(card: str) -> str:
+        root = parent.setdefault(card, card)
+        while root != parent[root]:
+            parent[root] = parent[parent[root]]
+            root = parent[root]
+        return root
+
+    for cmd in commands:
+        first, *others = command_cards(cmd)
+        for card in others:
+            parent[find(card)] = find(first)
+
+    groups: dict[str, list[int]] = {}
+    for index, cmd in enumerate(commands):
+        groups.setdefault(find(cmd["card_number"]), []).append(index)
+
+    return list(groups.values())
+
+
+class _SharedOutcome:
+    """
+    Callback của command đầu tiên có idempotency key trong batch: báo kết quả
+    cho cả các lần gửi trùng key trong batch (không được thực thi)
+    """
+
+    def __init__(self, callback: Optional[SuccessCallback]):
+        self.callback = callback
+        self.followers: list[SuccessCallback] = []
+
+    def notify(self, *args):
+        for follower in self.followers:
+            try:
+                follower.notify(*args)
+            except Exception as e:
+                print(f">> [IDEMPOTENCY] Không gửi được kết quả: {e}")
+        if self.callback is not None:
+            self.callback.notify(*args)
 
 
 class CommandExecutor:
-    def __init__(self, command_queue: CommandQueue, database_writer: DatabaseWriter):
+    # Số lần chạy 1 batch khi bị rollback vì deadlock/chờ lock quá lâu
+    BATCH_ATTEMPTS = 3
+    RETRY_BACKOFF = 0.05
+    SUCCESS: Outcome = ("Giao dịch thành công!", "success")
+    INTERNAL_ERROR: Outcome = ("Internal server error", "error")
+
+    def __init__(
+        self,
+        command_queue: CommandQueue,
+        database_writer: DatabaseWriter,
+        batch_mode: bool = False,
+        parallelism: int = 1,
+        balance_cache: Optional[BalanceCache] = None,
+        dedupe: Optional[CommandDedupe] = None,
+        idempotency: Optional[IdempotencyStore] = None,
+    ):
+        """
+        Args:
+            command_queue: Hàng đợi command
+            database_writer: Writer thực thi command
+            batch_mode: True -> các command lấy ra cùng lúc chạy trong 1 transaction
+                (mỗi command 1 savepoint, commit 1 lần)
+            parallelism: Số nhóm command không xung đột chạy đồng thời, mỗi nhóm
+                dùng 1 connection của writer pool (1 = tuần tự như cũ)
+            balance_cache: Cache số dư được cập nhật sau mỗi lệnh ghi thành công
+            dedupe: Chỉ mục command_id, command đã áp dụng được bỏ qua (replay/gửi lại).
+                Command có command_id luôn chạy qua batch transaction để ghi
+                command_id cùng lệnh
+            idempotency: Kết quả theo idempotency key, command có key đã được
+                command khác xử lý thì không chạy lại
+        """
         self.command_queue = command_queue
         self.database_writer = database_writer
+        self.batch_mode = batch_mode
+        self.parallelism = max(1, parallelism)
+        self.balance_cache = balance_cache
+        self.dedupe = dedupe
+        self.idempotency = idempotency
+
+        self._pool: Optional[ThreadPoolExecutor] = None
+        if self.parallelism > 1:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.parallelism, thread_name_prefix="command-executor"
+            )
 
     def exec_direct(self, commands: list[ATMCommand]) -> list[ATMCommand]:
+        """
+        Thực thi các command.
+
+        Returns:
+            list[ATMCommand]: Các command thành công, theo thứ tự gốc
+                (thứ tự được ghi lại để sync cho peer)
+        """
+        commands = self._skip_completed(commands)
+
+        if self._pool is not None and len(commands) > 1:
+            groups = partition_commands(commands)
+            if len(groups) > 1:
+                return self._exec_parallel(commands, groups)
+
+        return self._exec_group(commands)
+
+    def exec(self) -> list[ATMCommand]:
+        current = self.command_queue.get_all()
+        success = self.exec_direct(current)
+        self.command_queue.mark_executed(current)
+        return success
+
+    def exec_in_transaction(
+        self,
+        commands: list[ATMCommand],
+        before_commit: Callable[[WriteBatch], None],
+    ) -> list[ATMCommand]:
+        """
+        Thực thi các command trong đúng 1 transaction, before_commit(batch) chạy
+        ngay trước commit để ghi thêm dữ liệu phải commit cùng các command.
+        Không chạy lại từng lệnh khi batch lỗi.
+
+        Mọi command phải thành công (log của peer, đã thành công tại server đó):
+        1 command lỗi thì cả transaction bị rollback.
+
+        Returns:
+            list[ATMCommand]: Các command thành công (hoặc đã áp dụng), theo thứ tự gốc
+
+        Raises:
+            CommandFailedError: Nếu có command bị lỗi (dữ liệu đã lệch với peer)
+            SQLException: Nếu transaction bị rollback (không command nào được ghi)
+        """
+        return self._exec_batch(commands, before_commit, require_success=True)
+
+    def _exec_parallel(
+        self, commands: list[ATMCommand], groups: list[list[int]]
+    ) -> list[ATMCommand]:
+        """
+        Chạy các nhóm không xung đột đồng thời.
+
+        Các nhóm không dùng chung thẻ nên không tranh chấp row lock; trong mỗi
+        nhóm, các command của cùng 1 thẻ vẫn chạy đúng thứ tự gốc.
+        """
+        assert self._pool is not None
+        futures = [
+            (group, self._pool.submit(self._exec_group, [commands[i] for i in group]))
+            for group in groups
+        ]
+
+        succeeded: set[int] = set()
+        for group, future in futures:
+            try:
+                group_success = future.result()
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+                continue
+
+            success_ids = {id(cmd) for cmd in group_success}
+            succeeded.update(i for i in group if id(commands[i]) in success_ids)
+
+        return [cmd for i, cmd in enumerate(commands) if i in succeeded]
+
+    def _exec_group(self, commands: list[ATMCommand]) -> list[ATMCommand]:
+        if self.batch_mode and len(commands) > 1:
+            try:
+                return self._exec_batch(commands)
+            except SQLException as e:
+                # Batch bị rollback toàn bộ (mất kết nối, lỗi commit...) -> chạy lại từng lệnh
+                print(f">> [EXECUTOR] Batch thất bại, chạy lại từng lệnh: {e}")
+
+        return self._exec_each(commands)
+
+    def _exec_each(self, commands: list[ATMCommand]) -> list[ATMCommand]:
         success: list[ATMCommand] = []
 
         for cmd in commands:
-            try:
-                # Note: python version > 3.10
-                match cmd["command_type"]:
-                    case "change-pin":
-                        self.database_writer.change_pin(
-                            cmd["card_number"], cmd["new_pin"]
-                        )
-                    case "deposit":
-                        self.database_writer.deposit_money(
-                            cmd["card_number"], cmd["amount"], cmd["timestamp"]
-                        )
-                    case "withdraw":
-                        self.database_writer.withdraw_money(
-                            cmd["card_number"], cmd["amount"], cmd["timestamp"]
-                        )
-                    case "transfer":
-                        self.database_writer.transfer_money(
-                            cmd["card_number"],
-                            cmd["to_card"],
-                            cmd["amount"],
-                            cmd["timestamp"],
-                        )
+            if self._dedupe_key(cmd) is not None:
+                # Mỗi lệnh 1 transaction riêng, ghi command_id cùng lệnh
+                try:
+                    success.extend(self._exec_batch([cmd]))
+                except SQLException as e:
+                    self._on_failed(cmd, e)
+                    self._notify_error(cmd, e)
+                continue
 
+            applied = False
+            try:
+                self._apply(self.database_writer, cmd)
+                applied = True
                 success.append(cmd)
-
-                # Chỉ gọi callback nếu lệnh này xuất phát từ Server này
-                if cmd["peer_id"] == PEER_ID and "success_callback" in cmd:
-                    cmd["success_callback"].notify("\nGiao dịch thành công!")
-                else:
-                    # Lệnh của Peer -> Chỉ thực thi DB, không gọi callback (vì callback object là của client bên kia)
-                    pass
+                self._on_committed(cmd)
+                self._notify_success(cmd)
 
             # Thường thì peer chỉ nhận được các command thực thi thành công
             except SQLException as e:
-                if cmd["peer_id"] == PEER_ID and "success_callback" in cmd:
-                    cmd["success_callback"].notify(e.get_notify_message())
+                self._on_failed(cmd, e)
+                self._notify_error(cmd, e)
             except Exception as e:
                 print(f"Unexpected error: {e}")
+                if not applied:
+                    # Không rõ kết quả: key được chạy lại, ATM vẫn được báo lỗi
+                    self._on_failed(cmd, None)
+                    self._notify_unexpected(cmd)
 
         return success
 
-    def exec(self) -> list[ATMCommand]:
-        current = self.command_queue.get_all()
-        return self.exec_direct(current)
+    def _exec_batch(
+        self,
+        commands: list[ATMCommand],
+        before_commit: Optional[Callable[[WriteBatch], None]] = None,
+        require_success: bool = False,
+    ) -> list[ATMCommand]:
+        """
+        Chạy cả batch trong 1 transaction, callback chỉ được gọi sau khi commit.
+        before_commit ghi thêm dữ liệu sau các command, trước khi commit.
+        require_success: command lỗi -> CommandFailedError, cả batch bị rollback.
+            Dùng cho log của peer: replication_state quyết định entry nào chưa áp
+            dụng, command cũ hơn cửa sổ chống trùng được coi như đã áp dụng
+
+        Chỉ lỗi nghiệp vụ (và command đã áp dụng/quá cũ) là kết quả của riêng 1 command.
+        Lỗi khác hủy cả batch: không command nào được ghi, không cập nhật cache/
+        dedupe/idempotency; deadlock/chờ lock quá lâu thì cả batch được chạy lại.
+
+        Raises:
+            SQLException: Nếu cả batch bị rollback (không command nào được ghi)
+        """
+        for attempt in range(1, self.BATCH_ATTEMPTS + 1):
+            try:
+                outcomes = self._run_batch(commands, before_commit, require_success)
+                break
+            except SQLException as e:
+                if not e.is_transient() or attempt == self.BATCH_ATTEMPTS:
+                    raise
+                print(f">> [EXECUTOR] Batch bị rollback ({e}), chạy lại lần {attempt + 1}")
+                time.sleep(self.RETRY_BACKOFF * attempt)
+
+        success: list[ATMCommand] = []
+
+        for cmd, error in outcomes:
+            try:
+                if error is None:
+                    success.append(cmd)
+                    self._on_committed(cmd)
+                    self._notify_success(cmd)
+                elif isinstance(error, DuplicateCommandError) or (
+                    require_success and isinstance(error, StaleCommandError)
+                ):
+                    # Đã áp dụng (thành công) trước đó: không chạy lại, báo kết quả
+                    # thành công cho key đang chờ và client
+                    success.append(cmd)
+                    assert self.dedupe is not None
+                    if isinstance(error, StaleCommandError):
+                        self.dedupe.stale(error.origin_id, error.seq, replicated=True)
+                    else:
+                        self.dedupe.duplicate(error.origin_id, error.seq)
+                    if self.idempotency is not None:
+                        self.idempotency.complete(cmd, self.SUCCESS)
+                    self._notify_success(cmd)
+                else:
+                    if isinstance(error, StaleCommandError):
+                        assert self.dedupe is not None
+                        self.dedupe.stale(error.origin_id, error.seq)
+                    self._on_failed(cmd, error)
+                    self._notify_error(cmd, error)
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+
+        return success
+
+    def _run_batch(
+        self,
+        commands: list[ATMCommand],
+        before_commit: Optional[Callable[[WriteBatch], None]],
+        require_success: bool,
+    ) -> list[tuple[ATMCommand, Optional[SQLException]]]:
+        """
+        1 lần chạy batch, trả về kết quả của từng command sau khi đã commit.
+
+        Raises:
+            SQLException: Nếu cả batch bị rollback
+        """
+        outcomes: list[tuple[ATMCommand, Optional[SQLException]]] = []
+
+        with self.database_writer.batch() as batch:
+            for cmd in commands:
+                try:
+                    self._apply_once(batch, cmd)
+                    outcomes.append((cmd, None))
+                except (DuplicateCommandError, StaleCommandError) as e:
+                    outcomes.append((cmd, e))
+                except SQLException as e:
+                    if not e.is_business_error():
+                        raise
+                    outcomes.append((cmd, e))
+                except mysql.connector.Error:
+                    raise
+                except Exception as e:
+                    # Không rõ lệnh đã ghi được tới đâu: hủy cả batch
+                    raise SQLException(f"Unexpected error: {e}", None) from e
+
+            if require_success:
+                for cmd, error in outcomes:
+                    if error is not None and not isinstance(
+                        error, (DuplicateCommandError, StaleCommandError)
+                    ):
+                        raise CommandFailedError(cmd.get("command_id"), error)
+
+            if before_commit is not None:
+                before_commit(batch)
+
+        return outcomes
+
+    def _skip_completed(self, commands: list[ATMCommand]) -> list[ATMCommand]:
+        """
+        Bỏ các command có idempotency key đã được command khác xử lý
+        (ATM gửi lại sang server kia), báo kết quả cũ cho ATM.
+        Key trùng trong cùng batch chỉ chạy command đầu tiên, các command sau
+        nhận kết quả của command đó.
+        """
+        if self.idempotency is None:
+            return commands
+
+        pending: list[ATMCommand] = []
+        first_of_key: dict[tuple[str, str], ATMCommand] = {}
+        for cmd in commands:
+            outcome = self.idempotency.completed_outcome(cmd)
+            callback = self._callback(cmd)
+            key = cmd.get("idempotency_key")
+            scope = (cmd["card_number"], key) if key else None
+            first = first_of_key.get(scope) if scope is not None else None
+
+            if outcome is None and first is not None:
+                if callback is not None:
+                    self._share_outcome(first).followers.append(callback)
+            elif outcome is None:
+                pending.append(cmd)
+                if scope is not None:
+                    first_of_key[scope] = cmd
+            elif callback is not None:
+                try:
+                    callback.notify(*outcome)
+                except Exception as e:
+                    print(f"Unexpected error: {e}")
+
+        return pending
+
+    @staticmethod
+    def _share_outcome(cmd: ATMCommand) -> _SharedOutcome:
+        """Thay callback của cmd bằng _SharedOutcome (nếu chưa) để báo thêm cho command khác"""
+        shared = cmd.get("success_callback")
+        if not isinstance(shared, _SharedOutcome):
+            shared = _SharedOutcome(shared)
+            cmd["success_callback"] = cast(SuccessCallback, shared)
+        return shared
+
+    def _dedupe_key(self, cmd: ATMCommand) -> Optional[tuple[int, int]]:
+        return self.dedupe.key(cmd) if self.dedupe is not None else None
+
+    def _apply_once(self, batch: WriteBatch, cmd: ATMCommand):
+        """
+        Raises:
+            DuplicateCommandError: Nếu command_id đã được áp dụng
+            StaleCommandError: Nếu command_id cũ hơn cửa sổ chống trùng
+        """
+        key = self._dedupe_key(cmd)
+        if key is None:
+            self._apply(batch, cmd)
+            return
+
+        assert self.dedupe is not None
+        if self.dedupe.is_applied(*key):
+            raise DuplicateCommandError(*key)
+        if self.dedupe.is_stale(*key):
+            raise StaleCommandError(*key)
+
+        with batch.apply_once(*key):
+            self._apply(batch, cmd)
+
+    @staticmethod
+    def _apply(target: Union[DatabaseWriter, WriteBatch], cmd: ATMCommand):
+        # Note: python version > 3.10
+        match cmd["command_type"]:
+            case "change-pin":
+                target.change_pin(cmd["card_number"], cmd["new_pin"])
+            case "deposit":
+                target.deposit_money(cmd["card_number"], cmd["amount"], cmd["timestamp"])
+            case "withdraw":
+                target.withdraw_money(cmd["card_number"], cmd["amount"], cmd["timestamp"])
+            case "transfer":
+                target.transfer_money(
+                    cmd["card_number"],
+                    cmd["to_card"],
+                    cmd["amount"],
+                    cmd["timestamp"],
+                )
+
+    def _on_committed(self, cmd: ATMCommand):
+        """Cập nhật cache trước khi báo client (client thường hỏi số dư ngay sau đó)"""
+        if self.balance_cache is not None:
+            self.balance_cache.apply(cmd)
+
+        key = self._dedupe_key(cmd)
+        if key is not None:
+            assert self.dedupe is not None
+            self.dedupe.committed(*key)
+
+        if self.idempotency is not None:
+            self.idempotency.complete(cmd, self.SUCCESS)
+
+    def _on_failed(self, cmd: ATMCommand, error: Optional[SQLException]):
+        """Ghi kết quả lỗi cho idempotency key (error None = lỗi bất thường, không rõ kết quả)"""
+        if self.idempotency is None:
+            return
+
+        if error is None:
+            self.idempotency.discard(cmd)
+        else:
+            self.idempotency.complete(cmd, (error.get_notify_message(), "error"))
+
+    def submit_forwarded(self, cmd: ATMCommand, callback: SuccessCallback) -> bool:
+        """
+        Đăng ký idempotency key của command peer forward sang (như lệnh ATM gửi
+        tới server này).
+
+        Returns:
+            bool: True nếu phải thực thi command, False nếu key đã/đang được command
+                khác xử lý (callback đã/sẽ nhận kết quả đó)
+        """
+        key = cmd.get("idempotency_key")
+        if not key or self.idempotency is None:
+            return True
+        return self.idempotency.submit(
+            cmd["card_number"], key, cmd.get("command_id"), callback
+        )
+
+    def complete_forwarded(self, cmd: ATMCommand, outcome: Optional[Outcome]):
+        """
+        Kết quả của command đã forward cho peer thực thi (None = không rõ kết quả,
+        VD: peer không báo kết quả)
+        """
+        if self.idempotency is not None:
+            if outcome is None:
+                self.idempotency.discard(cmd)
+            else:
+                self.idempotency.complete(cmd, outcome)
+
+        callback = self._callback(cmd)
+        if outcome is not None and callback is not None:
+            try:
+                callback.notify(*outcome)
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+
+    @staticmethod
+    def _callback(cmd: ATMCommand) -> Optional[SuccessCallback]:
+        """
+        Callback báo kết quả: của ATM nếu lệnh được nhận tại server này, bộ thu kết
+        quả nếu lệnh do peer forward sang. Lệnh peer sync sang không có callback
+        (đã bị bỏ khi gửi vì callback object là của client bên kia).
+        """
+        return cmd.get("success_callback")
+
+    @classmethod
+    def _notify_success(cls, cmd: ATMCommand):
+        callback = cls._callback(cmd)
+        if callback is not None:
+            callback.notify(*cls.SUCCESS)
+
+    @classmethod
+    def _notify_error(cls, cmd: ATMCommand, error: SQLException):
+        callback = cls._callback(cmd)
+        if callback is not None:
+            callback.notify(error.get_notify_message(), "error")
+
+    @classmethod
+    def _notify_unexpected(cls, cmd: ATMCommand):
+        callback = cls._callback(cmd)
+        if callback is None:
+            return
+        try:
+            callback.notify(*cls.INTERNAL_ERROR)
+        except Exception as e:
+            print(f"Unexpected error: {e}")
@@ -0,0 +1,225 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+
+from shared.models.server import ATMCommand
+
+
+class JournalConfig(TypedDict):
+    enabled: bool
+    path: str  # File journal
+    group_commit_window: float  # Thời gian gom các command vào 1 lần fsync (s)
+    max_bytes: int  # Kích thước file tối đa trước khi được viết lại (khi không còn command chờ)
+
+
+# [length: uint32][crc32: uint32][payload JSON: length bytes]
+_HEADER = struct.Struct("!II")
+
+
+def _encode_record(record: Dict[str, Any]) -> bytes:
+    payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode()
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class CommandJournal:
+    """
+    Journal append-only trên đĩa cho các command đã được nhận.
+
+    - append(): ghi record "accept" và chỉ trả về khi record đã được fsync.
+      Các append đồng thời được gom lại, 1 lần fsync cho cả nhóm (group commit)
+    - mark_done(): ghi record "done" (checkpoint) sau khi command đã được thực thi,
+      không chờ fsync. Mất checkpoint làm command được replay lại: command_id
+      được ghi vào applied_commands cùng transaction với lệnh nên command đã
+      thực thi bị bỏ qua (CommandDedupe, bắt buộc khi bật journal)
+    - Khởi động: đọc lại journal, các command "accept" chưa "done" được trả về
+      để đưa lại vào queue. Record cuối bị ghi dở (crash) được cắt bỏ theo CRC
+
+    success_callback là remote object nên không được ghi vào journal,
+    command được replay sẽ không có callback.
+    """
+
+    def __init__(
+        self, path: str, group_commit_window: float = 0.002, max_bytes: int = 64 << 20
+    ):
+        self.path = path
+        self.group_commit_window = group_commit_window
+        self.max_bytes = max_bytes
+
+        self._cond = threading.Condition()
+        # (record, seq được mở, các seq được đóng)
+        self._buffer: List[Tuple[bytes, Optional[int], List[int]]] = []
+        self._buffered_seq = 0  # seq lớn nhất đã vào buffer
+        self._durable_seq = 0  # seq lớn nhất đã fsync
+        self._error: Optional[OSError] = None
+
+        # Các command đã ghi nhưng chưa thực thi xong
+        self._open: set[int] = set()
+        self._stats = {"appends": 0, "fsyncs": 0, "rotations": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._pending = self._recover()
+        self._next_seq = self._last_seq + 1
+        self._file = open(path, "ab")
+
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def pending_commands(self) -> List[ATMCommand]:
+        """Các command đã nhận nhưng chưa thực thi trước lần tắt server trước"""
+        return list(self._pending)
+
+    def append(self, command: ATMCommand) -> int:
+        """
+        Ghi command vào journal, chờ tới khi đã fsync.
+
+        Returns:
+            int: Số thứ tự của command trong journal (journal_seq)
+
+        Raises:
+            OSError: Nếu ghi/fsync journal bị lỗi
+        """
+        record = {k: v for k, v in command.items() if k != "success_callback"}
+
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            record["journal_seq"] = seq
+
+            self._buffer.append(
+                (_encode_record({"type": "accept", "command": record}), seq, [])
+            )
+            self._buffered_seq = seq
+            self._stats["appends"] += 1
+            self._cond.notify_all()
+
+            while self._durable_seq < seq and self._error is None:
+                self._cond.wait()
+
+            if self._error is not None:
+                raise self._error
+
+        return seq
+
+    def mark_done(self, seqs: List[int]):
+        """Checkpoint: các command đã được thực thi (thành công hoặc lỗi nghiệp vụ)"""
+        if not seqs:
+            return
+
+        with self._cond:
+            self._buffer.append(
+                (_encode_record({"type": "done", "seqs": seqs}), None, seqs)
+            )
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {**self._stats, "open": len(self._open)}
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._buffer:
+                    self._cond.wait()
+
+            # Chờ thêm một chút để gom các append đến gần nhau vào cùng 1 lần fsync
+            time.sleep(self.group_commit_window)
+
+            with self._cond:
+                records, self._buffer = self._buffer, []
+                batch_seq = self._buffered_seq
+
+            try:
+                self._file.write(b"".join(record for record, _, _ in records))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._track(records)
+                self._durable_seq = max(self._durable_seq, batch_seq)
+                self._stats["fsyncs"] += 1
+                self._cond.notify_all()
+
+            self._maybe_rotate()
+
+    def _track(self, records: List[Tuple[bytes, Optional[int], List[int]]]):
+        for _, opened, closed in records:
+            if opened is not None:
+                self._open.add(opened)
+            self._open.difference_update(closed)
+
+    def _maybe_rotate(self):
+        """Viết lại file rỗng khi file quá lớn và không còn command nào chờ"""
+        with self._cond:
+            if self._open or self._file.tell() < self.max_bytes:
+                return
+
+            # Giữ seq tiếp tục tăng sau khi khởi động lại
+            self._file.close()
+            self._rewrite([_encode_record({"type": "done", "seqs": [self._next_seq - 1]})])
+            self._file = open(self.path, "ab")
+            self._stats["rotations"] += 1
+
+    def _rewrite(self, records: List[bytes]):
+        """Thay file journal bằng các record cho trước (ghi file tạm rồi rename)"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as tmp:
+            tmp.write(b"".join(records))
+            tmp.flush()
+            os.fsync(tmp.fileno())
+
+        os.replace(tmp_path, self.path)
+
+    def _recover(self) -> List[ATMCommand]:
+        """Đọc journal cũ, trả về các command chưa thực thi và compact file"""
+        accepted: Dict[int, ATMCommand] = {}
+        self._last_seq = 0
+
+        if not os.path.exists(self.path):
+            return []
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, offset)
+            payload = data[offset + _HEADER.size : offset + _HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                # Record cuối bị ghi dở khi crash
+                break
+
+            record = json.loads(payload)
+            if record["type"] == "accept":
+                seq = record["command"]["journal_seq"]
+                accepted[seq] = record["command"]
+                self._last_seq = max(self._last_seq, seq)
+            else:
+                for seq in record["seqs"]:
+                    accepted.pop(seq, None)
+                    self._last_seq = max(self._last_seq, seq)
+
+            offset += _HEADER.size + length
+
+        pending = [accepted[seq] for seq in sorted(accepted)]
+
+        # Compact: chỉ giữ các command còn chờ + seq cuối
+        records = [_encode_record({"type": "accept", "command": cmd}) for cmd in pending]
+        records.append(_encode_record({"type": "done", "seqs": [self._last_seq]}))
+        self._rewrite(records)
+
+        self._open = {cmd["journal_seq"] for cmd in pending}
+        if pending:
+            print(f">> [JOURNAL] Khôi phục {len(pending)} command chưa thực thi")
+
+        return pending
@@ -1,20 +1,60 @@
 from queue import Queue
 from threading import Lock, Event
+from typing import Callable, Optional
 from shared.models.server import ATMCommand
 
+from .command_journal import CommandJournal
+
 
 class CommandQueue:
-    def __init__(self):
+    def __init__(self, journal: Optional[CommandJournal] = None):
+        """
+        Args:
+            journal: Journal trên đĩa, command chỉ được nhận vào queue sau khi
+                đã ghi bền vững (None = chỉ giữ trong RAM như cũ)
+        """
         self._queue: Queue[ATMCommand] = Queue()
         self._lock = Lock()
         self.has_data_event = Event()
+        self.journal = journal
+        self._listeners: list[Callable[[], None]] = []
+
+        if journal is not None:
+            # Các command đã nhận nhưng chưa thực thi trước khi server tắt
+            for command in journal.pending_commands():
+                self._put(command)
 
     def add(self, command: ATMCommand):
-        """Thêm command vào queue"""
+        """
+        Thêm command vào queue
+
+        Raises:
+            OSError: Nếu không ghi được journal (command không được nhận)
+        """
+        if self.journal is not None:
+            command["journal_seq"] = self.journal.append(command)
+
+        self._put(command)
+
+    def subscribe(self, listener: Callable[[], None]):
+        """Đăng ký hàm được gọi mỗi khi có command mới (ngoài lock của queue)"""
+        self._listeners.append(listener)
+
+    def _put(self, command: ATMCommand):
         with self._lock:
             self._queue.put(command)
             self.has_data_event.set()
 
+        for listener in self._listeners:
+            listener()
+
+    def mark_executed(self, commands: list[ATMCommand]):
+        """Checkpoint journal sau khi các command lấy ra đã được thực thi"""
+        if self.journal is not None:
+            self.journal.mark_done(
+                [cmd["journal_seq"] for cmd in commands if "journal_seq" in cmd]
+            )
+
     def get_all(self) -> list[ATMCommand]:
         """Lấy tất cả commands (để xử lý batch)"""
         commands = []
@@ -1,47 +1,214 @@
+import json
 import threading
 import socket
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, cast
 
 from rmi_framework.v2 import LocateRegistry
 
 from .command_queue import CommandQueue
 from .command_executor import CommandExecutor
 from .event_emitter import EventEmitter
-from .config import PEER_ID, get_peer_config
-
-from shared.models.server import ATMCommand
+from .replication_backlog import ReplicationBacklog
+from .replication import ReplicationError, ReplicationReceiver
+from .sync_window import SyncWindow
+from .idempotency import Outcome
+from .token_lease import TokenLease
+from .shard_ownership import ForwardingConfig, ShardOwnership, shard_of
+from .config import (
+    COMMAND_FORWARDING,
+    PEER_ID,
+    SHARD_COUNT,
+    SYNC_BATCH_MAX,
+    SYNC_WINDOW,
+    TOKEN_LEASE,
+    get_peer_configs,
+)
+
+from shared.models.server import (
+    ATMCommand,
+    ForwardOutcome,
+    ReplicationWatermark,
+    TokenLoad,
+)
+from shared.interfaces.client import SuccessCallback
 from shared.interfaces.server import PeerService
 
 
+class _OutcomeCollector:
+    """Thay callback của ATM cho command peer forward sang: giữ kết quả để trả về peer"""
+
+    def __init__(self):
+        self.args: List[str] = []
+        self.done = threading.Event()
+
+    def notify(self, *args):
+        self.args = list(args)
+        self.done.set()
+
+
+class _ForwardRequest:
+    """Các command server khác forward sang, chờ worker thực thi"""
+
+    def __init__(
+        self,
+        origin_id: int,
+        commands: List[ATMCommand],
+        position: Optional[ReplicationWatermark] = None,
+    ):
+        self.origin_id = origin_id
+        self.commands = commands
+        # Cuối log của server gửi lúc forward: áp dụng log tới đó rồi mới thực thi
+        self.position = position
+        # id(cmd) -> bộ thu kết quả, chỉ có với command được nhận thực thi
+        self.collectors: Dict[int, _OutcomeCollector] = {}
+        # Bộ thu của command trùng idempotency key với command khác (không thực
+        # thi), chờ kết quả của command đó
+        self.waiting: List[_OutcomeCollector] = []
+        self.done = threading.Event()
+        # Server gửi đã hết thời gian chờ (tự xử lý lại các command): không thực thi
+        self.abandoned = False
+
+    def outcomes(self) -> List[ForwardOutcome]:
+        outcomes: List[ForwardOutcome] = []
+        for cmd in self.commands:
+            collector = self.collectors.get(id(cmd))
+            outcomes.append(
+                {
+                    "accepted": collector is not None,
+                    "notify": collector.args if collector is not None else [],
+                }
+            )
+        return outcomes
+
+
 class Coordinator:
+    # Chờ server giữ shard trao shard đã xin, quá hạn thì xin lại (s); cũng là thời
+    # gian tối đa server khác chờ kết quả của các command nó forward sang
+    SHARD_REQUEST_TIMEOUT = 5.0
+    # Shard vừa nhận/chiếm chờ áp dụng log của các server khác tới watermark; không
+    # áp dụng được gì thêm trong thời gian này (server đó không liên lạc được) thì
+    # dùng shard luôn (s)
+    CATCH_UP_TIMEOUT = 2.0
+    # Server nhận chưa áp dụng hết đoạn log (chờ log của server khác, log bị hở):
+    # gửi lại sau (s)
+    SYNC_RETRY_DELAY = 0.2
+
     def __init__(
         self,
         command_queue: CommandQueue,
         command_executor: CommandExecutor,
         event_emitter: EventEmitter,
+        backlog: ReplicationBacklog,
+        receiver: ReplicationReceiver,
+        peer_service_proxies: Optional[Dict[int, PeerService]] = None,
+        node_id: int = PEER_ID,
+        shard_count: int = SHARD_COUNT,
+        forwarding: ForwardingConfig = COMMAND_FORWARDING,
     ):
+        """
+        Args:
+            backlog: Backlog có mốc ack cho từng server trong peer_service_proxies
+            receiver: Áp dụng log các server khác gửi sang (kiểm tra watermark khi nhận shard)
+            peer_service_proxies: PeerService của từng server khác theo ID, None =
+                lookup qua registry theo get_peer_configs() (truyền vào khi
+                benchmark/chạy trong 1 process)
+            node_id: ID của server này
+            shard_count: Số shard của không gian số thẻ, mọi server phải giống nhau
+                (1 = 1 token chung như thiết kế cũ)
+            forwarding: Forward command của shard chưa sở hữu cho server giữ shard
+                thực thi thay vì xin shard về
+        """
         self.queue = command_queue
         self.executor = command_executor
         self.emitter = event_emitter
+        # Các command đã thực thi nhưng còn server chưa nhận
+        self.backlog = backlog
+        self.receiver = receiver
+        self.node_id = node_id
+
+        if peer_service_proxies is None:
+            peer_service_proxies = {}
+            self.peer_registries = {}
+
+            for peer_id, peer_conf in get_peer_configs().items():
+                # Lookup peer service
+                # Dùng mux connection: worker loop và các thread sync/forward
+                # gọi peer đồng thời trên cùng một proxy
+                registry = LocateRegistry.get_registry(
+                    address=peer_conf["host"], port=peer_conf["port"], multiplexed=True
+                )
+                self.peer_registries[peer_id] = registry
+                peer_service_proxies[peer_id] = registry.lookup("peer", PeerService)
+
+        self.peers = peer_service_proxies
+        # Server trả lời lần thăm dò gần nhất
+        self._alive: Set[int] = set()
+
+        # State: shard nào thuộc server này, server nào giữ các shard còn lại,
+        # shard nào đang bị đòi
+        self.forwarding = forwarding
+        self.shards = ShardOwnership(
+            shard_count,
+            TOKEN_LEASE["idle_grace"],
+            forwarding["migrate_after"],
+            forwarding["migrate_window"],
+            self.SHARD_REQUEST_TIMEOUT,
+        )
+        # Command chờ shard chưa sở hữu (chỉ worker dùng)
+        self.parked: List[ATMCommand] = []
+        # Có thay đổi cần worker xét lại các command đang chờ (nhận shard, forward xong)
+        self._recheck = False
+        # depends_on gắn vào log gần nhất (chỉ worker dùng), chỉ gắn lại khi thay đổi
+        self._last_depends_on: List[ReplicationWatermark] = []
+        # Shard chờ áp dụng log tới watermark: (lúc bắt đầu chờ, shards, watermarks)
+        self._catch_ups: List[Tuple[float, List[int], List[ReplicationWatermark]]] = []
+
+        # Forward: command server khác gửi sang chờ thực thi (và chờ shard đang
+        # catching up hoặc log của server gửi, chỉ worker dùng), command trả về (server giữ shard không
+        # nhận), thẻ có command đang forward (các command sau của thẻ phải chờ)
+        self._incoming_forwards: List[_ForwardRequest] = []
+        self._deferred_forwards: List[_ForwardRequest] = []
+        self._returned: List[ATMCommand] = []
+        self._in_flight_cards: Set[str] = set()
+        # (server giữ shard, command) chờ thread _forward_loop gửi đi
+        self._outbox: List[Tuple[int, ATMCommand]] = []
+        self.outbox_cond = threading.Condition()
 
-        peer_conf = get_peer_config()
-
-        # Lookup peer service
-        self.peer_registry = LocateRegistry.get_registry(
-            address=peer_conf["host"], port=peer_conf["port"]
+        self.lock = threading.Lock()
+        # Worker ngủ trên condition này, được đánh thức khi state thay đổi:
+        # command mới, server khác đòi shard, nhận shard, sync nền xong
+        self.state_changed = threading.Condition(self.lock)
+        # Worker và thread sync nền không gửi cùng 1 đoạn backlog 2 lần cho 1 server
+        self.sync_locks = {peer_id: threading.Lock() for peer_id in self.peers}
+
+        # Gom các batch liên tiếp vào 1 lần sync (thread _sync_loop), gửi song song
+        # cho mọi server: mỗi server tối đa 1 lần sync đang chạy + 1 lần chờ
+        self.sync_window = SyncWindow(**SYNC_WINDOW)
+        self.sync_cond = threading.Condition()
+        self._unsynced_commands = 0
+        self._unsynced_bytes = 0
+        self._window_opened = 0.0
+        self._sync_scheduled: Set[int] = set()
+        self.sync_pool = ThreadPoolExecutor(
+            max_workers=2 * max(1, len(self.peers)), thread_name_prefix="sync"
         )
-        self.peer_service_proxy = self.peer_registry.lookup("peer", PeerService)
 
-        # State
-        self.has_token = False
-        self.peer_demanding = False
-        self.pending_sync_logs: List[ATMCommand] = []
+        # Lease: giữ shard đang dùng bao lâu khi server khác đòi
+        self.lease = TokenLease(**TOKEN_LEASE)
 
-        self.lock = threading.Lock()
-        self.token_event = threading.Event()
+        self.queue.subscribe(self.lease.on_arrival)
+        self.queue.subscribe(self._wake)
 
-        self._initial_token_check()
+        self._initial_ownership_check()
         threading.Thread(target=self._worker_loop, daemon=True).start()
+        threading.Thread(target=self._sync_loop, daemon=True).start()
+        if forwarding["enabled"]:
+            self.forward_pool = ThreadPoolExecutor(
+                max_workers=max(1, len(self.peers)), thread_name_prefix="forward"
+            )
+            threading.Thread(target=self._forward_loop, daemon=True).start()
 
     # def _initial_token_check(self):
     #     if PEER_ID == 1:
@@ -53,54 +220,105 @@ class Coordinator:
     #         with self.lock:
     #             self.has_token = False
     #         print(f">> [STARTUP] I am Server {PEER_ID}. Waiting.")
-    def _initial_token_check(self):
-        print(f">> Server [{PEER_ID}] started. Checking peer token status...")
-
-        try:
-            # Nếu Peer tắt -> Bị ConnectionRefusedError ngay lập tức, xử lý trong except
-            # Nếu Peer bật -> Trả về True/False
-            peer_has_token = self.peer_service_proxy.get_token_status()
-            print(f"\tPeer is ALIVE. Peer holding token: {peer_has_token}")
-
-            if peer_has_token:
-                # Peer đang giữ Token -> Mình nhịn
-                with self.lock:
-                    self.has_token = False
-                print("\tPeer holds the token, wait.")
-
-            else:
-                # Peer sống nhưng không giữ Token (Cả 2 cùng khởi động)
-                # Dùng ID để phân xử
-                if PEER_ID == 1:
-                    print("\tPeer ID:1 -> Seize token.")
-                    with self.lock:
-                        self.has_token = True
-                    self.token_event.set()
-                else:
-                    print("\tPeer ID:2 -> Wait token.")
-                    with self.lock:
-                        self.has_token = False
+    def _initial_ownership_check(self):
+        print(
+            f">> Server [{self.node_id}] started."
+            f" Checking shard ownership of {len(self.peers)} peers..."
+        )
+        all_shards = range(self.shards.shard_count)
+
+        # Server tắt/chưa mở -> ConnectionRefusedError ngay lập tức, coi như không sống
+        held = self._probe_owners()
+        taken = {shard for owned in held.values() for shard in owned}
+        print(f"\t{len(held)} peers ALIVE, holding {len(taken)} shards.")
+
+        if taken:
+            # Cụm đang chạy -> Chỉ nhận các shard không ai (còn sống) giữ, còn lại xin khi cần
+            mine = [shard for shard in all_shards if shard not in taken]
+        elif held:
+            # Có server sống nhưng không giữ shard nào (Cùng khởi động)
+            # Chia theo thứ tự ID trong SERVER_CONFIG: mọi server chia giống nhau
+            # kể cả khi thấy tập server sống khác nhau. Phần của server chưa chạy
+            # được chiếm khi cần (failover)
+            members = sorted({*self.peers, self.node_id})
+            owners = {shard: members[shard % len(members)] for shard in all_shards}
+            mine = [shard for shard, owner in owners.items() if owner == self.node_id]
+            for shard, owner in owners.items():
+                if owner != self.node_id:
+                    self.shards.set_owner(owner, [shard])
+        else:
+            # Không server nào sống
+            print("\tNo peer reachable. Seize all shards.")
+            mine = list(all_shards)
+
+        # Có server sống: log của chúng có thể chưa áp dụng hết (VD: sau khi mất
+        # kết nối), chưa dùng shard tới khi áp dụng xong
+        watermarks = self._peer_positions() if held else []
+        catching_up = not self.receiver.caught_up(watermarks)
+        self.shards.assign(mine, catching_up=catching_up)
+        if catching_up:
+            self._track_catch_up(mine, watermarks)
+        if taken and mine:
+            # Shard của server đã chết: báo để các server khác forward/xin đúng chỗ
+            self._announce_shards(mine)
+        print(f"\tHolding {len(mine)}/{self.shards.shard_count} shards.")
+
+    def _probe_owners(self) -> Dict[int, List[int]]:
+        """
+        Hỏi mọi server đang giữ shard nào, cập nhật thông tin server giữ shard.
 
-        except (ConnectionRefusedError, OSError):
-            # Peer chết/chưa mở
-            # ConnectionRefusedError bắt được ngay lập tức
-            print("\tPeer unreachable (ConnectionRefused). Seize the Token.")
-            with self.lock:
-                self.has_token = True
-            self.token_event.set()
+        Returns:
+            Dict[int, List[int]]: Shard của từng server trả lời được
+        """
+        held: Dict[int, List[int]] = {}
+
+        for peer_id, peer in self.peers.items():
+            try:
+                held[peer_id] = peer.get_owned_shards()
+            except (ConnectionRefusedError, OSError):
+                pass
+            except Exception as e:
+                # Các lỗi khác (như lỗi RPC Fault...) gần như không bao giờ xảy ra
+                print(f"\tUnexpected error probing peer {peer_id}: {e}")
+
+        self._alive = set(held)
+        owners = {shard: peer_id for peer_id, owned in held.items() for shard in owned}
+        for shard in range(self.shards.shard_count):
+            self.shards.set_owner(owners.get(shard), [shard])
+
+        return held
+
+    def _peer_positions(self) -> List[ReplicationWatermark]:
+        """Vị trí cuối log của các server đang sống (phải áp dụng tới đó mới bắt kịp)"""
+        positions: List[ReplicationWatermark] = []
+
+        for peer_id in sorted(self._alive):
+            try:
+                positions.append(self.peers[peer_id].get_replication_position())
+            except Exception as e:
+                print(f"\tCannot get replication position of peer {peer_id}: {e}")
+
+        return positions
+
+    def _track_catch_up(self, shards: List[int], watermarks: List[ReplicationWatermark]):
+        """Các shard (đã đánh dấu catching up) chờ áp dụng log tới watermarks"""
+        self.receiver.expect(watermarks)
+        with self.lock:
+            self._catch_ups.append((time.monotonic(), shards, watermarks))
+        print(
+            f">> [CATCH-UP] {len(shards)} shards wait for"
+            f" {sum(self.receiver.remaining(watermarks).values())} commands from peers."
+        )
 
-        except Exception as e:
-            # Các lỗi khác (như lỗi RPC Fault...)
-            # Trường hợp này gần như không bao giờ xảy ra, nhưng nếu có thì tự chiếm token
-            print(f"\tUnexpected error probing peer: {e}")
-            with self.lock:
-                self.has_token = True
-            self.token_event.set()
+    def _catch_up_deadline(self, started: float) -> float:
+        """Hết hạn chờ khi không áp dụng được gì thêm trong CATCH_UP_TIMEOUT"""
+        return max(started, self.receiver.last_applied_at() or 0.0) + self.CATCH_UP_TIMEOUT
 
     def _sanitize_logs(self, logs: List[ATMCommand]):
         """
         Làm sạch các command trước khi gửi đi (tránh bị Fault do callback là object)
-        Loại bỏ 'success_callback' vì nó là Remote Object không thể serialize qua XML-RPC.
+        Loại bỏ 'success_callback' vì nó là Remote Object không thể serialize qua XML-RPC,
+        và 'journal_seq' vì chỉ có nghĩa với journal của server này.
         Tạo bản copy để không ảnh hưởng dữ liệu gốc.
         """
         clean_logs = []
@@ -110,170 +328,696 @@ class Coordinator:
             clean_cmd = cmd.copy()
             if "success_callback" in clean_cmd:
                 del clean_cmd["success_callback"]
+            clean_cmd.pop("journal_seq", None)
             clean_logs.append(clean_cmd)
 
         return clean_logs
 
-    def is_holding_token(self):
+    def _wake(self, recheck: bool = False):
         with self.lock:
-            return self.has_token
+            self._recheck = self._recheck or recheck
+            self.state_changed.notify_all()
+
+    def _quantum_of(self, queue_depth: int) -> Callable[[int], float]:
+        return lambda peer_id: self.lease.quantum(queue_depth, peer_id)
+
+    def _wait_for_work(self):
+        """Ngủ tới khi worker có việc (gọi khi đang giữ self.lock)"""
+        while (
+            self.queue.is_empty()
+            and not self._recheck
+            and not self._incoming_forwards
+        ):
+            # Server khác đang đòi shard: dậy khi shard rảnh hoặc hết quantum
+            timeout = self.shards.handover_delay(self._quantum_of(0))
+            if timeout == 0:
+                return
+
+            deadlines = [self._catch_up_deadline(started) for started, _, _ in self._catch_ups]
+            if self.parked:
+                # Shard đã xin nhưng chưa được trao: dậy để xin lại khi quá hạn
+                deadline = self.shards.next_request_deadline()
+                if deadline is not None:
+                    deadlines.append(deadline)
+            if deadlines:
+                remaining = min(deadlines) - time.monotonic()
+                if remaining <= 0:
+                    return
+                timeout = remaining if timeout is None else min(timeout, remaining)
+
+            self.state_changed.wait(timeout)
+
+    def shard_stats(self):
+        """Thống kê shard (đang giữ, bị đòi, số lần trao/nhận) và lease"""
+        return {
+            **self.shards.stats(),
+            **self.lease.stats(self.queue.size()),
+            "parked": len(self.parked),
+            "alive_peers": sorted(self._alive),
+            "catch_up_remaining": [
+                self.receiver.remaining(watermarks) for _, _, watermarks in self._catch_ups
+            ],
+        }
+
+    def replication_stats(self):
+        """Thống kê sync và replication lag (command/thời gian còn server chưa xác nhận)"""
+        return {
+            **self.sync_window.stats(self.backlog.pending_count()),
+            "lag_by_peer": {
+                peer_id: self.backlog.pending_count(peer_id) for peer_id in self.peers
+            },
+        }
+
+    def get_owned_shards(self) -> List[int]:
+        return self.shards.owned()
+
+    def get_replication_position(self) -> ReplicationWatermark:
+        """Vị trí cuối log của server này: server khác áp dụng tới đây là bắt kịp"""
+        return {
+            "origin_id": self.node_id,
+            "epoch": self.backlog.epoch,
+            "applied": self.backlog.last_seq(),
+        }
 
     def on_peer_alive(self):
         """
-        Được gọi khi Peer vừa thăm dò mình.
-        Nghĩa là Peer đã sống lại -> Tranh thủ đẩy dữ liệu tồn đọng sang ngay.
+        Được gọi khi 1 server vừa thăm dò mình.
+        Nghĩa là server đó đã sống lại -> Tranh thủ đẩy dữ liệu tồn đọng sang ngay.
         """
-        # Kiểm tra nhanh xem có gì để gửi không
-        with self.lock:
-            has_pending = len(self.pending_sync_logs) > 0
-            has_token = self.has_token
-
-        # Chỉ gửi nếu mình đang giữ Token và có dữ liệu chưa gửi
-        if has_token and has_pending:
+        if self.backlog.pending_count() > 0:
             print(">> Peer is back, triggering immediate background sync...")
-            # Chạy trong thread riêng để không block hàm remote
-            threading.Thread(target=self._sync_data_only, daemon=True).start()
+            # Gửi trong thread sync, không block hàm remote
+            self._sync_data_only()
 
-    def set_peer_demanding(self, status: bool):
-        """Đánh dấu rằng peer kia đang cần token"""
-        with self.lock:
-            self.peer_demanding = status
+    def on_shards_requested(
+        self, requester_id: int, shards: List[int], load: Optional[TokenLoad] = None
+    ):
+        """
+        Server requester_id đòi các shard này (load: tải của server đó, để tính lease).
+        Shard mình không giữ thì xin về từ server đang giữ rồi trao lại.
+        """
+        self.lease.set_peer_load(requester_id, load)
+        # Mình ghi nhận chính server đòi đang giữ shard: thông tin đã cũ
+        # (hoặc 2 bên trao/xin cùng lúc), hỏi lại khi xin shard về
+        self.shards.set_owner(
+            None, [shard for shard in shards if self.shards.owner_of(shard) == requester_id]
+        )
+        self.shards.demand(requester_id, shards)
+        # Shard mình không giữ: worker phải dậy để xin về
+        self._wake(recheck=True)
+
+    def accept_shards(
+        self, giver_id: int, shards: List[int], watermarks: List[ReplicationWatermark]
+    ):
+        """
+        Nhận các shard server giver_id trao (server đó đã sync hết log trước đó).
+        Shard chỉ được dùng (và trao tiếp) khi log của các server khác đã áp dụng
+        tới watermarks.
+        """
+        catching_up = not self.receiver.caught_up(watermarks)
+        self.shards.acquire(shards, catching_up=catching_up)
+        if catching_up:
+            self._track_catch_up(shards, watermarks)
 
-    def accept_token(self):
-        """Đánh dấu mình cầm token"""
+        self._announce_shards(shards, exclude=giver_id)
+        self._wake(recheck=True)
+        print(f">> [SHARD] Received {len(shards)} shards from Peer {giver_id}.")
+
+    def on_log_applied(self):
+        """
+        Vừa áp dụng log của 1 server khác: xét lại các shard đang catching up và
+        các command forward đang chờ log
+        """
         with self.lock:
-            self.has_token = True
-            self.peer_demanding = False
-            self.token_event.set()
-        print(">> [TOKEN] Received Token from Peer.")
+            if self._catch_ups or self._deferred_forwards:
+                self._recheck = True
+                self.state_changed.notify_all()
+
+    def on_shards_announced(self, owner_id: int, shards: List[int]):
+        """Server owner_id báo vừa nhận các shard này"""
+        self.shards.set_owner(owner_id, shards)
 
-    def handle_incoming_sync(self, logs: List[ATMCommand]):
-        self.emitter.emit(self.executor.exec_direct, [logs])
+    def execute_forwarded(
+        self,
+        origin_id: int,
+        commands: List[ATMCommand],
+        position: Optional[ReplicationWatermark] = None,
+    ) -> List[ForwardOutcome]:
+        """
+        Thực thi các command server origin_id forward sang (trong worker, cùng
+        batch với command của server này), chờ tới khi có kết quả.
+        position: cuối log của server gửi, chỉ thực thi khi đã áp dụng log tới đó
+
+        Raises:
+            TimeoutError: Nếu worker không xử lý kịp trong SHARD_REQUEST_TIMEOUT
+        """
+        request = _ForwardRequest(origin_id, commands, position)
+        with self.lock:
+            self._incoming_forwards.append(request)
+            self.state_changed.notify_all()
+
+        deadline = time.monotonic() + self.SHARD_REQUEST_TIMEOUT
+        if not request.done.wait(self.SHARD_REQUEST_TIMEOUT):
+            request.abandoned = True
+            raise TimeoutError("Forwarded commands were not executed in time")
+        # Không chờ được kết quả thì báo không rõ kết quả (notify rỗng)
+        for collector in request.waiting:
+            collector.done.wait(max(0.0, deadline - time.monotonic()))
+        return request.outcomes()
 
     def _worker_loop(self):
         print(">> [COORDINATOR] Worker started.")
         while True:
-            # Ngủ 0.25s để check state liên tục
-            self.queue.wait_for_data(timeout=0.25)
-
             with self.lock:
-                am_holding_token = self.has_token
-                is_peer_demanding = self.peer_demanding
-                is_queue_empty = self.queue.is_empty()
-
-            # 1. KỊCH BẢN: NHƯỜNG TOKEN (Khi rảnh + Bị đòi)
-            if am_holding_token and is_peer_demanding and is_queue_empty:
-                self._sync_and_pass_token()
-                continue
+                # Ngủ tới khi có việc, không poll theo chu kỳ
+                self._wait_for_work()
+                self._recheck = False
+                incoming, self._incoming_forwards = self._incoming_forwards, []
+                returned, self._returned = self._returned, []
+                busy_cards = set(self._in_flight_cards)
+
+            # 0. Shard vừa nhận đã áp dụng đủ log thì dùng được
+            self._check_catch_ups()
+            with self.lock:
+                # Giữ lock: log áp dụng sau lần kiểm tra này thấy request đang chờ
+                # và đánh thức worker (on_log_applied)
+                incoming, self._deferred_forwards = self._defer_catching_up(
+                    self._deferred_forwards + incoming
+                )
+
+            # 1. Thực thi các command thuộc shard mình giữ (hoặc chỉ cộng tiền)
+            # cùng các command server khác forward sang, command của shard chưa giữ thì chờ
+            commands = returned + self.parked + self.queue.get_all()
+            runnable, self.parked = self.shards.split(commands, busy_cards)
+            runnable += self._accept_forwarded(incoming)
+            if runnable:
+                self._execute(runnable)
+            for request in incoming:
+                request.done.set()
+
+            # 2. Trao các shard bị đòi (rảnh hoặc đã giữ đủ quantum) cho từng server đòi
+            releasable = self.shards.releasable(self._quantum_of(self.queue.size()))
+            for requester_id, shards in releasable.items():
+                self._sync_and_pass_shards(requester_id, shards)
+
+            # 3. Forward command của shard chưa giữ cho server giữ shard (server đó
+            # tự trao shard khi lượng forward đủ lớn), tắt forward thì xin shard về
+            if self.forwarding["enabled"]:
+                self.parked = self._forward_parked(self.parked, busy_cards)
+            else:
+                self.shards.want(
+                    shard
+                    for shard in map(self.shards.required_shard, self.parked)
+                    if shard is not None
+                )
+
+            missing = self.shards.to_request(self.parked, self.SHARD_REQUEST_TIMEOUT)
+            if missing:
+                print(f">> [WORKER] Data waiting. Requesting {len(missing)} shards...")
+                self._request_shards(missing)
+
+    def _execute(self, commands: List[ATMCommand]):
+        success_cmds = self.executor.exec_direct(commands)
+        # Sanitize 1 lần khi đưa vào backlog
+        clean_cmds = self._sanitize_logs(success_cmds)
+        if clean_cmds:
+            self._attach_depends_on(clean_cmds[0])
+        last_seq = self.backlog.append(clean_cmds)
+        # Đánh dấu journal sau khi đã vào backlog: crash ở giữa thì command được
+        # chạy lại (bỏ qua nhờ command_id) và vẫn vào backlog
+        self.queue.mark_executed(commands)
+
+        if clean_cmds:
+            self.sync_window.on_append(last_seq, len(clean_cmds))
+            # Sync nhưng không trao shard (gom với các batch sau trong cửa sổ sync)
+            self._schedule_sync(clean_cmds)
+
+    def _attach_depends_on(self, cmd: ATMCommand):
+        """
+        Gắn vị trí log của các server khác đã áp dụng (đọc sau khi thực thi nên
+        không nhỏ hơn phần dữ liệu batch đã thấy) vào command đầu của batch:
+        server nhận chỉ áp dụng batch khi đã áp dụng log các server đó tới đây.
+        Chỉ có 2 server thì server nhận luôn thấy log của chính nó, không cần gắn
+        """
+        if len(self.peers) < 2:
+            return
 
-            # 2. KỊCH BẢN: CÓ VIỆC CẦN LÀM
-            if not is_queue_empty:
-                # Chưa có Token -> Xin
-                if not am_holding_token:
-                    print(">> [WORKER] Data waiting. Requesting Token...")
-                    success = self._request_token_logic()
-                    if success:
-                        am_holding_token = True
-                    else:
-                        continue
-
-                # Đã có Token -> Xử lý
-                if am_holding_token:
-                    commands = self.queue.get_all()
-                    # print("Execute:", commands) # Debug
-
-                    if commands:
-                        success_cmds = self.executor.exec_direct(commands)
-                        with self.lock:
-                            self.pending_sync_logs.extend(success_cmds)
-
-                        # Sync thay đổi, và pass token hay không tùy trường hợp bên kia cần không
-                        with self.lock:
-                            still_demanding = self.peer_demanding
-                            has_pending_logs = len(self.pending_sync_logs) > 0
-
-                        if still_demanding:
-                            # Nếu Peer đòi -> Sync + Pass Token luôn
-                            self._sync_and_pass_token()
-                        elif has_pending_logs:
-                            # Nếu Peer KHÔNG đòi nhưng có dữ liệu mới -> Sync nhưng không pass token
-                            self._sync_data_only()
-
-    def _request_token_logic(self) -> bool:
-        try:
-            self.peer_service_proxy.request_token()
-            got_token = self.token_event.wait(timeout=5.0)
+        depends_on = self.receiver.watermarks(self.peers)
+        if depends_on != self._last_depends_on:
+            cmd["depends_on"] = depends_on
+            self._last_depends_on = depends_on
 
-            if got_token:
-                return True
+    def _check_catch_ups(self):
+        with self.lock:
+            pending, self._catch_ups = self._catch_ups, []
+
+        waiting = []
+        for started, shards, watermarks in pending:
+            if self.receiver.caught_up(watermarks):
+                print(f">> [CATCH-UP] Done, {len(shards)} shards usable.")
+                self.shards.caught_up(shards)
+            elif time.monotonic() >= self._catch_up_deadline(started):
+                print(
+                    f">> [WARNING] No log applied for {self.CATCH_UP_TIMEOUT}s,"
+                    f" still behind {self.receiver.remaining(watermarks)}."
+                    f" Using {len(shards)} shards anyway."
+                )
+                self.shards.caught_up(shards)
             else:
-                print(">> [TIMEOUT] Peer did not reply in 5s.")
-                return False
+                waiting.append((started, shards, watermarks))
 
-        except (ConnectionRefusedError, OSError, socket.error):
-            print(">> [FAILOVER] Peer DOWN. Seizing Token.")
+        if waiting:
             with self.lock:
-                self.has_token = True
-                self.token_event.set()
-                self.peer_demanding = False
+                self._catch_ups.extend(waiting)
+
+    def _defer_catching_up(
+        self, requests: List[_ForwardRequest]
+    ) -> Tuple[List[_ForwardRequest], List[_ForwardRequest]]:
+        """
+        Chia thành (xử lý ngay, chờ): request có command thuộc shard đang catching
+        up hoặc chưa áp dụng log của server gửi tới position thì chờ, request
+        server gửi đã bỏ thì không thực thi
+        """
+        ready: List[_ForwardRequest] = []
+        deferred: List[_ForwardRequest] = []
+
+        for request in requests:
+            if request.abandoned:
+                request.done.set()
+            elif any(
+                self.shards.is_catching_up(self.shards.required_shard(cmd))
+                for cmd in request.commands
+            ) or (
+                request.position is not None
+                and not self.receiver.caught_up([request.position])
+            ):
+                deferred.append(request)
+            else:
+                ready.append(request)
+
+        return ready, deferred
+
+    def _request_shards(self, shards: List[int]):
+        """
+        Xin shard từ server đang giữ. Không rõ server nào giữ (hoặc server đó
+        không liên lạc được) thì hỏi lại mọi server, shard không ai còn sống
+        giữ thì xử lý như failover (_claim_orphans)
+        """
+        load = self.lease.local_load(self.queue.size())
+        unknown: List[int] = []
+
+        for owner_id, group in self._group_by_owner(shards).items():
+            if owner_id is None or not self._send_request(owner_id, group, load):
+                unknown.extend(group)
+
+        if not unknown:
+            return
+
+        self._probe_owners()
+        orphans: List[int] = []
+        for owner_id, group in self._group_by_owner(unknown).items():
+            if owner_id is None or not self._send_request(owner_id, group, load):
+                orphans.extend(group)
+
+        if orphans:
+            self._claim_orphans(orphans, load)
+
+    def _group_by_owner(self, shards: Iterable[int]) -> Dict[Optional[int], List[int]]:
+        groups: Dict[Optional[int], List[int]] = {}
+        for shard in shards:
+            groups.setdefault(self.shards.owner_of(shard), []).append(shard)
+        return groups
+
+    def _send_request(self, peer_id: int, shards: List[int], load: TokenLoad) -> bool:
+        """
+        Returns:
+            bool: False nếu server peer_id không liên lạc được
+        """
+        try:
+            # Shard được trao qua replicate, hết SHARD_REQUEST_TIMEOUT thì xin lại
+            self.peers[peer_id].request_shards(self.node_id, shards, load)
             return True
+
+        except (ConnectionRefusedError, OSError, socket.error):
+            print(f">> [FAILOVER] Peer {peer_id} DOWN.")
+            self.shards.set_owner(None, shards)
+            self._alive.discard(peer_id)
+            return False
         except Exception as e:
             print(f">> [ERROR] Request error: {e}")
-            return False
+            return True
 
-    def _sync_and_pass_token(self):
-        """Sync dữ liệu và CHUYỂN giao Token"""
+    def _claim_orphans(self, shards: List[int], load: TokenLoad):
+        """
+        Shard không server nào còn sống giữ: server sống có ID nhỏ nhất chiếm
+        (mọi server chọn cùng 1 server nên không chiếm trùng), server khác xin từ đó
+        """
+        while True:
+            successor = min({*self._alive, self.node_id})
+            if successor == self.node_id:
+                break
+            # Server đó không liên lạc được thì bị bỏ khỏi _alive, chọn server kế tiếp
+            if self._send_request(successor, shards, load):
+                return
+
+        print(f">> [FAILOVER] Seizing {len(shards)} shards.")
+        # Chủ cũ có thể đã trao shard cho server khác đang sống: chờ áp dụng xong
+        # log của các server sống trước khi dùng
+        watermarks = self._peer_positions()
+        catching_up = not self.receiver.caught_up(watermarks)
+        self.shards.acquire(shards, seized=True, catching_up=catching_up)
+        if catching_up:
+            self._track_catch_up(shards, watermarks)
+        self._announce_shards(shards)
         with self.lock:
-            # Lấy và sanitize logs
-            logs = self._sanitize_logs(self.pending_sync_logs)
-            log_size = len(logs)
+            self._recheck = True
+
+    def _announce_shards(self, shards: List[int], exclude: Optional[int] = None):
+        """Báo cho các server khác (trừ exclude) là mình vừa nhận các shard (thread riêng)"""
+        targets = [peer_id for peer_id in self.peers if peer_id != exclude]
+        if not targets:
+            return
+
+        def announce():
+            for peer_id in targets:
+                try:
+                    self.peers[peer_id].announce_shards(self.node_id, shards)
+                except Exception:
+                    # Server đó sẽ biết khi forward/xin shard bị từ chối
+                    pass
+
+        threading.Thread(target=announce, daemon=True).start()
+
+    def _accept_forwarded(self, requests: List[_ForwardRequest]) -> List[ATMCommand]:
+        """Nhận thực thi các command forward thuộc shard mình giữ, gắn bộ thu kết quả"""
+        accepted: List[ATMCommand] = []
+
+        for request in requests:
+            # Shard đã trao đi (hoặc thẻ có command trước đó bị từ chối): server gửi xử lý lại
+            runnable, _ = self.shards.split(request.commands, origin_id=request.origin_id)
+            for cmd in runnable:
+                collector = _OutcomeCollector()
+                cmd["success_callback"] = cast(SuccessCallback, collector)
+                request.collectors[id(cmd)] = collector
+                # Lần gửi lại của key đã/đang được xử lý tại đây (VD: ATM gửi lại
+                # thẳng tới server này): nhận kết quả đó, không thực thi lại
+                if not self.executor.submit_forwarded(cmd, collector):
+                    request.waiting.append(collector)
+                    continue
+                accepted.append(cmd)
+
+        return accepted
+
+    def _forward_parked(
+        self, parked: List[ATMCommand], busy_cards: Set[str]
+    ) -> List[ATMCommand]:
+        """
+        Chuyển các command đang chờ sang outbox để forward cho server giữ shard.
 
-        # Nếu không có log nào thì vẫn phải gọi để pass token
-        print(f">> [PASS] Syncing {log_size} logs & Passing Token...")
+        Returns:
+            List[ATMCommand]: Các command vẫn phải chờ (shard đang xin về, chưa
+                biết server giữ shard, hoặc thẻ có command trước đó đang forward/đang chờ)
+        """
+        forward: List[Tuple[int, ATMCommand]] = []
+        remaining: List[ATMCommand] = []
+        held_cards = set(busy_cards)
+
+        for cmd in parked:
+            shard = self.shards.required_shard(cmd)
+            # Deposit chỉ chờ theo command trước của cùng thẻ: gửi cùng server với command đó
+            owner_id = self.shards.owner_of(
+                shard_of(cmd["card_number"], self.shards.shard_count)
+            )
+            if (
+                cmd["card_number"] in held_cards
+                or owner_id is None
+                or (shard is not None and self.shards.is_wanted(shard))
+            ):
+                if shard is not None and owner_id is None:
+                    # Chưa biết server nào giữ: xin về (hỏi lại mọi server khi xin)
+                    self.shards.want([shard])
+                remaining.append(cmd)
+                held_cards.add(cmd["card_number"])
+                continue
 
-        try:
-            # pass_token = True
-            # Nếu bên kia bị mất kết nối => sync thất bại, xử lý trong except
-            self.peer_service_proxy.receive_sync(logs, True)
+            forward.append((owner_id, cmd))
 
+        if forward:
+            self.shards.record_forwarded(len(forward))
             with self.lock:
-                # Set trạng thái và giải phóng log khi gửi thành công
-                self.has_token = False
-                self.peer_demanding = False
-                self.pending_sync_logs = self.pending_sync_logs[log_size:]
-                self.token_event.clear()
+                self._in_flight_cards.update(cmd["card_number"] for _, cmd in forward)
+            with self.outbox_cond:
+                self._outbox.extend(forward)
+                self.outbox_cond.notify_all()
+
+        return remaining
+
+    def _forward_loop(self):
+        """
+        Gửi các command trong outbox cho server giữ shard, mỗi lần tối đa
+        max_batch command, các server được gửi song song
+        """
+        while True:
+            with self.outbox_cond:
+                while not self._outbox:
+                    self.outbox_cond.wait()
+
+                limit = self.forwarding["max_batch"]
+                batch, self._outbox = self._outbox[:limit], self._outbox[limit:]
+
+            by_owner: Dict[int, List[ATMCommand]] = {}
+            for owner_id, cmd in batch:
+                by_owner.setdefault(owner_id, []).append(cmd)
+
+            for future in [
+                self.forward_pool.submit(self._forward, owner_id, commands)
+                for owner_id, commands in by_owner.items()
+            ]:
+                future.result()
+
+    def _forward(self, owner_id: int, batch: List[ATMCommand]):
+        returned: List[ATMCommand] = []
+
+        try:
+            # Server giữ shard phải thấy mọi command server này đã thực thi trước đó
+            # (VD: deposit tại chỗ rồi withdraw được forward): gửi kèm cuối log, server
+            # đó chờ áp dụng tới đó. Log được đẩy ngay (thread sync), không chờ cửa sổ sync
+            position = self.get_replication_position()
+            if self.backlog.pending_count(owner_id) > 0:
+                self._sync_data_only()
+            outcomes = self.peers[owner_id].forward_commands(
+                self.node_id, self._sanitize_logs(batch), position
+            )
+        except Exception as e:
+            # Server giữ shard chết/lỗi -> xin shard về (không ai giữ thì failover khi xin)
+            print(f">> [ERROR] Forward to peer {owner_id} failed: {e}. Requesting shards.")
+            returned = batch
+        else:
+            for cmd, outcome in zip(batch, outcomes):
+                if not outcome["accepted"]:
+                    # Server đó không còn giữ shard (vừa trao đi): hỏi lại khi xin shard
+                    self.shards.set_owner(None, [self.shards.required_shard(cmd)])
+                    returned.append(cmd)
+                    continue
+
+                # notify rỗng: không báo kết quả (VD: lỗi bất thường khi thực thi)
+                result = cast(Outcome, tuple(outcome["notify"])) if outcome["notify"] else None
+                self.executor.complete_forwarded(cmd, result)
+                self.queue.mark_executed([cmd])
+
+        self.shards.want(
+            shard
+            for shard in map(self.shards.required_shard, returned)
+            if shard is not None
+        )
+        with self.lock:
+            self._in_flight_cards.difference_update(cmd["card_number"] for cmd in batch)
+            self._returned.extend(returned)
+            self._recheck = True
+            self.state_changed.notify_all()
+
+    def _ship_backlog(self, peer_id: int) -> int:
+        """
+        Gửi các command server peer_id chưa áp dụng, mỗi lần tối đa SYNC_BATCH_MAX
+        command (đọc thẳng từ backlog, không copy toàn bộ).
+
+        Returns:
+            int: Số command đã gửi
+
+        Raises:
+            OSError, Fault, ReplicationError: Nếu gửi thất bại, lần sau gửi tiếp
+                từ index server đó đã xác nhận
+        """
+        shipped = 0
+
+        while True:
+            entries = self.backlog.read_pending(peer_id, SYNC_BATCH_MAX)
+            if not entries:
+                return shipped
+
+            self._replicate(peer_id, entries, [], [])
+            shipped += len(entries)
+
+    def _replicate(
+        self,
+        peer_id: int,
+        entries: List[Tuple[int, ATMCommand]],
+        pass_shards: List[int],
+        watermarks: List[ReplicationWatermark],
+    ):
+        """
+        Gửi 1 đoạn log liên tiếp cho server peer_id, ack backlog theo index server
+        đó đã áp dụng.
+
+        Raises:
+            ReplicationError: Nếu server đó chưa áp dụng hết đoạn log
+        """
+        first_index = entries[0][0] if entries else self.backlog.acked_seq(peer_id) + 1
+        last_index = first_index + len(entries) - 1
+
+        started = time.monotonic()
+        ack = self.peers[peer_id].replicate(
+            self.node_id,
+            self.backlog.epoch,
+            first_index,
+            [cmd for _, cmd in entries],
+            pass_shards,
+            watermarks,
+        )
+        self.backlog.ack(peer_id, ack["applied"])
+        # Replication lag tính tới khi mọi server đã nhận
+        self.sync_window.on_synced(
+            self.backlog.acked_seq(), len(entries), time.monotonic() - started
+        )
 
-            print(">> [INFO] Token passed.")
+        if ack["applied"] < first_index - 1:
+            self._resend(peer_id, ack["applied"])
+        if ack["applied"] < last_index:
+            raise ReplicationError(
+                f"Peer {peer_id} mới áp dụng tới index {ack['applied']}/{last_index}"
+            )
+
+    def _resend(self, peer_id: int, applied: int):
+        """Server peer_id thiếu log sau index applied (mất replication_state): gửi lại từ đó"""
+        if self.backlog.rewind(peer_id, applied):
+            print(f"\tPeer {peer_id} is missing logs after index {applied}, resending.")
+            return
+
+        # Mọi server đã xác nhận phần đó nên backlog đã dọn: không replay lại được
+        print(
+            f"\tLogs after index {applied} are gone from the backlog,"
+            f" Peer {peer_id} cannot catch up by replay."
+        )
+
+    def _sync_and_pass_shards(self, requester_id: int, shards: List[int]):
+        """Sync dữ liệu và CHUYỂN giao các shard cho server requester_id"""
+        print(
+            f">> [PASS] Syncing {self.backlog.pending_count(requester_id)} logs"
+            f" & Passing {len(shards)} shards to Peer {requester_id}..."
+        )
+
+        try:
+            with self.sync_locks[requester_id]:
+                # Nếu bên kia bị mất kết nối => sync thất bại, xử lý trong except
+                entries = self.backlog.read_pending(requester_id, SYNC_BATCH_MAX)
+                while len(entries) == SYNC_BATCH_MAX:
+                    self._replicate(requester_id, entries, [], [])
+                    entries = self.backlog.read_pending(requester_id, SYNC_BATCH_MAX)
+
+                # Gửi đoạn cuối (có thể rỗng) cùng với shard trong 1 lần gọi
+                # Nếu không có log nào thì vẫn phải gọi để trao shard
+                # Kèm vị trí đã áp dụng log của các server khác: server nhận chờ
+                # áp dụng tới đó (thấy mọi command các chủ cũ của shard đã thực thi)
+                watermarks = self.receiver.watermarks(
+                    peer_id for peer_id in self.peers if peer_id != requester_id
+                )
+                self._replicate(requester_id, entries, shards, watermarks)
+
+            # Chỉ worker thực thi command nên không có command nào chạy trên
+            # các shard này giữa lúc server đó nhận và lúc bỏ khỏi danh sách
+            self.shards.release(requester_id, shards)
+            print(">> [INFO] Shards passed.")
 
         except (ConnectionRefusedError, OSError):
-            print(">> [ERROR] Peer died during pass. Keeping Token.")
-            with self.lock:
-                self.peer_demanding = False
+            print(f">> [ERROR] Peer {requester_id} died during pass. Keeping shards.")
+            self.shards.withdraw_demand(shards)
         except Exception as e:
             print(f">> [ERROR] Pass failed: {e}")
-            with self.lock:
-                self.peer_demanding = False
+            self.shards.withdraw_demand(shards)
 
-    def _sync_data_only(self):
-        """Sync dữ liệu nhưng giữ lại Token (Background Sync)"""
-        with self.lock:
-            logs = self._sanitize_logs(self.pending_sync_logs)
-            log_size = len(logs)
+    def _schedule_sync(self, commands: List[ATMCommand]):
+        """Đưa các command vừa thực thi vào cửa sổ sync, _sync_loop sẽ gửi"""
+        size = sum(len(json.dumps(cmd, ensure_ascii=False)) for cmd in commands)
 
-        print(f">> Pushing {log_size} logs to Peer (Keep Token)...")
+        with self.sync_cond:
+            if self._unsynced_commands == 0:
+                self._window_opened = time.monotonic()
+            self._unsynced_commands += len(commands)
+            self._unsynced_bytes += size
+            self.sync_cond.notify_all()
 
-        try:
-            # pass_token = False
-            self.peer_service_proxy.receive_sync(logs, False)
+    def _sync_loop(self):
+        """Sync nền: chờ cửa sổ gom đầy hoặc hết hạn rồi gửi backlog cho mọi server"""
+        while True:
+            with self.sync_cond:
+                while self._unsynced_commands == 0:
+                    self.sync_cond.wait()
+
+                deadline = self._window_opened + self.sync_window.delay()
+                while not self.sync_window.is_full(
+                    self._unsynced_commands, self._unsynced_bytes
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.sync_cond.wait(remaining)
+
+                self._unsynced_commands = 0
+                self._unsynced_bytes = 0
+
+            # Backlog có thể đã được gửi kèm lúc trao shard
+            if self.backlog.pending_count() > 0:
+                self._sync_data_only()
 
-            with self.lock:
-                # Xóa logs đã gửi để tránh gửi trùng lần sau
-                self.pending_sync_logs = self.pending_sync_logs[log_size:]
+    def _sync_data_only(self):
+        """Sync dữ liệu nhưng giữ lại shard (Background Sync), song song cho mọi server"""
+        with self.sync_cond:
+            targets = [
+                peer_id
+                for peer_id in self.peers
+                if peer_id not in self._sync_scheduled
+                and self.backlog.pending_count(peer_id) > 0
+            ]
+            self._sync_scheduled.update(targets)
+
+        for peer_id in targets:
+            self.sync_pool.submit(self._sync_peer, peer_id)
+
+    def _sync_peer(self, peer_id: int):
+        with self.sync_cond:
+            # Từ đây command mới sẽ được lần sync sau gửi
+            self._sync_scheduled.discard(peer_id)
+
+        print(
+            f">> Pushing {self.backlog.pending_count(peer_id)} logs"
+            f" to Peer {peer_id} (Keep shards)..."
+        )
 
+        try:
+            with self.sync_locks[peer_id]:
+                self._ship_backlog(peer_id)
             print("\tBackground sync success.")
+            self._wake()
 
         except (ConnectionRefusedError, OSError):
-            # Không làm gì cả, giữ logs lại trong pending_sync_logs để lần sau gửi tiếp
-            print("\t[Warning] Peer unreachable for background sync. Retrying later.")
+            # Không làm gì cả, các log chưa ack vẫn nằm trong backlog để lần sau gửi tiếp
+            print(f"\t[Warning] Peer {peer_id} unreachable for background sync. Retrying later.")
+        except ReplicationError as e:
+            # Server đó chờ log của server khác (hoặc log bị hở): gửi lại kể cả
+            # khi không có command mới
+            print(f"\t[Warning] {e}. Retrying in {self.SYNC_RETRY_DELAY}s.")
+            retry = threading.Timer(self.SYNC_RETRY_DELAY, self._sync_data_only)
+            retry.daemon = True
+            retry.start()
         except Exception as e:
-            print(f"\t[Error] Background sync failed: {e}")
+            print(f"\t[Error] Background sync to peer {peer_id} failed: {e}")
@@ -0,0 +1,101 @@
+from threading import Lock
+from typing import Callable, Dict, Iterable, Literal, Tuple
+
+from shared.models.server import ATMCommand
+
+# "off": không cache, check_balance luôn đọc DB
+# "on": check_balance đọc từ cache
+# "verify": vẫn đọc DB, so sánh với cache và báo lệch
+BalanceCacheMode = Literal["off", "on", "verify"]
+
+
+class BalanceCache:
+    """
+    Số dư của các thẻ trong RAM, key là số thẻ.
+
+    - Nạp toàn bộ từ bảng cards khi khởi động (warm)
+    - CommandExecutor cập nhật delta sau mỗi lệnh ghi đã commit thành công
+      (kể cả lệnh của peer gửi sang qua sync)
+    - Thẻ chưa có trong cache (thẻ mới tạo sau khi warm) -> đọc DB rồi lưu lại
+
+    Các thay đổi không đi qua CommandExecutor (admin sửa trực tiếp DB...)
+    sẽ làm cache lệch, dùng chế độ verify để phát hiện.
+    """
+
+    def __init__(self, verify: bool = False):
+        """
+        Args:
+            verify: True -> mỗi lần đọc vẫn lấy số dư từ DB và so với cache
+        """
+        self.verify = verify
+
+        self._lock = Lock()
+        self._balances: Dict[str, int] = {}
+        # Tăng sau mỗi lần apply, dùng để bỏ giá trị DB đọc được nếu có lệnh
+        # ghi xen vào giữa lúc đọc
+        self._version = 0
+        self._stats = {"hits": 0, "misses": 0, "verifications": 0, "drifts": 0}
+
+    def warm(self, balances: Iterable[Tuple[str, int]]):
+        """Nạp lại toàn bộ cache từ các cặp (số thẻ, số dư)"""
+        with self._lock:
+            self._balances = {number: int(balance) for number, balance in balances}
+            self._version += 1
+
+    def get_or_load(self, card_number: str, load: Callable[[], int]) -> int:
+        """
+        Lấy số dư từ cache, đọc DB bằng load() nếu chưa có (hoặc ở chế độ verify).
+        """
+        with self._lock:
+            cached = self._balances.get(card_number)
+            version = self._version
+
+            if cached is not None and not self.verify:
+                self._stats["hits"] += 1
+                return cached
+
+        db_balance = load()
+
+        with self._lock:
+            if cached is None:
+                self._stats["misses"] += 1
+                if self._version == version:
+                    self._balances.setdefault(card_number, db_balance)
+                return db_balance
+
+            self._stats["verifications"] += 1
+            current = self._balances.get(card_number)
+            if current != db_balance:
+                self._stats["drifts"] += 1
+                print(
+                    f">> [BALANCE CACHE] Lệch số dư thẻ {card_number}: "
+                    f"cache={current}, db={db_balance}"
+                )
+
+        return db_balance
+
+    def apply(self, cmd: ATMCommand):
+        """Cập nhật số dư theo command đã commit thành công"""
+        match cmd["command_type"]:
+            case "deposit":
+                deltas = [(cmd["card_number"], cmd["amount"])]
+            case "withdraw":
+                deltas = [(cmd["card_number"], -cmd["amount"])]
+            case "transfer":
+                deltas = [
+                    (cmd["card_number"], -cmd["amount"]),
+                    (cmd["to_card"], cmd["amount"]),
+                ]
+            case _:
+                return
+
+        with self._lock:
+            self._version += 1
+            for card_number, delta in deltas:
+                # Thẻ chưa có trong cache sẽ được đọc từ DB ở lần đọc tới
+                if card_number in self._balances:
+                    self._balances[card_number] += delta
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "cards": len(self._balances)}
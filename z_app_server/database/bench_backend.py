@@ -0,0 +1,113 @@
+"""
+Benchmark: backend "procedure" (callproc) vs "inline" (prepared statement)
+Chạy: python -m app_server.database.bench_backend
+
+Chạy cùng một chuỗi thao tác trên cả 2 backend:
+- check_balance, login (đọc)
+- deposit_money, withdraw_money, transfer_money (ghi, mỗi lệnh 1 transaction)
+- batch deposit/withdraw (nhiều lệnh trong 1 transaction, savepoint mỗi lệnh)
+và kiểm tra 2 backend trả về cùng message lỗi nghiệp vụ.
+"""
+
+import time
+from typing import Callable
+
+from shared.utils import now
+
+from .exceptions import SQLException
+from .main import Database, DatabaseBackend
+
+DB_ARGS = ("127.0.0.1", "root", "123456", "atm_db_s1")
+CARD_NUMBER = "111111"
+CARD_PIN = "1111"
+TO_CARD = "222222"
+ITERATIONS = 2000
+BATCH_SIZE = 20
+
+
+def print_separator(title: str):
+    """In dòng phân cách đẹp"""
+    print(f"\n{'='*60}")
+    print(f"  {title}")
+    print(f"{'='*60}")
+
+
+def measure(label: str, fn: Callable[[], None], iterations: int = ITERATIONS) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    per_op = (time.perf_counter() - started) / iterations * 1000
+
+    print(f"{label:<16}: {per_op:.3f} ms/lệnh")
+    return per_op
+
+
+def error_message(fn: Callable[[], None]) -> str:
+    try:
+        fn()
+    except SQLException as e:
+        return e.get_notify_message()
+    return "(không lỗi)"
+
+
+def run(backend: DatabaseBackend):
+    db = Database(*DB_ARGS, backend=backend)
+    reader, writer = db.reader(), db.writer()
+
+    def run_batch():
+        with writer.batch() as batch:
+            for _ in range(BATCH_SIZE // 2):
+                batch.deposit_money(CARD_NUMBER, 1, now())
+                batch.withdraw_money(CARD_NUMBER, 1, now())
+
+    try:
+        print_separator(f"BACKEND: {backend}")
+
+        results = {
+            "check_balance": measure(
+                "check_balance", lambda: reader.check_balance(CARD_NUMBER)
+            ),
+            "login": measure("login", lambda: reader.login(CARD_NUMBER, CARD_PIN)),
+            "deposit": measure(
+                "deposit", lambda: writer.deposit_money(CARD_NUMBER, 1, now())
+            ),
+            "withdraw": measure(
+                "withdraw", lambda: writer.withdraw_money(CARD_NUMBER, 1, now())
+            ),
+            "transfer": measure(
+                "transfer",
+                lambda: writer.transfer_money(CARD_NUMBER, TO_CARD, 1, now()),
+            ),
+            "batch": measure(
+                f"batch ({BATCH_SIZE})", run_batch, ITERATIONS // BATCH_SIZE
+            )
+            / BATCH_SIZE,
+        }
+
+        errors = [
+            error_message(lambda: writer.withdraw_money(CARD_NUMBER, 10**12, now())),
+            error_message(lambda: writer.transfer_money(CARD_NUMBER, CARD_NUMBER, 1, now())),
+            error_message(lambda: writer.transfer_money(CARD_NUMBER, "000000", 1, now())),
+            error_message(lambda: reader.login(CARD_NUMBER, "0000")),
+        ]
+        return results, errors
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # Lưu ý: benchmark ghi giao dịch thật vào CARD_NUMBER/TO_CARD, chạy trên DB test
+    procedure, procedure_errors = run("procedure")
+    inline, inline_errors = run("inline")
+
+    print_separator("KẾT QUẢ (ms/lệnh)")
+    for name in procedure:
+        speedup = procedure[name] / inline[name] if inline[name] else 0
+        print(
+            f"{name:<16}: procedure {procedure[name]:.3f} | "
+            f"inline {inline[name]:.3f} | x{speedup:.2f}"
+        )
+
+    print_separator("MESSAGE LỖI")
+    for old, new in zip(procedure_errors, inline_errors):
+        print(f"[{'OK' if old == new else 'KHÁC'}] {old} | {new}")
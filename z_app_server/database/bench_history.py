@@ -0,0 +1,186 @@
+"""
+Benchmark: lịch sử giao dịch trước/sau migration 001-transactions-keyset
+Chạy: python -m app_server.database.bench_history
+
+Tạo database riêng (BENCH_DB) với bảng transactions ROWS dòng ngẫu nhiên trên
+CARDS thẻ, rồi so sánh:
+- Query cũ (get_transaction_history): OR 2 cột + sort toàn bộ lịch sử của thẻ
+- Query phân trang (get_transaction_history_page): UNION ALL 2 range scan
+  trên index (thẻ, timestamp, id), trang đầu và trang sâu (theo cursor)
+Nạp 10M dòng mất vài phút, database BENCH_DB bị xóa và tạo lại mỗi lần chạy.
+"""
+
+import random
+import time
+from typing import Any, List, cast
+
+import mysql.connector
+from mysql.connector.connection import MySQLConnection
+
+DB_ARGS = {"host": "127.0.0.1", "user": "root", "password": "123456"}
+BENCH_DB = "atm_bench_history"
+ROWS = 10_000_000
+CARDS = 10_000
+CHUNK = 1_000_000
+PAGE = 20
+DEEP_PAGES = 10
+SAMPLES = 200
+
+SCHEMA = [
+    f"DROP DATABASE IF EXISTS {BENCH_DB}",
+    f"CREATE DATABASE {BENCH_DB} CHARACTER SET UTF8 COLLATE utf8_vietnamese_ci",
+    f"USE {BENCH_DB}",
+    "CREATE TABLE users (id INT AUTO_INCREMENT PRIMARY KEY, name NVARCHAR(255) NOT NULL)",
+    """CREATE TABLE cards (
+        number CHAR(6) NOT NULL PRIMARY KEY,
+        balance BIGINT UNSIGNED NOT NULL,
+        owner_id INT NOT NULL,
+        FOREIGN KEY (owner_id) REFERENCES users(id)
+    )""",
+    # Schema cũ: không có khóa chính, chỉ có index của FK
+    """CREATE TABLE transactions (
+        from_card_number CHAR(6) NOT NULL,
+        to_card_number CHAR(6) NOT NULL,
+        amount INT UNSIGNED NOT NULL,
+        transaction_type ENUM('Withdraw', 'Deposit', 'Transfer') NOT NULL,
+        timestamp BIGINT,
+        FOREIGN KEY (from_card_number) REFERENCES cards(number),
+        FOREIGN KEY (to_card_number) REFERENCES cards(number)
+    )""",
+    "CREATE TABLE digits (d INT NOT NULL)",
+    "INSERT INTO digits VALUES (0),(1),(2),(3),(4),(5),(6),(7),(8),(9)",
+]
+
+MIGRATION = """ALTER TABLE transactions
+    ADD COLUMN id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST,
+    ADD INDEX idx_transactions_from_time (from_card_number, timestamp),
+    ADD INDEX idx_transactions_to_time (to_card_number, timestamp)"""
+
+SQL_OLD = """SELECT * FROM transactions
+    WHERE from_card_number = %(card)s OR to_card_number = %(card)s
+    ORDER BY timestamp DESC"""
+
+SQL_PAGE = """SELECT * FROM (
+    (SELECT * FROM transactions
+        WHERE from_card_number = %(card)s
+          AND (timestamp < %(ts)s OR (timestamp = %(ts)s AND id < %(id)s))
+        ORDER BY timestamp DESC, id DESC LIMIT %(limit)s)
+    UNION ALL
+    (SELECT * FROM transactions
+        WHERE to_card_number = %(card)s AND from_card_number <> %(card)s
+          AND (timestamp < %(ts)s OR (timestamp = %(ts)s AND id < %(id)s))
+        ORDER BY timestamp DESC, id DESC LIMIT %(limit)s)
+) AS page ORDER BY timestamp DESC, id DESC LIMIT %(limit)s"""
+
+MAX_CURSOR = (2**63 - 1, 2**64 - 1)
+
+
+def print_separator(title: str):
+    """In dòng phân cách đẹp"""
+    print(f"\n{'='*60}")
+    print(f"  {title}")
+    print(f"{'='*60}")
+
+
+def card(n: int) -> str:
+    return f"{n:06d}"
+
+
+def load_data(conn: MySQLConnection):
+    cursor = conn.cursor()
+    for statement in SCHEMA:
+        cursor.execute(statement)
+
+    cursor.execute("INSERT INTO users (name) VALUES ('bench')")
+    cursor.executemany(
+        "INSERT INTO cards (number, balance, owner_id) VALUES (%s, 0, 1)",
+        [(card(n),) for n in range(CARDS)],
+    )
+    conn.commit()
+
+    # Sinh dòng bằng tích Descartes của bảng digits, mỗi lần CHUNK dòng
+    joins = " CROSS JOIN ".join(f"digits d{i}" for i in range(len(str(CHUNK)) - 1))
+    seq = " + ".join(f"d{i}.d * {10**i}" for i in range(len(str(CHUNK)) - 1))
+
+    cursor.execute("SET foreign_key_checks = 0")
+    for offset in range(0, ROWS, CHUNK):
+        started = time.perf_counter()
+        cursor.execute(
+            f"""INSERT INTO transactions
+                (from_card_number, to_card_number, amount, transaction_type, timestamp)
+            SELECT
+                LPAD(FLOOR(RAND() * {CARDS}), 6, '0'),
+                LPAD(FLOOR(RAND() * {CARDS}), 6, '0'),
+                1 + FLOOR(RAND() * 1000),
+                'Transfer',
+                1700000000 + {offset} + ({seq})
+            FROM {joins}"""
+        )
+        conn.commit()
+        print(f"Nạp {offset + CHUNK:>10,} dòng ({time.perf_counter() - started:.1f}s)")
+    cursor.execute("SET foreign_key_checks = 1")
+    cursor.close()
+
+
+def measure(label: str, conn: MySQLConnection, query) -> float:
+    cursor = conn.cursor()
+    cards = [card(random.randrange(CARDS)) for _ in range(SAMPLES)]
+
+    started = time.perf_counter()
+    for number in cards:
+        query(cursor, number)
+    per_query = (time.perf_counter() - started) / SAMPLES * 1000
+
+    cursor.close()
+    print(f"{label:<28}: {per_query:.3f} ms/query")
+    return per_query
+
+
+def old_history(cursor, number: str):
+    cursor.execute(SQL_OLD, {"card": number})
+    cursor.fetchall()
+
+
+def first_page(cursor, number: str):
+    ts, last_id = MAX_CURSOR
+    cursor.execute(SQL_PAGE, {"card": number, "ts": ts, "id": last_id, "limit": PAGE})
+    cursor.fetchall()
+
+
+def deep_page(cursor, number: str):
+    ts, last_id = MAX_CURSOR
+    for _ in range(DEEP_PAGES):
+        cursor.execute(SQL_PAGE, {"card": number, "ts": ts, "id": last_id, "limit": PAGE})
+        rows = cast(List[Any], cursor.fetchall())
+        if not rows:
+            break
+        # Cột id đứng đầu, timestamp đứng cuối (SELECT *)
+        last_id, ts = rows[-1][0], rows[-1][-1]
+
+
+if __name__ == "__main__":
+    conn = cast(MySQLConnection, mysql.connector.connect(**DB_ARGS, use_pure=True))
+
+    try:
+        print_separator(f"NẠP {ROWS:,} DÒNG / {CARDS:,} THẺ")
+        load_data(conn)
+
+        print_separator("TRƯỚC MIGRATION")
+        old = measure("Toàn bộ lịch sử (OR + sort)", conn, old_history)
+
+        print_separator("MIGRATION")
+        started = time.perf_counter()
+        conn.cursor().execute(MIGRATION)
+        print(f"ALTER TABLE: {time.perf_counter() - started:.1f}s")
+
+        print_separator("SAU MIGRATION")
+        old_indexed = measure("Toàn bộ lịch sử (OR + sort)", conn, old_history)
+        first = measure(f"Trang đầu ({PAGE} dòng)", conn, first_page)
+        deep = measure(f"{DEEP_PAGES} trang liên tiếp", conn, deep_page)
+
+        print_separator("KẾT QUẢ")
+        print(f"Trang đầu nhanh hơn query cũ x{old / first:.1f}")
+        print(f"Query cũ sau khi có index: x{old / old_indexed:.1f}")
+        print(f"Trung bình mỗi trang khi đọc sâu: {deep / DEEP_PAGES:.3f} ms")
+    finally:
+        conn.close()
@@ -0,0 +1,69 @@
+"""
+Benchmark: ping liveness trước mỗi query vs chỉ validate connection idle
+Chạy: python -m app_server.database.bench_ping
+
+So sánh 2 chiến lược kiểm tra connection của pool trên cùng database:
+- "ping mỗi query" (validate_idle_after = 0): giống Database.get_connection cũ,
+  mỗi check_balance/deposit_money tốn thêm 1 round trip ping
+- "validate khi idle" (mặc định): chỉ ping connection đã idle lâu
+"""
+
+import time
+
+from shared.utils import now
+
+from .main import Database
+from .pool import DEFAULT_POOL_CONFIG, PoolConfig
+
+DB_ARGS = ("127.0.0.1", "root", "123456", "atm_db_s1")
+CARD_NUMBER = "111111"
+ITERATIONS = 2000
+
+
+def print_separator(title: str):
+    """In dòng phân cách đẹp"""
+    print(f"\n{'='*60}")
+    print(f"  {title}")
+    print(f"{'='*60}")
+
+
+def run(label: str, validate_idle_after: float):
+    pool_config: PoolConfig = {
+        **DEFAULT_POOL_CONFIG,
+        "validate_idle_after": validate_idle_after,
+    }
+    db = Database(*DB_ARGS, reader_pool=pool_config, writer_pool=pool_config)
+    reader, writer = db.reader(), db.writer()
+
+    try:
+        print_separator(label)
+
+        started = time.perf_counter()
+        for _ in range(ITERATIONS):
+            reader.check_balance(CARD_NUMBER)
+        read_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(ITERATIONS):
+            writer.deposit_money(CARD_NUMBER, 1, now())
+        write_elapsed = time.perf_counter() - started
+
+        stats = db.pool_stats()
+        pings = stats["reader"]["validations"] + stats["writer"]["validations"]
+        commands = ITERATIONS * 2
+
+        print(f"check_balance: {read_elapsed / ITERATIONS * 1000:.3f} ms/lệnh")
+        print(f"deposit_money: {write_elapsed / ITERATIONS * 1000:.3f} ms/lệnh")
+        print(f"Ping: {pings} ({pings / commands:.3f} round trip/lệnh)")
+        return pings / commands
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # Lưu ý: benchmark nạp tiền thật vào thẻ CARD_NUMBER, chạy trên DB test
+    old = run("PING MỖI QUERY (cũ)", validate_idle_after=0)
+    new = run("VALIDATE KHI IDLE", validate_idle_after=30.0)
+
+    print_separator("KẾT QUẢ")
+    print(f"Tiết kiệm {old - new:.3f} round trip mỗi lệnh")
@@ -1,60 +1,122 @@
 import mysql.connector
 from mysql.connector.connection import MySQLConnection
 
+from contextlib import contextmanager
 from threading import Lock
 
-from typing import List, Any, Optional, cast
+from typing import Iterable, Iterator, List, Any, Literal, Optional, Set, cast
+from mysql.connector.cursor import MySQLCursor
 
 from shared.models.server import CardData, TransactionData, UserData
-from .exceptions import SQLException
+from shared.utils import now
+from .exceptions import SQLException, DuplicateCommandError
+from .pool import ConnectionPool, PoolConfig, DEFAULT_POOL_CONFIG, CONNECTION_ERRORS
+from .singleflight import SingleFlight
+from .balance_cache import BalanceCache, BalanceCacheMode
+
+# "procedure": gọi Stored Procedure (callproc)
+# "inline": câu SQL prepared statement phía server (xem inline.py)
+DatabaseBackend = Literal["procedure", "inline"]
 
 
 class Database:
-    """Quản lý kết nối database"""
+    """
+    Quản lý kết nối database.
+
+    Reader và writer dùng 2 pool connection riêng: đọc không phải chờ ghi,
+    và không có 2 thread nào dùng chung một connection.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        db_user: str,
+        db_password: str,
+        db_name: str,
+        coalesced_reads: Iterable[str] = (),
+        reader_pool: PoolConfig = DEFAULT_POOL_CONFIG,
+        writer_pool: PoolConfig = DEFAULT_POOL_CONFIG,
+        backend: DatabaseBackend = "procedure",
+        balance_cache: BalanceCacheMode = "off",
+    ):
+        """
+        Args:
+            coalesced_reads: Tên các procedure đọc được gộp khi chạy đồng thời
+                             với cùng tham số (singleflight)
+            reader_pool: Cấu hình pool connection cho DatabaseReader
+            writer_pool: Cấu hình pool connection cho DatabaseWriter
+            backend: Cách thực thi các thao tác chính (procedure/inline)
+            balance_cache: Chế độ cache số dư cho check_balance (off/on/verify)
+        """
+        if backend not in ("procedure", "inline"):
+            raise ValueError(f"Backend database không hợp lệ: {backend}")
 
-    def __init__(self, db_url: str, db_user: str, db_password: str, db_name: str):
         self.host = db_url
         self.user = db_user
         self.password = db_password
         self.db_name = db_name
+        self.coalesced_reads = set(coalesced_reads)
+        self.backend = backend
         self._lock = Lock()
 
         self._writer: Optional["DatabaseWriter"] = None
         self._reader: Optional["DatabaseReader"] = None
-        self.connection: Optional[MySQLConnection] = None
-        self._connect()
-
-    def _connect(self) -> None:
-        """Lấy kết nối tới database"""
-        if self.connection is None or not self.connection.is_connected():
-            self.connection = cast(
-                MySQLConnection,
-                mysql.connector.connect(
-                    host=self.host,
-                    user=self.user,
-                    password=self.password,
-                    database=self.db_name,
-                    use_pure=True,
-                ),
-            )
-            print("Kết nối database thành công!")
-
-    def get_connection(self):
-        """Lấy connection, tự động reconnect nếu cần"""
-        if self.connection is None or not self.connection.is_connected():
-            self._connect()
-
-        # Nếu _connect thất bại thì sẽ raise error ở đó,
-        # nên ở đây an toàn để assert connection không None
-        assert self.connection is not None
-
-        return self.connection
+
+        # Reader dùng autocommit: mỗi SELECT thấy dữ liệu mới nhất,
+        # không giữ snapshot cũ của transaction ngầm định
+        self.reader_pool = ConnectionPool(
+            "reader", lambda: self._connect(autocommit=True), reader_pool
+        )
+        self.writer_pool = ConnectionPool(
+            "writer", lambda: self._connect(autocommit=False), writer_pool
+        )
+        print("Kết nối database thành công!")
+
+        self.balance_cache: Optional[BalanceCache] = None
+        if balance_cache != "off":
+            self.balance_cache = BalanceCache(verify=balance_cache == "verify")
+            self.balance_cache.warm(self.reader().get_all_balances())
+
+    def _connect(self, autocommit: bool) -> MySQLConnection:
+        """Tạo kết nối mới tới database"""
+        connection = cast(
+            MySQLConnection,
+            mysql.connector.connect(
+                host=self.host,
+                user=self.user,
+                password=self.password,
+                database=self.db_name,
+                use_pure=True,
+            ),
+        )
+        connection.autocommit = autocommit
+        return connection
+
+    def read_connection(self):
+        """Checkout connection từ reader pool (dùng với `with`)"""
+        return self.reader_pool.connection()
+
+    def write_connection(self):
+        """Checkout connection từ writer pool (dùng với `with`)"""
+        return self.writer_pool.connection()
+
+    def pool_stats(self):
+        """Thống kê mức sử dụng và thời gian chờ của 2 pool"""
+        return {
+            "reader": self.reader_pool.stats(),
+            "writer": self.writer_pool.stats(),
+        }
 
     def writer(self):
         if self._writer is None:
             with self._lock:
                 if self._writer is None:
-                    self._writer = DatabaseWriter(self)
+                    if self.backend == "inline":
+                        from .inline import InlineDatabaseWriter
+
+                        self._writer = InlineDatabaseWriter(self)
+                    else:
+                        self._writer = DatabaseWriter(self)
 
         return self._writer
 
@@ -62,20 +124,51 @@ class Database:
         if self._reader is None:
             with self._lock:
                 if self._reader is None:
-                    self._reader = DatabaseReader(self)
+                    if self.backend == "inline":
+                        from .inline import InlineDatabaseReader
+
+                        self._reader = InlineDatabaseReader(self)
+                    else:
+                        self._reader = DatabaseReader(self)
 
         return self._reader
 
     def close(self) -> None:
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
+        self.reader_pool.close()
+        self.writer_pool.close()
 
 
 class DatabaseReader:
     """Xử lý các thao tác READ từ database"""
 
+    # Khoảng thời gian (s) trang lịch sử được tìm trước (partition pruning)
+    RECENT_HISTORY_WINDOW = 62 * 24 * 3600
+
     def __init__(self, database: Database):
         self.database: Database = database
+        self._singleflight = SingleFlight()
+
+    # Các read theo số thẻ, phải đọc lại sau khi thẻ có lệnh ghi
+    CARD_READS = ("check_balance", "get_transaction_history")
+
+    def coalescing_stats(self):
+        """Thống kê số lời gọi được gộp theo từng procedure"""
+        return self._singleflight.stats()
+
+    def forget_cards(self, card_numbers: Iterable[str]):
+        """
+        Các thẻ vừa có lệnh ghi commit: read gộp của thẻ đó bắt đầu trước lúc
+        commit không được dùng chung cho các lời gọi sau (sẽ thấy dữ liệu cũ).
+        Writer gọi sau khi commit, trước khi báo kết quả cho client.
+        """
+        procs = [name for name in self.CARD_READS if name in self.database.coalesced_reads]
+        if not procs:
+            return
+
+        for card_number in card_numbers:
+            for proc_name in procs:
+                for dictionary in (True, False):
+                    self._singleflight.forget(proc_name, ((card_number,), dictionary))
 
     def get_all_users(self):
         """Lấy danh sách tất cả users"""
@@ -89,13 +182,22 @@ class DatabaseReader:
 
     def login(self, card_number: str, card_pin: str):
         """Đăng nhập và lấy thông tin user"""
-        cursor = None
-        try:
-            cursor = self.database.get_connection().cursor()
-            args = [card_number, card_pin, 0, "", None, "", ""]
 
-            # callproc trả về một list các tham số đã được cập nhật giá trị
-            result_args = cast(List[Any], cursor.callproc("login", args))
+        def call_login():
+            cursor = None
+            with self.database.read_connection() as conn:
+                try:
+                    cursor = conn.cursor()
+                    args = [card_number, card_pin, 0, "", None, "", ""]
+
+                    # callproc trả về một list các tham số đã được cập nhật giá trị
+                    return cast(List[Any], cursor.callproc("login", args))
+                finally:
+                    if cursor:
+                        cursor.close()
+
+        try:
+            result_args = self._with_retry(call_login)
 
             user_info: UserData = {
                 "id": result_args[2],
@@ -108,12 +210,35 @@ class DatabaseReader:
             return user_info
         except mysql.connector.Error as e:
             raise SQLException(str(e.msg), e.sqlstate)
-        finally:
-            if cursor:
-                cursor.close()
 
     def check_balance(self, card_number: str):
-        """Kiểm tra số dư"""
+        """Kiểm tra số dư (đọc từ balance cache nếu được bật)"""
+        cache = self.database.balance_cache
+        if cache is None:
+            return self._check_balance_db(card_number)
+
+        return cache.get_or_load(
+            card_number, lambda: self._check_balance_db(card_number)
+        )
+
+    def get_all_balances(self) -> List[tuple[str, int]]:
+        """Lấy số dư của tất cả các thẻ (để warm balance cache)"""
+        rows = self._query_procedure("get_all_balances")
+        return [(row["number"], int(row["balance"])) for row in rows]
+
+    def get_replication_state(self, origin_id: int) -> Optional[tuple[str, int]]:
+        """(epoch, applied_index) của replication log peer origin_id đã áp dụng, None nếu chưa có"""
+        rows = self._query_procedure("get_replication_state", [origin_id])
+        if not rows:
+            return None
+        return rows[0]["epoch"], int(rows[0]["applied_index"])
+
+    def get_applied_commands(self, window: int) -> List[tuple[int, int]]:
+        """(origin_id, seq) của các command đã áp dụng trong cửa sổ window của mỗi origin"""
+        rows = self._query_procedure("get_applied_commands", [window])
+        return [(int(row["origin_id"]), int(row["seq"])) for row in rows]
+
+    def _check_balance_db(self, card_number: str) -> int:
         rows = self._query_procedure("check_balance", [card_number])
         if rows:
             row = cast(CardData, rows[0])  # lấy row đầu tiên từ results
@@ -121,38 +246,108 @@ class DatabaseReader:
 
         raise Exception(f"Không tìm thấy số dư cho thẻ {card_number}")
 
-    def get_transaction_history(self, card_number: str) -> List[TransactionData]:
-        """Lấy lịch sử giao dịch"""
-        rows = self._query_procedure("get_transaction_history", [card_number])
+    def get_transaction_history(
+        self,
+        card_number: str,
+        before: Optional[tuple[int, int]] = None,
+        limit: Optional[int] = None,
+    ) -> List[TransactionData]:
+        """
+        Lấy lịch sử giao dịch, mới nhất trước.
+        Giao dịch đã chuyển sang transactions_archive không được trả về.
+
+        Args:
+            before: (timestamp, id) của giao dịch cuối trang trước, None = trang đầu
+            limit: Số giao dịch mỗi trang, None = lấy toàn bộ lịch sử (như cũ)
+        """
+        if limit is None:
+            rows = self._query_procedure("get_transaction_history", [card_number])
+            return [cast(TransactionData, row) for row in rows]
+
+        before_timestamp, before_id = before if before is not None else (None, None)
+        params = [card_number, before_timestamp, before_id, limit]
+
+        # Thử trước trong các tháng gần đây (chỉ mở vài partition), chỉ quét
+        # toàn bộ bảng khi thẻ không có đủ giao dịch gần đây
+        newest = before_timestamp if before_timestamp is not None else now()
+        since = newest - self.RECENT_HISTORY_WINDOW
+        rows = self._query_procedure("get_transaction_history_page", [*params, since])
+
+        if len(rows) < limit:
+            rows = self._query_procedure("get_transaction_history_page", [*params, None])
+
         return [cast(TransactionData, row) for row in rows]
 
     def _query_procedure(
         self, proc_name: str, params: list | None = None, dictionary: bool = True
     ) -> List[Any]:
         """Hàm helper để thực thi proc lấy dữ liệu và bắt lỗi tập trung"""
-        cursor = None
-        results = []
-        try:
-            cursor = self.database.get_connection().cursor(dictionary=dictionary)
-            cursor.callproc(proc_name, params or [])
+        if proc_name not in self.database.coalesced_reads:
+            return self._call_procedure(proc_name, params, dictionary)
+
+        # Các read giống nhau đang chạy đồng thời dùng chung 1 query
+        key = (tuple(params or []), dictionary)
+        rows = self._singleflight.do(
+            proc_name,
+            key,
+            lambda: self._call_procedure(proc_name, params, dictionary),
+        )
+
+        # Copy list để các caller không dùng chung object
+        return list(rows)
 
-            # gom tất cả rows từ stored_results
-            for result in cursor.stored_results():
-                results.extend(result.fetchall())
-            return results
+    def _call_procedure(
+        self, proc_name: str, params: list | None, dictionary: bool
+    ) -> List[Any]:
+        def call():
+            cursor = None
+            results = []
+            with self.database.read_connection() as conn:
+                try:
+                    cursor = conn.cursor(dictionary=dictionary)
+                    cursor.callproc(proc_name, params or [])
+
+                    # gom tất cả rows từ stored_results
+                    for result in cursor.stored_results():
+                        results.extend(result.fetchall())
+                    return results
+                finally:
+                    if cursor:
+                        cursor.close()
+
+        try:
+            return self._with_retry(call)
         except mysql.connector.Error as e:
             raise SQLException(str(e.msg), e.sqlstate)
-        finally:
-            if cursor:
-                cursor.close()
+
+    @staticmethod
+    def _with_retry(query):
+        """
+        Thực thi query đọc, thử lại 1 lần nếu lỗi connection.
+
+        Đọc là idempotent nên chạy lại an toàn; connection lỗi đã bị pool
+        loại bỏ nên lần thử lại dùng connection khác (hoặc tạo mới).
+        """
+        try:
+            return query()
+        except CONNECTION_ERRORS:
+            return query()
 
 
 class DatabaseWriter:
     """Xử lý các thao tác WRITE vào database thông qua Stored Procedures"""
 
+    # Procedure ghi -> số tham số đầu tiên là số thẻ bị ghi
+    CARD_PARAMS = {
+        "register_card": 1,
+        "withdraw_money": 1,
+        "deposit_money": 1,
+        "change_pin": 1,
+        "transfer_money": 2,
+    }
+
     def __init__(self, database: Database):
         self.database = database
-        self._lock = Lock()
 
     # Note: k dùng trong app chính
     def register_user(self, name: str, dob: str, phone: str, citizen_id: str):
@@ -205,6 +400,54 @@ class DatabaseWriter:
         """
         self._exec_procedure("change_pin", [card_number, new_pin])
 
+    def prune_applied_commands(self, origin_id: int, below_seq: int):
+        """Xóa các command của origin_id có seq < below_seq khỏi applied_commands"""
+        self._exec_procedure("prune_applied_commands", [origin_id, below_seq])
+
+    @contextmanager
+    def batch(self) -> Iterator["WriteBatch"]:
+        """
+        Chạy nhiều lệnh ghi trong 1 transaction (group commit).
+
+        Mỗi lệnh trong batch được bọc trong 1 SAVEPOINT: lỗi nghiệp vụ chỉ
+        rollback lệnh đó, cả batch commit 1 lần khi thoát block `with`.
+        Mọi lỗi khác (connection, commit, deadlock, chờ lock...) -> rollback cả batch.
+
+        Raises:
+            SQLException: Nếu cả batch bị rollback (errno giữ mã lỗi của MySQL).
+        """
+        try:
+            with self.database.write_connection() as conn:
+                conn.start_transaction()
+                cursor = conn.cursor()
+                try:
+                    batch = WriteBatch(self, conn, cursor)
+                    yield batch
+                    conn.commit()
+                    self.database.reader().forget_cards(batch.cards)
+                except BaseException:
+                    self._rollback_quietly(conn)
+                    raise
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            raise SQLException(str(e.msg), e.sqlstate, e.errno)
+
+    def _call(
+        self,
+        conn: MySQLConnection,
+        cursor: MySQLCursor,
+        proc_name: str,
+        params: list,
+        in_batch: bool,
+    ):
+        """
+        Chạy 1 thao tác ghi trên connection, không commit.
+
+        in_batch=True -> gọi bản *_in_tx (không tự mở/commit transaction).
+        """
+        cursor.callproc(f"{proc_name}_in_tx" if in_batch else proc_name, params)
+
     def _exec_procedure(self, proc_name: str, params: list):
         """
         Thực thi Stored Procedure và xử lý lỗi.
@@ -212,13 +455,127 @@ class DatabaseWriter:
         Raises:
             SQLException: Nếu có lỗi nghiệp vụ từ SQL (45000) hoặc lỗi kết nối.
         """
-        with self._lock:
-            conn = self.database.get_connection()
-            cursor = conn.cursor()
-            try:
-                cursor.callproc(proc_name, params)
-                conn.commit()
-            except mysql.connector.Error as e:
-                raise SQLException(str(e.msg), e.sqlstate)
-            finally:
-                cursor.close()
+        try:
+            # Mỗi lệnh ghi dùng riêng 1 connection của writer pool
+            with self.database.write_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    self._call(conn, cursor, proc_name, params, in_batch=False)
+                    conn.commit()
+                    self.database.reader().forget_cards(self._cards_of(proc_name, params))
+                except (mysql.connector.Error, SQLException):
+                    self._rollback_quietly(conn)
+                    raise
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            raise SQLException(str(e.msg), e.sqlstate, e.errno)
+
+    @classmethod
+    def _cards_of(cls, proc_name: str, params: list) -> List[str]:
+        return params[: cls.CARD_PARAMS.get(proc_name, 0)]
+
+    @staticmethod
+    def _rollback_quietly(conn: MySQLConnection):
+        """Rollback trước khi trả connection về pool (bỏ qua nếu connection đã hỏng)"""
+        try:
+            conn.rollback()
+        except mysql.connector.Error:
+            pass
+
+
+class WriteBatch:
+    """Các lệnh ghi trong 1 batch transaction, lấy bằng DatabaseWriter.batch()"""
+
+    SAVEPOINT = "batch_command"
+    APPLY_ONCE_SAVEPOINT = "apply_once"
+    DUPLICATE_KEY = 1062
+
+    def __init__(
+        self, writer: DatabaseWriter, conn: MySQLConnection, cursor: MySQLCursor
+    ):
+        self.writer = writer
+        self.conn = conn
+        self.cursor = cursor
+        # Các thẻ có lệnh ghi trong batch (DatabaseReader.forget_cards sau khi commit)
+        self.cards: Set[str] = set()
+
+    def withdraw_money(self, card_number: str, amount: int, transaction_time: int):
+        self._exec_in_savepoint(
+            "withdraw_money", [card_number, amount, transaction_time]
+        )
+
+    def transfer_money(
+        self, from_card: str, to_card: str, amount: int, transaction_time: int
+    ):
+        self._exec_in_savepoint(
+            "transfer_money", [from_card, to_card, amount, transaction_time]
+        )
+
+    def deposit_money(self, card_number: str, amount: int, transaction_time: int):
+        self._exec_in_savepoint("deposit_money", [card_number, amount, transaction_time])
+
+    def change_pin(self, card_number: str, new_pin: str):
+        self._exec_in_savepoint("change_pin", [card_number, new_pin])
+
+    def set_replication_state(self, origin_id: int, epoch: str, applied_index: int):
+        """
+        Ghi vị trí replication log đã áp dụng, commit cùng các lệnh trong batch.
+
+        Raises:
+            mysql.connector.Error: Nếu ghi lỗi, cả batch phải bị hủy.
+        """
+        self.cursor.callproc("set_replication_state", [origin_id, epoch, applied_index])
+
+    @contextmanager
+    def apply_once(self, origin_id: int, seq: int) -> Iterator[None]:
+        """
+        Ghi (origin_id, seq) vào applied_commands cùng các lệnh trong block `with`.
+        Lệnh trong block lỗi nghiệp vụ -> bản ghi cũng bị rollback (command được
+        thử lại sau vẫn chạy được).
+
+        Raises:
+            DuplicateCommandError: Command đã được áp dụng, block không được chạy.
+        """
+        self.cursor.execute(f"SAVEPOINT {self.APPLY_ONCE_SAVEPOINT}")
+
+        try:
+            self.cursor.callproc("record_applied_command", [origin_id, seq])
+        except mysql.connector.IntegrityError as e:
+            if e.errno != self.DUPLICATE_KEY:
+                raise
+            self.cursor.execute(f"ROLLBACK TO SAVEPOINT {self.APPLY_ONCE_SAVEPOINT}")
+            raise DuplicateCommandError(origin_id, seq)
+
+        try:
+            yield
+        except SQLException as e:
+            if e.is_business_error():
+                self.cursor.execute(
+                    f"ROLLBACK TO SAVEPOINT {self.APPLY_ONCE_SAVEPOINT}"
+                )
+            raise
+
+    def _exec_in_savepoint(self, proc_name: str, params: list):
+        """
+        Raises:
+            SQLException: Lỗi nghiệp vụ, thay đổi của lệnh đã được rollback về savepoint.
+            mysql.connector.Error: Lỗi khác, cả batch phải bị hủy. Deadlock đã
+                rollback cả transaction (savepoint không còn), lệnh chạy tiếp sẽ
+                nằm trong 1 transaction mới
+        """
+        self.cards.update(self.writer._cards_of(proc_name, params))
+        # Tạo lại savepoint cùng tên sẽ thay thế savepoint cũ, không cần RELEASE
+        self.cursor.execute(f"SAVEPOINT {self.SAVEPOINT}")
+
+        try:
+            self.writer._call(self.conn, self.cursor, proc_name, params, in_batch=True)
+        except mysql.connector.Error as e:
+            if e.sqlstate != SQLException.BUSINESS_ERROR:
+                raise
+            self.cursor.execute(f"ROLLBACK TO SAVEPOINT {self.SAVEPOINT}")
+            raise SQLException(str(e.msg), e.sqlstate, e.errno)
+        except SQLException as e:
+            if e.is_business_error():
+                self.cursor.execute(f"ROLLBACK TO SAVEPOINT {self.SAVEPOINT}")
+            raise
@@ -0,0 +1,86 @@
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    """Một query đang chạy, các caller trùng key chờ trên done"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi giống nhau đang chạy đồng thời thành 1 lần thực thi.
+
+    Caller đầu tiên của một key thực thi hàm, các caller đến sau (khi hàm
+    chưa xong) chờ và nhận chung kết quả/exception. Không cache: khi hàm
+    xong, lời gọi tiếp theo sẽ thực thi lại.
+
+    forget(): dữ liệu của key vừa bị ghi, lời gọi sau không chờ lần thực thi
+    đã bắt đầu trước lúc ghi (có thể chưa thấy dữ liệu mới) mà thực thi lại.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: Dict[Tuple[str, Hashable], _Call] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def do(self, group: str, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Thực thi fn hoặc chờ kết quả của lần thực thi đang chạy cùng key.
+
+        Args:
+            group: Tên nhóm (tên method) để thống kê
+            key: Key xác định các lời gọi giống nhau
+            fn: Hàm thực thi thật sự
+        """
+        call_key = (group, key)
+
+        with self._lock:
+            stats = self._stats.setdefault(
+                group, {"calls": 0, "executed": 0, "coalesced": 0}
+            )
+            stats["calls"] += 1
+
+            call = self._calls.get(call_key)
+            is_leader = call is None
+
+            if call is None:
+                call = _Call()
+                self._calls[call_key] = call
+                stats["executed"] += 1
+            else:
+                stats["coalesced"] += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(call_key) is call:
+                    del self._calls[call_key]
+            call.done.set()
+
+    def forget(self, group: str, key: Hashable):
+        """Lời gọi sau với key này thực thi lại thay vì chờ lần đang chạy"""
+        with self._lock:
+            self._calls.pop((group, key), None)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Số lời gọi, số lần thực thi thật và số lời gọi được gộp theo từng nhóm"""
+        with self._lock:
+            return {group: dict(stats) for group, stats in self._stats.items()}
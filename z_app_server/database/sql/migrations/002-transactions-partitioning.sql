@@ -0,0 +1,68 @@
+-- Migration chia partition theo tháng cho transactions (chạy sau 001-transactions-keyset)
+-- - Bảng partition của InnoDB không hỗ trợ FOREIGN KEY -> bỏ FK, việc kiểm tra
+--   thẻ tồn tại do các procedure đảm nhiệm (chạy lại procedures.sql sau migration)
+-- - Mọi khóa unique phải chứa cột partition -> khóa chính (id, timestamp)
+-- - Partition theo tháng (UTC) trên timestamp, tính theo ngày chạy migration:
+--   12 tháng trước tới 3 tháng tới, trước đó vào p_old. TransactionArchiver tự
+--   thêm partition cho các tháng tới và chuyển partition cũ sang transactions_archive
+USE atm_db_s1;
+
+ALTER TABLE transactions
+    DROP FOREIGN KEY transactions_ibfk_1,
+    DROP FOREIGN KEY transactions_ibfk_2;
+
+ALTER TABLE transactions
+    MODIFY timestamp BIGINT NOT NULL DEFAULT (UNIX_TIMESTAMP()),
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (id, timestamp);
+
+-- Danh sách partition không dùng được biểu thức: ghép câu lệnh trong procedure
+-- tạm rồi chạy bằng PREPARE. Cận là timestamp UTC của đầu mỗi tháng
+DELIMITER //
+CREATE PROCEDURE partition_transactions_by_month(
+    IN months_back INT,
+    IN months_ahead INT
+)
+BEGIN
+    DECLARE current_month DATE DEFAULT DATE_FORMAT(UTC_DATE(), '%Y-%m-01');
+    DECLARE month_from DATE DEFAULT DATE_SUB(current_month, INTERVAL months_back MONTH);
+    DECLARE month_to DATE DEFAULT DATE_ADD(current_month, INTERVAL months_ahead + 1 MONTH);
+
+    SET @partitions = CONCAT(
+        'PARTITION p_old VALUES LESS THAN (',
+        TIMESTAMPDIFF(SECOND, '1970-01-01', month_from), ')'
+    );
+    WHILE month_from < month_to DO
+        SET @partitions = CONCAT(
+            @partitions, ', PARTITION p', DATE_FORMAT(month_from, '%Y%m'),
+            ' VALUES LESS THAN (',
+            TIMESTAMPDIFF(SECOND, '1970-01-01', DATE_ADD(month_from, INTERVAL 1 MONTH)), ')'
+        );
+        SET month_from = DATE_ADD(month_from, INTERVAL 1 MONTH);
+    END WHILE;
+
+    SET @sql = CONCAT(
+        'ALTER TABLE transactions PARTITION BY RANGE (timestamp) (',
+        @partitions, ', PARTITION p_future VALUES LESS THAN MAXVALUE)'
+    );
+    PREPARE stmt FROM @sql;
+    EXECUTE stmt;
+    DEALLOCATE PREPARE stmt;
+END //
+DELIMITER ;
+
+CALL partition_transactions_by_month(12, 3);
+DROP PROCEDURE partition_transactions_by_month;
+
+-- Dữ liệu lạnh: nén (ROW_FORMAT=COMPRESSED), chỉ đọc khi tra cứu/đối soát
+CREATE TABLE IF NOT EXISTS transactions_archive (
+    id BIGINT UNSIGNED NOT NULL,
+    from_card_number CHAR(6) NOT NULL,
+    to_card_number CHAR(6) NOT NULL,
+    amount INT UNSIGNED NOT NULL,
+    transaction_type ENUM('Withdraw', 'Deposit', 'Transfer') NOT NULL,
+    timestamp BIGINT NOT NULL,
+    PRIMARY KEY (id, timestamp),
+    INDEX idx_archive_from_time (from_card_number, timestamp),
+    INDEX idx_archive_to_time (to_card_number, timestamp)
+) ROW_FORMAT=COMPRESSED;
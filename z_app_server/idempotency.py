@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Literal, Optional, Tuple, TypedDict
+
+from shared.interfaces.client import SuccessCallback
+from shared.models.server import ATMCommand
+
+
+class IdempotencyConfig(TypedDict):
+    enabled: bool
+    ttl: float  # Thời gian giữ kết quả của 1 key (s)
+    max_entries: int  # Số key tối đa, key đã có kết quả cũ nhất bị loại khi vượt quá
+
+
+# (message, type) gửi cho SuccessCallback.notify
+Outcome = Tuple[str, Literal["success", "error"]]
+
+# Mọi key đều đang chờ thực thi: lệnh mới có key không được nhận
+BUSY: Outcome = ("Hệ thống đang bận, vui lòng thử lại sau.", "error")
+
+
+class _Entry:
+    __slots__ = ("command_id", "outcome", "waiters", "expires_at")
+
+    def __init__(self, command_id: Optional[str], expires_at: float):
+        self.command_id = command_id  # Command xử lý key này
+        self.outcome: Optional[Outcome] = None  # None = đang chờ thực thi
+        self.waiters: List[SuccessCallback] = []  # Callback của các lần gửi lại
+        self.expires_at = expires_at
+
+
+class IdempotencyStore:
+    """
+    Kết quả của các lệnh có idempotency key (key do ATM tạo), theo (số thẻ, key).
+
+    - Lần gửi đầu tiên tạo command như bình thường; các lần gửi lại cùng key
+      không tạo command mới: nhận ngay kết quả cũ, hoặc chờ kết quả nếu command
+      đầu tiên chưa thực thi xong
+    - Key đi theo command (cả khi sync sang peer), nên server kia cũng biết kết
+      quả. Khi thực thi, command có key đã được command khác xử lý thì bị bỏ qua
+      (ATM gửi lại sang server kia trước khi log kịp sync)
+    - Chỉ giữ trong RAM, tối đa max_entries key, mỗi key hết hạn sau ttl giây.
+      Key đang chờ thực thi không hết hạn/bị loại (lần gửi lại phải chờ kết quả);
+      hết chỗ mà mọi key đều đang chờ thì lệnh mới có key bị từ chối
+    """
+
+    def __init__(self, ttl: float = 600, max_entries: int = 100_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Tuple[str, str], _Entry] = OrderedDict()
+        self._stats = {
+            "replayed": 0,
+            "waited": 0,
+            "skipped": 0,
+            "evicted": 0,
+            "rejected": 0,
+        }
+
+    def submit(
+        self,
+        card_number: str,
+        key: str,
+        command_id: Optional[str],
+        callback: SuccessCallback,
+    ) -> bool:
+        """
+        Đăng ký lần gửi lệnh với key.
+
+        Returns:
+            bool: True nếu là lần gửi đầu tiên (caller tạo command),
+                False nếu là lần gửi lại (callback đã/sẽ nhận kết quả cũ) hoặc
+                bị từ chối vì mọi key đều đang chờ (callback nhận BUSY)
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get((card_number, key))
+
+            if entry is None:
+                if self._put((card_number, key), _Entry(command_id, self._deadline())):
+                    return True
+                self._stats["rejected"] += 1
+                outcome = BUSY
+            elif entry.outcome is None:
+                entry.waiters.append(callback)
+                self._stats["waited"] += 1
+                return False
+            else:
+                outcome = entry.outcome
+                self._stats["replayed"] += 1
+
+        self._notify([callback], outcome)
+        return False
+
+    def completed_outcome(self, cmd: ATMCommand) -> Optional[Outcome]:
+        """Kết quả của key nếu key đã được 1 command KHÁC xử lý xong (cmd phải bỏ qua)"""
+        key = cmd.get("idempotency_key")
+        if not key:
+            return None
+
+        with self._lock:
+            entry = self._entries.get((cmd["card_number"], key))
+            if (
+                entry is None
+                or entry.outcome is None
+                or entry.command_id == cmd.get("command_id")
+            ):
+                return None
+            self._stats["skipped"] += 1
+            return entry.outcome
+
+    def complete(self, cmd: ATMCommand, outcome: Outcome):
+        """Ghi kết quả thực thi của cmd, báo cho các lần gửi lại đang chờ"""
+        key = cmd.get("idempotency_key")
+        if not key:
+            return
+
+        with self._lock:
+            entry = self._entries.pop((cmd["card_number"], key), None)
+            if entry is None:
+                # Command của peer hoặc key đã hết hạn
+                entry = _Entry(cmd.get("command_id"), 0)
+            elif entry.outcome is not None:
+                # Đã có kết quả từ command khác, giữ kết quả đầu tiên
+                self._put((cmd["card_number"], key), entry)
+                return
+
+            entry.command_id = cmd.get("command_id")
+            entry.outcome = outcome
+            entry.expires_at = self._deadline()
+            waiters, entry.waiters = entry.waiters, []
+            self._put((cmd["card_number"], key), entry)
+
+        self._notify(waiters, outcome)
+
+    def discard(self, cmd: ATMCommand):
+        """Bỏ key của command không rõ kết quả (lỗi bất thường), lần gửi lại sẽ chạy lại"""
+        key = cmd.get("idempotency_key")
+        if not key:
+            return
+
+        with self._lock:
+            entry = self._entries.get((cmd["card_number"], key))
+            if entry is not None and entry.outcome is None:
+                del self._entries[(cmd["card_number"], key)]
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+    def _deadline(self) -> float:
+        return time.monotonic() + self.ttl
+
+    def _put(self, scope: Tuple[str, str], entry: _Entry) -> bool:
+        """
+        Thêm entry, loại các key đã có kết quả cũ nhất khi vượt max_entries.
+
+        Returns:
+            bool: False nếu không còn chỗ (mọi key đều đang chờ), entry không được thêm
+        """
+        if len(self._entries) >= self.max_entries:
+            # Thứ tự trong OrderedDict = thứ tự hết hạn (ttl như nhau)
+            excess = len(self._entries) - self.max_entries + 1
+            evicted: List[Tuple[str, str]] = []
+            for old_scope, old_entry in self._entries.items():
+                if len(evicted) == excess:
+                    break
+                if old_entry.outcome is not None:
+                    evicted.append(old_scope)
+            for old_scope in evicted:
+                del self._entries[old_scope]
+            self._stats["evicted"] += len(evicted)
+            if len(self._entries) >= self.max_entries:
+                return False
+
+        self._entries[scope] = entry
+        return True
+
+    def _expire(self):
+        now = time.monotonic()
+        # Key đang chờ thực thi không hết hạn (lần gửi lại phải chờ kết quả)
+        expired = []
+        for scope, entry in self._entries.items():
+            if entry.outcome is None:
+                continue
+            if entry.expires_at > now:
+                break
+            expired.append(scope)
+        for scope in expired:
+            del self._entries[scope]
+
+    @staticmethod
+    def _notify(callbacks: List[SuccessCallback], outcome: Outcome):
+        for callback in callbacks:
+            try:
+                callback.notify(*outcome)
+            except Exception as e:
+                # ATM đã ngắt kết nối
+                print(f">> [IDEMPOTENCY] Không gửi được kết quả: {e}")
@@ -3,12 +3,34 @@
 from rmi_framework.v2 import LocateRegistry
 
 from .database.main import Database
+from .database.archiver import TransactionArchiver
 from .command_queue import CommandQueue
+from .command_journal import CommandJournal
+from .replication_backlog import ReplicationBacklog
+from .replication import ReplicationReceiver
 from .command_executor import CommandExecutor
+from .command_dedupe import CommandDedupe, observe_command_seq, parse_command_id
+from .idempotency import IdempotencyStore
 from .event_emitter import EventEmitter
 
 from .services.auth_service import AuthServiceImpl
-from .config import get_current_config, PEER_ID
+from .config import (
+    get_current_config,
+    get_peer_configs,
+    PEER_ID,
+    COALESCED_READS,
+    DB_READER_POOL,
+    DB_WRITER_POOL,
+    DB_BACKEND,
+    BALANCE_CACHE_MODE,
+    TRANSACTION_ARCHIVE,
+    COMMAND_JOURNAL,
+    REPLICATION_BACKLOG,
+    COMMAND_DEDUPE,
+    IDEMPOTENCY,
+    EXECUTOR_BATCH_MODE,
+    EXECUTOR_PARALLELISM,
+)
 from .services.peer_service import PeerServiceImpl
 from .coordinator import Coordinator
 
@@ -16,18 +38,89 @@ from .coordinator import Coordinator
 current_conf = get_current_config()
 MY_PORT = current_conf["port"]
 
-database = Database("127.0.0.1", "root", "123456", f"atm_db_s{PEER_ID}")
-command_queue = CommandQueue()
+database = Database(
+    "127.0.0.1",
+    "root",
+    "123456",
+    f"atm_db_s{PEER_ID}",
+    coalesced_reads=[name for name, enabled in COALESCED_READS.items() if enabled],
+    reader_pool=DB_READER_POOL,
+    writer_pool=DB_WRITER_POOL,
+    backend=DB_BACKEND,
+    balance_cache=BALANCE_CACHE_MODE,
+)
+# Luôn chạy để có partition cho các tháng tới, lưu trữ theo TRANSACTION_ARCHIVE["enabled"]
+TransactionArchiver(database, TRANSACTION_ARCHIVE).start()
+
+if COMMAND_JOURNAL["enabled"] and not COMMAND_DEDUPE["enabled"]:
+    # Không có applied_commands, command được replay sẽ bị áp dụng lần 2
+    raise ValueError("COMMAND_JOURNAL cần bật COMMAND_DEDUPE")
+
+command_journal = None
+if COMMAND_JOURNAL["enabled"]:
+    command_journal = CommandJournal(
+        COMMAND_JOURNAL["path"],
+        group_commit_window=COMMAND_JOURNAL["group_commit_window"],
+        max_bytes=COMMAND_JOURNAL["max_bytes"],
+    )
+    # command_id mới phải lớn hơn của các command chưa thực thi (đồng hồ có thể bị chỉnh lùi)
+    for pending in command_journal.pending_commands():
+        if pending.get("command_id"):
+            observe_command_seq(parse_command_id(pending["command_id"])[1])
+
+command_queue = CommandQueue(command_journal)
 event_emitter = EventEmitter()
-command_executor = CommandExecutor(command_queue, database.writer())
+
+command_dedupe = None
+if COMMAND_DEDUPE["enabled"]:
+    command_dedupe = CommandDedupe(
+        database.reader(),
+        database.writer(),
+        window=COMMAND_DEDUPE["window"],
+        prune_every=COMMAND_DEDUPE["prune_every"],
+        origin_id=PEER_ID,
+    )
+
+idempotency_store = None
+if IDEMPOTENCY["enabled"]:
+    idempotency_store = IdempotencyStore(
+        ttl=IDEMPOTENCY["ttl"], max_entries=IDEMPOTENCY["max_entries"]
+    )
+
+command_executor = CommandExecutor(
+    command_queue,
+    database.writer(),
+    batch_mode=EXECUTOR_BATCH_MODE,
+    parallelism=EXECUTOR_PARALLELISM,
+    balance_cache=database.balance_cache,
+    dedupe=command_dedupe,
+    idempotency=idempotency_store,
+)
 
 # Coordinator
-coordinator = Coordinator(command_queue, command_executor, event_emitter)
+replication_backlog = ReplicationBacklog(
+    REPLICATION_BACKLOG["directory"],
+    peer_ids=get_peer_configs(),
+    memory_entries=REPLICATION_BACKLOG["memory_entries"],
+    segment_bytes=REPLICATION_BACKLOG["segment_bytes"],
+    state_interval=REPLICATION_BACKLOG["state_interval"],
+)
+replication_receiver = ReplicationReceiver(command_executor, database.reader())
+
+coordinator = Coordinator(
+    command_queue,
+    command_executor,
+    event_emitter,
+    replication_backlog,
+    replication_receiver,
+)
 
 local_registry = LocateRegistry.local_registry(MY_PORT)
 
-auth_service = AuthServiceImpl(local_registry, database, command_queue)
-peer_service = PeerServiceImpl(coordinator)
+auth_service = AuthServiceImpl(
+    local_registry, database, command_queue, idempotency_store
+)
+peer_service = PeerServiceImpl(coordinator, replication_receiver)
 
 local_registry.bind("auth", auth_service)
 local_registry.bind("peer", peer_service)
@@ -40,3 +133,18 @@ while command := input("\nEnter command or press Enter to exit...: "):
         print(command_queue.get_all())
     elif "exec" in command:
         print(command_executor.exec())
+    elif "stats" in command:
+        print("Coalesced reads:", database.reader().coalescing_stats())
+        print("DB pools:", database.pool_stats())
+        if database.balance_cache is not None:
+            print("Balance cache:", database.balance_cache.stats())
+        if command_journal is not None:
+            print("Command journal:", command_journal.stats())
+        print("Replication backlog:", replication_backlog.stats())
+        print("Replication sync:", coordinator.replication_stats())
+        print("Shard ownership:", coordinator.shard_stats())
+        print("Replication receiver:", replication_receiver.stats())
+        if command_dedupe is not None:
+            print("Command dedupe:", command_dedupe.stats())
+        if idempotency_store is not None:
+            print("Idempotency keys:", idempotency_store.stats())
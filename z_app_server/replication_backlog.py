@@ -0,0 +1,379 @@
+import json
+import mmap
+import os
+import secrets
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple, TypedDict
+
+from shared.models.server import ATMCommand
+
+
+class BacklogConfig(TypedDict):
+    directory: str  # Thư mục chứa các segment file
+    memory_entries: int  # Số entry mới nhất giữ trong RAM
+    segment_bytes: int  # Kích thước tối đa của 1 segment file
+    state_interval: float  # Khoảng thời gian tối thiểu giữa 2 lần ghi mốc ack (s)
+
+
+class _Segment:
+    """
+    Một file chứa các entry liên tiếp (mỗi entry 1 dòng JSON).
+
+    offsets giữ vị trí bắt đầu của từng entry; đọc bằng mmap nên không
+    phải đọc cả file vào RAM.
+    """
+
+    def __init__(self, path: str, first_seq: int):
+        self.path = path
+        self.first_seq = first_seq
+        self.offsets = array("Q")
+        self.size = 0
+
+        self._file = open(path, "ab")
+        self._map: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+
+    @classmethod
+    def load(cls, path: str, first_seq: int) -> "_Segment":
+        """Mở lại segment của lần chạy trước, cắt bỏ dòng cuối bị ghi dở (crash)"""
+        with open(path, "rb") as f:
+            data = f.read()
+
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(end)
+
+        segment = cls(path, first_seq)
+        offset = 0
+        while offset < end:
+            segment.offsets.append(offset)
+            offset = data.index(b"\n", offset) + 1
+        segment.size = end
+        return segment
+
+    @property
+    def last_seq(self) -> int:
+        return self.first_seq + len(self.offsets) - 1
+
+    def append(self, data: bytes):
+        self.offsets.append(self.size)
+        self._file.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def read(self, seq: int) -> bytes:
+        index = seq - self.first_seq
+        start = self.offsets[index]
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else self.size
+        return self._view()[start:end]
+
+    def _view(self) -> mmap.mmap:
+        # Segment đang được ghi thì map lại khi file đã lớn hơn lần map trước
+        if self._map is None or self._mapped_size < self.size:
+            self._file.flush()
+            if self._map is not None:
+                self._map.close()
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = self.size
+        return self._map
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class ReplicationBacklog:
+    """
+    Hàng đợi các command đã thực thi nhưng còn peer chưa xác nhận, đánh số seq tăng dần.
+
+    - Mọi entry được ghi vào các segment file ngay khi append; RAM chỉ giữ tối đa
+      memory_entries entry mới nhất, entry cũ hơn được đọc lại bằng mmap
+    - Mỗi peer có mốc ack riêng, ack(peer_id, seq) xác nhận cả prefix <= seq.
+      Entry/segment được dọn khi mọi peer đã xác nhận (không copy lại phần còn
+      lại như list slicing)
+    - Command được sanitize (bỏ callback) 1 lần khi append
+    - Khởi động lại: segment file, epoch và mốc ack của từng peer (file state.json)
+      được giữ nguyên, phần peer chưa xác nhận vẫn được gửi tiếp. Mốc ack chỉ
+      được ghi trước khi xóa segment hoặc tối đa 1 lần mỗi state_interval nên có
+      thể cũ hơn: peer nhận lại các entry đã áp dụng, bỏ qua chúng và trả về
+      index đã áp dụng (replication_state), mốc ack được đưa lên theo đó
+
+    Segment được flush (không fsync) sau mỗi lần append: server crash không mất
+    entry, mất điện thì journal chạy lại command (đã commit -> được bỏ qua nhờ
+    command_id nhưng vẫn vào lại backlog).
+    Seq chính là log index gửi cho peer; backlog mới (thư mục trống/mất state)
+    có epoch mới (tăng dần theo thời gian) để peer biết log được đánh số lại từ đầu.
+    """
+
+    STATE_FILE = "state.json"
+
+    def __init__(
+        self,
+        directory: str,
+        peer_ids: Iterable[int] = (0,),
+        memory_entries: int = 10_000,
+        segment_bytes: int = 16 << 20,
+        first_seq: int = 1,
+        state_interval: float = 1.0,
+    ):
+        """
+        Args:
+            directory: Thư mục chứa segment file, backlog của lần chạy trước
+                trong thư mục được mở lại
+            peer_ids: Các peer nhận log
+            memory_entries: Số entry mới nhất giữ trong RAM
+            segment_bytes: Kích thước tối đa của 1 segment file
+            first_seq: Seq của entry đầu tiên (backlog mới)
+            state_interval: Khoảng thời gian tối thiểu giữa 2 lần ghi mốc ack khi
+                không xóa segment nào (s)
+        """
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.segment_bytes = segment_bytes
+        self.state_interval = state_interval
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Thời điểm tạo backlog (ns, hex cố định 16 ký tự) + phần ngẫu nhiên:
+        # so sánh chuỗi được để biết epoch nào mới hơn
+        self.epoch = f"{time.time_ns():016x}{secrets.token_hex(4)}"
+
+        self._lock = threading.Lock()
+        self._segments: Deque[_Segment] = deque()
+        self._memory: Deque[Tuple[int, ATMCommand]] = deque()
+        self._next_seq = first_seq
+        self._acked_by: Dict[int, int] = {peer_id: first_seq - 1 for peer_id in peer_ids}
+        # Mốc mọi peer đã xác nhận, phần <= mốc được dọn
+        self._acked = first_seq - 1
+        # Lúc ghi state.json gần nhất (monotonic)
+        self._state_saved_at = 0.0
+        self._stats = {
+            "appended": 0,
+            "spilled": 0,
+            "segments_deleted": 0,
+            "state_saves": 0,
+        }
+
+        self._recover()
+
+    def append(self, commands: List[ATMCommand]) -> int:
+        """
+        Thêm các command (đã sanitize) vào cuối backlog.
+
+        Returns:
+            int: Seq của command cuối cùng
+        """
+        with self._lock:
+            for cmd in commands:
+                self._write(self._next_seq, cmd)
+                self._memory.append((self._next_seq, cmd))
+                self._next_seq += 1
+
+            if commands:
+                self._segments[-1].flush()
+            self._stats["appended"] += len(commands)
+
+            while len(self._memory) > self.memory_entries:
+                self._memory.popleft()
+                self._stats["spilled"] += 1
+
+            return self._next_seq - 1
+
+    def read(self, from_seq: int, max_entries: int) -> List[Tuple[int, ATMCommand]]:
+        """
+        Đọc tối đa max_entries entry từ from_seq (bỏ qua phần đã ack).
+
+        Returns:
+            List[Tuple[int, ATMCommand]]: Các cặp (seq, command) theo thứ tự
+        """
+        result: List[Tuple[int, ATMCommand]] = []
+
+        with self._lock:
+            seq = max(from_seq, self._acked + 1)
+            # Phần còn trong RAM không cần đọc lại từ segment
+            on_disk_end = self._memory[0][0] if self._memory else self._next_seq
+
+            for segment in self._segments:
+                seq = max(seq, segment.first_seq)
+                last_seq = min(segment.last_seq, on_disk_end - 1)
+                while seq <= last_seq and len(result) < max_entries:
+                    result.append((seq, json.loads(segment.read(seq))))
+                    seq += 1
+
+            for entry_seq, cmd in self._memory:
+                if len(result) >= max_entries:
+                    break
+                if entry_seq >= seq:
+                    result.append((entry_seq, cmd))
+
+        return result
+
+    def read_pending(
+        self, peer_id: int, max_entries: int
+    ) -> List[Tuple[int, ATMCommand]]:
+        """Đọc các entry peer chưa xác nhận, bắt đầu từ entry cũ nhất"""
+        return self.read(self.acked_seq(peer_id) + 1, max_entries)
+
+    def ack(self, peer_id: int, seq: int):
+        """Peer đã nhận tất cả entry <= seq"""
+        with self._lock:
+            if seq <= self._acked_by[peer_id]:
+                return
+            self._acked_by[peer_id] = min(seq, self._next_seq - 1)
+            self._truncate()
+
+    def rewind(self, peer_id: int, seq: int) -> bool:
+        """
+        Gửi lại cho peer từ seq + 1 (peer mất phần log đã xác nhận, VD: mất
+        state.json của receiver).
+
+        Returns:
+            bool: False nếu các entry đó đã bị dọn
+        """
+        with self._lock:
+            if seq < self._acked:
+                return False
+            self._acked_by[peer_id] = min(self._acked_by[peer_id], seq)
+            self._save_state()
+            return True
+
+    def pending_count(self, peer_id: Optional[int] = None) -> int:
+        """Số entry peer_id chưa xác nhận (None = của peer chậm nhất)"""
+        with self._lock:
+            return self._next_seq - 1 - self._acked_seq(peer_id)
+
+    def last_seq(self) -> int:
+        with self._lock:
+            return self._next_seq - 1
+
+    def acked_seq(self, peer_id: Optional[int] = None) -> int:
+        """Mốc peer_id đã xác nhận (None = mốc mọi peer đã xác nhận)"""
+        with self._lock:
+            return self._acked_seq(peer_id)
+
+    def peer_ids(self) -> List[int]:
+        return list(self._acked_by)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "pending": self._next_seq - 1 - self._acked,
+                "pending_by_peer": {
+                    peer_id: self._next_seq - 1 - acked
+                    for peer_id, acked in self._acked_by.items()
+                },
+                "in_memory": len(self._memory),
+                "segments": len(self._segments),
+                "segment_bytes": sum(segment.size for segment in self._segments),
+            }
+
+    def _truncate(self):
+        """
+        Dọn phần mọi peer đã xác nhận (gọi khi đang giữ self._lock).
+        Mốc ack được ghi trước khi xóa segment (crash giữa chừng không để lại khoảng
+        trống), không xóa segment nào thì chỉ ghi khi đã quá state_interval
+        """
+        self._acked = max(self._acked, min(self._acked_by.values()))
+        if (
+            self._segments and self._segments[0].last_seq <= self._acked
+        ) or time.monotonic() - self._state_saved_at >= self.state_interval:
+            self._save_state()
+
+        while self._memory and self._memory[0][0] <= self._acked:
+            self._memory.popleft()
+
+        while self._segments and self._segments[0].last_seq <= self._acked:
+            self._delete_segment(self._segments.popleft())
+
+    def _acked_seq(self, peer_id: Optional[int]) -> int:
+        return self._acked if peer_id is None else self._acked_by[peer_id]
+
+    def _write(self, seq: int, cmd: ATMCommand):
+        """Ghi entry vào segment cuối (tạo segment mới nếu đầy)"""
+        segment = self._segments[-1] if self._segments else None
+        if (
+            segment is None
+            or segment.size >= self.segment_bytes
+            or segment.last_seq != seq - 1
+        ):
+            if segment is not None:
+                segment.flush()
+            segment = _Segment(os.path.join(self.directory, f"{seq:020d}.seg"), seq)
+            self._segments.append(segment)
+
+        # JSON không chứa ký tự xuống dòng (đã được escape)
+        segment.append(json.dumps(cmd, ensure_ascii=False).encode() + b"\n")
+
+    def _save_state(self):
+        """Ghi epoch + mốc ack (gọi khi đang giữ self._lock), ghi file tạm rồi rename"""
+        state = {
+            "epoch": self.epoch,
+            "acked": self._acked,
+            "acked_by": {str(peer_id): acked for peer_id, acked in self._acked_by.items()},
+        }
+        path = os.path.join(self.directory, self.STATE_FILE)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+        self._state_saved_at = time.monotonic()
+        self._stats["state_saves"] += 1
+
+    def _recover(self):
+        """Mở lại backlog của lần chạy trước trong thư mục (không có state -> backlog mới)"""
+        path = os.path.join(self.directory, self.STATE_FILE)
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+
+        if state is None:
+            # Không biết các peer đã nhận tới đâu: bắt đầu log mới
+            for name in names:
+                os.remove(os.path.join(self.directory, name))
+            self._save_state()
+            return
+
+        self.epoch = state["epoch"]
+        self._acked = state["acked"]
+
+        for name in names:
+            segment = _Segment.load(os.path.join(self.directory, name), int(name[:-4]))
+            if segment.last_seq <= self._acked or (
+                self._segments and segment.first_seq != self._segments[-1].last_seq + 1
+            ):
+                # Đã được mọi peer xác nhận (chưa kịp xóa) hoặc không liền với phần trước
+                self._delete_segment(segment)
+                continue
+            self._segments.append(segment)
+
+        last_seq = self._segments[-1].last_seq if self._segments else self._acked
+        self._next_seq = last_seq + 1
+        for peer_id in self._acked_by:
+            acked = state["acked_by"].get(str(peer_id), self._acked)
+            self._acked_by[peer_id] = min(max(acked, self._acked), last_seq)
+
+        self._save_state()
+        print(
+            f">> [BACKLOG] Mở lại backlog: {last_seq - self._acked} entry chưa được"
+            f" mọi peer xác nhận (tới seq {last_seq})"
+        )
+
+    def _delete_segment(self, segment: _Segment):
+        segment.close()
+        try:
+            os.remove(segment.path)
+        except OSError:
+            pass
+        self._stats["segments_deleted"] += 1
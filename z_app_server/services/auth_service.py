@@ -6,6 +6,7 @@ from shared.models.server import LoginResult
 
 from ..database.main import Database
 from ..command_queue import CommandQueue
+from ..idempotency import IdempotencyStore
 
 from .user_service import UserServiceImpl
 
@@ -15,13 +16,18 @@ from typing import Optional
 
 class AuthServiceImpl(RemoteObject, AuthService):
     def __init__(
-        self, registry: LocalRegistry, database: Database, command_queue: CommandQueue
+        self,
+        registry: LocalRegistry,
+        database: Database,
+        command_queue: CommandQueue,
+        idempotency: Optional[IdempotencyStore] = None,
     ):
         super().__init__()
 
         self.registry = registry
         self.database = database
         self.command_queue = command_queue
+        self.idempotency = idempotency
 
         self.user_id: Optional[int] = None
 
@@ -40,6 +46,7 @@ class AuthServiceImpl(RemoteObject, AuthService):
                     registry=self.registry,
                     database_reader=self.database.reader(),
                     command_queue=self.command_queue,
+                    idempotency=self.idempotency,
                 )
 
                 # Đảm bảo session_id là duy nhất, chạy đến khi nào uuid không trùng thì thôi
@@ -1,8 +1,11 @@
+from typing import List, Optional
+
 from rmi_framework.v2 import RemoteObject, LocalRegistry
 
 from shared.interfaces.server import UserService
 from shared.interfaces.client import SuccessCallback
 from shared.models.server import (
+    ATMCommand,
     UserData,
     ChangePinCommand,
     WithdrawCommand,
@@ -13,10 +16,16 @@ from shared.utils import now
 
 from ..database.main import DatabaseReader
 from ..command_queue import CommandQueue
+from ..command_dedupe import new_command_id
+from ..idempotency import IdempotencyStore
 from ..config import PEER_ID
 
 
 class UserServiceImpl(RemoteObject, UserService):
+    # Số giao dịch mỗi trang lịch sử (mặc định / tối đa)
+    HISTORY_PAGE_SIZE = 20
+    HISTORY_PAGE_MAX = 100
+
     def __init__(
         self,
         session_id: str,
@@ -24,6 +33,7 @@ class UserServiceImpl(RemoteObject, UserService):
         registry: LocalRegistry,
         command_queue: CommandQueue,
         database_reader: DatabaseReader,
+        idempotency: Optional[IdempotencyStore] = None,
     ):
         super().__init__()
         self.session_id = session_id
@@ -31,54 +41,89 @@ class UserServiceImpl(RemoteObject, UserService):
         self.registry = registry
         self.command_queue = command_queue
         self.database_reader = database_reader
+        self.idempotency = idempotency
 
     def get_balance(self):
         return self.database_reader.check_balance(self.user["card_number"])
 
-    def get_transaction_history(self):
-        return self.database_reader.get_transaction_history(self.user["card_number"])
+    def get_transaction_history(
+        self, before: Optional[List[int]] = None, limit: Optional[int] = None
+    ):
+        limit = min(limit or self.HISTORY_PAGE_SIZE, self.HISTORY_PAGE_MAX)
+        return self.database_reader.get_transaction_history(
+            self.user["card_number"],
+            (before[0], before[1]) if before else None,
+            limit,
+        )
 
     def get_info(self):
         return self.user
 
-    def change_pin(self, new_pin: str, callback: SuccessCallback):
-        self.command_queue.add(
+    def change_pin(
+        self,
+        new_pin: str,
+        callback: SuccessCallback,
+        idempotency_key: Optional[str] = None,
+    ):
+        self._submit(
             ChangePinCommand(
                 command_type="change-pin",
                 card_number=self.user["card_number"],
                 peer_id=PEER_ID,
                 new_pin=new_pin,
                 timestamp=now(),
+                command_id=new_command_id(PEER_ID),
                 success_callback=callback,
-            )
+            ),
+            idempotency_key,
         )
 
-    def deposit(self, amount: int, callback: SuccessCallback):
-        self.command_queue.add(
+    def deposit(
+        self,
+        amount: int,
+        callback: SuccessCallback,
+        idempotency_key: Optional[str] = None,
+    ):
+        self._submit(
             DepositCommand(
                 peer_id=PEER_ID,
                 command_type="deposit",
                 card_number=self.user["card_number"],
                 amount=amount,
                 timestamp=now(),
+                command_id=new_command_id(PEER_ID),
                 success_callback=callback,
-            )
+            ),
+            idempotency_key,
         )
 
-    def withdraw(self, amount: int, callback: SuccessCallback):
-        self.command_queue.add(
+    def withdraw(
+        self,
+        amount: int,
+        callback: SuccessCallback,
+        idempotency_key: Optional[str] = None,
+    ):
+        self._submit(
             WithdrawCommand(
                 peer_id=PEER_ID,
                 command_type="withdraw",
                 card_number=self.user["card_number"],
                 amount=amount,
                 timestamp=now(),
+                command_id=new_command_id(PEER_ID),
                 success_callback=callback,
-            )
+            ),
+            idempotency_key,
         )
 
-    def transfer(self, to_card: str, amount: int, callback: SuccessCallback):
-        self.command_queue.add(
+    def transfer(
+        self,
+        to_card: str,
+        amount: int,
+        callback: SuccessCallback,
+        idempotency_key: Optional[str] = None,
+    ):
+        self._submit(
             TransferCommand(
                 peer_id=PEER_ID,
                 command_type="transfer",
@@ -86,10 +131,33 @@ class UserServiceImpl(RemoteObject, UserService):
                 to_card=to_card,
                 amount=amount,
                 timestamp=now(),
+                command_id=new_command_id(PEER_ID),
                 success_callback=callback,
-            )
+            ),
+            idempotency_key,
         )
 
+    def _submit(self, command: ATMCommand, idempotency_key: Optional[str]):
+        """Đưa command vào queue, trừ khi đây là lần gửi lại của 1 idempotency key"""
+        if idempotency_key and self.idempotency is not None:
+            command["idempotency_key"] = idempotency_key
+            is_new = self.idempotency.submit(
+                command["card_number"],
+                idempotency_key,
+                command.get("command_id"),
+                command["success_callback"],
+            )
+            if not is_new:
+                return
+
+        try:
+            self.command_queue.add(command)
+        except OSError:
+            # Command không được nhận, lần gửi lại phải được chạy
+            if self.idempotency is not None:
+                self.idempotency.discard(command)
+            raise
+
     def logout(self, callback: SuccessCallback):
         print(f"User [{self.user['name']}] log out")
         self.registry.unbind(self.session_id)
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple, TypedDict
+
+
+class SyncWindowConfig(TypedDict):
+    max_delay: float  # Thời gian tối đa 1 command chờ được gom trước khi sync (s)
+    max_commands: int  # Đủ số command này thì sync ngay
+    max_bytes: int  # Đủ số byte (JSON) này thì sync ngay
+
+
+class SyncWindow:
+    """
+    Cửa sổ gom các batch đã thực thi thành 1 lần sync cho peer.
+
+    Độ dài cửa sổ thích nghi theo EWMA của tốc độ command và RTT của lần sync:
+    - Chỉ chờ khi dự kiến có thêm command tới trong 1 RTT (rate * rtt >= 1),
+      nếu không thì chờ cũng không gom được gì -> sync ngay
+    - Chờ tối đa 1 RTT (độ trễ thêm không vượt quá chi phí của chính lần sync)
+      và không quá max_delay
+    - Đủ max_commands hoặc max_bytes thì sync ngay
+
+    Đồng thời theo dõi replication lag: số command và thời gian của command cũ
+    nhất đã thực thi nhưng peer chưa xác nhận.
+    """
+
+    def __init__(
+        self,
+        max_delay: float = 0.05,
+        max_commands: int = 1000,
+        max_bytes: int = 1 << 20,
+        smoothing: float = 0.2,
+    ):
+        """
+        Args:
+            smoothing: Hệ số EWMA (trọng số của mẫu mới)
+        """
+        self.max_delay = max_delay
+        self.max_commands = max_commands
+        self.max_bytes = max_bytes
+        self.smoothing = smoothing
+
+        self._lock = threading.Lock()
+        self._rate = 0.0  # command/s
+        self._rtt: Optional[float] = None  # s
+        self._last_append: Optional[float] = None
+
+        # (seq cuối của batch, thời điểm thực thi) của các batch peer chưa xác nhận
+        self._unacked: Deque[Tuple[int, float]] = deque()
+        self._stats = {"syncs": 0, "synced_commands": 0}
+
+    def on_append(self, last_seq: int, count: int):
+        """Ghi nhận 1 batch vừa được thêm vào backlog"""
+        now = time.monotonic()
+
+        with self._lock:
+            if self._last_append is not None and now > self._last_append:
+                self._rate = self._ewma(self._rate, count / (now - self._last_append))
+            self._last_append = now
+            self._unacked.append((last_seq, now))
+
+    def on_synced(self, acked_seq: int, count: int, rtt: float):
+        """Ghi nhận 1 lần gọi replicate: peer đã áp dụng tới acked_seq"""
+        with self._lock:
+            self._rtt = rtt if self._rtt is None else self._ewma(self._rtt, rtt)
+            self._stats["syncs"] += 1
+            self._stats["synced_commands"] += count
+
+            while self._unacked and self._unacked[0][0] <= acked_seq:
+                self._unacked.popleft()
+
+    def delay(self) -> float:
+        """Thời gian gom hiện tại (s)"""
+        with self._lock:
+            return self._delay()
+
+    def is_full(self, commands: int, size: int) -> bool:
+        return commands >= self.max_commands or size >= self.max_bytes
+
+    def stats(self, pending: int):
+        now = time.monotonic()
+        with self._lock:
+            synced = self._stats["synced_commands"]
+            return {
+                **self._stats,
+                "commands_per_sync": synced / self._stats["syncs"] if synced else 0.0,
+                "rate": round(self._rate, 1),
+                "rtt_ms": round((self._rtt or 0.0) * 1000, 2),
+                "window_ms": round(self._delay() * 1000, 2),
+                "lag_commands": pending,
+                "lag_ms": round((now - self._unacked[0][1]) * 1000, 1)
+                if self._unacked
+                else 0.0,
+            }
+
+    def _delay(self) -> float:
+        if self._rtt is None or self._rate * self._rtt < 1:
+            return 0.0
+        return min(self._rtt, self.max_delay)
+
+    def _ewma(self, current: float, sample: float) -> float:
+        return current + self.smoothing * (sample - current)
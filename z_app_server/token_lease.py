@@ -0,0 +1,95 @@
+import threading
+import time
+from typing import Dict, Optional, TypedDict
+
+from shared.models.server import TokenLoad
+
+
+class LeaseConfig(TypedDict):
+    min_quantum: float  # Thời gian giữ shard tối thiểu khi còn việc (s)
+    max_hold: float  # Thời gian giữ shard tối đa khi peer đang chờ (s), đảm bảo công bằng
+    idle_grace: float  # Shard không được dùng bao lâu thì coi là rảnh và trao sớm (s)
+
+
+class TokenLease:
+    """
+    Lease của shard: thời gian server được giữ shard đang dùng khi peer đòi.
+
+    quantum nằm trong [min_quantum, max_hold], chia theo tỉ lệ tải của server này
+    và server đòi: tải = tốc độ nhận command (EWMA, đo theo từng khoảng min_quantum)
+    + số command đang chờ / min_quantum (tải của server đòi gửi kèm request_shards).
+    Shard rảnh được trao sớm hơn (xem ShardOwnership).
+    """
+
+    def __init__(
+        self,
+        min_quantum: float = 0.02,
+        max_hold: float = 0.2,
+        idle_grace: float = 0.002,
+        smoothing: float = 0.2,
+    ):
+        """
+        Args:
+            idle_grace: Dùng bởi ShardOwnership
+            smoothing: Hệ số EWMA của tốc độ nhận command
+        """
+        self.min_quantum = min_quantum
+        self.max_hold = max(max_hold, min_quantum)
+        self.idle_grace = idle_grace
+        self.smoothing = smoothing
+
+        self._lock = threading.Lock()
+        self._rate = 0.0
+        self._arrivals = 0
+        self._rate_since = time.monotonic()
+        self._peer_loads: Dict[int, TokenLoad] = {}
+
+    def on_arrival(self):
+        """Ghi nhận 1 command mới vào queue"""
+        now = time.monotonic()
+        with self._lock:
+            self._arrivals += 1
+            # Đo theo khoảng (không theo từng command) để các đợt dồn dập không làm lệch tốc độ
+            if now - self._rate_since >= self.min_quantum:
+                sample = self._arrivals / (now - self._rate_since)
+                self._rate += self.smoothing * (sample - self._rate)
+                self._arrivals = 0
+                self._rate_since = now
+
+    def set_peer_load(self, peer_id: int, load: Optional[TokenLoad]):
+        with self._lock:
+            if load is None:
+                self._peer_loads.pop(peer_id, None)
+            else:
+                self._peer_loads[peer_id] = load
+
+    def local_load(self, queue_depth: int) -> TokenLoad:
+        """Tải của server này, gửi kèm khi xin shard"""
+        with self._lock:
+            return {"queue_depth": queue_depth, "arrival_rate": self._rate}
+
+    def quantum(self, queue_depth: int, peer_id: int) -> float:
+        """Thời gian giữ shard đang dùng khi server peer_id đòi (s)"""
+        with self._lock:
+            return self._quantum(queue_depth, peer_id)
+
+    def stats(self, queue_depth: int):
+        with self._lock:
+            return {
+                "arrival_rate": round(self._rate, 1),
+                "quantum_ms": {
+                    peer_id: round(self._quantum(queue_depth, peer_id) * 1000, 2)
+                    for peer_id in self._peer_loads
+                },
+                "peer_loads": dict(self._peer_loads),
+            }
+
+    def _quantum(self, queue_depth: int, peer_id: int) -> float:
+        local = self._rate + queue_depth / self.min_quantum
+        peer = 0.0
+        peer_load = self._peer_loads.get(peer_id)
+        if peer_load is not None:
+            peer = peer_load["arrival_rate"] + peer_load["queue_depth"] / self.min_quantum
+
+        share = local / (local + peer) if local + peer > 0 else 0.5
+        return self.min_quantum + (self.max_hold - self.min_quantum) * share